@@ -22,8 +22,10 @@ if config.config_file_name is not None:
 from app.config.settings import settings
 from app.config.database import Base
 
-# Set DB URL from app settings (so alembic.ini doesn't need hardcoded credentials)
-config.set_main_option('sqlalchemy.url', settings.DATABASE_URL)
+# Set DB URL from app settings (so alembic.ini doesn't need hardcoded credentials).
+# `alembic -x shard=N upgrade head` migrates shard N of SHARD_DATABASE_URLS instead.
+shard = int(context.get_x_argument(as_dictionary=True).get('shard', 0))
+config.set_main_option('sqlalchemy.url', settings.DATABASE_URL if shard == 0 else settings.SHARD_DATABASE_URLS[shard - 1])
 
 # add your model's MetaData object here for 'autogenerate' support
 target_metadata = Base.metadata
@@ -43,6 +45,18 @@ def run_migrations_offline():
 
 
 def run_migrations_online():
+    # init_db hands over its own connection when it migrates a database on boot.
+    connection = config.attributes.get('connection')
+    if connection is not None:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+        )
+
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
     # Create engine directly from settings to avoid relying on alembic.ini url
     url = config.get_main_option("sqlalchemy.url")
     connectable = create_engine(url, poolclass=pool.NullPool)
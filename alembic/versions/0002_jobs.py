@@ -0,0 +1,64 @@
+"""background jobs and storage drift report
+
+Revision ID: 3f1c2a9d7b01
+Revises: 000000000000
+Create Date: 2026-10-19 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '3f1c2a9d7b01'
+down_revision = '000000000000'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'jobs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('params', sa.Text(), nullable=True),
+        sa.Column('checkpoint', sa.Text(), nullable=True),
+        sa.Column('result', sa.Text(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('progress_done', sa.Integer(), nullable=True),
+        sa.Column('progress_total', sa.Integer(), nullable=True),
+        sa.Column('cancel_requested', sa.Boolean(), nullable=True),
+        sa.Column('created_by', sa.Integer(), sa.ForeignKey('users.id'), nullable=True),
+        sa.Column('worker_id', sa.String(), nullable=True),
+        sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_jobs_id', 'jobs', ['id'])
+    op.create_index('ix_jobs_kind', 'jobs', ['kind'])
+    op.create_index('ix_jobs_status', 'jobs', ['status'])
+
+    op.create_table(
+        'storage_drift',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('job_id', sa.Integer(), sa.ForeignKey('jobs.id'), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('recorded_bytes', sa.BigInteger(), nullable=False),
+        sa.Column('actual_bytes', sa.BigInteger(), nullable=False),
+        sa.Column('metadata_bytes', sa.BigInteger(), nullable=False),
+        sa.Column('drift_bytes', sa.BigInteger(), nullable=False),
+        sa.Column('missing_files', sa.Integer(), nullable=True),
+        sa.Column('applied', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_storage_drift_id', 'storage_drift', ['id'])
+    op.create_index('ix_storage_drift_job_id', 'storage_drift', ['job_id'])
+
+
+def downgrade():
+    op.drop_index('ix_storage_drift_job_id', table_name='storage_drift')
+    op.drop_index('ix_storage_drift_id', table_name='storage_drift')
+    op.drop_table('storage_drift')
+    op.drop_index('ix_jobs_status', table_name='jobs')
+    op.drop_index('ix_jobs_kind', table_name='jobs')
+    op.drop_index('ix_jobs_id', table_name='jobs')
+    op.drop_table('jobs')
@@ -0,0 +1,46 @@
+"""change journal for sync clients
+
+Revision ID: a7d4e2c91b55
+Revises: 3f1c2a9d7b01
+Create Date: 2026-10-19 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'a7d4e2c91b55'
+down_revision = '3f1c2a9d7b01'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'changes',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('seq', sa.BigInteger(), nullable=False),
+        sa.Column('item_type', sa.String(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('action', sa.String(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('parent_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.UniqueConstraint('user_id', 'seq', name='uq_changes_user_seq'),
+    )
+    op.create_index('ix_changes_id', 'changes', ['id'])
+    op.create_index('ix_changes_created_at', 'changes', ['created_at'])
+
+    op.create_table(
+        'sync_state',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('last_seq', sa.BigInteger(), nullable=False),
+        sa.Column('min_seq', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table('sync_state')
+    op.drop_index('ix_changes_created_at', table_name='changes')
+    op.drop_index('ix_changes_id', table_name='changes')
+    op.drop_table('changes')
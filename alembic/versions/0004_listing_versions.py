@@ -0,0 +1,25 @@
+"""listing version stamps
+
+Revision ID: c2e8f5a41d07
+Revises: a7d4e2c91b55
+Create Date: 2026-10-19 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'c2e8f5a41d07'
+down_revision = 'a7d4e2c91b55'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('folders', sa.Column('version', sa.BigInteger(), nullable=False, server_default='0'))
+    op.add_column('sync_state', sa.Column('root_version', sa.BigInteger(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('sync_state') as batch_op:
+        batch_op.drop_column('root_version')
+    with op.batch_alter_table('folders') as batch_op:
+        batch_op.drop_column('version')
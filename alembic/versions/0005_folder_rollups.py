@@ -0,0 +1,25 @@
+"""folder size and item count rollups
+
+Revision ID: 5b9d13e6f2a8
+Revises: c2e8f5a41d07
+Create Date: 2026-10-19 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '5b9d13e6f2a8'
+down_revision = 'c2e8f5a41d07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing folders start at zero; run the folder_rollups_repair job afterwards.
+    op.add_column('folders', sa.Column('total_bytes', sa.BigInteger(), nullable=False, server_default='0'))
+    op.add_column('folders', sa.Column('item_count', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('folders') as batch_op:
+        batch_op.drop_column('item_count')
+        batch_op.drop_column('total_bytes')
@@ -0,0 +1,50 @@
+"""file checksums and integrity scrub findings
+
+Revision ID: 8e4a6c0d2f93
+Revises: 5b9d13e6f2a8
+Create Date: 2026-10-19 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '8e4a6c0d2f93'
+down_revision = '5b9d13e6f2a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing files have no checksum; the first file_scrub run records one.
+    op.add_column('files', sa.Column('checksum', sa.String(length=64), nullable=True))
+    op.add_column('files', sa.Column('verified_at', sa.DateTime(), nullable=True))
+    op.add_column('files', sa.Column('integrity_error', sa.String(), nullable=True))
+    op.create_index('ix_files_verified_at', 'files', ['verified_at'])
+
+    op.create_table(
+        'integrity_findings',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('job_id', sa.Integer(), sa.ForeignKey('jobs.id'), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('problem', sa.String(), nullable=False),
+        sa.Column('expected_checksum', sa.String(length=64), nullable=True),
+        sa.Column('actual_checksum', sa.String(length=64), nullable=True),
+        sa.Column('expected_size', sa.BigInteger(), nullable=False),
+        sa.Column('actual_size', sa.BigInteger(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_integrity_findings_id', 'integrity_findings', ['id'])
+    op.create_index('ix_integrity_findings_job_id', 'integrity_findings', ['job_id'])
+    op.create_index('ix_integrity_findings_file_id', 'integrity_findings', ['file_id'])
+
+
+def downgrade():
+    op.drop_index('ix_integrity_findings_file_id', table_name='integrity_findings')
+    op.drop_index('ix_integrity_findings_job_id', table_name='integrity_findings')
+    op.drop_index('ix_integrity_findings_id', table_name='integrity_findings')
+    op.drop_table('integrity_findings')
+    op.drop_index('ix_files_verified_at', table_name='files')
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_column('integrity_error')
+        batch_op.drop_column('verified_at')
+        batch_op.drop_column('checksum')
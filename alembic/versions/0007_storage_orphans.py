@@ -0,0 +1,40 @@
+"""file path index and storage orphan report
+
+Revision ID: d61f0b7a9c24
+Revises: 8e4a6c0d2f93
+Create Date: 2026-10-19 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'd61f0b7a9c24'
+down_revision = '8e4a6c0d2f93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Byte order on PostgreSQL, so the orphan scan can read the index in order.
+    op.create_index('ix_files_file_path', 'files', ['file_path'], postgresql_ops={'file_path': 'COLLATE "C"'})
+
+    op.create_table(
+        'storage_orphans',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('job_id', sa.Integer(), sa.ForeignKey('jobs.id'), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('size', sa.BigInteger(), nullable=True),
+        sa.Column('quarantined_to', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_storage_orphans_id', 'storage_orphans', ['id'])
+    op.create_index('ix_storage_orphans_job_id', 'storage_orphans', ['job_id'])
+
+
+def downgrade():
+    op.drop_index('ix_storage_orphans_job_id', table_name='storage_orphans')
+    op.drop_index('ix_storage_orphans_id', table_name='storage_orphans')
+    op.drop_table('storage_orphans')
+    op.drop_index('ix_files_file_path', table_name='files')
@@ -0,0 +1,48 @@
+"""shard directory
+
+Revision ID: 5b2e8d41c7a0
+Revises: d61f0b7a9c24
+Create Date: 2026-10-19 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '5b2e8d41c7a0'
+down_revision = 'd61f0b7a9c24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Every shard gets the tables; only shard 0's are used, see app/shards.
+    op.create_table(
+        'shard_users',
+        sa.Column('user_id', sa.Integer(), primary_key=True),
+        sa.Column('shard', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(), nullable=False, unique=True),
+        sa.Column('username', sa.String(), nullable=False, unique=True),
+        sa.Column('moving', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_shard_users_shard', 'shard_users', ['shard'])
+
+    op.create_table(
+        'shard_shares',
+        sa.Column('share_token', sa.String(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+    )
+    op.create_index('ix_shard_shares_user_id', 'shard_shares', ['user_id'])
+
+    op.create_table(
+        'shard_jobs',
+        sa.Column('job_id', sa.Integer(), primary_key=True),
+        sa.Column('shard', sa.Integer(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('shard_jobs')
+    op.drop_index('ix_shard_shares_user_id', table_name='shard_shares')
+    op.drop_table('shard_shares')
+    op.drop_index('ix_shard_users_shard', table_name='shard_users')
+    op.drop_table('shard_users')
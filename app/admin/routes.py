@@ -1,12 +1,29 @@
+import heapq
+from contextlib import contextmanager
+from itertools import islice
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from sqlalchemy import func
+from datetime import datetime, timedelta
 from pydantic import BaseModel
-from app.config.database import get_db
+from app.config.database import get_db, is_sharded
 from app.users.models import User
 from app.common.models import File
+from app.common.admission import admission
 from app.common.helpers import get_admin_user
+from app.common.hot_cache import hot_cache
 from app.common.storage_engine import storage_engine
+from app.jobs.models import IntegrityFinding, Job, StorageDrift, StorageOrphan
+from app.jobs.runner import job_runner
+from app.config.settings import settings
+from app.monitoring.profiling import PROFILE_HEADER, create_profile_token, profile_store
+from app.schemas.change_schema import ChangesCompactRequest
+from app.schemas.job_schema import (
+    FileScrubRequest, FolderRollupsRepairRequest, IntegrityFindingResponse, IntegrityStatusResponse,
+    JobResponse, OrphanScanRequest, StorageReconcileRequest, StorageDriftResponse, StorageOrphanResponse
+)
+from app.storage.export import ExportFormat, inventory_response
+from app.shards.service import each_shard, job_shard, shard_db, shard_or_404, user_db
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
@@ -31,8 +48,16 @@ def get_all_users(
     admin_user: User = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
-    users = db.query(User).offset(skip).limit(limit).all()
-    return users
+    if not is_sharded():
+        users = db.query(User).offset(skip).limit(limit).all()
+        return users
+    
+    # Each shard's first skip + limit users, merged in id order, hold the page.
+    per_shard = [
+        shard_session.query(User).order_by(User.id).limit(skip + limit).all()
+        for shard_session in each_shard(db)
+    ]
+    return list(islice(heapq.merge(*per_shard, key=lambda user: user.id), skip, skip + limit))
 
 
 @router.post("/users/{user_id}/suspend")
@@ -41,16 +66,17 @@ def suspend_user(
     admin_user: User = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
-    user = db.query(User).filter(User.id == user_id).first()
-    
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
-    user.is_active = False
-    db.commit()
+    with user_db(user_id, db, write=True) as user_session:
+        user = user_session.query(User).filter(User.id == user_id).first()
+        
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
+            )
+        
+        user.is_active = False
+        user_session.commit()
     
     return {"message": f"User {user.username} suspended successfully"}
 
@@ -61,16 +87,17 @@ def activate_user(
     admin_user: User = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
-    user = db.query(User).filter(User.id == user_id).first()
-    
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
-    user.is_active = True
-    db.commit()
+    with user_db(user_id, db, write=True) as user_session:
+        user = user_session.query(User).filter(User.id == user_id).first()
+        
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
+            )
+        
+        user.is_active = True
+        user_session.commit()
     
     return {"message": f"User {user.username} activated successfully"}
 
@@ -81,17 +108,18 @@ def reset_user_storage(
     admin_user: User = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
-    user = db.query(User).filter(User.id == user_id).first()
-    
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
-    actual_storage = storage_engine.calculate_user_storage(user.id)
-    user.storage_used = actual_storage
-    db.commit()
+    with user_db(user_id, db, write=True) as user_session:
+        user = user_session.query(User).filter(User.id == user_id).first()
+        
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
+            )
+        
+        actual_storage = storage_engine.calculate_user_storage(user.id)
+        user.storage_used = actual_storage
+        user_session.commit()
     
     return {
         "message": "Storage recalculated",
@@ -104,14 +132,292 @@ def get_server_stats(
     admin_user: User = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
-    total_users = db.query(User).count()
-    active_users = db.query(User).filter(User.is_active == True).count()
-    total_files = db.query(File).count()
-    total_storage = db.query(User).with_entities(func.sum(User.storage_used)).scalar() or 0
+    totals = {"total_users": 0, "active_users": 0, "total_files": 0, "total_storage_bytes": 0}
+    for shard_session in each_shard(db):
+        stats = shard_session.query(
+            func.count(User.id).label("total_users"),
+            func.count(User.id).filter(User.is_active == True).label("active_users"),
+            func.coalesce(func.sum(User.storage_used), 0).label("total_storage"),
+            shard_session.query(func.count(File.id)).scalar_subquery().label("total_files")
+        ).one()
+        
+        totals["total_users"] += stats.total_users
+        totals["active_users"] += stats.active_users
+        totals["total_files"] += stats.total_files
+        totals["total_storage_bytes"] += stats.total_storage
     
+    return totals
+
+
+@router.get("/export")
+def export_inventory(
+    user_id: int | None = None,
+    format: ExportFormat = "ndjson",
+    gzip: bool = False,
+    cursor: str | None = None,
+    shard: int = 0,
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    # One user is exported from their shard; everyone, from the shard asked for.
+    if user_id is not None:
+        with user_db(user_id, db) as user_session:
+            if not user_session.query(User.id).filter(User.id == user_id).first():
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="User not found"
+                )
+            shard = user_session.shard
+    
+    return inventory_response(user_id, format, gzip, cursor, shard_or_404(shard))
+
+
+@contextmanager
+def _job_or_404(job_id: int, db: Session):
+    """Yield the job and a session on the shard it lives on."""
+    with shard_db(job_shard(job_id, db), db) as job_db:
+        job = job_db.query(Job).filter(Job.id == job_id).first()
+
+        if not job:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Job not found"
+            )
+
+        yield job, job_db
+
+
+@router.post("/jobs/storage-reconcile", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+def start_storage_reconcile(
+    request_data: StorageReconcileRequest,
+    shard: int = 0,
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    with shard_db(shard, db) as job_db:
+        return job_runner.submit(job_db, "storage_reconcile", request_data.model_dump(), admin_user.id)
+
+
+@router.post("/jobs/changes-compact", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+def start_changes_compact(
+    request_data: ChangesCompactRequest,
+    shard: int = 0,
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    with shard_db(shard, db) as job_db:
+        return job_runner.submit(job_db, "changes_compact", request_data.model_dump(), admin_user.id)
+
+
+@router.post("/jobs/folder-rollups", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+def start_folder_rollups_repair(
+    request_data: FolderRollupsRepairRequest,
+    shard: int = 0,
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    with shard_db(shard, db) as job_db:
+        return job_runner.submit(job_db, "folder_rollups_repair", request_data.model_dump(), admin_user.id)
+
+
+@router.post("/jobs/file-scrub", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+def start_file_scrub(
+    request_data: FileScrubRequest,
+    shard: int = 0,
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    with shard_db(shard, db) as job_db:
+        return job_runner.submit(job_db, "file_scrub", request_data.model_dump(), admin_user.id)
+
+
+@router.post("/jobs/storage-orphans", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+def start_orphan_scan(
+    request_data: OrphanScanRequest,
+    shard: int = 0,
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    with shard_db(shard, db) as job_db:
+        return job_runner.submit(job_db, "storage_orphans", request_data.model_dump(), admin_user.id)
+
+
+@router.get("/jobs", response_model=list[JobResponse])
+def list_jobs(
+    kind: str | None = None,
+    job_status: str | None = None,
+    skip: int = 0,
+    limit: int = 100,
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    def jobs(shard_session: Session):
+        query = shard_session.query(Job)
+
+        if kind:
+            query = query.filter(Job.kind == kind)
+        if job_status:
+            query = query.filter(Job.status == job_status)
+
+        return query.order_by(Job.id.desc())
+
+    if not is_sharded():
+        return jobs(db).offset(skip).limit(limit).all()
+
+    per_shard = [jobs(shard_session).limit(skip + limit).all() for shard_session in each_shard(db)]
+    return list(islice(heapq.merge(*per_shard, key=lambda job: -job.id), skip, skip + limit))
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+def get_job(
+    job_id: int,
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    with _job_or_404(job_id, db) as (job, _):
+        return job
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=JobResponse)
+def cancel_job(
+    job_id: int,
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    with _job_or_404(job_id, db) as (job, job_db):
+        return job_runner.cancel(job_db, job)
+
+
+@router.get("/jobs/{job_id}/drift", response_model=list[StorageDriftResponse])
+def get_storage_drift_report(
+    job_id: int,
+    only_drifted: bool = True,
+    skip: int = 0,
+    limit: int = 100,
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    with _job_or_404(job_id, db) as (_, job_db):
+        query = job_db.query(StorageDrift).filter(StorageDrift.job_id == job_id)
+        if only_drifted:
+            query = query.filter(StorageDrift.drift_bytes != 0)
+
+        return query.order_by(StorageDrift.user_id).offset(skip).limit(limit).all()
+
+
+@router.get("/jobs/{job_id}/findings", response_model=list[IntegrityFindingResponse])
+def get_integrity_findings(
+    job_id: int,
+    problem: str | None = None,
+    skip: int = 0,
+    limit: int = 100,
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    with _job_or_404(job_id, db) as (_, job_db):
+        query = job_db.query(IntegrityFinding).filter(IntegrityFinding.job_id == job_id)
+        if problem:
+            query = query.filter(IntegrityFinding.problem == problem)
+
+        return query.order_by(IntegrityFinding.id).offset(skip).limit(limit).all()
+
+
+@router.get("/jobs/{job_id}/orphans", response_model=list[StorageOrphanResponse])
+def get_storage_orphans(
+    job_id: int,
+    kind: str | None = None,
+    skip: int = 0,
+    limit: int = 100,
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    with _job_or_404(job_id, db) as (_, job_db):
+        query = job_db.query(StorageOrphan).filter(StorageOrphan.job_id == job_id)
+        if kind:
+            query = query.filter(StorageOrphan.kind == kind)
+
+        return query.order_by(StorageOrphan.id).offset(skip).limit(limit).all()
+
+
+@router.get("/integrity", response_model=IntegrityStatusResponse)
+def get_integrity_status(
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    stale_before = datetime.utcnow() - timedelta(hours=settings.SCRUB_STALE_AFTER_HOURS)
+    totals = [0, 0, 0, 0, 0]
+    oldest_verified_at = None
+    last_scrub = None
+    for shard_session in each_shard(db):
+        counts = shard_session.query(
+            func.count(File.id),
+            func.count(File.checksum),
+            func.count(File.id).filter(File.verified_at.is_(None)),
+            func.count(File.id).filter(File.verified_at < stale_before),
+            func.count(File.integrity_error),
+            func.min(File.verified_at)
+        ).one()
+        shard_scrub = shard_session.query(Job).filter(Job.kind == "file_scrub").order_by(Job.id.desc()).first()
+
+        totals = [total + count for total, count in zip(totals, counts[:5])]
+        if counts[5] is not None and (oldest_verified_at is None or counts[5] < oldest_verified_at):
+            oldest_verified_at = counts[5]
+        if shard_scrub is not None and (last_scrub is None or shard_scrub.id > last_scrub.id):
+            last_scrub = shard_scrub
+
+    return {
+        "files": totals[0],
+        "files_with_checksum": totals[1],
+        "never_verified": totals[2],
+        "stale": totals[3],
+        "flagged": totals[4],
+        "oldest_verified_at": oldest_verified_at,
+        "last_scrub": last_scrub,
+    }
+
+
+@router.get("/admission")
+def get_admission_status(admin_user: User = Depends(get_admin_user)):
+    # Counts are for the worker that serves this request.
+    return admission.snapshot()
+
+
+@router.get("/hot-cache")
+def get_hot_cache_status(admin_user: User = Depends(get_admin_user)):
+    # Like admission, the cache is per worker.
+    return hot_cache.snapshot()
+
+
+@router.post("/profiling/token")
+def create_profiling_token(
+    ttl_seconds: int | None = None,
+    admin_user: User = Depends(get_admin_user)
+):
+    token, expires = create_profile_token(ttl_seconds or settings.PROFILE_TOKEN_TTL_SECONDS)
+
     return {
-        "total_users": total_users,
-        "active_users": active_users,
-        "total_files": total_files,
-        "total_storage_bytes": total_storage
+        "header": PROFILE_HEADER,
+        "token": token,
+        "expires_at": expires
     }
+
+
+@router.get("/profiles")
+def list_profiles(admin_user: User = Depends(get_admin_user)):
+    return profile_store.list()
+
+
+@router.get("/profiles/{profile_id}")
+def get_profile(
+    profile_id: int,
+    admin_user: User = Depends(get_admin_user)
+):
+    profile = profile_store.get(profile_id)
+
+    if not profile:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+
+    return profile
@@ -1,12 +1,19 @@
-from passlib.context import CryptContext
+from functools import lru_cache
 
-# Use pbkdf2_sha256 to avoid bcrypt backend compatibility issues
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    # passlib is slow to import, so it is loaded on the first hash or verify
+    # rather than when a worker boots.
+    from passlib.context import CryptContext
+
+    # Use pbkdf2_sha256 to avoid bcrypt backend compatibility issues
+    return CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
@@ -1,44 +1,54 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from datetime import datetime
-from app.config.database import get_db
+from app.config.database import get_db, is_sharded
 from app.schemas.auth_schema import UserRegister, UserLogin, Token, TokenRefresh, PasswordUpdate
 from app.users.models import User
 from app.premium.models import Subscription
 from app.auth.hashing import hash_password, verify_password
 from app.auth.jwt_handler import create_access_token, create_refresh_token, verify_token
 from app.common.helpers import get_current_user
+from app.shards.service import email_db, register_user, release_user, shard_db, user_db
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
 
 @router.post("/register", response_model=Token, status_code=status.HTTP_201_CREATED)
 def register(user_data: UserRegister, db: Session = Depends(get_db)):
-    existing_user = db.query(User).filter(
-        (User.email == user_data.email) | (User.username == user_data.username)
-    ).first()
-    
-    if existing_user:
+    if is_sharded():
+        # The directory hands out the id and keeps email and username unique across shards.
+        entry = register_user(user_data.email, user_data.username)
+        taken = entry is None
+    else:
+        entry = None
+        taken = db.query(User).filter(
+            (User.email == user_data.email) | (User.username == user_data.username)
+        ).first() is not None
+    
+    if taken:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email or username already registered"
         )
     
     new_user = User(
+        id=entry.user_id if entry else None,
         email=user_data.email,
         username=user_data.username,
         hashed_password=hash_password(user_data.password),
         full_name=user_data.full_name,
         plan_type="free"
     )
+    new_user.subscription = Subscription(plan_type="free")
     
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    
-    subscription = Subscription(user_id=new_user.id, plan_type="free")
-    db.add(subscription)
-    db.commit()
+    with shard_db(entry.shard if entry else 0, db) as user_session:
+        user_session.add(new_user)
+        try:
+            user_session.commit()
+        except Exception:
+            if entry:
+                release_user(entry.user_id)
+            raise
     
     access_token = create_access_token({"sub": str(new_user.id)})
     refresh_token = create_refresh_token({"sub": str(new_user.id)})
@@ -52,22 +62,23 @@ def register(user_data: UserRegister, db: Session = Depends(get_db)):
 
 @router.post("/login", response_model=Token)
 def login(credentials: UserLogin, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == credentials.email).first()
-    
-    if not user or not verify_password(credentials.password, user.hashed_password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid email or password"
-        )
-    
-    if not user.is_active:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Account is inactive"
-        )
-    
-    user.last_login = datetime.utcnow()
-    db.commit()
+    with email_db(credentials.email, db, write=True) as user_session:
+        user = user_session.query(User).filter(User.email == credentials.email).first()
+        
+        if not user or not verify_password(credentials.password, user.hashed_password):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid email or password"
+            )
+        
+        if not user.is_active:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Account is inactive"
+            )
+        
+        user.last_login = datetime.utcnow()
+        user_session.commit()
     
     access_token = create_access_token({"sub": str(user.id)})
     refresh_token = create_refresh_token({"sub": str(user.id)})
@@ -89,8 +100,9 @@ def refresh_token_endpoint(token_data: TokenRefresh, db: Session = Depends(get_d
             detail="Invalid or expired refresh token"
         )
     
-    user_id = payload.get("sub")
-    user = db.query(User).filter(User.id == int(user_id)).first()
+    user_id = int(payload.get("sub"))
+    with user_db(user_id, db) as user_session:
+        user = user_session.query(User).filter(User.id == user_id).first()
     
     if not user or not user.is_active:
         raise HTTPException(
@@ -0,0 +1,322 @@
+"""Admission control and load shedding for uploads and downloads.
+
+A transfer holds a slot from the moment its request arrives until its
+response has been sent. It is admitted while the worker runs fewer than
+``ADMISSION_MAX_TRANSFERS`` transfers, its user fewer than
+``ADMISSION_MAX_USER_TRANSFERS``, and the memory the running transfers are
+estimated to hold stays within ``ADMISSION_MEMORY_MB``. Otherwise it waits
+in a queue of at most ``ADMISSION_QUEUE_SIZE`` requests, ordered by plan and
+then by arrival, for up to ``ADMISSION_QUEUE_TIMEOUT_SECONDS``. A request
+that cannot be admitted in time gets a 503 with Retry-After. When the queue
+is full, a request from a better plan takes the place of the worst one
+waiting.
+
+A limit of 0 turns that limit off. Like the bandwidth buckets, the limits
+apply to each worker process on its own.
+"""
+import asyncio
+import bisect
+import itertools
+import math
+import re
+import threading
+import time
+from collections import deque
+from starlette.responses import JSONResponse
+from app.common.bandwidth import bandwidth, bearer_user_id
+from app.config.settings import settings
+from app.monitoring.metrics import (
+    ADMISSION_ACTIVE, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+)
+from app.storage.batch_upload import QUEUE_CHUNKS
+
+KIB = 1024
+MIB = 1024 * KIB
+
+TRANSFERS = (
+    ("POST", re.compile(r"^/storage/upload$"), "upload"),
+    ("POST", re.compile(r"^/storage/upload/batch$"), "batch_upload"),
+    ("GET", re.compile(r"^/storage/files/\d+/download$"), "download"),
+    ("GET", re.compile(r"^/shares/[^/]+/download$"), "share_download"),
+)
+
+# Starlette keeps a form part in memory until it passes 1 MiB and save_file
+# copies it in 1 MiB chunks.
+UPLOAD_MEMORY = 2 * MIB
+# A streamed batch holds up to QUEUE_CHUNKS body chunks of at most 64 KiB for
+# each file being written, plus the one the parser is waiting on.
+BATCH_UPLOAD_CHUNK = 64 * KIB
+# FileResponse sends files in 64 KiB chunks.
+DOWNLOAD_MEMORY = 64 * KIB
+
+PLAN_PRIORITY = {"ultra": 0, "premium": 1, "free": 2}
+# Share downloads without a token and unknown users wait behind every plan.
+ANONYMOUS_PRIORITY = len(PLAN_PRIORITY)
+
+ADMITTED = "admitted"
+QUEUE_FULL = "queue_full"
+EVICTED = "evicted"
+TIMEOUT = "timeout"
+CANCELLED = "cancelled"
+
+
+def transfer_kind(scope) -> str | None:
+    for method, pattern, kind in TRANSFERS:
+        if scope["method"] == method and pattern.match(scope["path"]):
+            return kind
+    return None
+
+
+def memory_estimate(kind: str, content_length: int | None) -> int:
+    """Bytes a transfer is expected to hold in memory while it runs."""
+    if kind == "upload":
+        return min(content_length, UPLOAD_MEMORY) if content_length is not None else UPLOAD_MEMORY
+    if kind == "batch_upload":
+        return (settings.BATCH_UPLOAD_CONCURRENCY + 1) * QUEUE_CHUNKS * BATCH_UPLOAD_CHUNK
+    return DOWNLOAD_MEMORY
+
+
+class Ticket:
+    __slots__ = ("kind", "user_id", "memory", "priority", "outcome", "enqueued", "admitted", "event", "loop")
+
+    def __init__(self, kind: str, user_id: int | None, memory: int):
+        self.kind = kind
+        self.user_id = user_id
+        self.memory = memory
+        self.priority = ANONYMOUS_PRIORITY
+        self.outcome = None
+        self.enqueued = None
+        self.admitted = None
+        self.event = None
+        self.loop = None
+
+
+class AdmissionController:
+    def __init__(self):
+        self.active = 0
+        self.memory = 0
+        self.by_user = {}
+        # (priority, arrival, ticket), best first.
+        self.waiting = []
+        self.admitted = 0
+        self.rejected = {QUEUE_FULL: 0, EVICTED: 0, TIMEOUT: 0}
+        self.hold_seconds = 0.0
+        self._waits = deque(maxlen=1000)
+        self._arrivals = itertools.count()
+        # Requests normally share one event loop, but the test client runs
+        # each in a loop of its own thread.
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return max(
+            settings.ADMISSION_MAX_TRANSFERS, settings.ADMISSION_MAX_USER_TRANSFERS, settings.ADMISSION_MEMORY_MB
+        ) > 0
+
+    def _fits(self, ticket: Ticket) -> bool:
+        if self.active == 0:
+            # However large it is, a transfer runs on an idle worker.
+            return True
+        if 0 < settings.ADMISSION_MAX_TRANSFERS <= self.active:
+            return False
+        user_limit = settings.ADMISSION_MAX_USER_TRANSFERS
+        if ticket.user_id is not None and 0 < user_limit <= self.by_user.get(ticket.user_id, 0):
+            return False
+        budget = settings.ADMISSION_MEMORY_MB * MIB
+        return budget <= 0 or self.memory + ticket.memory <= budget
+
+    def _admit(self, ticket: Ticket):
+        self.active += 1
+        self.memory += ticket.memory
+        if ticket.user_id is not None:
+            self.by_user[ticket.user_id] = self.by_user.get(ticket.user_id, 0) + 1
+        self.admitted += 1
+        ticket.outcome = ADMITTED
+        ticket.admitted = time.monotonic()
+        ADMISSION_ACTIVE.inc()
+
+    def _finish_wait(self, ticket: Ticket, outcome: str):
+        ticket.outcome = outcome
+        waited = time.monotonic() - ticket.enqueued
+        self._waits.append(waited)
+        ADMISSION_WAIT_SECONDS.labels(outcome).observe(waited)
+        if outcome != ADMITTED:
+            self.rejected[outcome] += 1
+            ADMISSION_REJECTED.labels(ticket.kind, outcome).inc()
+        if ticket.event is not None:
+            ticket.loop.call_soon_threadsafe(ticket.event.set)
+
+    def _remove(self, ticket: Ticket):
+        for i, entry in enumerate(self.waiting):
+            if entry[2] is ticket:
+                del self.waiting[i]
+                ADMISSION_QUEUE_DEPTH.dec()
+                return
+
+    def _dispatch(self):
+        i = 0
+        while i < len(self.waiting):
+            ticket = self.waiting[i][2]
+            if self._fits(ticket):
+                del self.waiting[i]
+                ADMISSION_QUEUE_DEPTH.dec()
+                self._admit(ticket)
+                self._finish_wait(ticket, ADMITTED)
+            else:
+                # A transfer held back by its own user's limit does not block others.
+                i += 1
+
+    def try_admit(self, ticket: Ticket) -> bool:
+        """Admit a transfer that fits and would not jump the queue."""
+        with self._lock:
+            if self.waiting or not self._fits(ticket):
+                return False
+            self._admit(ticket)
+            return True
+
+    async def wait(self, ticket: Ticket) -> str:
+        """Queue a transfer until it is admitted or turned away; returns the outcome."""
+        ticket.loop = asyncio.get_running_loop()
+        ticket.event = asyncio.Event()
+        ticket.enqueued = time.monotonic()
+
+        with self._lock:
+            if len(self.waiting) >= settings.ADMISSION_QUEUE_SIZE:
+                worst = self.waiting[-1][2] if self.waiting else None
+                if worst is None or worst.priority <= ticket.priority:
+                    self._finish_wait(ticket, QUEUE_FULL)
+                    return QUEUE_FULL
+                self._remove(worst)
+                self._finish_wait(worst, EVICTED)
+
+            bisect.insort(self.waiting, (ticket.priority, next(self._arrivals), ticket))
+            ADMISSION_QUEUE_DEPTH.inc()
+            self._dispatch()
+
+        try:
+            await asyncio.wait_for(ticket.event.wait(), settings.ADMISSION_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            # The client went away while waiting.
+            with self._lock:
+                if ticket.outcome is None:
+                    self._remove(ticket)
+                    ticket.outcome = CANCELLED
+            if ticket.outcome == ADMITTED:
+                self.release(ticket)
+            raise
+
+        with self._lock:
+            if ticket.outcome is None:
+                self._remove(ticket)
+                self._finish_wait(ticket, TIMEOUT)
+        return ticket.outcome
+
+    def release(self, ticket: Ticket):
+        with self._lock:
+            self.active -= 1
+            self.memory -= ticket.memory
+            if ticket.user_id is not None:
+                remaining = self.by_user[ticket.user_id] - 1
+                if remaining:
+                    self.by_user[ticket.user_id] = remaining
+                else:
+                    del self.by_user[ticket.user_id]
+            held = time.monotonic() - ticket.admitted
+            self.hold_seconds = 0.9 * self.hold_seconds + 0.1 * held if self.hold_seconds else held
+            ADMISSION_ACTIVE.dec()
+            self._dispatch()
+
+    def retry_after(self) -> int:
+        """Seconds until the queue ahead is expected to drain, from the average transfer time."""
+        slots = settings.ADMISSION_MAX_TRANSFERS or max(self.active, 1)
+        estimate = math.ceil(self.hold_seconds * (len(self.waiting) + 1) / slots)
+        return max(1, min(estimate, settings.ADMISSION_RETRY_AFTER_MAX_SECONDS))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            queued = {}
+            for priority, _, _ in self.waiting:
+                plan = next((p for p, rank in PLAN_PRIORITY.items() if rank == priority), "anonymous")
+                queued[plan] = queued.get(plan, 0) + 1
+
+            return {
+                "enabled": self.enabled,
+                "limits": {
+                    "max_transfers": settings.ADMISSION_MAX_TRANSFERS,
+                    "max_user_transfers": settings.ADMISSION_MAX_USER_TRANSFERS,
+                    "memory_bytes": settings.ADMISSION_MEMORY_MB * MIB,
+                    "queue_size": settings.ADMISSION_QUEUE_SIZE,
+                    "queue_timeout_seconds": settings.ADMISSION_QUEUE_TIMEOUT_SECONDS,
+                },
+                "active": self.active,
+                "active_users": len(self.by_user),
+                "memory_bytes": self.memory,
+                "queued": len(self.waiting),
+                "queued_by_plan": queued,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "wait_ms": {
+                    "samples": len(waits),
+                    "p50": _percentile_ms(waits, 0.50),
+                    "p95": _percentile_ms(waits, 0.95),
+                    "max": _percentile_ms(waits, 1.0),
+                },
+                "average_transfer_seconds": round(self.hold_seconds, 3),
+                "retry_after_seconds": self.retry_after() if self.waiting else None,
+            }
+
+
+def _percentile_ms(ordered: list[float], q: float) -> float | None:
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+
+admission = AdmissionController()
+
+
+def _content_length(scope) -> int | None:
+    for name, value in scope["headers"]:
+        if name == b"content-length":
+            return int(value) if value.isdigit() else None
+    return None
+
+
+class AdmissionMiddleware:
+    """Admits uploads and downloads before their body is read or sent.
+
+    Pure ASGI, so a request that is turned away has not been parsed or
+    buffered. The user's plan is looked up only when a request has to wait.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        kind = transfer_kind(scope) if scope["type"] == "http" and admission.enabled else None
+        if kind is None:
+            await self.app(scope, receive, send)
+            return
+
+        user_id = bearer_user_id(scope)
+        ticket = Ticket(kind, user_id, memory_estimate(kind, _content_length(scope)))
+
+        if not admission.try_admit(ticket):
+            plan_type = await bandwidth.plan_for(user_id) if user_id is not None else None
+            ticket.priority = PLAN_PRIORITY.get(plan_type, ANONYMOUS_PRIORITY)
+            if await admission.wait(ticket) != ADMITTED:
+                response = JSONResponse(
+                    status_code=503,
+                    content={"detail": "Server is busy, please retry later"},
+                    headers={"Retry-After": str(admission.retry_after())}
+                )
+                await response(scope, receive, send)
+                return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.release(ticket)
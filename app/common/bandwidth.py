@@ -0,0 +1,225 @@
+"""Per-plan bandwidth shaping of request and response bodies.
+
+Every user has one token bucket per direction, refilled at their plan's
+rate and shared by all of their connections, and every shaped transfer
+also draws from a global bucket per direction. Buckets hold
+``BANDWIDTH_BURST_SECONDS`` of their rate, so small transfers and the start
+of large ones are not slowed down. A rate of 0 is unlimited; a request with
+nothing to limit is passed through without being wrapped.
+
+Buckets live in the worker process, so with several workers each one
+applies the rates on its own.
+"""
+import asyncio
+import threading
+import time
+from functools import lru_cache
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+from app.auth.jwt_handler import verify_token
+from app.common.throttle import TokenBucket
+from app.config.settings import settings
+
+MB = 1024 * 1024
+UPLOAD = "upload"
+DOWNLOAD = "download"
+# Past this many user buckets, the ones idle long enough to be full again are dropped.
+MAX_USER_BUCKETS = 10000
+
+
+def get_bandwidth_limit(plan_type: str) -> float:
+    """Bytes per second allowed in each direction for a plan; 0 is unlimited."""
+    limits = {
+        "free": settings.FREE_BANDWIDTH_MB_S,
+        "premium": settings.PREMIUM_BANDWIDTH_MB_S,
+        "ultra": settings.ULTRA_BANDWIDTH_MB_S
+    }
+    return limits.get(plan_type, settings.FREE_BANDWIDTH_MB_S) * MB
+
+
+class Limiter:
+    """The buckets one transfer draws from; it waits for the slowest."""
+
+    def __init__(self, buckets: list[TokenBucket]):
+        self.buckets = buckets
+
+    async def consume(self, amount: int):
+        delay = max(bucket.reserve(amount) for bucket in self.buckets)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def wrap_receive(self, receive):
+        async def shaped_receive():
+            message = await receive()
+            if message["type"] == "http.request" and message.get("body"):
+                await self.consume(len(message["body"]))
+            return message
+
+        return shaped_receive
+
+    def wrap_send(self, send):
+        async def shaped_send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                await self.consume(len(message["body"]))
+            await send(message)
+
+        return shaped_send
+
+
+class BandwidthShaper:
+    def __init__(self):
+        self._global = {}
+        self._buckets = {}
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return max(
+            settings.FREE_BANDWIDTH_MB_S, settings.PREMIUM_BANDWIDTH_MB_S,
+            settings.ULTRA_BANDWIDTH_MB_S, settings.GLOBAL_BANDWIDTH_MB_S
+        ) > 0
+
+    def _bucket(self, buckets: dict, key, rate: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None or bucket.rate != rate:
+            with self._lock:
+                bucket = buckets.get(key)
+                if bucket is None or bucket.rate != rate:
+                    if len(buckets) >= MAX_USER_BUCKETS:
+                        self._prune(buckets)
+                    bucket = buckets[key] = TokenBucket(rate, rate * settings.BANDWIDTH_BURST_SECONDS)
+        return bucket
+
+    @staticmethod
+    def _prune(buckets: dict):
+        now = time.monotonic()
+        for key, bucket in list(buckets.items()):
+            if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.capacity:
+                del buckets[key]
+
+    def limiter(self, user_id: int, plan_type: str, direction: str, include_global: bool = True) -> Limiter | None:
+        """Return the limiter for one transfer of a user, or None if nothing limits it."""
+        buckets = []
+
+        rate = get_bandwidth_limit(plan_type)
+        if rate > 0:
+            buckets.append(self._bucket(self._buckets, (user_id, direction), rate))
+
+        global_rate = settings.GLOBAL_BANDWIDTH_MB_S * MB
+        if include_global and global_rate > 0:
+            buckets.append(self._bucket(self._global, direction, global_rate))
+
+        return Limiter(buckets) if buckets else None
+
+    def plan_of(self, user_id: int) -> str | None:
+        """The user's plan, cached for ``BANDWIDTH_PLAN_CACHE_SECONDS``; None if there's no such user."""
+        cached = self._plans.get(user_id)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+
+        from app.users.models import User
+        from app.shards.service import open_user_session
+
+        db = open_user_session(user_id)
+        try:
+            plan_type = db.query(User.plan_type).filter(User.id == user_id).scalar()
+        finally:
+            db.close()
+
+        self._plans[user_id] = (plan_type, time.monotonic() + settings.BANDWIDTH_PLAN_CACHE_SECONDS)
+        return plan_type
+
+    async def plan_for(self, user_id: int) -> str | None:
+        cached = self._plans.get(user_id)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        return await run_in_threadpool(self.plan_of, user_id)
+
+    def forget(self, user_id: int):
+        """Drop a cached plan, e.g. after an upgrade."""
+        self._plans.pop(user_id, None)
+
+
+bandwidth = BandwidthShaper()
+
+
+def _without_pathsend(scope) -> dict:
+    # A server that can send a file by path would bypass the shaped send().
+    extensions = scope.get("extensions") or {}
+    if "http.response.pathsend" not in extensions:
+        return scope
+    return {**scope, "extensions": {k: v for k, v in extensions.items() if k != "http.response.pathsend"}}
+
+
+class ShapedFileResponse(FileResponse):
+    def __init__(self, *args, limiter: Limiter, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        await super().__call__(_without_pathsend(scope), receive, self.limiter.wrap_send(send))
+
+
+def shaped_file_response(limiter: Limiter | None, **kwargs) -> FileResponse:
+    if limiter is None:
+        return FileResponse(**kwargs)
+    return ShapedFileResponse(limiter=limiter, **kwargs)
+
+
+@lru_cache(maxsize=4096)
+def _token_subject(token: str) -> int | None:
+    # Routes still verify the token; an expired one only gets shaped here.
+    payload = verify_token(token, "access")
+    subject = payload.get("sub") if payload else None
+    return int(subject) if subject and str(subject).isdigit() else None
+
+
+def bearer_user_id(scope) -> int | None:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            return _token_subject(token) if scheme.lower() == "bearer" and token else None
+    return None
+
+
+class BandwidthMiddleware:
+    """Shapes the bodies of authenticated transfers by the user's plan.
+
+    Pure ASGI, so uploads are slowed down while they are read, before any
+    form parsing, and downloads as they are sent. Only the routes of the
+    admission table ``TRANSFERS`` are shaped; other requests pass through
+    untouched. Anonymous share downloads are shaped by the route itself,
+    by the owner's plan.
+    """
+
+    def __init__(self, app):
+        # Imported here: the admission module builds on this one.
+        from app.common.admission import transfer_kind
+        self.app = app
+        self.transfer_kind = transfer_kind
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not bandwidth.enabled or self.transfer_kind(scope) is None:
+            await self.app(scope, receive, send)
+            return
+
+        user_id = bearer_user_id(scope)
+        plan_type = await bandwidth.plan_for(user_id) if user_id is not None else None
+        if plan_type is None:
+            await self.app(scope, receive, send)
+            return
+
+        upload = bandwidth.limiter(user_id, plan_type, UPLOAD)
+        download = bandwidth.limiter(user_id, plan_type, DOWNLOAD)
+        if upload is None and download is None:
+            await self.app(scope, receive, send)
+            return
+
+        scope = _without_pathsend(scope)
+        scope.setdefault("state", {})["bandwidth_user_id"] = user_id
+        await self.app(
+            scope,
+            upload.wrap_receive(receive) if upload else receive,
+            download.wrap_send(send) if download else send
+        )
@@ -0,0 +1,208 @@
+"""Response compression negotiated from Accept-Encoding.
+
+Only textual types are compressed, and only once a body reaches
+``COMPRESSION_MIN_SIZE``. File downloads advertise byte ranges, which index
+the stored bytes, so they are always sent as stored, as are partial and
+already-encoded responses. Exports are attachments too but have no ranges,
+and are compressed as they stream. Bodies and stream chunks of at least ``COMPRESSION_OFFLOAD_SIZE``
+are compressed in the thread pool, so a large listing does not stall the
+event loop. Brotli is preferred when the ``brotli`` package is installed and
+the client accepts it; gzip otherwise.
+"""
+import zlib
+from functools import lru_cache
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from app.config.settings import settings
+from app.monitoring.metrics import COMPRESSION_BYTES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP = "gzip"
+BROTLI = "br"
+COMPRESSIBLE_TYPES = {
+    "application/json", "application/x-ndjson", "application/xml", "application/javascript",
+    "application/problem+json",
+}
+# Events have to reach the client as they happen.
+STREAMING_TYPES = {"text/event-stream"}
+SKIP_STATUSES = {204, 206, 304}
+
+
+def supported_encodings() -> tuple[str, ...]:
+    return (BROTLI, GZIP) if brotli is not None else (GZIP,)
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding: str) -> str | None:
+    """The best supported encoding the header allows, or None for identity."""
+    offered = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        offered[name.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in supported_encodings():
+        quality = offered.get(encoding, offered.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def is_compressible(content_type: str | None) -> bool:
+    if not content_type:
+        return False
+    media_type = content_type.partition(";")[0].strip().lower()
+    if media_type in STREAMING_TYPES:
+        return False
+    return (
+        media_type.startswith("text/")
+        or media_type in COMPRESSIBLE_TYPES
+        or media_type.endswith(("+json", "+xml"))
+    )
+
+
+class Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == BROTLI:
+            self._brotli = brotli.Compressor(mode=brotli.MODE_TEXT, quality=settings.COMPRESSION_BROTLI_QUALITY)
+        else:
+            # wbits 31 writes a gzip header and trailer.
+            self._zlib = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == BROTLI:
+            return self._brotli.process(data)
+        return self._zlib.compress(data)
+
+    def finish(self) -> bytes:
+        if self.encoding == BROTLI:
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+    def compress_all(self, data: bytes) -> bytes:
+        return self.compress(data) + self.finish()
+
+
+async def _offloaded(fn, data: bytes) -> bytes:
+    if len(data) >= settings.COMPRESSION_OFFLOAD_SIZE:
+        return await run_in_threadpool(fn, data)
+    return fn(data)
+
+
+class _CompressingSend:
+    def __init__(self, send, encoding: str):
+        self.send = send
+        self.encoding = encoding
+        self.start = None
+        self.headers = None
+        self.compressor = None
+        self.passthrough = False
+
+    def _should_skip(self, message, headers: MutableHeaders) -> bool:
+        return (
+            message["status"] < 200
+            or message["status"] in SKIP_STATUSES
+            or "content-encoding" in headers
+            or "accept-ranges" in headers
+            or "content-range" in headers
+            or not is_compressible(headers.get("content-type"))
+        )
+
+    def _encoded_headers(self):
+        self.headers["Content-Encoding"] = self.encoding
+        etag = self.headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            # The compressed bytes are a different representation.
+            self.headers["ETag"] = "W/" + etag
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            headers = MutableHeaders(raw=list(message.get("headers", ())))
+            if self._should_skip(message, headers):
+                self.passthrough = True
+                await self.send(message)
+                return
+            headers.add_vary_header("Accept-Encoding")
+            self.start = {**message, "headers": headers.raw}
+            self.headers = headers
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None and not more_body:
+            if len(body) >= settings.COMPRESSION_MIN_SIZE:
+                compressed = await _offloaded(Compressor(self.encoding).compress_all, body)
+                if len(compressed) < len(body):
+                    COMPRESSION_BYTES.labels(self.encoding, "in").inc(len(body))
+                    COMPRESSION_BYTES.labels(self.encoding, "out").inc(len(compressed))
+                    self._encoded_headers()
+                    self.headers["Content-Length"] = str(len(compressed))
+                    body = compressed
+            await self.send(self.start)
+            await self.send({"type": "http.response.body", "body": body})
+            return
+
+        if self.compressor is None:
+            content_length = self.headers.get("content-length")
+            if content_length is not None and int(content_length) < settings.COMPRESSION_MIN_SIZE:
+                self.passthrough = True
+                await self.send(self.start)
+                await self.send(message)
+                return
+            # A stream of unknown length is compressed as it goes.
+            self.compressor = Compressor(self.encoding)
+            self._encoded_headers()
+            if "content-length" in self.headers:
+                del self.headers["Content-Length"]
+            await self.send(self.start)
+
+        data = await _offloaded(self.compressor.compress, body) if body else b""
+        if not more_body:
+            data += self.compressor.finish()
+        COMPRESSION_BYTES.labels(self.encoding, "in").inc(len(body))
+        COMPRESSION_BYTES.labels(self.encoding, "out").inc(len(data))
+        if data or not more_body:
+            await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+
+def _accept_encoding(scope) -> str | None:
+    for name, value in scope["headers"]:
+        if name == b"accept-encoding":
+            return value.decode("latin-1")
+    return None
+
+
+class CompressionMiddleware:
+    """Pure ASGI, so streamed exports are compressed chunk by chunk instead of buffered."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        encoding = None
+        if scope["type"] == "http" and settings.COMPRESSION_ENABLED:
+            accept_encoding = _accept_encoding(scope)
+            encoding = negotiate(accept_encoding) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        await self.app(scope, receive, _CompressingSend(send, encoding))
@@ -0,0 +1,38 @@
+"""Encode plain rows straight to JSON, skipping FastAPI's response validation.
+
+The output is byte-for-byte what ``JSONResponse`` produces for the same data
+after a pydantic round trip: compact separators, raw UTF-8 and naive
+datetimes in ISO 8601. orjson is used when it is installed; the standard
+library encoder is the fallback.
+"""
+import json
+from datetime import datetime
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+        default=_default
+    ).encode("utf-8")
+
+
+def json_rows_response(rows: list[dict]) -> Response:
+    return Response(content=dumps(rows), media_type="application/json")
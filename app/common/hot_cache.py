@@ -0,0 +1,320 @@
+"""In-memory cache of small, popular shared files.
+
+Shared links to small files (avatars, icons, documents passed around a
+team) are downloaded far more often than they change, and each download
+opens and reads the blob again. Files up to ``HOT_CACHE_MAX_FILE_BYTES``
+are counted on every shared download and read into memory once they have
+been asked for ``HOT_CACHE_MIN_HITS`` times, within ``HOT_CACHE_MAX_BYTES``
+in total. When the cache is full, the least recently used entries make room
+only for a file asked for more often than they were (TinyLFU admission), so
+a burst of one-off downloads cannot flush the files that are popular.
+Counts are halved every ``HOT_CACHE_SAMPLE_SIZE`` lookups, so popularity
+fades and the counts kept stay bounded.
+
+Blobs are never rewritten in place, and ``StorageEngine`` drops a blob's
+entry when it deletes or moves it. Entries also only serve a file whose
+size still matches its row. The cache lives in the worker process, so with
+several workers each one caches on its own; ``HOT_CACHE_MAX_BYTES`` of 0
+turns it off.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+from hashlib import md5
+from mimetypes import guess_type
+from secrets import token_hex
+from urllib.parse import quote
+from starlette.datastructures import Headers
+from starlette.responses import PlainTextResponse, Response
+from app.config.settings import settings
+from app.monitoring.metrics import HOT_CACHE_BYTES, HOT_CACHE_ENTRIES, record_cache_lookup
+
+CACHE_NAME = "shared_files"
+CRLF = "\r\n"
+
+
+class CachedFile:
+    __slots__ = ("path", "data", "stat")
+
+    def __init__(self, path: str, data: bytes, stat: os.stat_result):
+        self.path = path
+        self.data = data
+        self.stat = stat
+
+
+class HotFileCache:
+    def __init__(self):
+        # Least recently used first.
+        self._entries: OrderedDict[str, CachedFile] = OrderedDict()
+        self._counts: dict[str, int] = {}
+        self._lookups_since_aging = 0
+        self._loading: set[str] = set()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.HOT_CACHE_MAX_BYTES > 0
+
+    def _count(self, path: str) -> int:
+        count = self._counts.get(path, 0) + 1
+        self._counts[path] = count
+        self._lookups_since_aging += 1
+        if self._lookups_since_aging >= settings.HOT_CACHE_SAMPLE_SIZE:
+            self._counts = {p: c // 2 for p, c in self._counts.items() if c > 1}
+            self._lookups_since_aging = 0
+        return count
+
+    def _victims(self, size: int, count: int) -> list[str] | None:
+        """Entries to evict so ``size`` more bytes fit; None if the newcomer loses."""
+        victims = []
+        free = settings.HOT_CACHE_MAX_BYTES - self.bytes
+        for path, entry in self._entries.items():
+            if free >= size:
+                break
+            if self._counts.get(path, 0) >= count:
+                return None
+            victims.append(path)
+            free += len(entry.data)
+        return victims if free >= size else None
+
+    def _drop(self, path: str) -> CachedFile | None:
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.bytes -= len(entry.data)
+        return entry
+
+    def _publish(self):
+        HOT_CACHE_BYTES.set(self.bytes)
+        HOT_CACHE_ENTRIES.set(len(self._entries))
+
+    def lookup(self, path: str, size: int) -> CachedFile | None:
+        """The cached blob at ``path``, read into the cache if it has become popular.
+
+        ``size`` is the size the file's row records; larger files are never
+        counted or cached.
+        """
+        if not self.enabled or size > settings.HOT_CACHE_MAX_FILE_BYTES:
+            return None
+
+        with self._lock:
+            count = self._count(path)
+            entry = self._entries.get(path)
+            if entry is not None and entry.stat.st_size != size:
+                self._drop(path)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(path)
+                self.hits += 1
+            else:
+                self.misses += 1
+            load = False
+            if entry is None and count >= settings.HOT_CACHE_MIN_HITS and path not in self._loading:
+                if self._victims(size, count) is None:
+                    self.rejected += 1
+                else:
+                    self._loading.add(path)
+                    load = True
+
+        record_cache_lookup(CACHE_NAME, entry is not None)
+        if not load:
+            return entry
+        return self._load(path, size, count)
+
+    def _load(self, path: str, size: int, count: int) -> CachedFile | None:
+        try:
+            with open(path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                data = f.read(size + 1)
+        except OSError:
+            data = None
+
+        with self._lock:
+            # Invalidated while it was being read.
+            if path not in self._loading:
+                return None
+            self._loading.discard(path)
+            if data is None or len(data) != size:
+                return None
+
+            victims = self._victims(size, count)
+            if victims is None:
+                self.rejected += 1
+                return None
+            for victim in victims:
+                self._drop(victim)
+                self.evictions += 1
+
+            entry = CachedFile(path, data, stat)
+            self._entries[path] = entry
+            self.bytes += size
+            self.admitted += 1
+            self._publish()
+            return entry
+
+    def invalidate(self, path: str):
+        with self._lock:
+            self._loading.discard(path)
+            self._counts.pop(path, None)
+            if self._drop(path) is not None:
+                self._publish()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "limits": {
+                    "max_bytes": settings.HOT_CACHE_MAX_BYTES,
+                    "max_file_bytes": settings.HOT_CACHE_MAX_FILE_BYTES,
+                    "min_hits": settings.HOT_CACHE_MIN_HITS,
+                    "sample_size": settings.HOT_CACHE_SAMPLE_SIZE,
+                },
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "tracked": len(self._counts),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "evictions": self.evictions,
+            }
+
+
+hot_cache = HotFileCache()
+
+
+class MemoryFileResponse(Response):
+    """Serves a cached blob with the headers of ``FileResponse``, body from memory.
+
+    It does its own Range handling rather than building on ``FileResponse``'s
+    private send methods. ETag and Last-Modified are computed like
+    ``FileResponse`` does, so conditional and If-Range requests behave the
+    same whether a download is served from memory or from disk.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, cached: CachedFile, *, limiter=None, filename: str | None = None,
+                 media_type: str | None = None, content_disposition_type: str = "attachment"):
+        self.data = cached.data
+        self.limiter = limiter
+        self.status_code = 200
+        self.background = None
+        self.media_type = media_type or guess_type(filename or cached.path)[0] or "text/plain"
+        self.init_headers()
+
+        self.headers["accept-ranges"] = "bytes"
+        if filename is not None:
+            quoted = quote(filename)
+            self.headers["content-disposition"] = (
+                f"{content_disposition_type}; filename*=utf-8''{quoted}" if quoted != filename
+                else f'{content_disposition_type}; filename="{filename}"'
+            )
+        etag_base = f"{cached.stat.st_mtime}-{cached.stat.st_size}"
+        self.etag = f'"{md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"'
+        self.last_modified = formatdate(cached.stat.st_mtime, usegmt=True)
+        self.headers["content-length"] = str(len(self.data))
+        self.headers["last-modified"] = self.last_modified
+        self.headers["etag"] = self.etag
+
+    async def __call__(self, scope, receive, send):
+        if self.limiter is not None:
+            send = self.limiter.wrap_send(send)
+        request_headers = Headers(scope=scope)
+        http_range = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if http_range is None or (if_range is not None and if_range not in (self.etag, self.last_modified)):
+            await self._send(send, scope, 200, [(0, len(self.data))])
+            return
+
+        ranges = parse_ranges(http_range, len(self.data))
+        if ranges is None:
+            await PlainTextResponse("Malformed range header.", status_code=400)(scope, receive, send)
+        elif not ranges:
+            response = PlainTextResponse(status_code=416, headers={"content-range": f"bytes */{len(self.data)}"})
+            await response(scope, receive, send)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.headers["content-range"] = f"bytes {start}-{end - 1}/{len(self.data)}"
+            self.headers["content-length"] = str(end - start)
+            await self._send(send, scope, 206, ranges)
+        else:
+            await self._send_multipart(send, scope, ranges)
+
+    async def _send(self, send, scope, status: int, ranges: list[tuple[int, int]], parts: list[bytes] = ()):
+        """Send the response start and the ``ranges`` of the blob, each after its part header if any."""
+        await send({"type": "http.response.start", "status": status, "headers": self.raw_headers})
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        view = memoryview(self.data)
+        for i, (start, end) in enumerate(ranges):
+            if parts:
+                await send({"type": "http.response.body", "body": parts[i], "more_body": True})
+            while start < end:
+                stop = min(start + self.chunk_size, end)
+                await send({"type": "http.response.body", "body": bytes(view[start:stop]), "more_body": True})
+                start = stop
+        await send({"type": "http.response.body", "body": parts[-1] if parts else b"", "more_body": False})
+
+    async def _send_multipart(self, send, scope, ranges: list[tuple[int, int]]):
+        boundary = token_hex(13)
+        content_type = self.headers["content-type"]
+        size = len(self.data)
+        parts = [
+            f"{'' if i == 0 else CRLF}--{boundary}{CRLF}Content-Type: {content_type}{CRLF}"
+            f"Content-Range: bytes {start}-{end - 1}/{size}{CRLF}{CRLF}".encode("latin-1")
+            for i, (start, end) in enumerate(ranges)
+        ]
+        parts.append(f"{CRLF}--{boundary}--{CRLF}".encode("latin-1"))
+        self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+        self.headers["content-length"] = str(sum(map(len, parts)) + sum(end - start for start, end in ranges))
+        await self._send(send, scope, 206, ranges, parts)
+
+
+_RANGE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+def parse_ranges(header: str, size: int) -> list[tuple[int, int]] | None:
+    """Parse a Range header into sorted, merged ``(start, end)`` byte ranges, ``end`` exclusive.
+
+    Returns None if the header is malformed and an empty list if a range
+    starts past the end of the blob, which is answered with 416 like
+    ``FileResponse`` does.
+    """
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes":
+        return None
+    ranges = []
+    for part in spec.split(","):
+        match = _RANGE.match(part)
+        if match is None or match.groups() == ("", ""):
+            return None
+        first, last = match.groups()
+        if not first:
+            start, end = max(size - int(last), 0), size
+        elif last and int(last) < int(first):
+            return None
+        else:
+            start, end = int(first), min(int(last) + 1, size) if last else size
+        if start >= size:
+            return []
+        ranges.append((start, end))
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
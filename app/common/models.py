@@ -1,18 +1,26 @@
-from sqlalchemy import Column, Integer, String, BigInteger, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, Boolean, ForeignKey, Index, Text
 from sqlalchemy.orm import relationship
 from datetime import datetime
-from app.config.database import Base
+from app.config.database import RANGED_ID_DEFAULT, Base
 
 
 class Folder(Base):
     __tablename__ = "folders"
+    # Ids stay unique across shards, see reserve_id_range in app/config/database.py.
+    __table_args__ = {"sqlite_autoincrement": True}
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True, default=RANGED_ID_DEFAULT)
     name = Column(String, nullable=False)
     path = Column(String, nullable=False, index=True)
     parent_id = Column(Integer, ForeignKey("folders.id"), nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     
+    # Bumped whenever a direct child changes; listings use it as their ETag.
+    version = Column(BigInteger, nullable=False, default=0)
+    # Live bytes and items in the whole subtree, see app/storage/rollups.py.
+    total_bytes = Column(BigInteger, nullable=False, default=0)
+    item_count = Column(Integer, nullable=False, default=0)
+    
     is_deleted = Column(Boolean, default=False)
     deleted_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -25,14 +33,26 @@ class Folder(Base):
 
 class File(Base):
     __tablename__ = "files"
+    __table_args__ = (
+        # The orphan scan walks files in byte order of their path, see app/jobs/orphans.py.
+        Index("ix_files_file_path", "file_path", postgresql_ops={"file_path": 'COLLATE "C"'}),
+        {"sqlite_autoincrement": True},
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True, default=RANGED_ID_DEFAULT)
     filename = Column(String, nullable=False)
     original_filename = Column(String, nullable=False)
     file_path = Column(String, nullable=False)
     file_size = Column(BigInteger, nullable=False)
     mime_type = Column(String)
     
+    # SHA-256 of the content, taken while the upload was written.
+    checksum = Column(String(64), nullable=True)
+    # Last time the blob was read back and matched, see app/jobs/scrub.py.
+    verified_at = Column(DateTime, nullable=True, index=True)
+    # Set by the scrubber when the blob is missing or no longer matches.
+    integrity_error = Column(String, nullable=True)
+    
     folder_id = Column(Integer, ForeignKey("folders.id"), nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     
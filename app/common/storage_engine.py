@@ -1,39 +1,85 @@
+import errno
+import hashlib
+import logging
 import os
 import shutil
-import aiofiles
 from pathlib import Path
 from fastapi import UploadFile
+from app.common.hot_cache import hot_cache
+from app.common.throttle import TokenBucket
 from app.config.settings import settings
 
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# ioctl request that makes a file share another file's extents (Linux).
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 1024 * 1024
+# copy_file_range fails with these where the kernel or filesystem can't do it.
+COPY_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL, errno.EPERM}
+# Hard links fail across filesystems, on filesystems without them and past the link limit.
+LINK_FALLBACK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.EMLINK}
+
 
 class StorageEngine:
     def __init__(self, base_path: str = None):
+        # The directory is created with the first user directory, not at import.
         self.base_path = base_path or settings.STORAGE_PATH
-        Path(self.base_path).mkdir(parents=True, exist_ok=True)
     
     def get_user_storage_path(self, user_id: int) -> str:
         user_path = os.path.join(self.base_path, str(user_id))
         Path(user_path).mkdir(parents=True, exist_ok=True)
         return user_path
     
-    async def save_file(self, file: UploadFile, user_id: int, filename: str) -> str:
+    async def save_file(self, file: UploadFile, user_id: int, filename: str) -> tuple[str, int, str]:
+        """Write an upload in chunks; returns its path, size and SHA-256.
+
+        The digest is taken from the chunks as they are written, so the
+        file is never read back.
+        """
+        import aiofiles
+
         user_path = self.get_user_storage_path(user_id)
         file_path = os.path.join(user_path, filename)
+        hasher = hashlib.sha256()
+        size = 0
         
         async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
+            while chunk := await file.read(COPY_CHUNK_SIZE):
+                hasher.update(chunk)
+                await f.write(chunk)
+                size += len(chunk)
         
-        return file_path
+        return file_path, size, hasher.hexdigest()
+    
+    def hash_file(self, file_path: str, throttle: TokenBucket | None = None) -> tuple[int, str]:
+        """Read a blob back and return its size and SHA-256.
+
+        With ``throttle`` every chunk read is paid for in bytes.
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        with open(file_path, "rb") as f:
+            while chunk := f.read(COPY_CHUNK_SIZE):
+                if throttle is not None:
+                    throttle.consume(len(chunk))
+                hasher.update(chunk)
+                size += len(chunk)
+        return size, hasher.hexdigest()
     
     def delete_file(self, file_path: str) -> bool:
+        hot_cache.invalidate(file_path)
         try:
             if os.path.exists(file_path):
                 os.remove(file_path)
                 return True
             return False
         except Exception as e:
-            print(f"Error deleting file: {e}")
+            logger.warning("Error deleting file %s: %s", file_path, e)
             return False
     
     def get_file_size(self, file_path: str) -> int:
@@ -42,14 +88,91 @@ class StorageEngine:
         return 0
     
     def move_file(self, old_path: str, new_path: str) -> bool:
+        hot_cache.invalidate(old_path)
         try:
             Path(os.path.dirname(new_path)).mkdir(parents=True, exist_ok=True)
             shutil.move(old_path, new_path)
             return True
         except Exception as e:
-            print(f"Error moving file: {e}")
+            logger.warning("Error moving file %s to %s: %s", old_path, new_path, e)
             return False
     
+    def copy_file(self, source_path: str, dest_path: str, link: bool = True) -> str:
+        """Copy a blob the cheapest way the filesystem allows.
+
+        Tries a reflink first, which shares the data until either copy is
+        written (btrfs, XFS), then with ``link`` a hard link, then
+        ``copy_file_range``, which copies inside the kernel, then a plain
+        chunked copy. Blobs are never rewritten in place, so two rows can
+        share one inode; ``place_file`` copies files from outside storage,
+        which may still change, and passes ``link=False``. Returns the
+        method used.
+        """
+        with open(source_path, "rb") as src, open(dest_path, "wb") as dst:
+            if fcntl is not None:
+                try:
+                    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                    return "reflink"
+                except OSError:
+                    pass
+        
+        if link:
+            os.remove(dest_path)
+            try:
+                os.link(source_path, dest_path)
+                return "hardlink"
+            except OSError as e:
+                if e.errno not in LINK_FALLBACK_ERRNOS:
+                    raise
+        
+        with open(source_path, "rb") as src, open(dest_path, "wb") as dst:
+            if hasattr(os, "copy_file_range"):
+                remaining = os.fstat(src.fileno()).st_size
+                try:
+                    while remaining > 0:
+                        copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                        if copied == 0:
+                            break
+                        remaining -= copied
+                    if remaining <= 0:
+                        return "copy_file_range"
+                except OSError as e:
+                    if e.errno not in COPY_FALLBACK_ERRNOS:
+                        raise
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+            
+            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+            return "chunked"
+    
+    def place_file(self, source_path: str, dest_path: str, mode: str = "copy") -> str:
+        """Put an existing file at ``dest_path``, without copying it if the mode allows.
+
+        ``link`` makes a hard link and ``move`` renames the file. When that is
+        not possible, e.g. across filesystems, both fall back to ``copy_file``,
+        and a move then removes the source. Returns the method used.
+        """
+        if mode == "link":
+            try:
+                os.link(source_path, dest_path)
+                return "hardlink"
+            except OSError as e:
+                if e.errno not in LINK_FALLBACK_ERRNOS:
+                    raise
+        elif mode == "move":
+            try:
+                os.rename(source_path, dest_path)
+                return "rename"
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+        
+        method = self.copy_file(source_path, dest_path, link=False)
+        if mode == "move":
+            os.remove(source_path)
+        return method
+    
     def calculate_user_storage(self, user_id: int) -> int:
         user_path = self.get_user_storage_path(user_id)
         total_size = 0
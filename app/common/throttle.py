@@ -0,0 +1,41 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """Allows ``rate`` units per second on average, in bursts of up to ``capacity``.
+
+    Callers take what they are about to use and wait the returned delay. The
+    bucket may go negative, so a large request is paid for by the callers
+    that come after it instead of being refused. A rate of 0 or less never
+    waits.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def consume(self, amount: float):
+        delay = self.reserve(amount)
+        if delay:
+            time.sleep(delay)
+
+    async def consume_async(self, amount: float):
+        delay = self.reserve(amount)
+        if delay:
+            await asyncio.sleep(delay)
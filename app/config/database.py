@@ -1,31 +1,282 @@
-from sqlalchemy import create_engine
+import logging
+import os
+import re
+from contextlib import contextmanager
+from fastapi import Request
+from sqlalchemy import bindparam, create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from app.config.settings import settings
 
-engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {},
-    echo=False
-)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _create_engine(url: str):
+    if "sqlite" in url:
+        # Named parameters: SQLAlchemy 1.4 misorders positional ones when a
+        # CTE sits inside an UPDATE, which the folder rollups rely on.
+        return create_engine(url, connect_args={"check_same_thread": False}, paramstyle="named", echo=False)
+    return create_engine(url, echo=False)
+
+
+class ShardSession(Session):
+    """A session bound to one shard; ``shard`` indexes ``shard_engines``."""
+
+    def __init__(self, *args, shard: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shard = shard
+
+
+def _sessionmaker(bind, shard: int):
+    # Sessions live for one request, so objects are kept loaded after commit
+    # instead of being re-selected when the response is serialized.
+    return sessionmaker(
+        class_=ShardSession, shard=shard, autocommit=False, autoflush=False, expire_on_commit=False, bind=bind
+    )
+
+
+engine = _create_engine(settings.DATABASE_URL)
+SessionLocal = _sessionmaker(engine, 0)
+
+# Shard 0 is DATABASE_URL; SHARD_DATABASE_URLS adds shards 1..N, see app/shards.
+shard_engines = [engine, *(_create_engine(url) for url in settings.SHARD_DATABASE_URLS)]
+shard_sessions = [SessionLocal, *(_sessionmaker(bind, shard) for shard, bind in enumerate(shard_engines[1:], 1))]
+
+# Tables whose ids reach clients and survive a move between shards.
+RANGED_TABLES = ("folders", "files", "shares")
+
+
+def next_ranged_id(context):
+    """Take the next id of a RANGED_TABLES row from ``sqlite_sequence`` alone.
+
+    SQLite gives a new row one more than the larger of ``sqlite_sequence``
+    and the largest id in the table, so a shard holding a user moved in
+    from a higher range would go on handing out ids from that range.
+    """
+    # A multi-row VALUES insert hands over a per-row copy of the column.
+    column = context.current_column
+    table = getattr(column, "original", column).table.name
+    connection = context.connection
+    if connection.exec_driver_sql("UPDATE sqlite_sequence SET seq = seq + 1 WHERE name = ?", (table,)).rowcount:
+        return connection.exec_driver_sql("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).scalar()
+    # No row has been inserted yet, or the table was created without AUTOINCREMENT.
+    return connection.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}").scalar()
+
+
+# The id default of RANGED_TABLES. A single database, or PostgreSQL whose
+# sequences ignore explicit ids, lets the database assign them as usual.
+RANGED_ID_DEFAULT = (
+    next_ranged_id if len(shard_engines) > 1 and all(bind.dialect.name == "sqlite" for bind in shard_engines)
+    else None
+)
 
 Base = declarative_base()
 
+logger = logging.getLogger(__name__)
+
+ALEMBIC_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "alembic")
+_REVISION_LINE = re.compile(r"^(revision|down_revision)\s*=\s*['\"]?(\w+)", re.MULTILINE)
+
+
+class SchemaRevisionError(RuntimeError):
+    """The database schema is not at the revision the code was written for."""
+
 
-def get_db():
-    db = SessionLocal()
+def is_sharded() -> bool:
+    return len(shard_engines) > 1
+
+
+def insert_returning_ids(db: Session, table, rows: list[dict]) -> list[int]:
+    """Insert ``rows`` with one statement and return their ids, in row order.
+
+    PostgreSQL returns them from the INSERT; its sequence hands them out in
+    row order. SQLite (whose dialect here compiles no RETURNING) runs one
+    writer at a time, so the rows get consecutive ids ending at the last
+    inserted rowid.
+    """
+    statement = table.insert().values(rows)
+    if db.get_bind().dialect.name == "postgresql":
+        return sorted(db.execute(statement.returning(table.c.id)).scalars())
+    last_id = db.execute(statement).lastrowid
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+
+def get_db(request: Request):
+    if is_sharded():
+        from app.shards.service import request_session
+        db = request_session(request)
+    else:
+        db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
 
-def init_db():
+def head_revision() -> str:
+    """Return the newest Alembic revision, read from the version files.
+
+    Parsing the files directly keeps Alembic itself out of worker boot.
+    """
+    versions = os.path.join(ALEMBIC_PATH, "versions")
+    revisions, parents = set(), set()
+    for name in os.listdir(versions):
+        if not name.endswith(".py") or name.startswith("__"):
+            continue
+        with open(os.path.join(versions, name)) as f:
+            fields = dict(_REVISION_LINE.findall(f.read()))
+        if "revision" in fields:
+            revisions.add(fields["revision"])
+            parents.add(fields.get("down_revision"))
+
+    heads = revisions - parents
+    if len(heads) != 1:
+        raise RuntimeError(f"Expected a single Alembic head, found {sorted(heads)}")
+    return heads.pop()
+
+
+def current_revision(bind=engine) -> str | None:
+    with bind.connect() as connection:
+        if not bind.dialect.has_table(connection, "alembic_version"):
+            return None
+        return connection.exec_driver_sql("SELECT version_num FROM alembic_version").scalar()
+
+
+def reserve_id_range(connection, shard: int):
+    """Start the ids of an empty shard at ``shard * SHARD_ID_STRIDE``.
+
+    Folder, file and share ids are kept when a user moves between shards,
+    so each shard hands them out from its own range. SQLite only honours
+    this for tables created with AUTOINCREMENT, which the models ask for.
+    """
+    start = shard * settings.SHARD_ID_STRIDE
+    for table in RANGED_TABLES:
+        if connection.execute(text(f"SELECT 1 FROM {table} LIMIT 1")).first():
+            continue
+        if connection.dialect.name == "postgresql":
+            connection.execute(
+                text("SELECT setval(pg_get_serial_sequence(:table, 'id'), :start, false)"),
+                {"table": table, "start": start}
+            )
+        elif connection.dialect.name == "sqlite":
+            definition = connection.execute(
+                text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :table"), {"table": table}
+            ).scalar()
+            if "AUTOINCREMENT" not in (definition or "").upper():
+                logger.warning("Cannot reserve an id range for %s: the table was created without AUTOINCREMENT", table)
+                continue
+            connection.execute(text("DELETE FROM sqlite_sequence WHERE name = :table"), {"table": table})
+            connection.execute(
+                text("INSERT INTO sqlite_sequence (name, seq) VALUES (:table, :seq)"),
+                {"table": table, "seq": start - 1}
+            )
+        else:
+            logger.warning("Cannot reserve an id range for %s on %s", table, connection.dialect.name)
+
+
+def next_ids(connection) -> dict[str, int]:
+    """The last id handed out in each of RANGED_TABLES, where the database tracks one."""
+    if connection.dialect.name == "sqlite":
+        return dict(connection.execute(
+            text("SELECT name, seq FROM sqlite_sequence WHERE name IN :tables").bindparams(
+                bindparam("tables", expanding=True)
+            ),
+            {"tables": list(RANGED_TABLES)}
+        ).all())
+    if connection.dialect.name == "postgresql":
+        ids = {}
+        for table in RANGED_TABLES:
+            sequence = connection.execute(
+                text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}
+            ).scalar()
+            ids[table] = connection.execute(text(f"SELECT last_value FROM {sequence}")).scalar()
+        return ids
+    return {}
+
+
+@contextmanager
+def keep_id_range(connection, shard: int):
+    """Keep rows inserted with their ids from moving the shard's next ids.
+
+    On SQLite, inserting an id past ``sqlite_sequence`` raises it, so a user
+    copied in from a higher range would push the shard into that range. The
+    sequences are put back once the block is done. PostgreSQL sequences
+    ignore explicit ids and need nothing.
+    """
+    if connection.dialect.name != "sqlite":
+        yield
+        return
+
+    before = next_ids(connection)
+    yield
+    for table in RANGED_TABLES:
+        connection.execute(
+            text("UPDATE sqlite_sequence SET seq = :seq WHERE name = :table AND seq > :seq"),
+            {"table": table, "seq": before.get(table, max(shard * settings.SHARD_ID_STRIDE - 1, 0))}
+        )
+
+
+def create_schema(bind=engine, shard: int = 0):
+    """Create every table from the models and stamp the database at head."""
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
     from app.users.models import User
     from app.common.models import File, Folder
     from app.sharing.models import Share
     from app.premium.models import Subscription
-    
-    Base.metadata.create_all(bind=engine)
+    from app.jobs.models import IntegrityFinding, Job, StorageDrift, StorageOrphan
+    from app.storage.models import Change, SyncState
+    from app.shards.models import ShardJob, ShardShare, ShardUser
+
+    Base.metadata.create_all(bind=bind)
+    with bind.begin() as connection:
+        if shard:
+            reserve_id_range(connection, shard)
+        MigrationContext.configure(connection).stamp(ScriptDirectory(ALEMBIC_PATH), "head")
+
+
+def upgrade_schema(bind=engine):
+    """Apply every migration to a database whose tables predate them.
+
+    Such a database was built by ``create_all`` with the tables of the
+    initial revision, which creates nothing, so the upgrade starts there.
+    """
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option("script_location", ALEMBIC_PATH)
+    with bind.begin() as connection:
+        config.attributes["connection"] = connection
+        command.upgrade(config, "head")
+
+
+def init_db():
+    """Check that the database schema matches the migrations.
+
+    This is a single query per shard on every boot. A database without an
+    ``alembic_version`` table is built from the models and stamped when it
+    is empty, and migrated when it holds tables from before migrations were
+    tracked. Any other revision than head stops the boot.
+    """
+    head = head_revision()
+    for shard, bind in enumerate(shard_engines):
+        current = current_revision(bind)
+
+        if current is None:
+            with bind.connect() as connection:
+                untracked = bind.dialect.has_table(connection, "users")
+            try:
+                if untracked:
+                    logger.info("Shard %d has tables but no schema revision; migrating it to %s", shard, head)
+                    upgrade_schema(bind)
+                else:
+                    logger.info("Shard %d has no schema revision; creating tables and stamping %s", shard, head)
+                    create_schema(bind, shard)
+            except Exception as e:
+                # Another worker booting at the same time may have got there first.
+                if current_revision(bind) != head:
+                    raise SchemaRevisionError(f"Shard {shard} could not be brought to revision {head}") from e
+        elif current != head:
+            raise SchemaRevisionError(
+                f"Shard {shard} schema is at revision {current} but the code expects {head}; "
+                f"run `alembic -x shard={shard} upgrade head`"
+            )
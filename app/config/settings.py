@@ -11,11 +11,100 @@ class Settings(BaseSettings):
     STORAGE_PATH: str = "./storage"
     
     MAX_UPLOAD_SIZE: int = 5 * 1024 * 1024 * 1024
+    BATCH_UPLOAD_MAX_FILES: int = 1000
+    BATCH_UPLOAD_CONCURRENCY: int = 4
     
     FREE_STORAGE_LIMIT: int = 20 * 1024 * 1024 * 1024
     PREMIUM_STORAGE_LIMIT: int = 1024 * 1024 * 1024 * 1024
     ULTRA_STORAGE_LIMIT: int = 2 * 1024 * 1024 * 1024 * 1024
     
+    # Upload and download rates per plan in MB/s; 0 is unlimited.
+    FREE_BANDWIDTH_MB_S: float = 0.0
+    PREMIUM_BANDWIDTH_MB_S: float = 0.0
+    ULTRA_BANDWIDTH_MB_S: float = 0.0
+    GLOBAL_BANDWIDTH_MB_S: float = 0.0
+    BANDWIDTH_BURST_SECONDS: float = 2.0
+    BANDWIDTH_PLAN_CACHE_SECONDS: float = 60.0
+    
+    # Concurrent uploads and downloads per worker; 0 turns a limit off.
+    ADMISSION_MAX_TRANSFERS: int = 64
+    ADMISSION_MAX_USER_TRANSFERS: int = 8
+    ADMISSION_MEMORY_MB: int = 512
+    ADMISSION_QUEUE_SIZE: int = 256
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: float = 10.0
+    ADMISSION_RETRY_AFTER_MAX_SECONDS: int = 60
+    
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MIN_SIZE: int = 1024
+    COMPRESSION_OFFLOAD_SIZE: int = 64 * 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    
+    JOB_WORKERS: int = 2
+    JOB_POLL_INTERVAL_SECONDS: float = 5.0
+    JOB_STALE_SECONDS: int = 60
+    
+    RECONCILE_DISK_CONCURRENCY: int = 4
+    RECONCILE_BATCH_SIZE: int = 100
+    
+    # Request and database metrics; turned off only to measure what they cost.
+    METRICS_ENABLED: bool = True
+    
+    PROFILE_SAMPLE_RATE: float = 0.0
+    PROFILE_SAMPLE_INTERVAL_MS: float = 5.0
+    PROFILE_BUFFER_SIZE: int = 100
+    PROFILE_MAX_STACKS: int = 200
+    PROFILE_TOKEN_TTL_SECONDS: int = 3600
+    SLOW_QUERY_THRESHOLD_MS: float = 500.0
+    
+    # Empty log paths keep error.log and access.log next to the project directory.
+    LOG_FILE: str = ""
+    LOG_LEVEL: str = "INFO"
+    LOG_MAX_BYTES: int = 50 * 1024 * 1024
+    LOG_BACKUP_COUNT: int = 5
+    LOG_QUEUE_SIZE: int = 10000
+    ACCESS_LOG_ENABLED: bool = True
+    ACCESS_LOG_FILE: str = ""
+    ACCESS_LOG_SAMPLE_RATES: dict[str, float] = {}
+    
+    EXPORT_BATCH_SIZE: int = 1000
+    
+    CHANGES_RETENTION_DAYS: int = 30
+    CHANGES_COMPACT_BATCH_SIZE: int = 500
+    CHANGES_MAX_WAIT_SECONDS: float = 60.0
+    CHANGES_POLL_INTERVAL_SECONDS: float = 2.0
+    
+    ROLLUPS_REPAIR_BATCH_SIZE: int = 100
+    
+    COPY_INLINE_MAX_ITEMS: int = 200
+    COPY_INLINE_MAX_BYTES: int = 256 * 1024 * 1024
+    
+    SCRUB_RATE_MB_S: float = 20.0
+    SCRUB_BATCH_SIZE: int = 100
+    SCRUB_STALE_AFTER_HOURS: float = 7 * 24
+    
+    ORPHAN_SCAN_BATCH_SIZE: int = 1000
+    ORPHAN_MIN_AGE_HOURS: float = 24.0
+    # Names of one directory sorted in memory; larger listings spill sorted runs to temporary files.
+    ORPHAN_SCAN_SORT_RUN: int = 100_000
+    
+    BACKUP_PATH: str = "./backups"
+    BACKUP_WORKERS: int = 4
+    BACKUP_RATE_MB_S: float = 50.0
+    BACKUP_OVERLAP_MINUTES: float = 60.0
+    
+    # Extra databases for user data; DATABASE_URL is shard 0 and holds the shard directory.
+    SHARD_DATABASE_URLS: list[str] = []
+    SHARD_NEW_USER_SHARDS: list[int] = []
+    SHARD_ID_STRIDE: int = 1 << 27
+    SHARD_MOVE_DRAIN_SECONDS: float = 5.0
+    
+    # Small shared files kept in memory by each worker once popular; 0 bytes turns it off.
+    HOT_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    HOT_CACHE_MAX_FILE_BYTES: int = 1024 * 1024
+    HOT_CACHE_MIN_HITS: int = 3
+    HOT_CACHE_SAMPLE_SIZE: int = 10000
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
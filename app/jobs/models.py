@@ -0,0 +1,79 @@
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, Boolean, ForeignKey, Text
+from datetime import datetime
+from app.config.database import Base
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False, index=True)
+    status = Column(String, nullable=False, default="queued", index=True)
+
+    params = Column(Text, nullable=True)
+    checkpoint = Column(Text, nullable=True)
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+
+    progress_done = Column(Integer, default=0)
+    progress_total = Column(Integer, nullable=True)
+
+    cancel_requested = Column(Boolean, default=False)
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+
+    worker_id = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class StorageDrift(Base):
+    __tablename__ = "storage_drift"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    recorded_bytes = Column(BigInteger, nullable=False)
+    actual_bytes = Column(BigInteger, nullable=False)
+    metadata_bytes = Column(BigInteger, nullable=False)
+    drift_bytes = Column(BigInteger, nullable=False)
+    missing_files = Column(Integer, default=0)
+
+    applied = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class IntegrityFinding(Base):
+    __tablename__ = "integrity_findings"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), nullable=False, index=True)
+    # Not a foreign key: findings are kept after the file is purged.
+    file_id = Column(Integer, nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    problem = Column(String, nullable=False)
+    expected_checksum = Column(String(64), nullable=True)
+    actual_checksum = Column(String(64), nullable=True)
+    expected_size = Column(BigInteger, nullable=False)
+    actual_size = Column(BigInteger, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class StorageOrphan(Base):
+    __tablename__ = "storage_orphans"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), nullable=False, index=True)
+    # orphan_blob: a file on disk without a row; dangling_row: a row without its file.
+    kind = Column(String, nullable=False)
+    path = Column(String, nullable=False)
+    file_id = Column(Integer, nullable=True)
+    user_id = Column(Integer, nullable=True)
+    size = Column(BigInteger, nullable=True)
+    quarantined_to = Column(String, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,278 @@
+"""Find blobs without a file row and file rows without a blob.
+
+The storage tree and the ``file_path`` column are both read in path order
+and merge-joined, so memory is bounded by one page of rows and, for each
+directory on the way down, at most ``ORPHAN_SCAN_SORT_RUN`` names however
+many files there are. A larger directory is sorted in runs spilled to
+temporary files and merged. Directories sort as if their name ended with a
+separator, which makes the walk produce paths in the same byte order the
+database sorts them in.
+
+A blob modified within ``min_age_hours`` is left alone, since an upload or
+copy may be about to commit its row. Every other mismatch is checked again
+on its own before it is reported, because files and rows keep changing
+while the scan runs. Orphaned blobs can be moved to a quarantine directory
+inside the storage tree; dangling rows are only reported.
+
+The storage tree is shared by all shards, so a scan on one shard reports
+only the blobs of the users that shard holds.
+"""
+import heapq
+import os
+import tempfile
+import time
+from contextlib import ExitStack
+from typing import Iterator
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+from app.common.models import File
+from app.common.storage_engine import storage_engine
+from app.config.settings import settings
+from app.jobs.models import StorageOrphan
+from app.jobs.runner import JobContext
+from app.shards.service import owns_user
+
+QUARANTINE_DIR = ".quarantine"
+SPILL_READ_SIZE = 64 * 1024
+
+
+class OrphanScanError(Exception):
+    pass
+
+
+def _spill(names: list[str], runs: ExitStack):
+    """Write a sorted run of names to a temporary file; names never contain NUL."""
+    names.sort()
+    run = runs.enter_context(tempfile.TemporaryFile())
+    run.write(b"".join(os.fsencode(name) + b"\0" for name in names))
+    run.seek(0)
+    return run
+
+
+def _read_run(run) -> Iterator[str]:
+    tail = b""
+    while chunk := run.read(SPILL_READ_SIZE):
+        *names, tail = (tail + chunk).split(b"\0")
+        for name in names:
+            yield os.fsdecode(name)
+
+
+def _sorted_keys(directory: str, after: str | None, runs: ExitStack) -> Iterator[str]:
+    """List ``directory`` as sort keys, in order, leaving out what sorts before ``after``.
+
+    At most ``ORPHAN_SCAN_SORT_RUN`` names are held at once: a longer
+    listing is sorted in runs of that size, which are spilled to temporary
+    files registered with ``runs`` and merged.
+    """
+    run_size = settings.ORPHAN_SCAN_SORT_RUN
+    keys, spilled = [], []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                key = entry.name + os.sep
+                path = os.path.join(directory, key)
+                # The whole subtree sorts before ``after``.
+                if after is not None and path < after and not after.startswith(path):
+                    continue
+            elif entry.is_file(follow_symlinks=False):
+                key = entry.name
+                if after is not None and os.path.join(directory, key) <= after:
+                    continue
+            else:
+                continue
+            keys.append(key)
+            if len(keys) >= run_size:
+                spilled.append(_spill(keys, runs))
+                keys = []
+
+    keys.sort()
+    if not spilled:
+        return iter(keys)
+    return heapq.merge(keys, *map(_read_run, spilled))
+
+
+def iter_disk_paths(directory: str, after: str | None = None, skip: str | None = None,
+                    onerror=None) -> Iterator[str]:
+    """Yield the regular files under ``directory`` in path order, starting after ``after``.
+
+    A directory that cannot be listed raises, unless ``onerror`` is given;
+    it is then called with the error and the directory is left out.
+    """
+    with ExitStack() as runs:
+        try:
+            keys = _sorted_keys(directory, after, runs)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            if onerror is None:
+                raise
+            onerror(e)
+            return
+
+        for key in keys:
+            path = os.path.join(directory, key)
+            if not key.endswith(os.sep):
+                yield path
+            elif path[:-1] != skip:
+                yield from iter_disk_paths(path[:-1], after, skip, onerror)
+
+
+def _path_column(db: Session):
+    # Compare bytes, whatever the database's default collation is.
+    if db.get_bind().dialect.name == "postgresql":
+        return File.file_path.collate("C")
+    return File.file_path
+
+
+def iter_file_rows(db: Session, after: str | None = None, batch_size: int | None = None):
+    """Yield the file rows in ``file_path`` order, a page at a time."""
+    batch_size = batch_size or settings.ORPHAN_SCAN_BATCH_SIZE
+    path = _path_column(db)
+    last_path, last_id = after, None
+
+    while True:
+        query = db.query(File.id, File.user_id, File.file_path, File.file_size)
+        if last_id is not None:
+            query = query.filter(or_(path > last_path, and_(path == last_path, File.id > last_id)))
+        elif last_path is not None:
+            query = query.filter(path > last_path)
+
+        rows = query.order_by(path, File.id).limit(batch_size).all()
+        if not rows:
+            return
+        yield from rows
+        last_path, last_id = rows[-1].file_path, rows[-1].id
+
+
+def rows_outside_storage(db: Session, base_path: str) -> int:
+    """Count file rows whose path is not under ``base_path``; they never meet the walk."""
+    prefix = os.path.join(base_path, "")
+    path = _path_column(db)
+    return (
+        db.query(func.count(File.id)).filter(path < prefix).scalar()
+        + db.query(func.count(File.id)).filter(path >= prefix[:-1] + chr(ord(os.sep) + 1)).scalar()
+    )
+
+
+def scan_storage(db: Session, base_path: str, after: str | None = None) -> Iterator[tuple[str, bool, list]]:
+    """Merge the walk with the rows; yields each path, whether it is on disk and its rows."""
+    blobs = iter_disk_paths(base_path, after, skip=os.path.join(base_path, QUARANTINE_DIR))
+    rows = iter_file_rows(db, after)
+    blob = next(blobs, None)
+    row = next(rows, None)
+    previous = after
+
+    while blob is not None or row is not None:
+        path = min(p for p in (blob, row and row.file_path) if p is not None)
+        if previous is not None and path <= previous:
+            raise OrphanScanError(f"Paths out of order at {path!r}; the database does not sort file_path bytewise")
+        previous = path
+
+        on_disk = blob == path
+        if on_disk:
+            blob = next(blobs, None)
+        matched = []
+        while row is not None and row.file_path == path:
+            matched.append(row)
+            row = next(rows, None)
+        yield path, on_disk, matched
+
+
+def _owner(path: str, base_path: str) -> int | None:
+    first = os.path.relpath(path, base_path).split(os.sep)[0]
+    return int(first) if first.isdigit() else None
+
+
+def find_mismatches(db: Session, base_path: str, after: str | None = None,
+                    min_age_hours: float | None = None, shard: int = 0) -> Iterator[tuple[str, list[dict]]]:
+    """Yield every scanned path with the confirmed mismatches found at it."""
+    if min_age_hours is None:
+        min_age_hours = settings.ORPHAN_MIN_AGE_HOURS
+    cutoff = time.time() - min_age_hours * 3600
+
+    for path, on_disk, rows in scan_storage(db, base_path, after):
+        findings = []
+        if on_disk and not rows:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stat = None
+            if stat is not None and stat.st_mtime < cutoff and not db.query(File.id).filter(
+                File.file_path == path
+            ).first() and owns_user(_owner(path, base_path), shard):
+                findings.append({
+                    "kind": "orphan_blob", "path": path, "file_id": None,
+                    "user_id": _owner(path, base_path), "size": stat.st_size,
+                })
+        elif not on_disk:
+            for row in rows:
+                if not os.path.exists(path) and db.query(File.id).filter(File.id == row.id).first():
+                    findings.append({
+                        "kind": "dangling_row", "path": path, "file_id": row.id,
+                        "user_id": row.user_id, "size": row.file_size,
+                    })
+        yield path, findings
+
+
+def quarantine_blob(path: str, base_path: str, batch: str) -> str:
+    """Move an orphaned blob under ``.quarantine/<batch>/``, keeping its relative path."""
+    dest = os.path.join(base_path, QUARANTINE_DIR, batch, os.path.relpath(path, base_path))
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    os.replace(path, dest)
+    return dest
+
+
+def find_orphans(ctx: JobContext) -> dict:
+    params = ctx.params
+    quarantine = params.get("quarantine", False)
+    base_path = storage_engine.base_path
+    state = ctx.checkpoint or {
+        "after": None,
+        "done": 0,
+        "orphans": 0,
+        "orphan_bytes": 0,
+        "dangling": 0,
+        "quarantined": 0,
+    }
+
+    db = ctx.session()
+    try:
+        outside = rows_outside_storage(db, base_path)
+        if quarantine and outside:
+            # Most likely STORAGE_PATH is spelled differently from the stored
+            # paths, and every blob would look orphaned.
+            raise OrphanScanError(f"{outside} file rows are not under {base_path}; refusing to quarantine")
+        db.commit()
+
+        for path, findings in find_mismatches(db, base_path, state["after"], params.get("min_age_hours"), ctx.shard):
+            for finding in findings:
+                if finding["kind"] == "orphan_blob":
+                    state["orphans"] += 1
+                    state["orphan_bytes"] += finding["size"]
+                    if quarantine:
+                        finding["quarantined_to"] = quarantine_blob(path, base_path, f"job-{ctx.job_id}")
+                        state["quarantined"] += 1
+                else:
+                    state["dangling"] += 1
+                db.add(StorageOrphan(job_id=ctx.job_id, **finding))
+
+            state["after"] = path
+            state["done"] += 1
+            if state["done"] % settings.ORPHAN_SCAN_BATCH_SIZE == 0:
+                ctx.check()
+                ctx.save_checkpoint(db, state, done=state["done"])
+                db.commit()
+
+        ctx.save_checkpoint(db, state, done=state["done"])
+        db.commit()
+    finally:
+        db.close()
+
+    return {
+        "paths_scanned": state["done"],
+        "orphaned_blobs": state["orphans"],
+        "orphaned_bytes": state["orphan_bytes"],
+        "dangling_rows": state["dangling"],
+        "quarantined": state["quarantined"],
+        "rows_outside_storage": outside,
+    }
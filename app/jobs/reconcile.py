@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from sqlalchemy.orm import Session
+from app.config.database import shard_sessions
+from app.config.settings import settings
+from app.common.models import File
+from app.common.storage_engine import storage_engine
+from app.jobs.models import StorageDrift
+from app.jobs.runner import JobContext
+from app.users.models import User
+
+
+def _selected_users(db: Session, params: dict):
+    query = db.query(User.id, User.storage_used)
+
+    if params.get("user_ids"):
+        query = query.filter(User.id.in_(params["user_ids"]))
+    if params.get("plan_type"):
+        query = query.filter(User.plan_type == params["plan_type"])
+    if params.get("only_active"):
+        query = query.filter(User.is_active == True)
+
+    return query
+
+
+def measure_user_storage(user_id: int, shard: int = 0) -> dict:
+    """Sum the on-disk size of a user's live files.
+
+    Trashed files keep their blobs but are not charged to ``storage_used``,
+    so only rows that are not soft-deleted are measured.
+    """
+    db = shard_sessions[shard]()
+    try:
+        rows = db.query(File.file_path, File.file_size).filter(
+            File.user_id == user_id,
+            File.is_deleted == False
+        ).yield_per(1000)
+
+        actual_bytes = 0
+        metadata_bytes = 0
+        missing_files = 0
+        for row in rows:
+            metadata_bytes += row.file_size
+            size = storage_engine.get_file_size(row.file_path)
+            if size == 0 and row.file_size:
+                missing_files += 1
+            actual_bytes += size
+    finally:
+        db.close()
+
+    return {
+        "actual_bytes": actual_bytes,
+        "metadata_bytes": metadata_bytes,
+        "missing_files": missing_files,
+    }
+
+
+def reconcile_storage(ctx: JobContext) -> dict:
+    params = ctx.params
+    apply = params.get("apply", True)
+    state = ctx.checkpoint or {
+        "last_user_id": 0,
+        "done": 0,
+        "drifted": 0,
+        "applied": 0,
+        "drift_bytes": 0,
+    }
+
+    db = ctx.session()
+    try:
+        if ctx.progress_total is None:
+            ctx.set_total(db, _selected_users(db, params).count())
+            db.commit()
+
+        with ThreadPoolExecutor(
+            max_workers=settings.RECONCILE_DISK_CONCURRENCY,
+            thread_name_prefix="holabox-reconcile"
+        ) as pool:
+            while True:
+                ctx.check()
+
+                users = _selected_users(db, params).filter(
+                    User.id > state["last_user_id"]
+                ).order_by(User.id).limit(settings.RECONCILE_BATCH_SIZE).all()
+                if not users:
+                    break
+
+                measurements = pool.map(partial(measure_user_storage, shard=ctx.shard), [u.id for u in users])
+
+                for user, measured in zip(users, measurements):
+                    drift = measured["actual_bytes"] - user.storage_used
+                    applied = False
+
+                    if apply and drift:
+                        # Only correct the counter if no upload or delete moved it
+                        # while the user's files were being measured.
+                        applied = db.query(User).filter(
+                            User.id == user.id,
+                            User.storage_used == user.storage_used
+                        ).update(
+                            {User.storage_used: measured["actual_bytes"]},
+                            synchronize_session=False
+                        ) == 1
+
+                    db.add(StorageDrift(
+                        job_id=ctx.job_id,
+                        user_id=user.id,
+                        recorded_bytes=user.storage_used,
+                        actual_bytes=measured["actual_bytes"],
+                        metadata_bytes=measured["metadata_bytes"],
+                        drift_bytes=drift,
+                        missing_files=measured["missing_files"],
+                        applied=applied
+                    ))
+
+                    if drift:
+                        state["drifted"] += 1
+                        state["drift_bytes"] += drift
+                    if applied:
+                        state["applied"] += 1
+
+                state["last_user_id"] = users[-1].id
+                state["done"] += len(users)
+                ctx.save_checkpoint(db, state, done=state["done"])
+                db.commit()
+    finally:
+        db.close()
+
+    return {
+        "users_scanned": state["done"],
+        "users_drifted": state["drifted"],
+        "users_corrected": state["applied"],
+        "total_drift_bytes": state["drift_bytes"],
+    }
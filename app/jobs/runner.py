@@ -0,0 +1,299 @@
+import importlib
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+from app.config.database import is_sharded, shard_sessions
+from app.config.settings import settings
+from app.jobs.models import Job
+from app.shards.service import allocate_job_id
+
+logger = logging.getLogger(__name__)
+
+# Handlers are imported on first use so that registering a job kind does not
+# pull its dependencies into every worker at boot.
+JOB_HANDLERS = {
+    "storage_reconcile": "app.jobs.reconcile:reconcile_storage",
+    "changes_compact": "app.storage.changes:compact_changes",
+    "folder_rollups_repair": "app.storage.rollups:repair_rollups",
+    "folder_copy": "app.storage.copy:copy_folder_job",
+    "file_scrub": "app.jobs.scrub:scrub_files",
+    "storage_orphans": "app.jobs.orphans:find_orphans",
+}
+
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobInterrupted(Exception):
+    pass
+
+
+class JobLost(Exception):
+    """The job was taken over by another worker, e.g. after its heartbeat went stale."""
+
+
+class JobContext:
+    """Handle passed to a job handler.
+
+    Handlers persist their checkpoint with ``save_checkpoint`` inside the same
+    transaction as the work it describes, so a resumed job never redoes or
+    skips a committed batch. If another worker has taken the job over,
+    ``save_checkpoint`` raises ``JobLost`` before that transaction commits. A job runs on the shard it was submitted to,
+    and ``session`` opens sessions there.
+    """
+
+    def __init__(self, runner: "JobRunner", job: Job, shard: int = 0):
+        self.runner = runner
+        self.shard = shard
+        self.job_id = job.id
+        self.kind = job.kind
+        self.created_by = job.created_by
+        self.params = json.loads(job.params) if job.params else {}
+        self.checkpoint = json.loads(job.checkpoint) if job.checkpoint else None
+        self.progress_total = job.progress_total
+
+    def session(self) -> Session:
+        return shard_sessions[self.shard]()
+
+    def check(self):
+        if self.runner.stopping:
+            raise JobInterrupted()
+
+        db = self.session()
+        try:
+            cancel_requested = db.query(Job.cancel_requested).filter(Job.id == self.job_id).scalar()
+        finally:
+            db.close()
+
+        if cancel_requested:
+            raise JobCancelled()
+
+    def set_total(self, db: Session, total: int):
+        self.progress_total = total
+        db.query(Job).filter(Job.id == self.job_id).update(
+            {Job.progress_total: total}, synchronize_session=False
+        )
+
+    def save_checkpoint(self, db: Session, checkpoint: dict, done: int | None = None):
+        self.checkpoint = checkpoint
+        values = {
+            Job.checkpoint: json.dumps(checkpoint),
+            Job.heartbeat_at: datetime.utcnow(),
+        }
+        if done is not None:
+            values[Job.progress_done] = done
+
+        if not db.query(Job).filter(
+            Job.id == self.job_id,
+            Job.worker_id == self.runner.worker_id
+        ).update(values, synchronize_session=False):
+            raise JobLost()
+
+
+def _load_handler(kind: str):
+    module_name, func_name = JOB_HANDLERS[kind].split(":")
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+class JobRunner:
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stopping = False
+        self._executor = None
+        self._poller = None
+        # Running job ids, with the shard each one lives on.
+        self._running = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        if self._executor is not None:
+            return
+
+        self.stopping = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.JOB_WORKERS,
+            thread_name_prefix="holabox-job"
+        )
+        self._poller = threading.Thread(target=self._poll_loop, name="holabox-job-poller", daemon=True)
+        self._poller.start()
+
+    def stop(self):
+        if self._executor is None:
+            return
+
+        self.stopping = True
+        self._wakeup.set()
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def submit(self, db: Session, kind: str, params: dict, created_by: int | None = None) -> Job:
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        job = Job(kind=kind, status="queued", params=json.dumps(params), created_by=created_by)
+        if is_sharded():
+            job.id = allocate_job_id(db.shard)
+        db.add(job)
+        db.commit()
+
+        self._wakeup.set()
+        return job
+
+    def cancel(self, db: Session, job: Job) -> Job:
+        if job.status in FINISHED_STATUSES:
+            return job
+
+        now = datetime.utcnow()
+        # A queued job has no handler to observe the flag, so finish it here.
+        db.query(Job).filter(Job.id == job.id, Job.status == "queued").update(
+            {Job.status: "cancelled", Job.cancel_requested: True, Job.finished_at: now},
+            synchronize_session=False
+        )
+        db.query(Job).filter(Job.id == job.id, Job.status == "running").update(
+            {Job.cancel_requested: True}, synchronize_session=False
+        )
+        db.commit()
+        db.refresh(job)
+        return job
+
+    def _poll_loop(self):
+        while not self.stopping:
+            try:
+                self._heartbeat()
+                self._fill()
+            except Exception:
+                logger.exception("Job poller iteration failed")
+
+            self._wakeup.wait(settings.JOB_POLL_INTERVAL_SECONDS)
+            self._wakeup.clear()
+
+    def _heartbeat(self):
+        with self._lock:
+            running = dict(self._running)
+
+        for shard in sorted(set(running.values())):
+            db = shard_sessions[shard]()
+            try:
+                job_ids = [job_id for job_id, job_shard in running.items() if job_shard == shard]
+                db.query(Job).filter(Job.id.in_(job_ids), Job.worker_id == self.worker_id).update(
+                    {Job.heartbeat_at: datetime.utcnow()}, synchronize_session=False
+                )
+                db.commit()
+            finally:
+                db.close()
+
+    def _claimable(self, now: datetime):
+        stale_before = now - timedelta(seconds=settings.JOB_STALE_SECONDS)
+        return or_(
+            Job.status == "queued",
+            and_(Job.status == "running", or_(Job.heartbeat_at.is_(None), Job.heartbeat_at < stale_before))
+        )
+
+    def _fill(self):
+        # Shards take turns, so a busy one does not starve the others.
+        idle = set()
+        shard = 0
+        while not self.stopping and len(idle) < len(shard_sessions):
+            with self._lock:
+                if len(self._running) >= settings.JOB_WORKERS:
+                    return
+
+            if shard not in idle and not self._claim(shard):
+                idle.add(shard)
+            shard = (shard + 1) % len(shard_sessions)
+
+    def _claim(self, shard: int) -> bool:
+        """Start the oldest claimable job on ``shard``; False if there is none."""
+        db = shard_sessions[shard]()
+        try:
+            now = datetime.utcnow()
+            candidate = db.query(Job.id).filter(
+                self._claimable(now),
+                Job.kind.in_(list(JOB_HANDLERS))
+            ).order_by(Job.id).first()
+            if not candidate:
+                return False
+
+            claimed = db.query(Job).filter(Job.id == candidate.id, self._claimable(now)).update(
+                {
+                    Job.status: "running",
+                    Job.worker_id: self.worker_id,
+                    Job.heartbeat_at: now,
+                    Job.started_at: func.coalesce(Job.started_at, now),
+                },
+                synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+        if claimed:
+            with self._lock:
+                self._running[candidate.id] = shard
+            self._executor.submit(self._run, candidate.id, shard)
+        return True
+
+    def _finish(self, job_id: int, shard: int, values: dict):
+        db = shard_sessions[shard]()
+        try:
+            db.query(Job).filter(Job.id == job_id, Job.worker_id == self.worker_id).update(
+                values, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _run(self, job_id: int, shard: int):
+        try:
+            db = shard_sessions[shard]()
+            try:
+                job = db.query(Job).filter(Job.id == job_id).first()
+                ctx = JobContext(self, job, shard)
+            finally:
+                db.close()
+
+            try:
+                result = _load_handler(ctx.kind)(ctx)
+            except JobCancelled:
+                self._finish(job_id, shard, {Job.status: "cancelled", Job.finished_at: datetime.utcnow()})
+            except JobInterrupted:
+                # Hand the job back so the next runner resumes it from its checkpoint.
+                self._finish(job_id, shard, {Job.status: "queued", Job.worker_id: None})
+            except JobLost:
+                # The job row belongs to the worker that took it over.
+                logger.warning("Job %s (%s) was taken over by another worker", job_id, ctx.kind)
+            except Exception as e:
+                logger.exception("Job %s (%s) failed", job_id, ctx.kind)
+                self._finish(job_id, shard, {
+                    Job.status: "failed",
+                    Job.error: str(e),
+                    Job.finished_at: datetime.utcnow()
+                })
+            else:
+                self._finish(job_id, shard, {
+                    Job.status: "succeeded",
+                    Job.result: json.dumps(result) if result is not None else None,
+                    Job.finished_at: datetime.utcnow()
+                })
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+            self._wakeup.set()
+
+
+job_runner = JobRunner()
@@ -0,0 +1,143 @@
+"""Background integrity scrub of stored blobs.
+
+Files are read back oldest verification first, with files never verified
+ahead of everything else, at no more than ``SCRUB_RATE_MB_S`` so the scrub
+does not starve uploads and downloads of disk bandwidth. A file that still
+matches gets a new ``verified_at``. One that is missing, has the wrong
+size or no longer matches its checksum is flagged with ``integrity_error``
+and reported as an ``IntegrityFinding``. Files stored before checksums
+existed get theirs recorded on their first scrub.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from app.common.models import File
+from app.common.storage_engine import storage_engine
+from app.common.throttle import TokenBucket
+from app.config.settings import settings
+from app.jobs.models import IntegrityFinding
+from app.jobs.runner import JobContext
+from app.storage.changes import bump_listing_versions
+
+MB = 1024 * 1024
+
+
+def _due_files(db: Session, params: dict, cutoff: datetime):
+    query = db.query(File).filter(or_(File.verified_at.is_(None), File.verified_at < cutoff))
+    if params.get("user_ids"):
+        query = query.filter(File.user_id.in_(params["user_ids"]))
+    return query
+
+
+def check_file(file: File, throttle: TokenBucket | None = None) -> tuple[str | None, int | None, str | None]:
+    """Read a blob back; returns the problem found, if any, with its size and digest."""
+    try:
+        size, checksum = storage_engine.hash_file(file.file_path, throttle)
+    except FileNotFoundError:
+        return "missing", None, None
+
+    if size != file.file_size:
+        return "size_mismatch", size, checksum
+    if file.checksum is not None and checksum != file.checksum:
+        return "checksum_mismatch", size, checksum
+    return None, size, checksum
+
+
+def scrub_files(ctx: JobContext) -> dict:
+    params = ctx.params
+    rate = params.get("rate_mb_s")
+    rate = settings.SCRUB_RATE_MB_S if rate is None else rate
+    # A burst of one second's worth keeps small files from waiting on each other.
+    throttle = TokenBucket(rate * MB)
+
+    state = ctx.checkpoint
+    if state is None:
+        stale_after = params.get("stale_after_hours")
+        stale_after = settings.SCRUB_STALE_AFTER_HOURS if stale_after is None else stale_after
+        state = {
+            # Files verified after this are skipped; the cutoff is fixed at the
+            # start so a resumed job doesn't go over its own work again.
+            "cutoff": (datetime.utcnow() - timedelta(hours=stale_after)).isoformat(),
+            "done": 0,
+            "bytes": 0,
+            "verified": 0,
+            "backfilled": 0,
+            "flagged": 0,
+            "problems": {},
+        }
+    cutoff = datetime.fromisoformat(state["cutoff"])
+    max_files = params.get("max_files")
+
+    db = ctx.session()
+    try:
+        if ctx.progress_total is None:
+            total = _due_files(db, params, cutoff).count()
+            ctx.set_total(db, min(total, max_files) if max_files else total)
+            db.commit()
+
+        while max_files is None or state["done"] < max_files:
+            limit = settings.SCRUB_BATCH_SIZE
+            if max_files is not None:
+                limit = min(limit, max_files - state["done"])
+            files = _due_files(db, params, cutoff).order_by(
+                File.verified_at.asc().nullsfirst(), File.id
+            ).limit(limit).all()
+            # Everything read below gets a new verified_at, so the batch
+            # drops out of the query and the next one picks up after it.
+            db.commit()
+            if not files:
+                break
+
+            backfilled = defaultdict(set)
+            for file in files:
+                # Reading a large file at the scrub rate takes a while.
+                ctx.check()
+                problem, size, checksum = check_file(file, throttle)
+                now = datetime.utcnow()
+                # Keep updated_at: scrubbing doesn't modify the file.
+                values = {File.verified_at: now, File.updated_at: File.updated_at}
+
+                if problem is None:
+                    values[File.integrity_error] = None
+                    if file.checksum is None:
+                        values[File.checksum] = checksum
+                        backfilled[file.user_id].add(file.folder_id)
+                        state["backfilled"] += 1
+                    state["verified"] += 1
+                else:
+                    values[File.integrity_error] = problem
+                    db.add(IntegrityFinding(
+                        job_id=ctx.job_id,
+                        file_id=file.id,
+                        user_id=file.user_id,
+                        problem=problem,
+                        expected_checksum=file.checksum,
+                        actual_checksum=checksum,
+                        expected_size=file.file_size,
+                        actual_size=size
+                    ))
+                    state["flagged"] += 1
+                    state["problems"][problem] = state["problems"].get(problem, 0) + 1
+
+                db.query(File).filter(File.id == file.id).update(values, synchronize_session=False)
+                state["bytes"] += size or 0
+
+            # Checksums are part of the file listings.
+            for user_id, folder_ids in backfilled.items():
+                bump_listing_versions(db, user_id, folder_ids)
+
+            state["done"] += len(files)
+            ctx.save_checkpoint(db, state, done=state["done"])
+            db.commit()
+    finally:
+        db.close()
+
+    return {
+        "files_scanned": state["done"],
+        "bytes_read": state["bytes"],
+        "files_verified": state["verified"],
+        "checksums_recorded": state["backfilled"],
+        "files_flagged": state["flagged"],
+        "problems": state["problems"],
+    }
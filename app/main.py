@@ -2,7 +2,18 @@ from fastapi import FastAPI
 import os
 import logging
 from fastapi.middleware.cors import CORSMiddleware
-from app.config.database import init_db
+from prometheus_client import multiprocess
+from app.common.admission import AdmissionMiddleware
+from app.common.bandwidth import BandwidthMiddleware
+from app.common.compression import CompressionMiddleware
+from app.config.database import SchemaRevisionError, init_db, shard_engines
+from app.config.settings import settings
+from app.jobs.runner import job_runner
+from app.monitoring.db import instrument_engine
+from app.monitoring.logs import AccessLogMiddleware, configure_logging, stop_logging
+from app.monitoring.middleware import MetricsMiddleware
+from app.monitoring.profiling import ProfilingMiddleware
+from app.monitoring import routes as monitoring_routes
 from app.auth import routes as auth_routes
 from app.users import routes as user_routes
 from app.storage import routes as storage_routes
@@ -16,12 +27,16 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# configure logging to file for unhandled exceptions
-logging.basicConfig(
-    filename=os.path.join(os.path.dirname(os.path.dirname(__file__)), '..', 'error.log'),
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
-)
+# Log records, including unhandled exceptions, are written by a background thread.
+configure_logging(os.path.join(os.path.dirname(os.path.dirname(__file__)), '..', 'error.log'))
+
+# Innermost, so shaping, metrics and the access log all count compressed bytes.
+app.add_middleware(CompressionMiddleware)
+# Added next so the shaped send() sits below the other middleware and metrics
+# see the transfer at the rate the client gets it.
+app.add_middleware(BandwidthMiddleware)
+# Outside the shaper, so a shaped transfer keeps its slot until it is done.
+app.add_middleware(AdmissionMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,12 +46,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(AccessLogMiddleware)
+if settings.METRICS_ENABLED:
+    # Added last so it wraps every other middleware and times the whole request.
+    app.add_middleware(MetricsMiddleware)
+# The slow-query log and per-statement profiles stay on without metrics.
+for shard_engine in shard_engines:
+    instrument_engine(shard_engine, metrics=settings.METRICS_ENABLED)
+
 app.include_router(auth_routes.router)
 app.include_router(user_routes.router)
 app.include_router(storage_routes.router)
 app.include_router(sharing_routes.router)
 app.include_router(premium_routes.router)
 app.include_router(admin_routes.router)
+app.include_router(monitoring_routes.router)
 
 
 @app.on_event("startup")
@@ -53,8 +78,25 @@ def startup_event():
 
     try:
         init_db()
+    except SchemaRevisionError:
+        # Serving with a schema the code does not match would fail request by request.
+        raise
     except Exception:
         logging.exception("Database initialization failed. Continuing without DB because SKIP_DB is not set.")
+        return
+
+    job_runner.start()
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # Running jobs are handed back to the queue and resume from their checkpoint.
+    job_runner.stop()
+
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
+    stop_logging()
 
 
 from fastapi.responses import JSONResponse
@@ -0,0 +1,66 @@
+from time import perf_counter
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.config.settings import settings
+from app.monitoring.metrics import DB_POOL_CHECKOUT, DB_QUERY_DURATION, request_stats
+from app.monitoring.profiling import current_profile
+from app.monitoring.slow_queries import log_slow_query
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._holabox_started = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - context._holabox_started
+
+    profile = current_profile.get()
+    if profile is not None:
+        profile.record_statement(statement, elapsed)
+
+    if elapsed * 1000 >= settings.SLOW_QUERY_THRESHOLD_MS:
+        log_slow_query(conn.engine, statement, parameters, executemany, elapsed)
+
+
+def _observe_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - context._holabox_started
+    DB_QUERY_DURATION.observe(elapsed)
+
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_time += elapsed
+
+
+def _instrument_pool(engine: Engine):
+    pool = engine.pool
+    if getattr(pool, "_holabox_timed", False):
+        return
+    connect = pool.connect
+
+    def timed_connect():
+        started = perf_counter()
+        try:
+            return connect()
+        finally:
+            DB_POOL_CHECKOUT.observe(perf_counter() - started)
+
+    # SQLAlchemy has no "before checkout" event, so time the call the engine
+    # makes to obtain a connection. engine.dispose() builds a fresh pool,
+    # so call instrument_engine again after disposing.
+    pool.connect = timed_connect
+    pool._holabox_timed = True
+
+
+def instrument_engine(engine: Engine, metrics: bool = True):
+    """Hook the slow-query log and SQL profiles into ``engine``.
+
+    With ``metrics``, statements and pool checkouts are also timed for Prometheus.
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    if metrics:
+        if not event.contains(engine, "after_cursor_execute", _observe_cursor_execute):
+            event.listen(engine, "after_cursor_execute", _observe_cursor_execute)
+        _instrument_pool(engine)
@@ -0,0 +1,185 @@
+"""Logging that never makes a request wait on file I/O.
+
+Records go through a bounded queue to a listener thread, which formats
+them and writes them to size-rotated files: application logs to
+``LOG_FILE`` and one JSON object per request to ``ACCESS_LOG_FILE``. When
+the queue is full, records are dropped and counted rather than waited for.
+
+``ACCESS_LOG_SAMPLE_RATES`` maps a route, optionally prefixed with its
+method (``"GET /storage/files"``), to the fraction of its requests that is
+logged. Server errors are always logged.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from time import perf_counter
+from app.common.bandwidth import bearer_user_id
+from app.config.settings import settings
+from app.monitoring.metrics import LOG_RECORDS_DROPPED
+from app.monitoring.middleware import route_label
+
+ACCESS_LOGGER = "holabox.access"
+REQUEST_ID_HEADER = b"x-request-id"
+APP_LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s]: %(message)s"
+_VALID_REQUEST_ID = re.compile(rb"^[A-Za-z0-9._-]{1,64}$")
+
+# Set for the duration of a request, so application log lines carry its id.
+current_request_id: ContextVar[str | None] = ContextVar("current_request_id", default=None)
+access_logger = logging.getLogger(ACCESS_LOGGER)
+_listener = None
+
+
+class DroppingQueueHandler(QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels("access" if record.name == ACCESS_LOGGER else "app").inc()
+
+    def prepare(self, record):
+        record.request_id = current_request_id.get() or "-"
+        if record.name == ACCESS_LOGGER:
+            # Already plain data; the listener does all the formatting.
+            return record
+        return super().prepare(record)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(), **record.access}
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+
+def _rotating_handler(path: str, formatter: logging.Formatter) -> RotatingFileHandler:
+    # One file per worker when the path asks for it; workers must not
+    # rotate the same file.
+    path = path.replace("{pid}", str(os.getpid()))
+    handler = RotatingFileHandler(
+        path, maxBytes=settings.LOG_MAX_BYTES, backupCount=settings.LOG_BACKUP_COUNT, encoding="utf-8", delay=True
+    )
+    handler.setFormatter(formatter)
+    return handler
+
+
+def configure_logging(default_file: str):
+    """Route the root and access loggers through the queue; safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(settings.LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+
+    app_file = settings.LOG_FILE or default_file
+    app_handler = _rotating_handler(app_file, logging.Formatter(APP_LOG_FORMAT))
+    app_handler.addFilter(lambda record: record.name != ACCESS_LOGGER)
+    access_handler = _rotating_handler(
+        settings.ACCESS_LOG_FILE or os.path.join(os.path.dirname(app_file), "access.log"), JsonFormatter()
+    )
+    access_handler.addFilter(lambda record: record.name == ACCESS_LOGGER)
+
+    root = logging.getLogger()
+    root.setLevel(settings.LOG_LEVEL)
+    root.addHandler(queue_handler)
+    access_logger.setLevel(logging.INFO)
+    access_logger.addHandler(queue_handler)
+    access_logger.propagate = False
+
+    _listener = QueueListener(log_queue, app_handler, access_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write out whatever is still queued and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def sample_rate(method: str, route: str) -> float:
+    rates = settings.ACCESS_LOG_SAMPLE_RATES
+    if not rates:
+        return 1.0
+    return rates.get(f"{method} {route}", rates.get(route, 1.0))
+
+
+def _incoming_request_id(scope) -> str | None:
+    for name, value in scope["headers"]:
+        if name == REQUEST_ID_HEADER:
+            return value.decode("ascii") if _VALID_REQUEST_ID.match(value) else None
+    return None
+
+
+class AccessLogMiddleware:
+    """Pure ASGI middleware writing one structured access log record per request.
+
+    Takes the request id from ``X-Request-ID`` when the client sends a
+    usable one, generates it otherwise, and returns it in the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.ACCESS_LOG_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        request_id = _incoming_request_id(scope) or uuid.uuid4().hex
+        token = current_request_id.set(request_id)
+        received = 0
+        sent = 0
+        status_code = 500
+
+        async def receive_counting():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def send_logging(message):
+            nonlocal sent, status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", ()), (REQUEST_ID_HEADER, request_id.encode("ascii"))]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        started = perf_counter()
+        try:
+            await self.app(scope, receive_counting, send_logging)
+        finally:
+            elapsed = perf_counter() - started
+            current_request_id.reset(token)
+
+            method = scope["method"]
+            route = route_label(scope)
+            rate = sample_rate(method, route)
+            if status_code >= 500 or rate >= 1.0 or random.random() < rate:
+                access = {
+                    "request_id": request_id,
+                    "method": method,
+                    "route": route,
+                    "path": scope["path"],
+                    "status": status_code,
+                    "user_id": bearer_user_id(scope),
+                    "bytes_in": received,
+                    "bytes_out": sent,
+                    "duration_ms": round(elapsed * 1000, 3),
+                    "client": scope["client"][0] if scope.get("client") else None,
+                }
+                if rate < 1.0:
+                    access["sample_rate"] = rate
+                access_logger.info("access", extra={"access": access})
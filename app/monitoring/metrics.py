@@ -0,0 +1,142 @@
+from contextvars import ContextVar
+from prometheus_client import Counter, Gauge, Histogram
+
+# When PROMETHEUS_MULTIPROC_DIR is set before the workers start, prometheus_client
+# backs every metric below with a per-process mmap file and the /metrics
+# endpoint merges them, so counters are aggregated across uvicorn workers.
+
+HTTP_REQUESTS = Counter(
+    "holabox_http_requests_total",
+    "HTTP requests handled",
+    ["method", "route", "status"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "holabox_http_request_duration_seconds",
+    "HTTP request latency",
+    ["method", "route"]
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "holabox_http_requests_in_progress",
+    "HTTP requests currently being handled",
+    ["method"],
+    multiprocess_mode="livesum"
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    "holabox_http_response_size_bytes",
+    "HTTP response body size",
+    ["route"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864, float("inf"))
+)
+
+TRANSFER_BYTES = Counter(
+    "holabox_transfer_bytes_total",
+    "File bytes received by uploads and sent by downloads",
+    ["direction"]
+)
+TRANSFER_THROUGHPUT = Histogram(
+    "holabox_transfer_throughput_bytes_per_second",
+    "Per-request file transfer throughput",
+    ["direction"],
+    buckets=(65536, 262144, 1048576, 4194304, 16777216, 67108864, 268435456, 1073741824, float("inf"))
+)
+
+ADMISSION_ACTIVE = Gauge(
+    "holabox_admission_active_transfers",
+    "Uploads and downloads currently admitted",
+    multiprocess_mode="livesum"
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "holabox_admission_queue_depth",
+    "Uploads and downloads waiting to be admitted",
+    multiprocess_mode="livesum"
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "holabox_admission_wait_seconds",
+    "Time spent in the admission queue",
+    ["outcome"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+)
+ADMISSION_REJECTED = Counter(
+    "holabox_admission_rejected_total",
+    "Uploads and downloads turned away with a 503",
+    ["kind", "reason"]
+)
+
+COMPRESSION_BYTES = Counter(
+    "holabox_compression_bytes_total",
+    "Response bytes before (in) and after (out) compression",
+    ["encoding", "stage"]
+)
+
+DB_QUERY_DURATION = Histogram(
+    "holabox_db_query_duration_seconds",
+    "SQL statement execution time",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, float("inf"))
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "holabox_db_queries_per_request",
+    "SQL statements issued while handling one request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 4, 5, 8, 12, 20, 50, float("inf"))
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "holabox_db_time_per_request_seconds",
+    "Total SQL execution time while handling one request",
+    ["route"]
+)
+DB_POOL_CHECKOUT = Histogram(
+    "holabox_db_pool_checkout_seconds",
+    "Time spent waiting for a connection from the pool",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+)
+
+THREADPOOL_IN_USE = Gauge(
+    "holabox_threadpool_in_use",
+    "Worker threads currently running sync endpoints and dependencies",
+    multiprocess_mode="livesum"
+)
+THREADPOOL_CAPACITY = Gauge(
+    "holabox_threadpool_capacity",
+    "Size of the worker thread pool",
+    multiprocess_mode="livesum"
+)
+
+CACHE_LOOKUPS = Counter(
+    "holabox_cache_lookups_total",
+    "Cache lookups by cache and outcome",
+    ["cache", "result"]
+)
+HOT_CACHE_BYTES = Gauge(
+    "holabox_hot_cache_bytes",
+    "Bytes of small shared files held in memory",
+    multiprocess_mode="livesum"
+)
+HOT_CACHE_ENTRIES = Gauge(
+    "holabox_hot_cache_entries",
+    "Small shared files held in memory",
+    multiprocess_mode="livesum"
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    "holabox_log_records_dropped_total",
+    "Log records dropped because the logging queue was full",
+    ["log"]
+)
+
+
+class RequestStats:
+    __slots__ = ("queries", "query_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+
+
+# Set by the metrics middleware for the duration of a request; sync endpoints
+# run in a copy of this context, so SQL events fired from worker threads still
+# find the request's stats object.
+request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
@@ -0,0 +1,124 @@
+import asyncio
+from functools import lru_cache
+from time import perf_counter
+from anyio.to_thread import current_default_thread_limiter
+from app.monitoring.metrics import (
+    HTTP_REQUESTS, HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_PROGRESS, HTTP_RESPONSE_SIZE,
+    TRANSFER_BYTES, TRANSFER_THROUGHPUT, DB_QUERIES_PER_REQUEST, DB_TIME_PER_REQUEST,
+    THREADPOOL_IN_USE, THREADPOOL_CAPACITY, RequestStats, request_stats
+)
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def route_label(scope) -> str:
+    # Label by the route template rather than the raw path so that ids in
+    # URLs do not explode the number of series.
+    route = scope.get("route")
+    return route.path_format if route is not None else UNMATCHED_ROUTE
+
+
+@lru_cache(maxsize=1024)
+def _route_metrics(method: str, route: str, status_code: int):
+    # Looking up labelled children takes a lock and a dict lookup each;
+    # a route sees the same few combinations over and over.
+    return (
+        HTTP_REQUESTS.labels(method, route, status_code),
+        HTTP_REQUEST_DURATION.labels(method, route),
+        HTTP_RESPONSE_SIZE.labels(route),
+        DB_QUERIES_PER_REQUEST.labels(route),
+        DB_TIME_PER_REQUEST.labels(route),
+    )
+
+
+@lru_cache(maxsize=16)
+def _in_progress(method: str):
+    return HTTP_REQUESTS_IN_PROGRESS.labels(method)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request, transfer and DB metrics.
+
+    Implemented without BaseHTTPMiddleware so that streaming responses are not
+    buffered and the per-request cost stays at a handful of metric updates.
+    """
+
+    def __init__(self, app, exclude_paths: tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.exclude_paths = exclude_paths
+        # anyio keeps one default limiter per event loop and finding it goes
+        # through sniffio on every call, so remember it for the running loop.
+        self._limiter_loop = None
+        self._limiter = None
+        self._threadpool = (None, None)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        in_progress = _in_progress(method)
+        in_progress.inc()
+
+        is_upload = any(
+            name == b"content-type" and value.startswith(b"multipart/form-data")
+            for name, value in scope["headers"]
+        )
+        received = 0
+        sent = 0
+        status_code = 500
+        is_download = False
+
+        async def receive_counting():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def send_counting(message):
+            nonlocal sent, status_code, is_download
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                is_download = any(name == b"content-disposition" for name, _ in message.get("headers", ()))
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        started = perf_counter()
+        try:
+            await self.app(scope, receive_counting if is_upload else receive, send_counting)
+        finally:
+            elapsed = perf_counter() - started
+            route = route_label(scope)
+            request_stats.reset(token)
+            in_progress.dec()
+
+            requests, duration, response_size, queries, query_time = _route_metrics(method, route, status_code)
+            requests.inc()
+            duration.observe(elapsed)
+            response_size.observe(sent)
+            queries.observe(stats.queries)
+            query_time.observe(stats.query_time)
+
+            if is_upload and received:
+                TRANSFER_BYTES.labels("upload").inc(received)
+                TRANSFER_THROUGHPUT.labels("upload").observe(received / elapsed)
+            if is_download and sent:
+                TRANSFER_BYTES.labels("download").inc(sent)
+                TRANSFER_THROUGHPUT.labels("download").observe(sent / elapsed)
+
+            self._record_threadpool()
+
+    def _record_threadpool(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._limiter_loop:
+            self._limiter_loop, self._limiter = loop, current_default_thread_limiter()
+        threadpool = (self._limiter.borrowed_tokens, self._limiter.total_tokens)
+        if threadpool != self._threadpool:
+            self._threadpool = threadpool
+            THREADPOOL_IN_USE.set(threadpool[0])
+            THREADPOOL_CAPACITY.set(threadpool[1])
@@ -0,0 +1,223 @@
+import hashlib
+import hmac
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime
+from app.config.settings import settings
+from app.monitoring.middleware import route_label
+
+PROFILE_HEADER = "X-Profile-Token"
+_PROFILE_HEADER_KEY = PROFILE_HEADER.lower().encode()
+
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_MONITORING_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _sign(expires: int) -> str:
+    return hmac.new(settings.SECRET_KEY.encode(), f"profile:{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+def create_profile_token(ttl_seconds: int) -> tuple[str, int]:
+    expires = int(time.time()) + ttl_seconds
+    return f"{expires}.{_sign(expires)}", expires
+
+
+def verify_profile_token(token: str) -> bool:
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _sign(int(expires)))
+
+
+def _call_site() -> str | None:
+    # First frame in application code that is not part of the instrumentation.
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_APP_DIR) and not filename.startswith(_MONITORING_DIR):
+            return f"{os.path.relpath(filename, os.path.dirname(_APP_DIR))}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def _collapse(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class RequestProfile:
+    def __init__(self, profile_id: int, method: str, path: str, trigger: str):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started_at = datetime.utcnow()
+        self.threads = {threading.get_ident()}
+        self.statements = []
+        self.samples = Counter()
+
+    def record_statement(self, statement: str, elapsed: float):
+        # Sync endpoints run in a worker thread; the first statement they
+        # issue is how the sampler learns which thread to watch.
+        self.threads.add(threading.get_ident())
+        self.statements.append({
+            "sql": statement,
+            "duration_ms": round(elapsed * 1000, 3),
+            "call_site": _call_site(),
+        })
+
+
+current_profile: ContextVar[RequestProfile | None] = ContextVar("current_profile", default=None)
+
+
+class StackSampler:
+    """Samples the stacks of threads serving profiled requests.
+
+    A single daemon thread runs only while at least one request is being
+    profiled. The event-loop thread is shared by concurrent requests, so its
+    samples can include work done for other requests.
+    """
+
+    def __init__(self):
+        self._active = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._active.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="holabox-profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: RequestProfile):
+        with self._lock:
+            self._active.discard(profile)
+
+    def _run(self):
+        interval = settings.PROFILE_SAMPLE_INTERVAL_MS / 1000
+        while True:
+            with self._lock:
+                profiles = list(self._active)
+                if not profiles:
+                    self._thread = None
+                    return
+
+            frames = sys._current_frames()
+            for profile in profiles:
+                for thread_id in list(profile.threads):
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        profile.samples[_collapse(frame)] += 1
+
+            time.sleep(interval)
+
+
+class ProfileStore:
+    """Bounded ring buffer of finished profiles, local to each worker process."""
+
+    def __init__(self):
+        self._profiles = deque(maxlen=settings.PROFILE_BUFFER_SIZE)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def add(self, record: dict):
+        with self._lock:
+            self._profiles.append(record)
+
+    def list(self) -> list[dict]:
+        with self._lock:
+            profiles = list(self._profiles)
+        return [
+            {key: value for key, value in record.items() if key not in ("statements", "stacks")}
+            for record in reversed(profiles)
+        ]
+
+    def get(self, profile_id: int) -> dict | None:
+        with self._lock:
+            for record in self._profiles:
+                if record["id"] == profile_id:
+                    return record
+        return None
+
+
+profile_store = ProfileStore()
+stack_sampler = StackSampler()
+
+
+class ProfilingMiddleware:
+    """Profiles requests carrying a valid signed token or picked by sampling."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _trigger(self, scope) -> str | None:
+        for name, value in scope["headers"]:
+            if name == _PROFILE_HEADER_KEY:
+                return "header" if verify_profile_token(value.decode("latin-1")) else None
+
+        sample_rate = settings.PROFILE_SAMPLE_RATE
+        if sample_rate > 0 and random.random() < sample_rate:
+            return "sample"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trigger = self._trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(profile_store.next_id(), scope["method"], scope["path"], trigger)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        token = current_profile.set(profile)
+        stack_sampler.add(profile)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - started
+            stack_sampler.remove(profile)
+            current_profile.reset(token)
+
+            profile_store.add({
+                "id": profile.id,
+                "method": profile.method,
+                "path": profile.path,
+                "route": route_label(scope),
+                "status": status_code,
+                "trigger": profile.trigger,
+                "started_at": profile.started_at.isoformat(),
+                "duration_ms": round(duration * 1000, 3),
+                "sql_count": len(profile.statements),
+                "sql_ms": round(sum(s["duration_ms"] for s in profile.statements), 3),
+                "samples": sum(profile.samples.values()),
+                "statements": profile.statements,
+                "stacks": [
+                    {"stack": stack, "samples": count}
+                    for stack, count in profile.samples.most_common(settings.PROFILE_MAX_STACKS)
+                ],
+            })
@@ -0,0 +1,58 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_EXPLAIN_PREFIXES = {
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "postgresql": "EXPLAIN ",
+}
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+_MAX_PENDING = 100
+
+# EXPLAIN runs on its own connection in a background thread so the slow
+# request is not made slower by its own diagnostics.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="holabox-explain")
+_pending = threading.BoundedSemaphore(_MAX_PENDING)
+
+
+def _explain(engine: Engine, statement: str, parameters) -> list[str]:
+    prefix = _EXPLAIN_PREFIXES.get(engine.dialect.name)
+    if prefix is None or not statement.lstrip().upper().startswith(_EXPLAINABLE):
+        return []
+
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+    return [" | ".join(str(column) for column in row) for row in rows]
+
+
+def _log(engine: Engine, statement: str, parameters, elapsed: float):
+    try:
+        try:
+            plan = _explain(engine, statement, parameters)
+        except Exception as e:
+            plan = [f"EXPLAIN failed: {e}"]
+
+        logger.warning(
+            "Slow query (%.1f ms): %s\nPlan:\n  %s",
+            elapsed * 1000, statement, "\n  ".join(plan) or "(not available)"
+        )
+    finally:
+        _pending.release()
+
+
+def log_slow_query(engine: Engine, statement: str, parameters, executemany: bool, elapsed: float):
+    if statement.startswith("EXPLAIN"):
+        return
+
+    if executemany:
+        logger.warning("Slow executemany (%.1f ms): %s", elapsed * 1000, statement)
+        return
+
+    if not _pending.acquire(blocking=False):
+        logger.warning("Slow query (%.1f ms), explain backlog full: %s", elapsed * 1000, statement)
+        return
+
+    _executor.submit(_log, engine, statement, parameters, elapsed)
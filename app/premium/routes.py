@@ -6,6 +6,7 @@ from app.config.database import get_db
 from app.users.models import User
 from app.premium.models import Subscription
 from app.common.helpers import get_current_user
+from app.common.bandwidth import bandwidth
 
 router = APIRouter(prefix="/premium", tags=["Premium"])
 
@@ -89,7 +90,7 @@ def upgrade_plan(
     current_user.plan_type = upgrade_data.plan_type
     
     db.commit()
-    db.refresh(subscription)
+    bandwidth.forget(current_user.id)
     
     return subscription
 
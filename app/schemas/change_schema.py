@@ -0,0 +1,25 @@
+from pydantic import BaseModel
+from datetime import datetime
+
+
+class ChangeResponse(BaseModel):
+    seq: int
+    item_type: str
+    item_id: int
+    action: str
+    name: str | None
+    parent_id: int | None
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+
+class ChangeFeedResponse(BaseModel):
+    changes: list[ChangeResponse]
+    cursor: str
+    has_more: bool
+
+
+class ChangesCompactRequest(BaseModel):
+    retention_days: int | None = None
@@ -19,12 +19,23 @@ class FolderResponse(BaseModel):
         from_attributes = True
 
 
+class FolderSummaryResponse(FolderResponse):
+    item_count: int
+    total_bytes: int
+
+
+class FolderBreadcrumb(BaseModel):
+    id: int
+    name: str
+
+
 class FileUploadResponse(BaseModel):
     id: int
     filename: str
     original_filename: str
     file_size: int
     mime_type: str | None
+    checksum: str | None = None
     folder_id: int | None
     created_at: datetime
     
@@ -32,16 +43,32 @@ class FileUploadResponse(BaseModel):
         from_attributes = True
 
 
-class FileResponse(BaseModel):
+class BatchUploadItem(BaseModel):
+    original_filename: str
+    status: str
+    file: FileUploadResponse | None = None
+    sha256: str | None = None
+    error: str | None = None
+
+
+class BatchUploadResponse(BaseModel):
+    files: list[BatchUploadItem]
+    uploaded: int
+    failed: int
+    total_bytes: int
+
+
+class FileListingResponse(BaseModel):
+    """A file in ``GET /storage/files``, whose ETag only changes with the folder's contents."""
     id: int
     filename: str
     original_filename: str
     file_size: int
     mime_type: str | None
+    checksum: str | None = None
     folder_id: int | None
     is_deleted: bool
     view_count: int
-    download_count: int
     created_at: datetime
     updated_at: datetime
     
@@ -49,6 +76,10 @@ class FileResponse(BaseModel):
         from_attributes = True
 
 
+class FileResponse(FileListingResponse):
+    download_count: int
+
+
 class FileMove(BaseModel):
     file_id: int
     target_folder_id: int | None
@@ -60,3 +91,28 @@ class FileRename(BaseModel):
 
 class FolderRename(BaseModel):
     new_name: str
+
+
+class FolderMove(BaseModel):
+    target_parent_id: int | None
+
+
+class FileCopy(BaseModel):
+    target_folder_id: int | None = None
+    new_name: str | None = None
+
+
+class FolderCopy(BaseModel):
+    target_parent_id: int | None = None
+    new_name: str | None = None
+
+
+class BrowseResponse(BaseModel):
+    folder: FolderSummaryResponse | None
+    ancestors: list[FolderBreadcrumb]
+    folders: list[FolderSummaryResponse]
+    files: list[FileResponse]
+    total_folders: int
+    total_files: int
+    offset: int
+    limit: int
@@ -0,0 +1,94 @@
+from pydantic import BaseModel, Field, Json
+from typing import Any
+from datetime import datetime
+
+
+class StorageReconcileRequest(BaseModel):
+    user_ids: list[int] | None = None
+    plan_type: str | None = None
+    only_active: bool = False
+    apply: bool = True
+
+
+class FolderRollupsRepairRequest(BaseModel):
+    user_ids: list[int] | None = None
+    apply: bool = True
+
+
+class FileScrubRequest(BaseModel):
+    user_ids: list[int] | None = None
+    rate_mb_s: float | None = Field(None, ge=0)
+    stale_after_hours: float | None = Field(None, ge=0)
+    max_files: int | None = Field(None, ge=1)
+
+
+class OrphanScanRequest(BaseModel):
+    quarantine: bool = False
+    min_age_hours: float | None = Field(None, ge=0)
+
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    status: str
+    progress_done: int
+    progress_total: int | None
+    cancel_requested: bool
+    result: Json[Any] | None
+    error: str | None
+    created_at: datetime
+    started_at: datetime | None
+    finished_at: datetime | None
+
+    class Config:
+        from_attributes = True
+
+
+class StorageDriftResponse(BaseModel):
+    user_id: int
+    recorded_bytes: int
+    actual_bytes: int
+    metadata_bytes: int
+    drift_bytes: int
+    missing_files: int
+    applied: bool
+
+    class Config:
+        from_attributes = True
+
+
+class IntegrityFindingResponse(BaseModel):
+    file_id: int
+    user_id: int
+    problem: str
+    expected_checksum: str | None
+    actual_checksum: str | None
+    expected_size: int
+    actual_size: int | None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class IntegrityStatusResponse(BaseModel):
+    files: int
+    files_with_checksum: int
+    never_verified: int
+    stale: int
+    flagged: int
+    oldest_verified_at: datetime | None
+    last_scrub: JobResponse | None
+
+
+class StorageOrphanResponse(BaseModel):
+    kind: str
+    path: str
+    file_id: int | None
+    user_id: int | None
+    size: int | None
+    quarantined_to: str | None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
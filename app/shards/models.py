@@ -0,0 +1,33 @@
+from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from datetime import datetime
+from app.config.database import Base
+
+
+class ShardUser(Base):
+    """Where a user's data lives. Only shard 0's copy of this table is used."""
+    __tablename__ = "shard_users"
+
+    # Hands out user ids, so they are unique across shards.
+    user_id = Column(Integer, primary_key=True)
+    shard = Column(Integer, nullable=False, default=0, index=True)
+    email = Column(String, unique=True, nullable=False)
+    username = Column(String, unique=True, nullable=False)
+
+    # Set while the rebalancer copies the user; writes are refused meanwhile.
+    moving = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ShardShare(Base):
+    __tablename__ = "shard_shares"
+
+    share_token = Column(String, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+
+
+class ShardJob(Base):
+    __tablename__ = "shard_jobs"
+
+    # Hands out job ids, so a job can be found from its id alone.
+    job_id = Column(Integer, primary_key=True)
+    shard = Column(Integer, nullable=False)
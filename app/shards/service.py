@@ -0,0 +1,205 @@
+"""Which shard holds a user's data.
+
+With ``SHARD_DATABASE_URLS`` empty there is one shard and nothing here
+touches the directory, so a single database costs no extra queries.
+Otherwise the directory tables in shard 0 hand out user and job ids and
+map users, share tokens and jobs to their shard, and every request runs
+on the shard of the user it is for.
+"""
+import random
+from contextlib import contextmanager
+from fastapi import HTTPException, Request, status
+from sqlalchemy.exc import IntegrityError
+from app.common.bandwidth import bearer_user_id
+from app.config.database import SessionLocal, ShardSession, is_sharded, shard_engines, shard_sessions
+from app.config.settings import settings
+from app.shards.models import ShardJob, ShardShare, ShardUser
+
+SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+def moving_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Account is being moved, try again shortly",
+        headers={"Retry-After": str(max(1, round(settings.SHARD_MOVE_DRAIN_SECONDS)))}
+    )
+
+
+def _switch(db: ShardSession, shard: int) -> ShardSession:
+    # The directory lives on shard 0, so its session serves shard 0 users too.
+    if shard == db.shard:
+        return db
+    db.close()
+    return shard_sessions[shard]()
+
+
+def request_session(request: Request) -> ShardSession:
+    """A session on the shard of the bearer token's user, for ``get_db``."""
+    db = SessionLocal()
+    user_id = bearer_user_id(request.scope)
+    if user_id is None:
+        return db
+
+    entry = db.get(ShardUser, user_id)
+    if entry is None:
+        return db
+    if entry.moving and request.method not in SAFE_METHODS:
+        db.close()
+        raise moving_error()
+    return _switch(db, entry.shard)
+
+
+def get_share_db(share_token: str):
+    """Like ``get_db``, on the shard of the share's owner."""
+    db = SessionLocal()
+    try:
+        if is_sharded():
+            entry = db.query(ShardUser).join(ShardShare, ShardShare.user_id == ShardUser.user_id).filter(
+                ShardShare.share_token == share_token
+            ).first()
+            if entry is not None:
+                # Opening a share counts a view or a download, which is a write.
+                if entry.moving:
+                    raise moving_error()
+                db = _switch(db, entry.shard)
+        yield db
+    finally:
+        db.close()
+
+
+def shard_or_404(shard: int) -> int:
+    if not 0 <= shard < len(shard_sessions):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Shard not found"
+        )
+    return shard
+
+
+@contextmanager
+def shard_db(shard: int, db: ShardSession | None = None):
+    """A session on ``shard``; ``db`` itself when it is already on that shard."""
+    if db is not None and db.shard == shard:
+        yield db
+        return
+
+    other = shard_sessions[shard_or_404(shard)]()
+    try:
+        yield other
+    finally:
+        other.close()
+
+
+def each_shard(db: ShardSession):
+    """Sessions on every shard in order, reusing ``db`` for its own."""
+    for shard in range(len(shard_sessions)):
+        with shard_db(shard, db) as shard_session:
+            yield shard_session
+
+
+def locate_user(user_id: int, db: ShardSession | None = None) -> ShardUser | None:
+    with shard_db(0, db) as directory:
+        return directory.get(ShardUser, user_id)
+
+
+def locate_email(email: str, db: ShardSession | None = None) -> ShardUser | None:
+    with shard_db(0, db) as directory:
+        return directory.query(ShardUser).filter(ShardUser.email == email).first()
+
+
+def _shard_of(entry: ShardUser | None, write: bool) -> int:
+    # Users missing from the directory are on shard 0 until it is backfilled.
+    if entry is None:
+        return 0
+    if write and entry.moving:
+        raise moving_error()
+    return entry.shard
+
+
+def user_db(user_id: int, db: ShardSession, write: bool = False):
+    """A session on the shard holding ``user_id``, see ``shard_db``."""
+    if not is_sharded():
+        return shard_db(0, db)
+    return shard_db(_shard_of(locate_user(user_id, db), write), db)
+
+
+def email_db(email: str, db: ShardSession, write: bool = False):
+    if not is_sharded():
+        return shard_db(0, db)
+    return shard_db(_shard_of(locate_email(email, db), write), db)
+
+
+def owns_user(user_id: int | None, shard: int) -> bool:
+    """Whether ``shard`` answers for a user's blobs; shard 0 also for blobs of no user."""
+    if not is_sharded():
+        return True
+    if user_id is None:
+        return shard == 0
+    return _shard_of(locate_user(user_id), False) == shard
+
+
+def open_user_session(user_id: int) -> ShardSession:
+    """A new session on the shard holding ``user_id``; the caller closes it."""
+    if not is_sharded():
+        return SessionLocal()
+    return shard_sessions[_shard_of(locate_user(user_id), False)]()
+
+
+def new_user_shard() -> int:
+    return random.choice(settings.SHARD_NEW_USER_SHARDS or range(len(shard_engines)))
+
+
+def register_user(email: str, username: str) -> ShardUser | None:
+    """Reserve a user id, email and username; None if either is taken."""
+    with shard_db(0) as directory:
+        entry = ShardUser(email=email, username=username, shard=new_user_shard())
+        directory.add(entry)
+        try:
+            directory.commit()
+        except IntegrityError:
+            directory.rollback()
+            return None
+        return entry
+
+
+def release_user(user_id: int):
+    with shard_db(0) as directory:
+        directory.query(ShardUser).filter(ShardUser.user_id == user_id).delete(synchronize_session=False)
+        directory.commit()
+
+
+def change_user_email(user_id: int, email: str) -> bool:
+    """Move the directory entry to a new email; False if it is taken."""
+    with shard_db(0) as directory:
+        try:
+            directory.query(ShardUser).filter(ShardUser.user_id == user_id).update(
+                {ShardUser.email: email}, synchronize_session=False
+            )
+            directory.commit()
+        except IntegrityError:
+            directory.rollback()
+            return False
+        return True
+
+
+def register_share(share_token: str, user_id: int):
+    with shard_db(0) as directory:
+        directory.add(ShardShare(share_token=share_token, user_id=user_id))
+        directory.commit()
+
+
+def allocate_job_id(shard: int) -> int:
+    with shard_db(0) as directory:
+        entry = ShardJob(shard=shard)
+        directory.add(entry)
+        directory.commit()
+        return entry.job_id
+
+
+def job_shard(job_id: int, db: ShardSession) -> int:
+    if not is_sharded():
+        return 0
+    with shard_db(0, db) as directory:
+        shard = directory.query(ShardJob.shard).filter(ShardJob.job_id == job_id).scalar()
+    return shard if shard is not None else 0
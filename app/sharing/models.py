@@ -1,13 +1,14 @@
 from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
 from sqlalchemy.orm import relationship
 from datetime import datetime
-from app.config.database import Base
+from app.config.database import RANGED_ID_DEFAULT, Base
 
 
 class Share(Base):
     __tablename__ = "shares"
+    __table_args__ = {"sqlite_autoincrement": True}
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True, default=RANGED_ID_DEFAULT)
     share_token = Column(String, unique=True, index=True, nullable=False)
     file_id = Column(Integer, ForeignKey("files.id"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -1,5 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 import os
 from app.config.database import get_db
@@ -7,8 +6,11 @@ from app.schemas.share_schema import ShareCreate, ShareResponse, ShareAccess, Sh
 from app.common.models import File
 from app.users.models import User
 from app.common.helpers import get_current_user
+from app.common.bandwidth import DOWNLOAD, bandwidth, shaped_file_response
+from app.common.hot_cache import MemoryFileResponse, hot_cache
 from app.sharing.service import create_share_link, verify_share_access
 from app.sharing.models import Share
+from app.shards.service import get_share_db
 
 router = APIRouter(prefix="/shares", tags=["Sharing"])
 
@@ -54,7 +56,7 @@ def get_my_shares(
 def access_shared_file(
     share_token: str,
     share_access: ShareAccess,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_share_db)
 ):
     share = verify_share_access(share_token, share_access.password, db)
     
@@ -73,7 +75,7 @@ def access_shared_file(
     share.view_count += 1
     db.commit()
     
-    file = db.query(File).filter(File.id == share.file_id).first()
+    file = share.file
     
     return {
         "file_id": file.id,
@@ -86,8 +88,9 @@ def access_shared_file(
 @router.get("/{share_token}/download")
 def download_shared_file(
     share_token: str,
+    request: Request,
     password: str | None = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_share_db)
 ):
     share = verify_share_access(share_token, password, db)
     
@@ -103,9 +106,11 @@ def download_shared_file(
             detail="Invalid password"
         )
     
-    file = db.query(File).filter(File.id == share.file_id).first()
+    file = share.file
     
-    if not os.path.exists(file.file_path):
+    # A popular small file is served from memory, without touching the disk.
+    cached = hot_cache.lookup(file.file_path, file.file_size)
+    if cached is None and not os.path.exists(file.file_path):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="File does not exist"
@@ -114,7 +119,27 @@ def download_shared_file(
     share.download_count += 1
     db.commit()
     
-    return FileResponse(
+    # Shared downloads count against the owner's bandwidth. A signed-in
+    # downloader is already shaped by the middleware, globally included.
+    limiter = None
+    if bandwidth.enabled:
+        plan_type = bandwidth.plan_of(file.user_id)
+        if plan_type is not None:
+            limiter = bandwidth.limiter(
+                file.user_id, plan_type, DOWNLOAD,
+                include_global=getattr(request.state, "bandwidth_user_id", None) is None
+            )
+    
+    if cached is not None:
+        return MemoryFileResponse(
+            cached,
+            limiter=limiter,
+            filename=file.original_filename,
+            media_type=file.mime_type
+        )
+    
+    return shaped_file_response(
+        limiter,
         path=file.file_path,
         filename=file.original_filename,
         media_type=file.mime_type
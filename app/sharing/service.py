@@ -1,9 +1,11 @@
 import secrets
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from app.sharing.models import Share
 from app.common.models import File
 from app.auth.hashing import hash_password, verify_password
+from app.config.database import is_sharded
+from app.shards.service import register_share
 
 
 def create_share_link(file_id: int, user_id: int, password: str | None, expiry_hours: int | None, db: Session):
@@ -25,14 +27,17 @@ def create_share_link(file_id: int, user_id: int, password: str | None, expiry_h
         expires_at=expires_at
     )
     
+    # Registered first, so a token never resolves to nothing; a failed insert leaves a harmless entry.
+    if is_sharded():
+        register_share(share_token, user_id)
+    
     db.add(share)
     db.commit()
-    db.refresh(share)
     return share
 
 
 def verify_share_access(share_token: str, password: str | None, db: Session):
-    share = db.query(Share).filter(
+    share = db.query(Share).options(joinedload(Share.file)).filter(
         Share.share_token == share_token,
         Share.is_active == True
     ).first()
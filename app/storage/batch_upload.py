@@ -0,0 +1,210 @@
+"""Multi-file uploads streamed straight from the request body.
+
+Each file part is written to its final location while the body arrives
+instead of being spooled to a temporary file first. Writing and hashing run
+in the thread pool for at most ``BATCH_UPLOAD_CONCURRENCY`` files at a time.
+A file waiting for a slot buffers a few chunks, then the parser waits too,
+so a fast client cannot make the server hold more than that in memory.
+"""
+import asyncio
+import hashlib
+import os
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from app.common.helpers import generate_unique_filename
+from app.common.storage_engine import storage_engine
+from app.config.settings import settings
+
+# Chunks buffered per file before the parser waits for its writer.
+QUEUE_CHUNKS = 8
+
+
+class BatchUploadError(Exception):
+    pass
+
+
+class UploadedPart:
+    def __init__(self, original_filename: str, user_path: str):
+        self.original_filename = original_filename
+        self.filename = generate_unique_filename(original_filename)
+        self.file_path = os.path.join(user_path, self.filename)
+        self.file_size = 0
+        self.sha256 = None
+        self.error = None
+        self.ended = False
+        self._hasher = hashlib.sha256()
+        self._file = None
+        self._queue = asyncio.Queue(QUEUE_CHUNKS)
+        self._task = None
+
+    def start(self, slots: asyncio.Semaphore):
+        self._task = asyncio.create_task(self._drain(slots))
+
+    async def feed(self, chunk: bytes):
+        await self._queue.put(chunk)
+
+    async def end(self):
+        self.ended = True
+        await self._queue.put(None)
+
+    async def wait(self):
+        await self._task
+
+    async def _drain(self, slots: asyncio.Semaphore):
+        async with slots:
+            while (chunk := await self._queue.get()) is not None:
+                # A failed part is still drained so the parser never waits on it.
+                if self.error is None:
+                    try:
+                        await run_in_threadpool(self._write, chunk)
+                    except OSError:
+                        self.error = "Could not store file"
+            await run_in_threadpool(self._close)
+
+    def _write(self, chunk: bytes):
+        if self._file is None:
+            self._file = open(self.file_path, "wb")
+        self._file.write(chunk)
+        self._hasher.update(chunk)
+
+    def _close(self):
+        try:
+            if self._file is not None:
+                self._file.close()
+            elif self.error is None:
+                open(self.file_path, "wb").close()
+        except OSError:
+            self.error = "Could not store file"
+
+        if self.error is None:
+            self.sha256 = self._hasher.hexdigest()
+        else:
+            self.discard()
+
+    def discard(self):
+        storage_engine.delete_file(self.file_path)
+
+
+class BatchUploadReceiver:
+    """Parses a multipart body and writes every part with a filename.
+
+    Parts without a filename are ignored. A file over ``MAX_UPLOAD_SIZE``,
+    or one that would take the batch over its declared size, fails on its
+    own and the rest of the batch carries on.
+    """
+
+    def __init__(self, request: Request, user_id: int, declared_size: int):
+        self.request = request
+        self.user_id = user_id
+        self.declared_size = declared_size
+        self.received = 0
+        self.parts: list[UploadedPart] = []
+        self._slots = asyncio.Semaphore(settings.BATCH_UPLOAD_CONCURRENCY)
+        self._events = []
+        self._user_path = None
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = None
+        self._current = None
+
+    def on_part_begin(self):
+        self._disposition = None
+        self._current = None
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        filename = options.get(b"filename")
+        if not filename:
+            return
+        if len(self.parts) >= settings.BATCH_UPLOAD_MAX_FILES:
+            raise BatchUploadError(f"Too many files; at most {settings.BATCH_UPLOAD_MAX_FILES} per batch")
+
+        self._current = UploadedPart(filename.decode("utf-8", errors="replace"), self._user_path)
+        self.parts.append(self._current)
+        self._events.append(("begin", self._current, None))
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._current is not None:
+            self._events.append(("data", self._current, data[start:end]))
+
+    def on_part_end(self):
+        if self._current is not None:
+            self._events.append(("end", self._current, None))
+
+    async def _dispatch(self):
+        # Callbacks run inside parser.write(), which can't await, so their
+        # events are handled here after each chunk.
+        events, self._events = self._events, []
+        for kind, part, data in events:
+            if kind == "begin":
+                part.start(self._slots)
+            elif kind == "end":
+                await part.end()
+            elif part.error is None:
+                part.file_size += len(data)
+                self.received += len(data)
+                if part.file_size > settings.MAX_UPLOAD_SIZE:
+                    part.error = "File exceeds the maximum upload size"
+                elif self.received > self.declared_size:
+                    part.error = "Batch exceeds its declared total size"
+                if part.error is None:
+                    await part.feed(data)
+                else:
+                    self.received -= part.file_size
+
+    async def receive(self) -> list[UploadedPart]:
+        content_type, params = parse_options_header(self.request.headers.get("content-type"))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise BatchUploadError("Expected a multipart/form-data body")
+
+        self._user_path = await run_in_threadpool(storage_engine.get_user_storage_path, self.user_id)
+        parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        })
+
+        try:
+            try:
+                async for chunk in self.request.stream():
+                    parser.write(chunk)
+                    await self._dispatch()
+                parser.finalize()
+            except MultipartParseError:
+                raise BatchUploadError("Malformed multipart body")
+            await self._dispatch()
+            if any(not part.ended for part in self.parts):
+                raise BatchUploadError("Multipart body ended in the middle of a file")
+            await asyncio.gather(*(part.wait() for part in self.parts))
+        except BaseException:
+            await self.abort()
+            raise
+
+        return self.parts
+
+    async def abort(self):
+        """Stop every writer and remove whatever was written."""
+        for part in self.parts:
+            part.error = part.error or "Upload aborted"
+            if not part.ended and part._task is not None:
+                await part.end()
+        await asyncio.gather(*(part.wait() for part in self.parts if part._task is not None), return_exceptions=True)
+        await run_in_threadpool(lambda: [part.discard() for part in self.parts])
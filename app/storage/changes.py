@@ -0,0 +1,224 @@
+"""Per-user change journal for sync clients.
+
+Every mutation of a user's files and folders calls ``record_change`` before
+its commit, so the journal entry lands in the same transaction. Sequence
+numbers come from the user's ``sync_state`` row. Incrementing it locks the
+row until commit, so one user's changes always become visible in sequence
+order, and a client that has seen ``seq`` N has seen everything before it.
+
+A folder's delete, restore, purge, move or copy is journaled once and covers
+the whole subtree.
+
+The same call bumps the listing version of the item's parent folder, or of
+the user's root, which is what listing ETags are made from. The root's is on
+the ``sync_state`` row and goes up with the sequence number. A parent whose
+version was already bumped by ``propagate_rollups`` is left alone, and other
+listings the change invalidates (the old parent of a move) can be passed
+along. Operations that change many listings (every folder of a subtree) bump
+those themselves.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import Integer, String, event, func, literal, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.config.database import ShardSession
+from app.config.settings import settings
+from app.common.models import Folder
+from app.jobs.runner import JobContext
+from app.storage.models import Change, SyncState
+
+
+class ResyncRequired(Exception):
+    pass
+
+
+def _next_seq(db: Session, user_id: int, bump_root: bool, count: int = 1) -> int:
+    values = {SyncState.last_seq: SyncState.last_seq + count, SyncState.updated_at: datetime.utcnow()}
+    if bump_root:
+        values[SyncState.root_version] = SyncState.root_version + 1
+    return db.query(SyncState).filter(SyncState.user_id == user_id).update(values, synchronize_session=False)
+
+
+def _reserve_seqs(db: Session, user_id: int, parent_id: int | None, count: int = 1,
+                  parent_bumped: bool = False, other_listings=()):
+    listings = set(other_listings)
+    if parent_id is None or not parent_bumped:
+        listings.add(parent_id)
+    if not _next_seq(db, user_id, None in listings, count):
+        # First change for this user.
+        try:
+            with db.begin_nested():
+                db.add(SyncState(user_id=user_id, last_seq=0, min_seq=1))
+        except IntegrityError:
+            pass  # created by a concurrent transaction
+        _next_seq(db, user_id, None in listings, count)
+    bump_listing_versions(db, user_id, listings - {None})
+
+
+def bump_listing_versions(db: Session, user_id: int, folder_ids):
+    """Invalidate the listings of ``folder_ids``; ``None`` stands for the root."""
+    ids = {folder_id for folder_id in folder_ids if folder_id is not None}
+    if ids:
+        db.query(Folder).filter(Folder.id.in_(ids)).update(
+            {Folder.version: Folder.version + 1}, synchronize_session=False
+        )
+    if None in folder_ids:
+        db.query(SyncState).filter(SyncState.user_id == user_id).update(
+            {SyncState.root_version: SyncState.root_version + 1}, synchronize_session=False
+        )
+
+
+def record_change(db: Session, user_id: int, item_type: str, item_id: int, action: str,
+                  name: str | None = None, parent_id: int | None = None,
+                  parent_bumped: bool = False, other_listings=()):
+    """Journal a change and invalidate the listings it affects.
+
+    ``parent_bumped`` says the parent's listing version was bumped already;
+    ``other_listings`` are folder ids to bump as well, ``None`` for the root.
+    """
+    _reserve_seqs(db, user_id, parent_id, 1, parent_bumped, other_listings)
+
+    # The new sequence number is read inside the INSERT, saving a round trip.
+    db.execute(Change.__table__.insert().from_select(
+        ["user_id", "seq", "item_type", "item_id", "action", "name", "parent_id", "created_at"],
+        select(
+            literal(user_id), SyncState.last_seq, literal(item_type), literal(item_id),
+            literal(action), literal(name, String), literal(parent_id, Integer), literal(datetime.utcnow())
+        ).where(SyncState.user_id == user_id)
+    ))
+    db.info.setdefault("changed_users", set()).add(user_id)
+
+
+def record_changes(db: Session, user_id: int, item_type: str, action: str,
+                   items: list[tuple[int, str]], parent_id: int | None = None,
+                   parent_bumped: bool = False):
+    """Journal the same action on several items of one parent.
+
+    The items get consecutive sequence numbers from a single increment and
+    are inserted with one statement.
+    """
+    if not items:
+        return
+    _reserve_seqs(db, user_id, parent_id, len(items), parent_bumped)
+
+    last_seq = db.query(SyncState.last_seq).filter(SyncState.user_id == user_id).scalar()
+    now = datetime.utcnow()
+    first_seq = last_seq - len(items) + 1
+    db.execute(Change.__table__.insert(), [
+        {"user_id": user_id, "seq": first_seq + i, "item_type": item_type, "item_id": item_id,
+         "action": action, "name": name, "parent_id": parent_id, "created_at": now}
+        for i, (item_id, name) in enumerate(items)
+    ])
+    db.info.setdefault("changed_users", set()).add(user_id)
+
+
+def get_changes(user_id: int, since: int | None, limit: int, db: Session) -> dict:
+    state = db.query(SyncState.last_seq, SyncState.min_seq).filter(SyncState.user_id == user_id).first()
+    last_seq, min_seq = (state.last_seq, state.min_seq) if state else (0, 1)
+
+    if since is None:
+        return {"changes": [], "cursor": str(last_seq), "has_more": False}
+    if since > last_seq:
+        raise ValueError("Change cursor is ahead of the journal")
+    if since < min_seq - 1:
+        raise ResyncRequired()
+
+    changes = db.query(Change).filter(
+        Change.user_id == user_id,
+        Change.seq > since
+    ).order_by(Change.seq).limit(limit).all()
+
+    cursor = changes[-1].seq if changes else since
+    return {"changes": changes, "cursor": str(cursor), "has_more": cursor < last_seq}
+
+
+class ChangeNotifier:
+    """Wakes long-polling requests in this process when a user's changes commit.
+
+    Changes committed by other worker processes are picked up by polling.
+    """
+
+    def __init__(self):
+        self._waiters = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def notify(self, user_ids):
+        with self._lock:
+            waiters = [waiter for user_id in user_ids for waiter in self._waiters.get(user_id, ())]
+        for loop, wakeup in waiters:
+            loop.call_soon_threadsafe(wakeup.set)
+
+    async def wait(self, user_id: int, timeout: float):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters[user_id].add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters[user_id].discard(waiter)
+                if not self._waiters[user_id]:
+                    del self._waiters[user_id]
+
+
+change_notifier = ChangeNotifier()
+
+
+@event.listens_for(ShardSession, "after_commit")
+def _notify_after_commit(session):
+    user_ids = session.info.pop("changed_users", None)
+    if user_ids:
+        change_notifier.notify(user_ids)
+
+
+@event.listens_for(ShardSession, "after_soft_rollback")
+def _discard_after_rollback(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("changed_users", None)
+
+
+def compact_changes(ctx: JobContext) -> dict:
+    """Delete journal entries older than the retention period.
+
+    ``min_seq`` moves past the deleted entries in the same transaction, so a
+    client whose cursor is older than what remains is told to resync.
+    """
+    retention_days = ctx.params.get("retention_days") or settings.CHANGES_RETENTION_DAYS
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    state = ctx.checkpoint or {"last_user_id": 0, "done": 0, "deleted": 0}
+
+    db = ctx.session()
+    try:
+        while True:
+            ctx.check()
+
+            users = db.query(Change.user_id, func.max(Change.seq).label("max_seq")).filter(
+                Change.created_at < cutoff,
+                Change.user_id > state["last_user_id"]
+            ).group_by(Change.user_id).order_by(Change.user_id).limit(settings.CHANGES_COMPACT_BATCH_SIZE).all()
+            if not users:
+                break
+
+            for user in users:
+                state["deleted"] += db.query(Change).filter(
+                    Change.user_id == user.user_id,
+                    Change.seq <= user.max_seq
+                ).delete(synchronize_session=False)
+                db.query(SyncState).filter(
+                    SyncState.user_id == user.user_id,
+                    SyncState.min_seq <= user.max_seq
+                ).update({SyncState.min_seq: user.max_seq + 1}, synchronize_session=False)
+
+            state["last_user_id"] = users[-1].user_id
+            state["done"] += len(users)
+            ctx.save_checkpoint(db, state, done=state["done"])
+            db.commit()
+    finally:
+        db.close()
+
+    return {"users_compacted": state["done"], "changes_deleted": state["deleted"]}
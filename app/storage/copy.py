@@ -0,0 +1,308 @@
+"""Server-side copies of files and folder subtrees.
+
+Blobs are copied first, outside any transaction, with
+``storage_engine.copy_file``. The rows are then created in bulk in one
+short transaction that also charges the quota, so a copy appears whole or
+not at all. Only live items are copied. Copies keep the source checksum but
+are left unverified, so the scrubber reads them back early.
+
+A folder copy is journaled once, as a ``copy`` of its root; sync clients
+list the new subtree like they would after a move.
+"""
+import logging
+import os
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+from sqlalchemy.orm import Session
+from app.common.helpers import generate_unique_filename
+from app.common.models import File, Folder
+from app.common.storage_engine import storage_engine
+from app.jobs.runner import JobContext
+from app.storage.changes import record_change
+from app.storage.service import add_to_live_folder, subtree_folder_ids
+from app.users.models import User
+from app.users.service import reserve_storage
+
+logger = logging.getLogger(__name__)
+
+# Folder rows inserted per statement; also bounds the IN lists used to read their ids back.
+INSERT_BATCH_SIZE = 500
+
+
+class CopyFailed(Exception):
+    pass
+
+
+class CopyQuotaExceeded(CopyFailed):
+    pass
+
+
+def _copy_blob(source_path: str, user_id: int, name: str, filename: str | None = None) -> tuple[str, str, str]:
+    filename = filename or generate_unique_filename(name)
+    dest_path = os.path.join(storage_engine.get_user_storage_path(user_id), filename)
+    try:
+        method = storage_engine.copy_file(source_path, dest_path)
+    except BaseException:
+        storage_engine.delete_file(dest_path)
+        raise
+    return filename, dest_path, method
+
+
+def copy_user_file(file: File, target_folder_id: int | None, new_name: str | None, user: User, db: Session):
+    """Copy a live file into ``target_folder_id``.
+
+    Returns the new file, None if it would exceed the quota, and False if
+    the file or the target folder went away meanwhile.
+    """
+    # Don't hold a transaction open while the blob is copied.
+    db.commit()
+
+    name = new_name or file.original_filename
+    try:
+        filename, file_path, _ = _copy_blob(file.file_path, user.id, name)
+    except FileNotFoundError:
+        return False
+
+    try:
+        if not reserve_storage(user, file.file_size, db):
+            db.rollback()
+            storage_engine.delete_file(file_path)
+            return None
+
+        if not add_to_live_folder(db, target_folder_id, file.file_size, 1) or not db.query(File.id).filter(
+            File.id == file.id,
+            File.is_deleted == False
+        ).first():
+            db.rollback()
+            storage_engine.delete_file(file_path)
+            return False
+
+        copy = File(
+            filename=filename,
+            original_filename=name,
+            file_path=file_path,
+            file_size=file.file_size,
+            mime_type=file.mime_type,
+            checksum=file.checksum,
+            folder_id=target_folder_id,
+            user_id=user.id
+        )
+        db.add(copy)
+        db.flush()
+        record_change(
+            db, user.id, "file", copy.id, "create", copy.original_filename, target_folder_id, parent_bumped=True
+        )
+        db.commit()
+    except BaseException:
+        db.rollback()
+        storage_engine.delete_file(file_path)
+        raise
+
+    return copy
+
+
+def _snapshot(folder_id: int, user_id: int, db: Session) -> tuple[list, list]:
+    """Read the live folders of a subtree, parents first, and their live files."""
+    subtree = subtree_folder_ids(folder_id)
+    rows = db.query(Folder.id, Folder.parent_id, Folder.name).filter(
+        Folder.id.in_(subtree),
+        Folder.user_id == user_id,
+        Folder.is_deleted == False
+    ).all()
+
+    children = defaultdict(list)
+    folders = [row for row in rows if row.id == folder_id]
+    for row in rows:
+        children[row.parent_id].append(row)
+    for row in folders:
+        folders.extend(children[row.id])
+
+    files = db.query(
+        File.id, File.folder_id, File.original_filename, File.file_path, File.file_size, File.mime_type,
+        File.checksum
+    ).filter(
+        File.folder_id.in_(subtree),
+        File.user_id == user_id,
+        File.is_deleted == False
+    ).order_by(File.id).all()
+    return folders, files
+
+
+def _subtree_rollups(folders: list, files: list) -> dict[int, tuple[int, int]]:
+    totals = {folder.id: [0, 0] for folder in folders}
+    for file in files:
+        totals[file.folder_id][0] += file.file_size
+        totals[file.folder_id][1] += 1
+    # Parents come first, so children are added to them before they are read.
+    for folder in reversed(folders[1:]):
+        totals[folder.parent_id][0] += totals[folder.id][0]
+        totals[folder.parent_id][1] += totals[folder.id][1] + 1
+    return {folder_id: tuple(values) for folder_id, values in totals.items()}
+
+
+def _insert_folders(root: Folder, folders: list, rollups: dict, user_id: int, db: Session) -> dict:
+    """Insert the copied subfolders level by level; returns old id -> new id."""
+    children = defaultdict(list)
+    for folder in folders[1:]:
+        children[folder.parent_id].append(folder)
+
+    now = datetime.utcnow()
+    new_ids = {folders[0].id: root.id}
+    paths = {root.id: root.path}
+    level = [folders[0].id]
+    while level:
+        pending = [child for old_id in level for child in children[old_id]]
+        level = []
+        for start in range(0, len(pending), INSERT_BATCH_SIZE):
+            batch = pending[start:start + INSERT_BATCH_SIZE]
+            db.execute(Folder.__table__.insert(), [
+                {
+                    "name": folder.name, "path": f"{paths[new_ids[folder.parent_id]]}/{folder.name}",
+                    "parent_id": new_ids[folder.parent_id], "user_id": user_id, "version": 0,
+                    "is_deleted": False, "total_bytes": rollups[folder.id][0], "item_count": rollups[folder.id][1],
+                    "created_at": now, "updated_at": now,
+                }
+                for folder in batch
+            ])
+            # Siblings may share a name, so rows are matched back in insertion order.
+            inserted = db.query(Folder.id, Folder.path).filter(
+                Folder.parent_id.in_({new_ids[folder.parent_id] for folder in batch}),
+                Folder.id > max(new_ids.values())
+            ).order_by(Folder.id).all()
+            for folder, row in zip(batch, inserted):
+                new_ids[folder.id] = row.id
+                paths[row.id] = row.path
+            level.extend(folder.id for folder in batch)
+
+    return new_ids
+
+
+def copy_folder(folder: Folder, target_parent_id: int | None, new_name: str | None, user: User, db: Session,
+                ctx: JobContext | None = None) -> dict:
+    """Copy a live folder and its live contents under ``target_parent_id``.
+
+    Raises ``CopyFailed`` if the source or the target went away, or if the
+    copy would exceed the quota. With ``ctx`` the copy reports progress and
+    can be cancelled between files.
+    """
+    folders, files = _snapshot(folder.id, user.id, db)
+    if not folders:
+        raise CopyFailed("Folder not found")
+    # Files of folders that are not reachable through live folders are left out.
+    reachable = {row.id for row in folders}
+    files = [file for file in files if file.folder_id in reachable]
+    db.commit()
+
+    if ctx is not None:
+        ctx.set_total(db, len(files))
+        db.commit()
+
+    copied = []
+    methods = Counter()
+    # A job's copies share a name prefix, saved before the first one is made,
+    # so a run that died can be cleaned up by the next; see copy_folder_job.
+    prefix = uuid.uuid4().hex[:24]
+    try:
+        for i, file in enumerate(files):
+            if ctx is not None and i % 100 == 0:
+                ctx.check()
+                ctx.save_checkpoint(db, {"copied": i, "blob_prefix": prefix}, done=i)
+                db.commit()
+            filename = f"{prefix}{i:08x}{os.path.splitext(file.original_filename)[1]}"
+            try:
+                filename, file_path, method = _copy_blob(file.file_path, user.id, file.original_filename, filename)
+            except FileNotFoundError:
+                continue  # purged meanwhile
+            methods[method] += 1
+            copied.append((file, filename, file_path))
+
+        rollups = _subtree_rollups(folders, [file for file, _, _ in copied])
+        total_bytes, item_count = rollups[folder.id]
+
+        if not reserve_storage(user, total_bytes, db):
+            raise CopyQuotaExceeded("Storage limit exceeded")
+        if not add_to_live_folder(db, target_parent_id, total_bytes, item_count + 1):
+            raise CopyFailed("Target folder not found")
+
+        name = new_name or folder.name
+        parent_path = db.query(Folder.path).filter(Folder.id == target_parent_id).scalar() if target_parent_id else ""
+        root = Folder(
+            name=name,
+            path=f"{parent_path}/{name}",
+            parent_id=target_parent_id,
+            user_id=user.id,
+            total_bytes=total_bytes,
+            item_count=item_count
+        )
+        db.add(root)
+        db.flush()
+
+        new_ids = _insert_folders(root, folders, rollups, user.id, db)
+        now = datetime.utcnow()
+        for start in range(0, len(copied), INSERT_BATCH_SIZE):
+            db.execute(File.__table__.insert(), [
+                {
+                    "filename": filename, "original_filename": file.original_filename, "file_path": file_path,
+                    "file_size": file.file_size, "mime_type": file.mime_type, "checksum": file.checksum,
+                    "folder_id": new_ids[file.folder_id],
+                    "user_id": user.id, "is_deleted": False, "view_count": 0, "download_count": 0,
+                    "created_at": now, "updated_at": now,
+                }
+                for file, filename, file_path in copied[start:start + INSERT_BATCH_SIZE]
+            ])
+
+        record_change(db, user.id, "folder", root.id, "copy", name, target_parent_id, parent_bumped=True)
+        result = {
+            "folder_id": root.id,
+            "folders": len(folders),
+            "files": len(copied),
+            "bytes": total_bytes,
+            "methods": dict(methods),
+        }
+        if ctx is not None:
+            # Committed with the rows: a job resumed after this point is done.
+            ctx.save_checkpoint(db, {"result": result}, done=len(files))
+        db.commit()
+    except BaseException:
+        db.rollback()
+        for _, _, file_path in copied:
+            storage_engine.delete_file(file_path)
+        raise
+
+    return result
+
+
+def _delete_copies(user_id: int, prefix: str) -> int:
+    """Delete the blobs named with ``prefix`` in a user's storage directory."""
+    deleted = 0
+    with os.scandir(storage_engine.get_user_storage_path(user_id)) as entries:
+        for entry in entries:
+            if entry.name.startswith(prefix):
+                deleted += storage_engine.delete_file(entry.path)
+    return deleted
+
+
+def copy_folder_job(ctx: JobContext) -> dict:
+    params = ctx.params
+    checkpoint = ctx.checkpoint or {}
+    if "result" in checkpoint:
+        return checkpoint["result"]
+    if "blob_prefix" in checkpoint:
+        # A previous run stopped before its rows were committed; a resumed
+        # copy starts over, so the blobs it made are removed first.
+        deleted = _delete_copies(params["user_id"], checkpoint["blob_prefix"])
+        logger.info("Copy job %s removed %s blobs left by an interrupted run", ctx.job_id, deleted)
+    db = ctx.session()
+    try:
+        user = db.query(User).filter(User.id == params["user_id"]).first()
+        folder = db.query(Folder).filter(
+            Folder.id == params["folder_id"],
+            Folder.user_id == params["user_id"],
+            Folder.is_deleted == False
+        ).first()
+        if not user or not folder:
+            raise CopyFailed("Folder not found")
+        return copy_folder(folder, params.get("target_parent_id"), params.get("new_name"), user, db, ctx)
+    finally:
+        db.close()
@@ -0,0 +1,141 @@
+"""Streaming export of the folder and file inventory.
+
+Rows are read on a dedicated connection with ``yield_per``, which uses a
+server-side cursor where the driver supports one. They are encoded one batch
+at a time, so memory stays flat however many rows are exported. Folders are
+exported before files, each in id order. The cursor ``<type>:<id>`` of the
+last row received resumes an interrupted export after that row.
+"""
+import csv
+import io
+import zlib
+from datetime import datetime
+from typing import Iterator, Literal
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from app.common.fast_json import dumps
+from app.common.models import File, Folder
+from app.config.database import shard_engines
+from app.config.settings import settings
+
+ExportFormat = Literal["ndjson", "csv"]
+
+FOLDER_COLUMNS = [
+    Folder.id, Folder.user_id, Folder.name, Folder.path, Folder.parent_id,
+    Folder.is_deleted, Folder.deleted_at, Folder.created_at, Folder.updated_at,
+]
+FILE_COLUMNS = [
+    File.id, File.user_id, File.folder_id, File.filename, File.original_filename, File.file_size,
+    File.mime_type, File.checksum, File.is_deleted, File.deleted_at, File.view_count, File.download_count,
+    File.created_at, File.updated_at,
+]
+EXPORT_TABLES = [("folder", Folder, FOLDER_COLUMNS), ("file", File, FILE_COLUMNS)]
+
+# Every column of both tables, for the single CSV header.
+CSV_FIELDS = ["type"] + list(dict.fromkeys(c.key for _, _, columns in EXPORT_TABLES for c in columns))
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def parse_cursor(cursor: str | None) -> tuple[int, int]:
+    """Return (table index, last id) for a ``<type>:<id>`` cursor."""
+    if not cursor:
+        return 0, 0
+
+    kind, _, last_id = cursor.partition(":")
+    kinds = [name for name, _, _ in EXPORT_TABLES]
+    if kind not in kinds or not last_id.isdigit():
+        raise ValueError(f"Invalid export cursor: {cursor}")
+    return kinds.index(kind), int(last_id)
+
+
+def iter_inventory(user_id: int | None, cursor: str | None = None, batch_size: int | None = None,
+                   shard: int = 0) -> Iterator[tuple[str, list[dict]]]:
+    """Yield (type, rows) batches for one user, or for every user of ``shard`` when ``user_id`` is None."""
+    start_table, after_id = parse_cursor(cursor)
+    batch_size = batch_size or settings.EXPORT_BATCH_SIZE
+
+    with shard_engines[shard].connect() as connection:
+        connection = connection.execution_options(yield_per=batch_size)
+        for index, (kind, model, columns) in enumerate(EXPORT_TABLES):
+            if index < start_table:
+                continue
+
+            query = select(*columns).order_by(model.id)
+            if user_id is not None:
+                query = query.where(model.user_id == user_id)
+            if index == start_table and after_id:
+                query = query.where(model.id > after_id)
+
+            for partition in connection.execute(query).partitions():
+                yield kind, [row._asdict() for row in partition]
+
+
+def encode_ndjson(batches) -> Iterator[bytes]:
+    for kind, rows in batches:
+        yield b"".join(dumps({"type": kind, **row}) + b"\n" for row in rows)
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+def encode_csv(batches) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    for kind, rows in batches:
+        for row in rows:
+            writer.writerow({"type": kind, **{key: _csv_value(value) for key, value in row.items()}})
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def gzip_frames(chunks) -> Iterator[bytes]:
+    # A sync flush after every batch ends each frame on a byte boundary, so a
+    # truncated download still decompresses through its last complete batch;
+    # drop the partial line after it and resume from the last full one.
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_inventory(user_id: int | None, export_format: ExportFormat = "ndjson", gzip: bool = False,
+                     cursor: str | None = None, batch_size: int | None = None, shard: int = 0) -> Iterator[bytes]:
+    encode = encode_csv if export_format == "csv" else encode_ndjson
+    chunks = encode(iter_inventory(user_id, cursor, batch_size, shard))
+    return gzip_frames(chunks) if gzip else chunks
+
+
+def inventory_response(user_id: int | None, export_format: ExportFormat, gzip: bool, cursor: str | None,
+                       shard: int = 0) -> StreamingResponse:
+    try:
+        parse_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    filename = f"inventory-{user_id if user_id is not None else 'all'}.{export_format}"
+    media_type = MEDIA_TYPES[export_format]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+
+    return StreamingResponse(
+        stream_inventory(user_id, export_format, gzip, cursor, shard=shard),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
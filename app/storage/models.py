@@ -0,0 +1,32 @@
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, ForeignKey, UniqueConstraint
+from datetime import datetime
+from app.config.database import Base
+
+
+class Change(Base):
+    __tablename__ = "changes"
+    __table_args__ = (UniqueConstraint("user_id", "seq", name="uq_changes_user_seq"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    seq = Column(BigInteger, nullable=False)
+
+    item_type = Column(String, nullable=False)
+    item_id = Column(Integer, nullable=False)
+    action = Column(String, nullable=False)
+    name = Column(String, nullable=True)
+    parent_id = Column(Integer, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class SyncState(Base):
+    __tablename__ = "sync_state"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    # Highest sequence number handed out, and the oldest one still journaled.
+    last_seq = Column(BigInteger, nullable=False, default=0)
+    min_seq = Column(BigInteger, nullable=False, default=1)
+    # Listing version of the user's root, the counterpart of Folder.version.
+    root_version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,204 @@
+"""Recursive size and item-count rollups of folders.
+
+``Folder.total_bytes`` and ``Folder.item_count`` cover a folder's whole
+subtree. An item counts towards its folder when both have the same
+``deleted_at``: live items in live folders, and items trashed together with
+the folder. A folder trashed with its subtree therefore keeps the rollups it
+had, which is exactly what its parent gets back when it is restored.
+
+Mutations call ``propagate_rollups`` with the change in an item's
+contribution. One UPDATE applies it to the folder and to every ancestor the
+same rule reaches, so concurrent mutations only ever add deltas to the rows
+they lock. The folder's own listing version can be bumped by that UPDATE too,
+which is how items added to a folder claim it. SQLite runs one writer at a time; on PostgreSQL an ancestor can
+be moved while the UPDATE waits for its lock, which is checked afterwards.
+"""
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import bindparam, case, func, select, update
+from sqlalchemy.orm import Session, aliased
+from app.common.models import File, Folder
+from app.config.settings import settings
+from app.jobs.runner import JobContext
+
+
+def _rollup_chain(folder_id: int, deleted_at: datetime | None):
+    """Select a folder and the ancestors its rollups propagate to.
+
+    Nothing is selected unless the folder has ``deleted_at``, i.e. unless
+    an item with that ``deleted_at`` counts towards it.
+    """
+    # Nested into the statement that selects from it, so an UPDATE using the
+    # chain still starts with UPDATE and pysqlite reports its rowcount.
+    chain = select(Folder.id, Folder.parent_id, Folder.deleted_at).where(
+        Folder.id == folder_id,
+        Folder.deleted_at.is_not_distinct_from(deleted_at)
+    ).cte("rollup_chain", recursive=True, nesting=True)
+    parent = aliased(Folder)
+    chain = chain.union_all(
+        select(parent.id, parent.parent_id, parent.deleted_at).where(
+            parent.id == chain.c.parent_id,
+            parent.deleted_at.is_not_distinct_from(chain.c.deleted_at)
+        )
+    )
+    return select(chain.c.id)
+
+
+def propagate_rollups(db: Session, folder_id: int | None, total_bytes, item_count,
+                      deleted_at: datetime | None = None, bump_version: bool = False) -> bool:
+    """Add a delta to the rollups of ``folder_id`` and its ancestors.
+
+    ``deleted_at`` is that of the item whose contribution changes, as it
+    was when it counted (or will be once it counts). With ``bump_version``
+    the same UPDATE bumps the listing version of ``folder_id`` itself.
+
+    Returns whether the delta reached ``folder_id``, i.e. whether it has
+    ``deleted_at``; if not, nothing was updated.
+    """
+    if folder_id is None:
+        return False
+
+    def add(folder_ids, undo: bool = False):
+        values = {
+            Folder.total_bytes: Folder.total_bytes - total_bytes if undo else Folder.total_bytes + total_bytes,
+            Folder.item_count: Folder.item_count - item_count if undo else Folder.item_count + item_count,
+        }
+        if bump_version and not undo:
+            values[Folder.version] = Folder.version + case((Folder.id == folder_id, 1), else_=0)
+        return update(Folder).where(Folder.id.in_(folder_ids)).values(values).execution_options(
+            synchronize_session=False
+        )
+
+    chain = _rollup_chain(folder_id, deleted_at)
+    if db.get_bind().dialect.name != "postgresql":
+        # The chain starts at the folder, so it was updated if anything was.
+        return db.execute(add(chain)).rowcount > 0
+
+    # The chain comes from the statement's snapshot. If an ancestor was moved
+    # while the UPDATE waited for its lock, the folders above it are stale;
+    # every folder updated is locked now, so reading the chain again shows
+    # where it leads, and the delta is moved over until both agree.
+    updated = set(db.execute(add(chain).returning(Folder.id)).scalars())
+    while True:
+        current = set(db.execute(chain).scalars())
+        if current == updated:
+            return folder_id in updated
+        if updated - current:
+            db.execute(add(sorted(updated - current), undo=True))
+        added = set()
+        if current - updated:
+            added = set(db.execute(add(sorted(current - updated)).returning(Folder.id)).scalars())
+        updated = (updated & current) | added
+
+
+def folder_contribution(folder_id: int, sign: int = 1) -> tuple:
+    """Return what a folder contributes to its parent's rollups, as SQL.
+
+    The values are read inside the UPDATE that applies them, so they
+    include every change committed before it.
+    """
+    folder = aliased(Folder)
+    total_bytes = select(folder.total_bytes).where(folder.id == folder_id).scalar_subquery()
+    item_count = select(folder.item_count + 1).where(folder.id == folder_id).scalar_subquery()
+    return (total_bytes, item_count) if sign > 0 else (-total_bytes, -item_count)
+
+
+def compute_user_rollups(db: Session, user_id: int) -> dict[int, tuple[int, int]]:
+    """Recompute the rollups of all of a user's folders, bottom-up."""
+    folders = db.query(Folder.id, Folder.parent_id, Folder.deleted_at).filter(Folder.user_id == user_id).all()
+    files = db.query(
+        File.folder_id, File.deleted_at, func.count(File.id), func.sum(File.file_size)
+    ).filter(File.user_id == user_id, File.folder_id.isnot(None)).group_by(File.folder_id, File.deleted_at)
+
+    deleted_at = {folder.id: folder.deleted_at for folder in folders}
+    totals = {folder.id: [0, 0] for folder in folders}
+    for folder_id, file_deleted_at, count, size in files:
+        if folder_id in totals and file_deleted_at == deleted_at[folder_id]:
+            totals[folder_id][0] += size
+            totals[folder_id][1] += count
+
+    children = defaultdict(list)
+    order = []
+    for folder in folders:
+        if folder.parent_id in totals:
+            children[folder.parent_id].append(folder.id)
+        else:
+            order.append(folder.id)
+    # Breadth-first from the top-level folders, then children before parents.
+    for folder_id in order:
+        order.extend(children[folder_id])
+
+    parents = {folder.id: folder.parent_id for folder in folders}
+    for folder_id in reversed(order):
+        parent_id = parents[folder_id]
+        if parent_id in totals and deleted_at[folder_id] == deleted_at[parent_id]:
+            totals[parent_id][0] += totals[folder_id][0]
+            totals[parent_id][1] += totals[folder_id][1] + 1
+
+    return {folder_id: tuple(values) for folder_id, values in totals.items()}
+
+
+def repair_rollups(ctx: JobContext) -> dict:
+    """Recompute folder rollups user by user and correct the ones that drifted."""
+    params = ctx.params
+    apply = params.get("apply", True)
+    state = ctx.checkpoint or {"last_user_id": 0, "done": 0, "checked": 0, "drifted": 0, "corrected": 0}
+
+    db = ctx.session()
+    try:
+        users = db.query(Folder.user_id).distinct()
+        if params.get("user_ids"):
+            users = users.filter(Folder.user_id.in_(params["user_ids"]))
+        if ctx.progress_total is None:
+            ctx.set_total(db, users.count())
+            db.commit()
+
+        update = Folder.__table__.update().where(
+            Folder.id == bindparam("folder_id"),
+            Folder.total_bytes == bindparam("old_bytes"),
+            Folder.item_count == bindparam("old_count")
+        ).values(total_bytes=bindparam("new_bytes"), item_count=bindparam("new_count"))
+
+        while True:
+            ctx.check()
+
+            user_ids = [row.user_id for row in users.filter(
+                Folder.user_id > state["last_user_id"]
+            ).order_by(Folder.user_id).limit(settings.ROLLUPS_REPAIR_BATCH_SIZE)]
+            if not user_ids:
+                break
+
+            for user_id in user_ids:
+                # Read the stored values first: a mutation that lands before the
+                # recount changes them, and the compare-and-set below skips it.
+                stored = {
+                    row.id: (row.total_bytes, row.item_count)
+                    for row in db.query(Folder.id, Folder.total_bytes, Folder.item_count).filter(
+                        Folder.user_id == user_id
+                    )
+                }
+                drifted = [
+                    {"folder_id": folder_id, "old_bytes": stored[folder_id][0], "old_count": stored[folder_id][1],
+                     "new_bytes": values[0], "new_count": values[1]}
+                    for folder_id, values in compute_user_rollups(db, user_id).items()
+                    if folder_id in stored and stored[folder_id] != values
+                ]
+
+                state["checked"] += len(stored)
+                state["drifted"] += len(drifted)
+                if apply and drifted:
+                    state["corrected"] += db.execute(update, drifted).rowcount
+
+            state["last_user_id"] = user_ids[-1]
+            state["done"] += len(user_ids)
+            ctx.save_checkpoint(db, state, done=state["done"])
+            db.commit()
+    finally:
+        db.close()
+
+    return {
+        "users_scanned": state["done"],
+        "folders_checked": state["checked"],
+        "folders_drifted": state["drifted"],
+        "folders_corrected": state["corrected"],
+    }
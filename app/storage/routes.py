@@ -1,19 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File as FastAPIFile
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status, UploadFile, File as FastAPIFile
+from fastapi.responses import FileResponse as DiskFileResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+import asyncio
 import os
 from app.config.database import get_db
+from app.config.settings import settings
+from app.jobs.models import Job
+from app.jobs.runner import job_runner
+from app.schemas.change_schema import ChangeFeedResponse
 from app.schemas.file_schema import (
-    FolderCreate, FolderResponse, FileUploadResponse, FileResponse,
-    FileMove, FileRename, FolderRename
+    BatchUploadResponse, BrowseResponse, FolderCreate, FolderResponse, FileUploadResponse, FileListingResponse,
+    FileCopy, FileMove, FileRename, FolderCopy, FolderMove, FolderRename
 )
+from app.schemas.job_schema import JobResponse
 from app.common.models import File, Folder
 from app.users.models import User
 from app.common.helpers import get_current_user, generate_unique_filename, check_storage_available
 from app.common.storage_engine import storage_engine
-from app.storage.service import create_folder, get_user_files, get_user_folders, soft_delete_file, restore_file
-from app.storage.utils import get_mime_type
-from app.users.service import update_user_storage
+from app.common.fast_json import json_rows_response
+from app.storage.export import ExportFormat, inventory_response
+from app.storage.batch_upload import BatchUploadError, BatchUploadReceiver
+from app.storage.copy import CopyFailed, CopyQuotaExceeded, copy_folder, copy_user_file
+from app.storage.changes import ResyncRequired, change_notifier, get_changes, record_change
+from app.storage.service import (
+    browse_folder, create_folder, create_uploaded_file, create_uploaded_files, get_user_file_rows, get_user_folder_rows,
+    get_listing_version, soft_delete_file, restore_file,
+    purge_file, move_user_file, get_user_folder, rename_folder, move_folder, soft_delete_folder, restore_folder, purge_folder
+)
+from app.users.service import release_storage, reserve_storage
 
 router = APIRouter(prefix="/storage", tags=["Storage"])
 
@@ -33,15 +48,245 @@ def create_new_folder(
     return folder
 
 
+def _listing_etag(kind: str, user_id: int, folder_id: int | None, include_deleted: bool, db: Session) -> str | None:
+    # Read before the listing itself, so a concurrent change can only make
+    # the ETag older than the body, never newer.
+    version = get_listing_version(user_id, folder_id, db)
+    if version is None:
+        return None
+    return f'"{kind}-{user_id}-{folder_id or 0}-{version}{"-trash" if include_deleted else ""}"'
+
+
+def _not_modified(etag: str | None, if_none_match: str | None) -> bool:
+    if not etag or not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def _listing_response(etag: str | None, if_none_match: str | None, load_rows) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"} if etag else {}
+    
+    if _not_modified(etag, if_none_match):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    response = json_rows_response(load_rows())
+    response.headers.update(headers)
+    return response
+
+
 @router.get("/folders", response_model=list[FolderResponse])
 def list_folders(
     parent_id: int | None = None,
     include_deleted: bool = False,
+    if_none_match: str | None = Header(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    folders = get_user_folders(current_user.id, parent_id, include_deleted, db)
-    return folders
+    etag = _listing_etag("folders", current_user.id, parent_id, include_deleted, db)
+    return _listing_response(
+        etag, if_none_match,
+        lambda: get_user_folder_rows(current_user.id, parent_id, include_deleted, db)
+    )
+
+
+@router.get("/browse/{folder_id}", response_model=BrowseResponse)
+def browse(
+    folder_id: int,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Return a folder, its ancestors and a page of its contents; ``0`` is the root."""
+    view = browse_folder(current_user.id, folder_id, offset, limit, db)
+    
+    if view is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Folder not found"
+        )
+    
+    return view
+
+
+def _get_folder_or_404(folder_id: int, user: User, db: Session, deleted: bool = False) -> Folder:
+    folder = get_user_folder(folder_id, user.id, deleted, db)
+    
+    if not folder:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Folder not found in trash" if deleted else "Folder not found"
+        )
+    
+    return folder
+
+
+@router.put("/folders/{folder_id}/rename", response_model=FolderResponse)
+def rename_existing_folder(
+    folder_id: int,
+    rename_data: FolderRename,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    folder = _get_folder_or_404(folder_id, current_user, db)
+    return rename_folder(folder, rename_data.new_name, db)
+
+
+@router.put("/folders/{folder_id}/move", response_model=FolderResponse)
+def move_existing_folder(
+    folder_id: int,
+    move_data: FolderMove,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    folder = _get_folder_or_404(folder_id, current_user, db)
+    target = None
+    if move_data.target_parent_id is not None:
+        target = _get_folder_or_404(move_data.target_parent_id, current_user, db)
+    
+    result = move_folder(folder, target, db)
+    
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Folder not found"
+        )
+    elif result is False:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cannot move a folder into itself or one of its subfolders"
+        )
+    
+    return folder
+
+
+@router.post(
+    "/folders/{folder_id}/copy",
+    response_model=FolderResponse | JobResponse,
+    status_code=status.HTTP_201_CREATED
+)
+def copy_existing_folder(
+    folder_id: int,
+    copy_data: FolderCopy,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Copy a folder and its contents.
+
+    Small subtrees are copied before responding with the new folder. Larger
+    ones are copied by a ``folder_copy`` job, and the response is the job
+    with ``202 Accepted``; poll it with ``GET /storage/jobs/{id}``.
+    """
+    folder = _get_folder_or_404(folder_id, current_user, db)
+    if copy_data.target_parent_id is not None:
+        _get_folder_or_404(copy_data.target_parent_id, current_user, db)
+    
+    # Checked again when the copy is charged; this only fails early.
+    if not check_storage_available(current_user, folder.total_bytes):
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Storage limit exceeded"
+        )
+    
+    if folder.item_count > settings.COPY_INLINE_MAX_ITEMS or folder.total_bytes > settings.COPY_INLINE_MAX_BYTES:
+        response.status_code = status.HTTP_202_ACCEPTED
+        params = {"user_id": current_user.id, "folder_id": folder.id, **copy_data.model_dump()}
+        return job_runner.submit(db, "folder_copy", params, current_user.id)
+    
+    try:
+        result = copy_folder(folder, copy_data.target_parent_id, copy_data.new_name, current_user, db)
+    except CopyQuotaExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    except CopyFailed as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    
+    return get_user_folder(result["folder_id"], current_user.id, False, db)
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+def get_own_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    job = db.query(Job).filter(
+        Job.id == job_id,
+        Job.created_by == current_user.id,
+        Job.kind == "folder_copy"
+    ).first()
+    
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    
+    return job
+
+
+@router.delete("/folders/{folder_id}")
+def delete_folder(
+    folder_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    folder = _get_folder_or_404(folder_id, current_user, db)
+    
+    if not soft_delete_folder(folder, current_user, db):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Folder not found"
+        )
+    
+    return {"message": "Folder moved to trash"}
+
+
+@router.post("/folders/{folder_id}/restore")
+def restore_folder_from_trash(
+    folder_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    folder = _get_folder_or_404(folder_id, current_user, db, deleted=True)
+    result = restore_folder(folder, current_user, db)
+    
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Cannot restore folder: storage quota would be exceeded"
+        )
+    elif result is False:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Folder not found in trash"
+        )
+    
+    return {"message": "Folder restored successfully"}
+
+
+@router.delete("/folders/{folder_id}/purge")
+def purge_folder_from_trash(
+    folder_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    folder = _get_folder_or_404(folder_id, current_user, db, deleted=True)
+    
+    if not purge_folder(folder, current_user, db):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Folder not found in trash"
+        )
+    
+    return {"message": "Folder permanently deleted"}
 
 
 @router.post("/upload", response_model=FileUploadResponse)
@@ -51,50 +296,146 @@ async def upload_file(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    content = await file.read()
-    file_size = len(content)
+    if folder_id is not None:
+        _get_folder_or_404(folder_id, current_user, db)
     
-    if not check_storage_available(current_user, file_size):
+    # The multipart parser has already spooled the file and knows its size.
+    if not check_storage_available(current_user, file.size):
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             detail="Storage limit exceeded"
         )
     
-    await file.seek(0)
-    
     unique_filename = generate_unique_filename(file.filename)
-    file_path = await storage_engine.save_file(file, current_user.id, unique_filename)
-    
-    mime_type = get_mime_type(file.filename)
-    
-    new_file = File(
-        filename=unique_filename,
-        original_filename=file.filename,
-        file_path=file_path,
-        file_size=file_size,
-        mime_type=mime_type,
-        folder_id=folder_id,
-        user_id=current_user.id
-    )
+    file_path, file_size, checksum = await storage_engine.save_file(file, current_user.id, unique_filename)
     
-    db.add(new_file)
-    update_user_storage(current_user, file_size, db, add=True)
-    current_user.total_uploads += 1
-    db.commit()
-    db.refresh(new_file)
+    try:
+        new_file = await run_in_threadpool(
+            create_uploaded_file, file.filename, unique_filename, file_path, file_size, checksum, folder_id,
+            current_user, db
+        )
+    except BaseException:
+        storage_engine.delete_file(file_path)
+        raise
+    
+    if new_file is None:
+        storage_engine.delete_file(file_path)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Storage limit exceeded"
+        )
+    if new_file is False:
+        storage_engine.delete_file(file_path)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Folder not found"
+        )
     
     return new_file
 
 
-@router.get("/files", response_model=list[FileResponse])
+def _reserve_upload(user: User, size: int, db: Session) -> bool:
+    reserved = reserve_storage(user, size, db)
+    # Commit the reservation so the transaction isn't held open during the upload.
+    db.commit()
+    return reserved
+
+
+def _abandon_upload(parts: list, user: User, reserved: int, db: Session):
+    db.rollback()
+    release_storage(user, reserved, db)
+    db.commit()
+    for part in parts:
+        part.discard()
+
+
+@router.post("/upload/batch", response_model=BatchUploadResponse)
+async def upload_files(
+    request: Request,
+    total_size: int = Query(..., ge=0),
+    folder_id: int | None = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Upload many files in one multipart request.
+
+    ``total_size`` is the sum of the file sizes. It is reserved against the
+    quota before the body is read, and whatever the files don't use is
+    released when they are recorded.
+    """
+    if folder_id is not None:
+        _get_folder_or_404(folder_id, current_user, db)
+    
+    if not await run_in_threadpool(_reserve_upload, current_user, total_size, db):
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Storage limit exceeded"
+        )
+    
+    try:
+        parts = await BatchUploadReceiver(request, current_user.id, total_size).receive()
+    except BaseException as e:
+        await run_in_threadpool(_abandon_upload, [], current_user, total_size, db)
+        if isinstance(e, BatchUploadError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+        raise
+    
+    stored = [part for part in parts if part.error is None]
+    try:
+        rows = await run_in_threadpool(create_uploaded_files, stored, folder_id, current_user, total_size, db)
+    except BaseException:
+        await run_in_threadpool(_abandon_upload, stored, current_user, total_size, db)
+        raise
+    
+    if rows is None:
+        await run_in_threadpool(_abandon_upload, stored, current_user, total_size, db)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Folder not found"
+        )
+    
+    created = iter(rows)
+    items = [
+        {"original_filename": part.original_filename, "status": "created", "file": next(created), "sha256": part.sha256}
+        if part.error is None else
+        {"original_filename": part.original_filename, "status": "failed", "error": part.error}
+        for part in parts
+    ]
+    return {
+        "files": items,
+        "uploaded": len(rows),
+        "failed": len(parts) - len(rows),
+        "total_bytes": sum(row["file_size"] for row in rows),
+    }
+
+
+@router.get("/files", response_model=list[FileListingResponse])
 def list_files(
     folder_id: int | None = None,
     include_deleted: bool = False,
+    if_none_match: str | None = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    etag = _listing_etag("files", current_user.id, folder_id, include_deleted, db)
+    return _listing_response(
+        etag, if_none_match,
+        lambda: get_user_file_rows(current_user.id, folder_id, include_deleted, db)
+    )
+
+
+@router.get("/export")
+def export_inventory(
+    format: ExportFormat = "ndjson",
+    gzip: bool = False,
+    cursor: str | None = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    files = get_user_files(current_user.id, folder_id, include_deleted, db)
-    return files
+    return inventory_response(current_user.id, format, gzip, cursor, db.shard)
 
 
 @router.get("/files/{file_id}/download")
@@ -123,7 +464,7 @@ async def download_file(
     file.download_count += 1
     db.commit()
     
-    return FileResponse(
+    return DiskFileResponse(
         path=file.file_path,
         filename=file.original_filename,
         media_type=file.mime_type
@@ -185,6 +526,164 @@ def rename_file(
         )
     
     file.original_filename = rename_data.new_name
+    record_change(db, current_user.id, "file", file.id, "rename", file.original_filename, file.folder_id)
     db.commit()
     
     return {"message": "File renamed successfully"}
+
+
+@router.post("/files/move")
+def move_file(
+    move_data: FileMove,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    file = db.query(File).filter(
+        File.id == move_data.file_id,
+        File.user_id == current_user.id,
+        File.is_deleted == False
+    ).first()
+    
+    if not file:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+    
+    if move_data.target_folder_id is not None:
+        _get_folder_or_404(move_data.target_folder_id, current_user, db)
+    
+    if not move_user_file(file, move_data.target_folder_id, current_user, db):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+    
+    return {"message": "File moved successfully"}
+
+
+@router.post("/files/{file_id}/copy", response_model=FileUploadResponse, status_code=status.HTTP_201_CREATED)
+def copy_existing_file(
+    file_id: int,
+    copy_data: FileCopy,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    file = db.query(File).filter(
+        File.id == file_id,
+        File.user_id == current_user.id,
+        File.is_deleted == False
+    ).first()
+    
+    if not file:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+    
+    if copy_data.target_folder_id is not None:
+        _get_folder_or_404(copy_data.target_folder_id, current_user, db)
+    
+    if not check_storage_available(current_user, file.file_size):
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Storage limit exceeded"
+        )
+    
+    copy = copy_user_file(file, copy_data.target_folder_id, copy_data.new_name, current_user, db)
+    
+    if copy is None:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Storage limit exceeded"
+        )
+    elif copy is False:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+    
+    return copy
+
+
+@router.delete("/files/{file_id}/purge")
+def purge_file_from_trash(
+    file_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    file = db.query(File).filter(
+        File.id == file_id,
+        File.user_id == current_user.id,
+        File.is_deleted == True
+    ).first()
+    
+    if not file:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found in trash"
+        )
+    
+    if not purge_file(file, current_user, db):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found in trash"
+        )
+    
+    return {"message": "File permanently deleted"}
+
+
+@router.get("/changes", response_model=ChangeFeedResponse)
+async def list_changes(
+    since: str | None = None,
+    limit: int = Query(500, ge=1, le=1000),
+    wait: float = Query(0, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Return the caller's changes after the ``since`` cursor.
+
+    Without ``since`` only the current cursor is returned; take it before a
+    full listing and poll from it afterwards. With ``wait`` the request is
+    held open for up to that many seconds until a change arrives.
+    """
+    if since is not None and not since.isdigit():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid change cursor"
+        )
+    
+    user_id = current_user.id
+    cursor = int(since) if since is not None else None
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(wait, settings.CHANGES_MAX_WAIT_SECONDS)
+    
+    while True:
+        try:
+            feed = await run_in_threadpool(_read_changes, user_id, cursor, limit, db)
+        except ResyncRequired:
+            raise HTTPException(
+                status_code=status.HTTP_410_GONE,
+                detail="Change cursor has expired; resync required"
+            )
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+        
+        remaining = deadline - loop.time()
+        if feed["changes"] or cursor is None or remaining <= 0:
+            return feed
+        
+        # Woken at once by commits in this process; other workers' commits
+        # are seen on the next poll.
+        await change_notifier.wait(user_id, min(remaining, settings.CHANGES_POLL_INTERVAL_SECONDS))
+
+
+def _read_changes(user_id: int, since: int | None, limit: int, db: Session) -> dict:
+    try:
+        return get_changes(user_id, since, limit, db)
+    finally:
+        # Don't hold a transaction open while the request waits.
+        db.close()
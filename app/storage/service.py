@@ -1,6 +1,17 @@
+from sqlalchemy import String, case, func, literal, select
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 from app.common.models import File, Folder
+from app.common.storage_engine import storage_engine
+from app.config.database import insert_returning_ids
+from app.schemas.file_schema import FileListingResponse, FileResponse, FolderResponse
+from app.sharing.models import Share
+from app.storage.changes import record_change, record_changes
+from app.storage.models import SyncState
+from app.storage.rollups import folder_contribution, propagate_rollups
+from app.storage.utils import get_mime_type
 from app.users.models import User
+from app.users.service import reserve_storage
 from datetime import datetime
 from app.common.helpers import check_storage_available
 
@@ -8,6 +19,8 @@ from app.common.helpers import check_storage_available
 def create_folder(name: str, parent_id: int | None, user: User, db: Session):
     parent_path = ""
     if parent_id:
+        if not add_to_live_folder(db, parent_id, 0, 1):
+            return None
         parent = db.query(Folder).filter(
             Folder.id == parent_id,
             Folder.user_id == user.id,
@@ -26,37 +39,252 @@ def create_folder(name: str, parent_id: int | None, user: User, db: Session):
         user_id=user.id
     )
     db.add(folder)
+    db.flush()
+    record_change(db, user.id, "folder", folder.id, "create", name, parent_id, parent_bumped=True)
     db.commit()
-    db.refresh(folder)
     return folder
 
 
-def get_user_files(user_id: int, folder_id: int | None, include_deleted: bool, db: Session):
-    query = db.query(File).filter(File.user_id == user_id)
+# Listings select only the columns of their response schema, in schema order,
+# so the rows can be encoded without building ORM objects or pydantic models.
+FILE_COLUMNS = [getattr(File, name) for name in FileResponse.model_fields]
+FILE_LISTING_COLUMNS = [getattr(File, name) for name in FileListingResponse.model_fields]
+FOLDER_LISTING_COLUMNS = [getattr(Folder, name) for name in FolderResponse.model_fields]
+
+
+def _file_filters(user_id: int, folder_id: int | None, include_deleted: bool) -> list:
+    filters = [File.user_id == user_id]
     
     if folder_id:
-        query = query.filter(File.folder_id == folder_id)
+        filters.append(File.folder_id == folder_id)
     else:
-        query = query.filter(File.folder_id.is_(None))
+        filters.append(File.folder_id.is_(None))
     
     if not include_deleted:
-        query = query.filter(File.is_deleted == False)
+        filters.append(File.is_deleted == False)
     
-    return query.all()
+    return filters
 
 
-def get_user_folders(user_id: int, parent_id: int | None, include_deleted: bool, db: Session):
-    query = db.query(Folder).filter(Folder.user_id == user_id)
+def _folder_filters(user_id: int, parent_id: int | None, include_deleted: bool) -> list:
+    filters = [Folder.user_id == user_id]
     
     if parent_id:
-        query = query.filter(Folder.parent_id == parent_id)
+        filters.append(Folder.parent_id == parent_id)
     else:
-        query = query.filter(Folder.parent_id.is_(None))
+        filters.append(Folder.parent_id.is_(None))
     
     if not include_deleted:
-        query = query.filter(Folder.is_deleted == False)
+        filters.append(Folder.is_deleted == False)
+    
+    return filters
+
+
+def get_user_files(user_id: int, folder_id: int | None, include_deleted: bool, db: Session):
+    return db.query(File).filter(*_file_filters(user_id, folder_id, include_deleted)).all()
+
+
+def get_user_file_rows(user_id: int, folder_id: int | None, include_deleted: bool, db: Session) -> list[dict]:
+    result = db.execute(select(*FILE_LISTING_COLUMNS).where(*_file_filters(user_id, folder_id, include_deleted)))
+    return [row._asdict() for row in result]
+
+
+def get_user_folders(user_id: int, parent_id: int | None, include_deleted: bool, db: Session):
+    return db.query(Folder).filter(*_folder_filters(user_id, parent_id, include_deleted)).all()
+
+
+def get_user_folder_rows(user_id: int, parent_id: int | None, include_deleted: bool, db: Session) -> list[dict]:
+    result = db.execute(select(*FOLDER_LISTING_COLUMNS).where(*_folder_filters(user_id, parent_id, include_deleted)))
+    return [row._asdict() for row in result]
+
+
+def get_listing_version(user_id: int, folder_id: int | None, db: Session) -> int | None:
+    """Return the version of a folder's listing, or of the root's; None if unknown."""
+    if folder_id:
+        query = select(Folder.version).where(Folder.id == folder_id, Folder.user_id == user_id)
+    else:
+        query = select(SyncState.root_version).where(SyncState.user_id == user_id)
+    return db.execute(query).scalar()
+
+
+def _folder_ancestors(user_id: int, folder_id: int, db: Session) -> list[dict]:
+    """Return a live folder and its ancestors, root first; empty if not found."""
+    chain = select(Folder.id, Folder.parent_id, literal(0).label("depth")).where(
+        Folder.id == folder_id,
+        Folder.user_id == user_id,
+        Folder.is_deleted == False
+    ).cte("chain", recursive=True)
+    chain = chain.union_all(
+        select(Folder.id, Folder.parent_id, chain.c.depth + 1).where(Folder.id == chain.c.parent_id)
+    )
+    result = db.execute(
+        select(*FOLDER_LISTING_COLUMNS, Folder.item_count, Folder.total_bytes)
+        .join(chain, Folder.id == chain.c.id).order_by(chain.c.depth.desc())
+    )
+    return [row._asdict() for row in result]
+
+
+def _subfolder_page_rows(user_id: int, parent_id: int | None, offset: int, limit: int, db: Session) -> list[dict]:
+    result = db.execute(
+        select(*FOLDER_LISTING_COLUMNS, Folder.item_count, Folder.total_bytes).where(
+            *_folder_filters(user_id, parent_id, False)
+        ).order_by(Folder.name, Folder.id).offset(offset).limit(limit)
+    )
+    return [row._asdict() for row in result]
+
+
+def browse_folder(user_id: int, folder_id: int | None, offset: int, limit: int, db: Session) -> dict | None:
+    """Return everything a directory view needs in a fixed number of queries.
+
+    Subfolders come before files, each sorted by name, and ``offset`` and
+    ``limit`` page through both as one list. None if the folder is not found.
+    """
+    folder, ancestors = None, []
+    if folder_id:
+        chain = _folder_ancestors(user_id, folder_id, db)
+        if not chain:
+            return None
+        folder, ancestors = chain[-1], chain[:-1]
+    
+    totals = db.execute(select(
+        select(func.count()).select_from(Folder).where(*_folder_filters(user_id, folder_id, False)).scalar_subquery(),
+        select(func.count()).select_from(File).where(*_file_filters(user_id, folder_id, False)).scalar_subquery()
+    )).one()
+    total_folders, total_files = totals
+    
+    folders = []
+    if offset < total_folders:
+        folders = _subfolder_page_rows(user_id, folder_id, offset, limit, db)
+    
+    files = []
+    file_limit = limit - len(folders)
+    if file_limit > 0 and total_files:
+        result = db.execute(
+            select(*FILE_COLUMNS).where(*_file_filters(user_id, folder_id, False))
+            .order_by(File.original_filename, File.id)
+            .offset(max(0, offset - total_folders)).limit(file_limit)
+        )
+        files = [row._asdict() for row in result]
+    
+    return {
+        "folder": folder,
+        "ancestors": [{"id": row["id"], "name": row["name"]} for row in ancestors],
+        "folders": folders,
+        "files": files,
+        "total_folders": total_folders,
+        "total_files": total_files,
+        "offset": offset,
+        "limit": limit,
+    }
+
+
+def _claim(db: Session, model, item_id: int, expected: dict, values: dict) -> bool:
+    """Apply ``values`` to a row only if it still has the ``expected`` values.
+
+    Mutations start with this write. If a concurrent request changed the row
+    since it was read, nothing is applied, the transaction is rolled back to
+    release its locks and the mutation gives up. Once it succeeds the row
+    stays locked until commit, so anything read afterwards is current.
+    """
+    criteria = [getattr(model, name).is_not_distinct_from(value) for name, value in expected.items()]
+    if db.query(model).filter(model.id == item_id, *criteria).update(values, synchronize_session=False) == 1:
+        return True
+    db.rollback()
+    return False
+
+
+def add_to_live_folder(db: Session, folder_id: int | None, total_bytes, item_count) -> bool:
+    """Claim a folder that items are about to be added to.
+
+    The UPDATE that adds the items to the folder's rollups also bumps its
+    listing version, so the journal entry is recorded with
+    ``parent_bumped=True``. Fails, with the transaction rolled back, if the
+    folder was trashed since it was looked up; an item added to it anyway
+    would be live inside the trash.
+    """
+    if folder_id is None or propagate_rollups(db, folder_id, total_bytes, item_count, bump_version=True):
+        return True
+    db.rollback()
+    return False
+
+
+def create_uploaded_file(original_filename: str, filename: str, file_path: str, file_size: int, checksum: str,
+                         folder_id: int | None, user: User, db: Session):
+    """Insert the row of an uploaded file and charge it to the user's quota.
+
+    Returns the new file, None if it would exceed the quota, and False if
+    the folder was deleted while the file was uploading; nothing is applied
+    in either case.
+    """
+    # Checked again in one statement: concurrent uploads may have used the
+    # space in the meantime, and adding to a stale value would lose theirs.
+    if not reserve_storage(user, file_size, db, uploads=1):
+        db.rollback()
+        return None
     
-    return query.all()
+    if not add_to_live_folder(db, folder_id, file_size, 1):
+        return False
+    
+    # The digest was taken from the bytes as they were written.
+    new_file = File(
+        filename=filename,
+        original_filename=original_filename,
+        file_path=file_path,
+        file_size=file_size,
+        mime_type=get_mime_type(original_filename),
+        checksum=checksum,
+        verified_at=datetime.utcnow(),
+        folder_id=folder_id,
+        user_id=user.id
+    )
+    db.add(new_file)
+    db.flush()
+    record_change(db, user.id, "file", new_file.id, "create", original_filename, folder_id, parent_bumped=True)
+    db.commit()
+    return new_file
+
+
+def create_uploaded_files(parts: list, folder_id: int | None, user: User, reserved: int, db: Session) -> list[dict] | None:
+    """Insert the rows of a batch upload with one statement.
+
+    ``reserved`` bytes were added to the user's storage before the upload,
+    and what the files did not use is given back in the same transaction.
+    Returns None, with nothing applied, if the folder was deleted while the
+    files were uploading.
+    """
+    now = datetime.utcnow()
+    # The digests were taken from the bytes as they were written, so the
+    # files count as verified now and the scrubber gets to older ones first.
+    rows = [
+        {
+            "filename": part.filename, "original_filename": part.original_filename,
+            "file_path": part.file_path, "file_size": part.file_size,
+            "mime_type": get_mime_type(part.original_filename), "checksum": part.sha256, "verified_at": now,
+            "folder_id": folder_id, "user_id": user.id,
+            "is_deleted": False, "view_count": 0, "download_count": 0, "created_at": now, "updated_at": now,
+        }
+        for part in parts
+    ]
+    total_bytes = sum(row["file_size"] for row in rows)
+    
+    if rows:
+        if not add_to_live_folder(db, folder_id, total_bytes, len(rows)):
+            return None
+        
+        for row, file_id in zip(rows, insert_returning_ids(db, File.__table__, rows)):
+            row["id"] = file_id
+        
+        record_changes(
+            db, user.id, "file", "create", [(row["id"], row["original_filename"]) for row in rows], folder_id,
+            parent_bumped=True
+        )
+    
+    db.query(User).filter(User.id == user.id).update({
+        User.storage_used: User.storage_used - (reserved - total_bytes),
+        User.total_uploads: User.total_uploads + len(rows)
+    }, synchronize_session=False)
+    db.commit()
+    return rows
 
 
 def soft_delete_file(file_id: int, user: User, db: Session):
@@ -66,15 +294,19 @@ def soft_delete_file(file_id: int, user: User, db: Session):
         File.is_deleted == False
     ).first()
     
-    if file:
-        file.is_deleted = True
-        file.deleted_at = datetime.utcnow()
-        
-        user.storage_used = max(0, user.storage_used - file.file_size)
-        
-        db.commit()
-        return True
-    return False
+    if not file or not _claim(
+        db, File, file.id,
+        {"is_deleted": False, "folder_id": file.folder_id},
+        {File.is_deleted: True, File.deleted_at: datetime.utcnow()}
+    ):
+        return False
+    
+    user.storage_used = max(0, user.storage_used - file.file_size)
+    bumped = propagate_rollups(db, file.folder_id, -file.file_size, -1, bump_version=True)
+    record_change(db, user.id, "file", file.id, "delete", file.original_filename, file.folder_id, bumped)
+    
+    db.commit()
+    return True
 
 
 def restore_file(file_id: int, user: User, db: Session):
@@ -90,10 +322,269 @@ def restore_file(file_id: int, user: User, db: Session):
     if not check_storage_available(user, file.file_size):
         return None
     
-    file.is_deleted = False
-    file.deleted_at = None
+    if not _claim(
+        db, File, file.id,
+        {"is_deleted": True, "deleted_at": file.deleted_at, "folder_id": file.folder_id},
+        {File.is_deleted: False, File.deleted_at: None}
+    ):
+        return False
+    
+    # Like a folder, a file whose folder is still in the trash comes back at the root.
+    others = ()
+    if file.folder_id and not get_user_folder(file.folder_id, user.id, False, db):
+        if not propagate_rollups(db, file.folder_id, -file.file_size, -1, file.deleted_at, bump_version=True):
+            others = (file.folder_id,)
+        file.folder_id = None
+        bumped = False
+    else:
+        bumped = propagate_rollups(db, file.folder_id, file.file_size, 1, bump_version=True)
     
     user.storage_used += file.file_size
+    record_change(db, user.id, "file", file.id, "restore", file.original_filename, file.folder_id, bumped, others)
     
     db.commit()
     return True
+
+
+def move_user_file(file: File, target_folder_id: int | None, user: User, db: Session) -> bool:
+    old_folder_id = file.folder_id
+    if not _claim(
+        db, File, file.id,
+        {"is_deleted": False, "folder_id": old_folder_id},
+        {File.folder_id: target_folder_id}
+    ) or not add_to_live_folder(db, target_folder_id, file.file_size, 1):
+        return False
+    
+    set_committed_value(file, "folder_id", target_folder_id)
+    old_bumped = propagate_rollups(db, old_folder_id, -file.file_size, -1, bump_version=True)
+    record_change(
+        db, user.id, "file", file.id, "move", file.original_filename, target_folder_id,
+        parent_bumped=True, other_listings=() if old_bumped else (old_folder_id,)
+    )
+    
+    db.commit()
+    return True
+
+
+def purge_file(file: File, user: User, db: Session) -> bool:
+    db.query(Share).filter(Share.file_id == file.id).delete(synchronize_session=False)
+    purged = db.query(File).filter(
+        File.id == file.id,
+        File.is_deleted == file.is_deleted,
+        File.deleted_at.is_not_distinct_from(file.deleted_at),
+        File.folder_id.is_not_distinct_from(file.folder_id)
+    ).delete(synchronize_session=False)
+    
+    if not purged:
+        db.rollback()
+        return False
+    
+    if not file.is_deleted:
+        user.storage_used = max(0, user.storage_used - file.file_size)
+    
+    bumped = propagate_rollups(db, file.folder_id, -file.file_size, -1, file.deleted_at, bump_version=True)
+    record_change(db, user.id, "file", file.id, "purge", file.original_filename, file.folder_id, bumped)
+    db.commit()
+    
+    # The blob goes only once the row is gone for good.
+    storage_engine.delete_file(file.file_path)
+    return True
+
+
+def get_user_folder(folder_id: int, user_id: int, deleted: bool, db: Session) -> Folder | None:
+    return db.query(Folder).filter(
+        Folder.id == folder_id,
+        Folder.user_id == user_id,
+        Folder.is_deleted == deleted
+    ).first()
+
+
+def subtree_folder_ids(folder_id: int):
+    """Select the ids of a folder and all of its descendants."""
+    tree = select(Folder.id).where(Folder.id == folder_id).cte("subtree", recursive=True)
+    tree = tree.union_all(select(Folder.id).where(Folder.parent_id == tree.c.id))
+    return select(tree.c.id)
+
+
+def _set_path(folder: Folder, new_path: str, db: Session):
+    # Every listing in the subtree shows paths, so all of them change.
+    old_path = folder.path
+    db.query(Folder).filter(Folder.id.in_(subtree_folder_ids(folder.id))).update(
+        {
+            Folder.path: literal(new_path, String) + func.substr(Folder.path, len(old_path) + 1, type_=String),
+            Folder.version: Folder.version + 1
+        },
+        synchronize_session=False
+    )
+    set_committed_value(folder, "path", new_path)
+
+
+def rename_folder(folder: Folder, new_name: str, db: Session):
+    parent_path = folder.path[:-len(folder.name)]
+    _set_path(folder, parent_path + new_name, db)
+    folder.name = new_name
+    record_change(db, folder.user_id, "folder", folder.id, "rename", new_name, folder.parent_id)
+    db.commit()
+    return folder
+
+
+def move_folder(folder: Folder, target: Folder | None, db: Session):
+    """Move a folder under ``target``, or to the root.
+
+    Returns False if that would create a cycle, and None if the folder or
+    the target changed concurrently.
+    """
+    old_parent_id = folder.parent_id
+    new_parent_id = target.id if target else None
+    if not _claim(
+        db, Folder, folder.id,
+        {"is_deleted": False, "parent_id": old_parent_id},
+        {Folder.parent_id: new_parent_id}
+    ):
+        return None
+    
+    # Checked after the claim, so two crossing moves cannot both pass.
+    if target is not None:
+        if db.query(subtree_folder_ids(folder.id).subquery()).filter_by(id=target.id).first():
+            db.rollback()
+            return False
+        target = db.query(Folder).filter(
+            Folder.id == target.id,
+            Folder.is_deleted == False
+        ).populate_existing().with_for_update().first()
+        if target is None:
+            db.rollback()
+            return None
+    db.refresh(folder)
+    
+    _set_path(folder, f"{target.path if target else ''}/{folder.name}", db)
+    old_bumped = propagate_rollups(db, old_parent_id, *folder_contribution(folder.id, -1), bump_version=True)
+    bumped = propagate_rollups(db, new_parent_id, *folder_contribution(folder.id), bump_version=True)
+    record_change(
+        db, folder.user_id, "folder", folder.id, "move", folder.name, new_parent_id,
+        parent_bumped=bumped, other_listings=() if old_bumped else (old_parent_id,)
+    )
+    db.commit()
+    return True
+
+
+def _subtree_files(folder: Folder, db: Session):
+    return db.query(File).filter(File.folder_id.in_(subtree_folder_ids(folder.id)))
+
+
+def soft_delete_folder(folder: Folder, user: User, db: Session):
+    now = datetime.utcnow()
+    if not _claim(
+        db, Folder, folder.id,
+        {"is_deleted": False, "parent_id": folder.parent_id},
+        {Folder.is_deleted: True, Folder.deleted_at: now}
+    ):
+        return False
+    
+    live_files = _subtree_files(folder, db).filter(File.is_deleted == False)
+    freed = live_files.with_entities(func.coalesce(func.sum(File.file_size), 0)).scalar()
+    
+    # Everything trashed here shares one deleted_at, which is how restore
+    # tells it apart from items that were already in the trash.
+    # Folders already in the trash keep their deleted_at but may still hold
+    # files trashed here, so the whole subtree gets a new listing version.
+    live_files.update({File.is_deleted: True, File.deleted_at: now}, synchronize_session=False)
+    db.query(Folder).filter(Folder.id.in_(subtree_folder_ids(folder.id))).update(
+        {
+            Folder.is_deleted: True,
+            Folder.deleted_at: case((Folder.is_deleted == False, now), else_=Folder.deleted_at),
+            Folder.version: Folder.version + 1
+        },
+        synchronize_session=False
+    )
+    
+    # The subtree keeps its rollups; only the live ancestors lose them.
+    bumped = propagate_rollups(db, folder.parent_id, *folder_contribution(folder.id, -1), bump_version=True)
+    user.storage_used = max(0, user.storage_used - freed)
+    record_change(db, user.id, "folder", folder.id, "delete", folder.name, folder.parent_id, bumped)
+    db.commit()
+    return True
+
+
+def restore_folder(folder: Folder, user: User, db: Session):
+    """Restore a folder with everything trashed along with it.
+
+    Returns None if that would exceed the quota, and False if the folder
+    changed concurrently.
+    """
+    deleted_at = folder.deleted_at
+    if not _claim(
+        db, Folder, folder.id,
+        {"is_deleted": True, "deleted_at": deleted_at, "parent_id": folder.parent_id},
+        {Folder.version: Folder.version + 1}
+    ):
+        return False
+    
+    trashed_files = _subtree_files(folder, db).filter(File.is_deleted == True, File.deleted_at == deleted_at)
+    size = trashed_files.with_entities(func.coalesce(func.sum(File.file_size), 0)).scalar()
+    
+    if not check_storage_available(user, size):
+        db.rollback()
+        return None
+    
+    restored = (Folder.is_deleted == True) & (Folder.deleted_at == deleted_at)
+    trashed_files.update({File.is_deleted: False, File.deleted_at: None}, synchronize_session=False)
+    db.query(Folder).filter(Folder.id.in_(subtree_folder_ids(folder.id))).update(
+        {
+            Folder.is_deleted: case((restored, False), else_=Folder.is_deleted),
+            Folder.deleted_at: case((restored, None), else_=Folder.deleted_at),
+            Folder.version: Folder.version + 1
+        },
+        synchronize_session=False
+    )
+    db.refresh(folder)
+    
+    # A folder whose parent is still in the trash comes back at the root.
+    others = ()
+    if folder.parent_id and not get_user_folder(folder.parent_id, user.id, False, db):
+        if not propagate_rollups(
+            db, folder.parent_id, *folder_contribution(folder.id, -1), deleted_at, bump_version=True
+        ):
+            others = (folder.parent_id,)
+        _set_path(folder, f"/{folder.name}", db)
+        folder.parent_id = None
+        bumped = False
+    else:
+        bumped = propagate_rollups(db, folder.parent_id, *folder_contribution(folder.id), bump_version=True)
+    
+    user.storage_used += size
+    record_change(db, user.id, "folder", folder.id, "restore", folder.name, folder.parent_id, bumped, others)
+    db.commit()
+    return True
+
+
+def purge_folder(folder: Folder, user: User, db: Session):
+    if not _claim(
+        db, Folder, folder.id,
+        {"is_deleted": True, "deleted_at": folder.deleted_at, "parent_id": folder.parent_id},
+        {Folder.version: Folder.version + 1}
+    ):
+        return False
+    
+    files = _subtree_files(folder, db)
+    blobs = [row.file_path for row in files.with_entities(File.file_path)]
+    bumped = propagate_rollups(
+        db, folder.parent_id, *folder_contribution(folder.id, -1), folder.deleted_at, bump_version=True
+    )
+    live_bytes = files.filter(File.is_deleted == False).with_entities(
+        func.coalesce(func.sum(File.file_size), 0)
+    ).scalar()
+    
+    db.query(Share).filter(
+        Share.file_id.in_(select(File.id).where(File.folder_id.in_(subtree_folder_ids(folder.id))))
+    ).delete(synchronize_session=False)
+    files.delete(synchronize_session=False)
+    db.query(Folder).filter(Folder.id.in_(subtree_folder_ids(folder.id))).delete(synchronize_session=False)
+    
+    user.storage_used = max(0, user.storage_used - live_bytes)
+    record_change(db, user.id, "folder", folder.id, "purge", folder.name, folder.parent_id, bumped)
+    db.commit()
+    
+    for path in blobs:
+        storage_engine.delete_file(path)
+    return True
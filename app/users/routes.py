@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from app.config.database import get_db
+from app.config.database import get_db, is_sharded
 from app.schemas.user_schema import UserResponse, UserUpdate, StorageInfo
 from app.users.models import User
 from app.common.helpers import get_current_user
 from app.users.service import get_user_storage_info
+from app.shards.service import change_user_email
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
@@ -24,10 +25,14 @@ def update_user_profile(
         current_user.full_name = user_update.full_name
     
     if user_update.email is not None:
-        existing = db.query(User).filter(
-            User.email == user_update.email,
-            User.id != current_user.id
-        ).first()
+        if is_sharded():
+            # Emails are unique across shards only in the directory.
+            existing = not change_user_email(current_user.id, user_update.email)
+        else:
+            existing = db.query(User).filter(
+                User.email == user_update.email,
+                User.id != current_user.id
+            ).first()
         if existing:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -36,7 +41,6 @@ def update_user_profile(
         current_user.email = user_update.email
     
     db.commit()
-    db.refresh(current_user)
     return current_user
 
 
@@ -21,6 +21,27 @@ def update_user_storage(user: User, file_size: int, db: Session, add: bool = Tru
     else:
         user.storage_used = max(0, user.storage_used - file_size)
     
-    db.commit()
-    db.refresh(user)
     return user
+
+
+def reserve_storage(user: User, size: int, db: Session, uploads: int = 0) -> bool:
+    """Add ``size`` to the user's storage if it stays within the plan limit.
+
+    The check and the increment are one statement, so concurrent uploads
+    cannot both pass the check against the same remaining quota. ``uploads``
+    is added to the user's upload count by the same statement.
+    """
+    storage_limit = get_storage_limit(user.plan_type)
+    values = {User.storage_used: User.storage_used + size}
+    if uploads:
+        values[User.total_uploads] = User.total_uploads + uploads
+    return db.query(User).filter(
+        User.id == user.id,
+        User.storage_used + size <= storage_limit
+    ).update(values, synchronize_session=False) == 1
+
+
+def release_storage(user: User, size: int, db: Session):
+    db.query(User).filter(User.id == user.id).update(
+        {User.storage_used: User.storage_used - size}, synchronize_session=False
+    )
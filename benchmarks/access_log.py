@@ -0,0 +1,112 @@
+"""Measure what access logging costs in request throughput.
+
+Runs the same ``http_load`` scenarios against three servers on the same
+temporary database: access logging off, on for every request, and on with
+``ACCESS_LOG_SAMPLE_RATES`` applied to the listing routes. Logs are written
+to the temporary directory:
+
+    python benchmarks/access_log.py --concurrency 16 --requests 2000 --output access_log.json
+
+Exits with status 1 if full logging lowers any scenario's throughput by
+more than --max-overhead percent.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+
+from common import ServerProcess, temp_environment, write_results
+from http_load import UPLOAD_SIZES, prepare, run_scenario
+
+DEFAULT_SCENARIOS = ["list_files", "list_folders", "share_access", "mixed"]
+SAMPLED_ROUTES = {"GET /storage/files": 0.1, "GET /storage/folders": 0.1}
+
+
+async def run_variant(server: ServerProcess, args, payloads: dict) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=server.base_url, limits=limits, timeout=args.timeout) as client:
+        users = await prepare(client, args, payloads)
+        return {
+            name: await run_scenario(name, client, server, users, args, payloads)
+            for name in args.scenarios
+        }
+
+
+def count_lines(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Access logging overhead benchmark")
+    parser.add_argument("--scenarios", nargs="+", default=DEFAULT_SCENARIOS)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--listing-files", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--max-overhead", type=float, default=10.0, help="allowed throughput loss in percent")
+    parser.add_argument("--output", default="access_log.json")
+    args = parser.parse_args()
+
+    env = temp_environment()
+    payloads = {size: os.urandom(n) for size, n in UPLOAD_SIZES.items()}
+    log_dir = os.path.join(env["work_dir"], "logs")
+    os.makedirs(log_dir)
+
+    variants = {
+        "off": {"ACCESS_LOG_ENABLED": "false"},
+        "on": {},
+        "sampled": {"ACCESS_LOG_SAMPLE_RATES": json.dumps(SAMPLED_ROUTES)},
+    }
+    results = {}
+    for name, extra_env in variants.items():
+        access_log = os.path.join(log_dir, f"access-{name}.log")
+        extra_env = {
+            "LOG_FILE": os.path.join(log_dir, f"error-{name}.log"),
+            "ACCESS_LOG_FILE": access_log,
+            # Rotation is part of what is measured, not a limit on it.
+            "LOG_MAX_BYTES": str(8 * 1024 * 1024),
+            **extra_env,
+        }
+        with ServerProcess(env, extra_env=extra_env) as server:
+            print(f"[{name}] server ready in {server.ready_seconds:.2f}s")
+            results[name] = asyncio.run(run_variant(server, args, payloads))
+        results[name]["access_log_lines"] = count_lines(access_log)
+
+    overhead = {}
+    for scenario in args.scenarios:
+        off = results["off"][scenario]["throughput_rps"]
+        row = []
+        for name in variants:
+            r = results[name][scenario]
+            row.append(f"{name} {r['throughput_rps']:8.1f} req/s p95 {r['p95_ms']:7.2f} ms")
+        overhead[scenario] = {
+            name: round((off - results[name][scenario]["throughput_rps"]) / off * 100, 2)
+            for name in ("on", "sampled")
+        }
+        print(f"{scenario:14s} " + "  |  ".join(row))
+    results["overhead_pct"] = overhead
+    print(f"access log lines: on {results['on']['access_log_lines']}, "
+          f"sampled {results['sampled']['access_log_lines']}")
+
+    params = {k: v for k, v in vars(args).items() if k != "output"}
+    write_results(args.output, "access_log", params, results)
+
+    problems = [
+        f"{scenario}: logging costs {pct['on']:.2f}% of throughput"
+        for scenario, pct in overhead.items() if pct["on"] > args.max_overhead
+    ]
+    if problems:
+        print("\n".join(problems))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Throw a burst of transfers at a server with small admission limits.
+
+Starts ``app.main:app`` under uvicorn with ``ADMISSION_MAX_TRANSFERS`` and
+the queue cut down, and free downloads slowed by bandwidth shaping so that
+they hold their slots. Free and premium users then start downloads and
+uploads all at once, more than the server admits and queues together:
+
+    python benchmarks/admission.py --free-users 24 --premium-users 8 --output admission.json
+
+Reports, per plan, how many transfers were served and how many got a 503,
+the latency of each, the server's peak RSS, and the admission metrics the
+server exposes. Exits with status 1 if a 503 lacks Retry-After, a request
+fails any other way, or premium transfers were turned away more often than
+free ones.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+
+import httpx
+
+from common import ServerProcess, latency_summary, temp_environment, write_results
+
+MIB = 1024 * 1024
+_serial = itertools.count()
+
+
+async def register(client: httpx.AsyncClient, plan: str) -> dict:
+    n = next(_serial)
+    response = await client.post(
+        "/auth/register",
+        json={"email": f"spike{n}@example.com", "username": f"spike{n}", "password": "bench-password"}
+    )
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    if plan != "free":
+        upgrade = await client.post("/premium/upgrade", json={"plan_type": plan, "payment_method": "card"},
+                                    headers=headers)
+        upgrade.raise_for_status()
+    return headers
+
+
+async def transfer(client: httpx.AsyncClient, method: str, url: str, **kwargs) -> tuple[float, httpx.Response]:
+    started = time.perf_counter()
+    async with client.stream(method, url, **kwargs) as response:
+        async for _ in response.aiter_raw():
+            pass
+    return time.perf_counter() - started, response
+
+
+def sample_rss(server: ServerProcess, stop: threading.Event, peak: list):
+    while not stop.is_set():
+        peak[0] = max(peak[0], server.rss())
+        time.sleep(0.02)
+
+
+def admission_metrics(text: str) -> dict:
+    metrics = {}
+    for line in text.splitlines():
+        match = re.match(r"^(holabox_admission_\w+?)(\{[^}]*\})? ([0-9.e+-]+)$", line)
+        if match and not match.group(1).endswith(("_created", "_bucket")):
+            metrics[match.group(1) + (match.group(2) or "")] = float(match.group(3))
+    return metrics
+
+
+async def spike(server: ServerProcess, args) -> dict:
+    payload = os.urandom(args.file_mib * MIB)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+
+    async with httpx.AsyncClient(base_url=server.base_url, timeout=args.timeout, limits=limits) as client:
+        users = [("free", await register(client, "free")) for _ in range(args.free_users)]
+        users += [("premium", await register(client, "premium")) for _ in range(args.premium_users)]
+        file_ids = {}
+        for plan, headers in users:
+            response = await client.post("/storage/upload", files={"file": ("blob.bin", payload)}, headers=headers)
+            response.raise_for_status()
+            file_ids[headers["Authorization"]] = response.json()["id"]
+
+        # Let the shaped users' buckets fill up again after their uploads.
+        await asyncio.sleep(args.settle_seconds)
+
+        async def run(plan: str, headers: dict, kind: str):
+            if kind == "download":
+                url = f"/storage/files/{file_ids[headers['Authorization']]}/download"
+                seconds, response = await transfer(client, "GET", url, headers=headers)
+            else:
+                seconds, response = await transfer(client, "POST", "/storage/upload", headers=headers,
+                                                   files={"file": ("spike.bin", payload)})
+            return plan, kind, seconds, response
+
+        peak = [0]
+        stop = threading.Event()
+        sampler = threading.Thread(target=sample_rss, args=(server, stop, peak), daemon=True)
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            results = await asyncio.gather(*(
+                run(plan, headers, kind)
+                for plan, headers in users
+                for kind in ("download",) * args.downloads_per_user + ("upload",) * args.uploads_per_user
+            ))
+        finally:
+            stop.set()
+            sampler.join()
+        elapsed = time.perf_counter() - started
+
+        metrics = admission_metrics((await client.get("/metrics")).text)
+
+    summary = {"elapsed_seconds": round(elapsed, 3), "peak_rss_mib": round(peak[0] / MIB, 1)}
+    problems = []
+    for plan in ("free", "premium"):
+        served = [seconds for p, _, seconds, response in results if p == plan and response.status_code == 200]
+        shed = [
+            (seconds, response) for p, _, seconds, response in results if p == plan and response.status_code == 503
+        ]
+        other = [response.status_code for p, _, _, response in results if p == plan
+                 and response.status_code not in (200, 503)]
+        total = len(served) + len(shed) + len(other)
+        summary[plan] = {
+            "requests": total,
+            "served": len(served),
+            "rejected": len(shed),
+            "rejected_pct": round(len(shed) / total * 100, 1) if total else 0.0,
+            "served_latency": latency_summary(served) if served else None,
+            "rejected_latency": latency_summary([seconds for seconds, _ in shed]) if shed else None,
+            "retry_after": sorted({int(response.headers.get("retry-after", 0)) for _, response in shed}),
+        }
+        if any("retry-after" not in response.headers for _, response in shed):
+            problems.append(f"{plan}: a 503 without Retry-After")
+        if other:
+            problems.append(f"{plan}: unexpected statuses {sorted(set(other))}")
+
+    if summary["premium"]["rejected_pct"] > summary["free"]["rejected_pct"]:
+        problems.append("premium transfers were turned away more often than free ones")
+
+    summary["metrics"] = metrics
+    return summary, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Admission control load-shedding benchmark")
+    parser.add_argument("--free-users", type=int, default=24)
+    parser.add_argument("--premium-users", type=int, default=8)
+    parser.add_argument("--downloads-per-user", type=int, default=2)
+    parser.add_argument("--uploads-per-user", type=int, default=1)
+    parser.add_argument("--file-mib", type=int, default=4)
+    parser.add_argument("--free-rate-mb-s", type=float, default=8.0, help="slows free transfers so they hold slots")
+    parser.add_argument("--max-transfers", type=int, default=8)
+    parser.add_argument("--max-user-transfers", type=int, default=2)
+    parser.add_argument("--memory-mb", type=int, default=16)
+    parser.add_argument("--queue-size", type=int, default=16)
+    parser.add_argument("--queue-timeout", type=float, default=2.0)
+    parser.add_argument("--settle-seconds", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", default="admission.json")
+    args = parser.parse_args()
+
+    env = temp_environment()
+    extra_env = {
+        "ADMISSION_MAX_TRANSFERS": str(args.max_transfers),
+        "ADMISSION_MAX_USER_TRANSFERS": str(args.max_user_transfers),
+        "ADMISSION_MEMORY_MB": str(args.memory_mb),
+        "ADMISSION_QUEUE_SIZE": str(args.queue_size),
+        "ADMISSION_QUEUE_TIMEOUT_SECONDS": str(args.queue_timeout),
+        "FREE_BANDWIDTH_MB_S": str(args.free_rate_mb_s),
+        "BANDWIDTH_BURST_SECONDS": "0.25",
+    }
+
+    with ServerProcess(env, extra_env=extra_env) as server:
+        print(f"Server ready in {server.ready_seconds:.2f}s (data in {env['work_dir']})")
+        results, problems = asyncio.run(spike(server, args))
+
+    for plan in ("free", "premium"):
+        r = results[plan]
+        latency = r["served_latency"] or {}
+        print(f"{plan:8s} {r['served']:4d} served  {r['rejected']:4d} rejected ({r['rejected_pct']:5.1f}%)  "
+              f"served p50 {latency.get('p50_ms', 0):8.1f} ms  p95 {latency.get('p95_ms', 0):8.1f} ms  "
+              f"Retry-After {r['retry_after']}")
+    print(f"burst took {results['elapsed_seconds']:.2f}s, server peak RSS {results['peak_rss_mib']:.1f} MiB")
+
+    params = {k: v for k, v in vars(args).items() if k != "output"}
+    write_results(args.output, "admission", params, results)
+
+    if problems:
+        print("\n".join(problems))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
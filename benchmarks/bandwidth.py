@@ -0,0 +1,200 @@
+"""Check that bandwidth shaping holds its configured rates and costs nothing when off.
+
+Starts ``app.main:app`` under uvicorn twice against the same temporary
+database: once with shaping off, once with ``FREE_BANDWIDTH_MB_S`` set.
+On the shaped server a free user downloads one file, then several at once,
+uploads one and serves one through a public share. Each measured rate is
+compared with the configured one, after subtracting the burst allowance.
+A premium user, who is not limited, then downloads and makes small
+requests on both servers to measure the shaper's overhead:
+
+    python benchmarks/bandwidth.py --rate-mb-s 8 --file-mib 16 --output bandwidth.json
+
+Exits with status 1 if a shaped rate is off by more than --tolerance
+percent or an unthrottled run is slower by more than --max-overhead percent.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+from common import ServerProcess, latency_summary, temp_environment, write_results
+
+MIB = 1024 * 1024
+_serial = itertools.count()
+
+
+async def register(client: httpx.AsyncClient) -> dict:
+    n = next(_serial)
+    response = await client.post(
+        "/auth/register",
+        json={"email": f"shape{n}@example.com", "username": f"shape{n}", "password": "bench-password"}
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def upload(client: httpx.AsyncClient, headers: dict, payload: bytes) -> int:
+    response = await client.post("/storage/upload", files={"file": ("blob.bin", payload)}, headers=headers)
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+async def download(client: httpx.AsyncClient, url: str, headers: dict | None = None) -> int:
+    received = 0
+    async with client.stream("GET", url, headers=headers) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_raw():
+            received += len(chunk)
+    return received
+
+
+async def timed(coro) -> tuple[float, int]:
+    started = time.perf_counter()
+    transferred = await coro
+    return time.perf_counter() - started, transferred
+
+
+def shaped_result(name: str, seconds: float, transferred: int, rate: float, burst: float) -> dict:
+    # Buckets start full, so the first ``burst`` bytes pass unshaped.
+    measured = (transferred - burst) / seconds
+    result = {
+        "seconds": round(seconds, 3),
+        "mib": round(transferred / MIB, 2),
+        "configured_mib_s": round(rate / MIB, 3),
+        "measured_mib_s": round(measured / MIB, 3),
+        "error_pct": round((measured - rate) / rate * 100, 2),
+    }
+    print(f"{name:22s} {result['measured_mib_s']:8.3f} MiB/s (configured {result['configured_mib_s']:.3f}, "
+          f"error {result['error_pct']:+.2f}%)")
+    return result
+
+
+async def shaped_runs(server: ServerProcess, args) -> dict:
+    rate = args.rate_mb_s * MIB
+    burst = rate * args.burst_seconds
+    payload = os.urandom(args.file_mib * MIB)
+    results = {}
+
+    async with httpx.AsyncClient(base_url=server.base_url, timeout=args.timeout) as client:
+        # Each scenario gets a fresh user, so it starts with a full bucket.
+        headers = await register(client)
+        file_id = await upload(client, headers, payload)
+        await asyncio.sleep(args.burst_seconds * 2)
+        seconds, n = await timed(download(client, f"/storage/files/{file_id}/download", headers))
+        results["download"] = shaped_result("download", seconds, n, rate, burst)
+
+        await asyncio.sleep(args.burst_seconds * 2)
+        url = f"/storage/files/{file_id}/download"
+        seconds, n = await timed(_gather_sum(download(client, url, headers) for _ in range(args.streams)))
+        results["download_parallel"] = shaped_result(f"download x{args.streams}", seconds, n, rate, burst)
+
+        headers = await register(client)
+        seconds, _ = await timed(upload(client, headers, payload))
+        results["upload"] = shaped_result("upload", seconds, len(payload), rate, burst)
+
+        await asyncio.sleep(args.burst_seconds * 2)
+        file_id = (await client.get("/storage/files", headers=headers)).json()[0]["id"]
+        share = await client.post("/shares/", json={"file_id": file_id}, headers=headers)
+        share.raise_for_status()
+        await asyncio.sleep(args.burst_seconds * 2)
+        seconds, n = await timed(download(client, f"/shares/{share.json()['share_token']}/download"))
+        results["share_download"] = shaped_result("share download", seconds, n, rate, burst)
+
+    return results
+
+
+async def _gather_sum(coros) -> int:
+    return sum(await asyncio.gather(*coros))
+
+
+async def unthrottled_runs(server: ServerProcess, args) -> dict:
+    payload = os.urandom(args.overhead_file_mib * MIB)
+    async with httpx.AsyncClient(base_url=server.base_url, timeout=args.timeout) as client:
+        headers = await register(client)
+        upgrade = await client.post(
+            "/premium/upgrade", json={"plan_type": "premium", "payment_method": "card"}, headers=headers
+        )
+        upgrade.raise_for_status()
+        file_id = await upload(client, headers, payload)
+
+        throughputs = []
+        for _ in range(args.repeat):
+            seconds, n = await timed(download(client, f"/storage/files/{file_id}/download", headers))
+            throughputs.append(n / seconds / MIB)
+
+        latencies = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            response = await client.get("/users/me", headers=headers)
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+
+    return {
+        "download_mib_s": round(statistics.median(throughputs), 1),
+        **latency_summary(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bandwidth shaping accuracy and overhead benchmark")
+    parser.add_argument("--rate-mb-s", type=float, default=8.0, help="FREE_BANDWIDTH_MB_S on the shaped server")
+    parser.add_argument("--burst-seconds", type=float, default=0.5)
+    parser.add_argument("--file-mib", type=int, default=16)
+    parser.add_argument("--streams", type=int, default=4, help="parallel downloads by one user")
+    parser.add_argument("--overhead-file-mib", type=int, default=128)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--tolerance", type=float, default=5.0, help="allowed rate error in percent")
+    parser.add_argument("--max-overhead", type=float, default=10.0, help="allowed slowdown in percent")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", default="bandwidth.json")
+    args = parser.parse_args()
+
+    env = temp_environment()
+    shaping = {
+        "FREE_BANDWIDTH_MB_S": str(args.rate_mb_s),
+        "BANDWIDTH_BURST_SECONDS": str(args.burst_seconds),
+    }
+
+    results = {}
+    with ServerProcess(env) as server:
+        print(f"Server ready in {server.ready_seconds:.2f}s (data in {env['work_dir']})")
+        results["unthrottled_off"] = asyncio.run(unthrottled_runs(server, args))
+    with ServerProcess(env, extra_env=shaping) as server:
+        results["unthrottled_on"] = asyncio.run(unthrottled_runs(server, args))
+        results.update(asyncio.run(shaped_runs(server, args)))
+
+    off, on = results["unthrottled_off"], results["unthrottled_on"]
+    overhead = {
+        "download_pct": round((off["download_mib_s"] - on["download_mib_s"]) / off["download_mib_s"] * 100, 2),
+        "p50_pct": round((on["p50_ms"] - off["p50_ms"]) / off["p50_ms"] * 100, 2),
+    }
+    results["overhead"] = overhead
+    print(f"premium, shaping off   {off['download_mib_s']:8.1f} MiB/s  p50 {off['p50_ms']:.3f} ms")
+    print(f"premium, shaping on    {on['download_mib_s']:8.1f} MiB/s  p50 {on['p50_ms']:.3f} ms")
+
+    params = {k: v for k, v in vars(args).items() if k != "output"}
+    write_results(args.output, "bandwidth", params, results)
+
+    problems = [
+        f"{name}: rate off by {result['error_pct']:+.2f}%"
+        for name, result in results.items()
+        if "error_pct" in result and abs(result["error_pct"]) > args.tolerance
+    ]
+    problems += [
+        f"unthrottled {metric} slower by {value:.2f}%"
+        for metric, value in overhead.items() if value > args.max_overhead
+    ]
+    if problems:
+        print("\n".join(problems))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Compare one multi-file upload with the same files uploaded one by one.
+
+Starts ``app.main:app`` under uvicorn against a temporary database, then for
+each run registers a fresh user and uploads ``--files`` files either as
+separate ``POST /storage/upload`` requests, ``--concurrency`` at a time like
+a browser would, or as a single ``POST /storage/upload/batch``. Every run
+checks that the user ends up with all files and the right storage usage:
+
+    python benchmarks/batch_upload.py --files 500 --file-size-kib 64 --output batch.json
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+from common import ServerProcess, compare_results, temp_environment, write_results
+
+KIB = 1024
+_serial = itertools.count()
+
+
+async def register(client: httpx.AsyncClient) -> dict:
+    n = next(_serial)
+    response = await client.post(
+        "/auth/register",
+        json={"email": f"batch{n}@example.com", "username": f"batch{n}", "password": "bench-password"}
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def upload_single(client: httpx.AsyncClient, headers: dict, payloads: list[bytes], concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int, payload: bytes):
+        async with semaphore:
+            response = await client.post(
+                "/storage/upload",
+                files={"file": (f"photo{i}.jpg", payload, "image/jpeg")},
+                headers=headers
+            )
+            response.raise_for_status()
+
+    await asyncio.gather(*(one(i, payload) for i, payload in enumerate(payloads)))
+
+
+async def upload_batch(client: httpx.AsyncClient, headers: dict, payloads: list[bytes], concurrency: int):
+    response = await client.post(
+        "/storage/upload/batch",
+        params={"total_size": sum(len(payload) for payload in payloads)},
+        files=[("files", (f"photo{i}.jpg", payload, "image/jpeg")) for i, payload in enumerate(payloads)],
+        headers=headers
+    )
+    response.raise_for_status()
+    if response.json()["failed"]:
+        raise RuntimeError(f"Batch upload had failed files: {response.json()}")
+
+
+async def verify(client: httpx.AsyncClient, headers: dict, payloads: list[bytes]) -> list[str]:
+    problems = []
+    files = (await client.get("/storage/files", headers=headers)).json()
+    if len(files) != len(payloads):
+        problems.append(f"{len(files)} files listed, expected {len(payloads)}")
+    used = (await client.get("/users/storage", headers=headers)).json()["storage_used"]
+    if used != sum(len(payload) for payload in payloads):
+        problems.append(f"storage_used is {used}, expected {sum(len(payload) for payload in payloads)}")
+    return problems
+
+
+async def run(args) -> tuple[dict, list[str]]:
+    env = temp_environment()
+    payloads = [os.urandom(args.file_size_kib * KIB) for _ in range(args.files)]
+    megabytes = sum(len(payload) for payload in payloads) / KIB / KIB
+    modes = {"single": upload_single, "batch": upload_batch}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    results = {}
+    problems = []
+    with ServerProcess(env) as server:
+        print(f"Server ready in {server.ready_seconds:.2f}s (data in {env['work_dir']})")
+        async with httpx.AsyncClient(base_url=server.base_url, limits=limits, timeout=args.timeout) as client:
+            for name, mode in modes.items():
+                durations = []
+                peak_rss = server.rss()
+                for _ in range(args.repeat):
+                    headers = await register(client)
+                    running = True
+
+                    async def sample_rss():
+                        nonlocal peak_rss
+                        while running:
+                            peak_rss = max(peak_rss, server.rss())
+                            await asyncio.sleep(0.05)
+
+                    sampler = asyncio.create_task(sample_rss())
+                    started = time.perf_counter()
+                    await mode(client, headers, payloads, args.concurrency)
+                    durations.append(time.perf_counter() - started)
+                    running = False
+                    await sampler
+                    problems.extend(f"{name}: {problem}" for problem in await verify(client, headers, payloads))
+
+                mean = statistics.mean(durations)
+                results[name] = {
+                    "mean_ms": round(mean * 1000, 3),
+                    "min_ms": round(min(durations) * 1000, 3),
+                    "files_per_s": round(args.files / mean, 1),
+                    "throughput_mib_s": round(megabytes / mean, 2),
+                    "peak_rss_mib": round(peak_rss / KIB / KIB, 1),
+                }
+                r = results[name]
+                print(f"{name:8s} {r['mean_ms']:10.1f} ms  {r['files_per_s']:8.1f} files/s  "
+                      f"{r['throughput_mib_s']:8.2f} MiB/s  rss {r['peak_rss_mib']:7.1f} MiB")
+
+    print(f"speedup {results['single']['mean_ms'] / results['batch']['mean_ms']:.1f}x")
+    return results, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch upload vs. single uploads benchmark")
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--file-size-kib", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=6, help="parallel single uploads, as in a browser")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", default="batch_upload.json")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=15.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    results, problems = asyncio.run(run(args))
+    params = {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+    write_results(args.output, "batch_upload", params, results)
+
+    if problems:
+        print("\n".join(problems))
+        sys.exit(1)
+    if args.compare:
+        regressions = compare_results(args.compare, results, {"mean_ms": "lower"}, args.max_regression)
+        if regressions:
+            print("Regressions: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Measure how long a worker takes to boot and serve its first request.
+
+Each run starts a fresh uvicorn process against the same temporary database
+and records the time until ``/health`` answers and until a login followed by
+an authenticated request has completed, which includes everything loaded
+lazily on first use. The first boot creates the schema and is reported on
+its own. An import-time profile of ``app.main`` lists the slowest modules:
+
+    python benchmarks/cold_start.py --runs 10 --budget-ms 2500 --output cold.json
+
+The run exits with status 1 if the median time to first request exceeds
+``--budget-ms``, or with ``--compare`` if it regressed.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from common import PROJECT_ROOT, ServerProcess, compare_results, temp_environment, write_results
+
+CREDENTIALS = {"email": "coldstart@example.com", "password": "cold-start-password"}
+
+
+def import_profile(env: dict, top: int) -> tuple[float, list[tuple[str, int, int]]]:
+    """Return the total import time of app.main and its ``top`` slowest modules."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=PROJECT_ROOT, capture_output=True, text=True,
+        env={**os.environ, "DATABASE_URL": env["DATABASE_URL"], "STORAGE_PATH": env["STORAGE_PATH"]}
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    total = next((cumulative for name, _, cumulative in modules if name == "app.main"), 0)
+    return total / 1e6, sorted(modules, key=lambda m: m[1], reverse=True)[:top]
+
+
+def boot(env: dict, register: bool = False) -> dict:
+    started = time.perf_counter()
+    with ServerProcess(env) as server:
+        ready = time.perf_counter() - started
+        with httpx.Client(base_url=server.base_url) as client:
+            if register:
+                client.post("/auth/register", json={**CREDENTIALS, "username": "coldstart"}).raise_for_status()
+            response = client.post("/auth/login", json=CREDENTIALS)
+            response.raise_for_status()
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            client.get("/users/me", headers=headers).raise_for_status()
+        first_request = time.perf_counter() - started
+        rss = server.rss()
+    return {"ready_s": ready, "first_request_s": first_request, "rss_mib": rss / 1024 / 1024}
+
+
+def summarize(samples: list[dict]) -> dict:
+    return {
+        "ready_ms": round(statistics.median(s["ready_s"] for s in samples) * 1000, 1),
+        "first_request_ms": round(statistics.median(s["first_request_s"] for s in samples) * 1000, 1),
+        "first_request_max_ms": round(max(s["first_request_s"] for s in samples) * 1000, 1),
+        "rss_mib": round(statistics.median(s["rss_mib"] for s in samples), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HolaBox cold start benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="boots against an existing database")
+    parser.add_argument("--budget-ms", type=float, default=3000.0, help="median time to first request")
+    parser.add_argument("--top", type=int, default=15, help="modules listed in the import profile")
+    parser.add_argument("--output", default="cold_start.json")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=15.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    env = temp_environment()
+    results = {"first_boot": summarize([boot(env, register=True)])}
+    results["boot"] = summarize([boot(env) for _ in range(args.runs)])
+
+    import_seconds, slowest = import_profile(env, args.top)
+    results["import"] = {"app_main_ms": round(import_seconds * 1000, 1)}
+
+    print(f"import app.main       {import_seconds * 1000:8.1f} ms")
+    for name, r in results.items():
+        if name != "import":
+            print(f"{name:12s} ready {r['ready_ms']:8.1f} ms  first request {r['first_request_ms']:8.1f} ms  "
+                  f"rss {r['rss_mib']:6.1f} MiB")
+    print("\nSlowest imports (self time):")
+    for name, self_us, cumulative_us in slowest:
+        print(f"  {self_us / 1000:8.1f} ms  (cumulative {cumulative_us / 1000:8.1f} ms)  {name}")
+
+    write_results(args.output, "cold_start", {k: v for k, v in vars(args).items() if k not in ("output", "compare")}, results)
+
+    failed = False
+    if results["boot"]["first_request_ms"] > args.budget_ms:
+        print(f"Over budget: {results['boot']['first_request_ms']} ms > {args.budget_ms} ms")
+        failed = True
+    if args.compare:
+        regressions = compare_results(
+            args.compare, results, {"ready_ms": "lower", "first_request_ms": "lower"}, args.max_regression
+        )
+        if regressions:
+            print("Regressions: " + ", ".join(regressions))
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Helpers shared by the benchmark scripts.
+
+Benchmarks never touch the configured database or storage directory: each
+run gets a temporary directory holding a fresh SQLite file and storage root.
+"""
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+def temp_environment(prefix: str = "holabox-bench-") -> dict:
+    work_dir = tempfile.mkdtemp(prefix=prefix)
+    return {
+        "work_dir": work_dir,
+        "DATABASE_URL": f"sqlite:///{os.path.join(work_dir, 'holabox.db')}",
+        "STORAGE_PATH": os.path.join(work_dir, "storage"),
+    }
+
+
+def use_temp_environment(prefix: str = "holabox-bench-") -> dict:
+    """Point the app at a temporary database; call before importing ``app``."""
+    env = temp_environment(prefix)
+    os.environ["DATABASE_URL"] = env["DATABASE_URL"]
+    os.environ["STORAGE_PATH"] = env["STORAGE_PATH"]
+    return env
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+
+    # Not Linux: fall back to ps, which reports kilobytes.
+    output = subprocess.run(["ps", "-o", "rss=", "-p", str(pid)], capture_output=True, text=True).stdout
+    return int(output.strip() or 0) * 1024
+
+
+def cpu_seconds(pid: int) -> float | None:
+    """User and system CPU time of a process so far; None where /proc is missing."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name may contain spaces; the fields after it do not.
+            fields = f.read().rpartition(")")[2].split()
+    except FileNotFoundError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class ServerProcess:
+    """Runs ``app.main:app`` under uvicorn in a subprocess."""
+
+    def __init__(self, env: dict, workers: int = 1, extra_env: dict | None = None):
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.workers = workers
+        self.env = {
+            **os.environ,
+            "DATABASE_URL": env["DATABASE_URL"],
+            "STORAGE_PATH": env["STORAGE_PATH"],
+            **(extra_env or {}),
+        }
+        self.process = None
+        self.ready_seconds = None
+
+    def start(self, timeout: float = 30.0):
+        started = time.perf_counter()
+        self.process = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "app.main:app",
+                "--host", "127.0.0.1", "--port", str(self.port),
+                "--workers", str(self.workers), "--log-level", "warning",
+            ],
+            cwd=PROJECT_ROOT,
+            env=self.env
+        )
+
+        deadline = started + timeout
+        while time.perf_counter() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with status {self.process.returncode}")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.2) as sock:
+                    sock.sendall(b"GET /health HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n")
+                    if sock.recv(64).startswith(b"HTTP/1.1 200"):
+                        self.ready_seconds = time.perf_counter() - started
+                        return self
+            except OSError:
+                pass
+            time.sleep(0.02)
+
+        self.stop()
+        raise RuntimeError("Server did not become ready in time")
+
+    def pids(self) -> list[int]:
+        pids = [self.process.pid]
+        # With --workers > 1 the serving processes are children of the supervisor.
+        children = f"/proc/{self.process.pid}/task/{self.process.pid}/children"
+        if os.path.exists(children):
+            with open(children) as f:
+                pids.extend(int(pid) for pid in f.read().split())
+        return pids
+
+    def rss(self) -> int:
+        return sum(rss_bytes(pid) for pid in self.pids())
+
+    def cpu_seconds(self) -> float | None:
+        times = [cpu_seconds(pid) for pid in self.pids()]
+        return None if None in times else sum(times)
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_summary(latencies: list[float]) -> dict:
+    return {
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+
+def git_revision() -> str | None:
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=PROJECT_ROOT, capture_output=True, text=True
+    )
+    return result.stdout.strip() or None
+
+
+def write_results(path: str, benchmark: str, params: dict, results: dict):
+    payload = {
+        "benchmark": benchmark,
+        "revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2)
+    print(f"Results written to {path}")
+
+
+def compare_results(baseline_path: str, results: dict, metrics: dict[str, str], max_regression: float) -> list[str]:
+    """Compare ``results`` with a previous run written by ``write_results``.
+
+    ``metrics`` maps a metric name to "lower" or "higher", whichever is better.
+    Returns one message per metric that regressed by more than
+    ``max_regression`` percent.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for metric, better in metrics.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = change > max_regression if better == "lower" else change < -max_regression
+            marker = "REGRESSION" if worse else ""
+            print(f"  {name:24s} {metric:16s} {old:12.3f} -> {new:12.3f} ({change:+6.1f}%) {marker}")
+            if worse:
+                regressions.append(f"{name}.{metric} {change:+.1f}%")
+    return regressions
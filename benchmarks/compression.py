@@ -0,0 +1,127 @@
+"""Bytes on the wire and CPU cost of compressing large listings.
+
+Seeds one user with a large folder, then requests ``/storage/files`` and
+``/storage/folders`` with each encoding the server offers and with none.
+For each it reports the compressed size, the request latency and the
+process CPU time per request, and the CPU time of compressing the body on
+its own. It also estimates the time to deliver the body over a slow link:
+
+    python benchmarks/compression.py --files 50000 --link-mbit 10 --output compression.json
+
+Exits with status 1 if a compressed body does not decode to the
+uncompressed one.
+"""
+import argparse
+import gzip
+import statistics
+import sys
+import time
+
+from common import latency_summary, use_temp_environment, write_results
+
+use_temp_environment()
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.auth.jwt_handler import create_access_token
+from app.common.compression import Compressor, supported_encodings
+from app.config.database import init_db
+from listing_serialization import seed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIB = 1024 * 1024
+
+
+def decode(encoding: str | None, body: bytes) -> bytes:
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "br":
+        return brotli.decompress(body)
+    return body
+
+
+def fetch(client: TestClient, url: str, headers: dict) -> tuple[float, float, str | None, bytes]:
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    with client.stream("GET", url, headers=headers) as response:
+        response.raise_for_status()
+        raw = b"".join(response.iter_raw())
+    return (
+        time.perf_counter() - started, time.process_time() - cpu_started,
+        response.headers.get("content-encoding"), raw
+    )
+
+
+def compress_cpu(encoding: str, body: bytes, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.thread_time()
+        Compressor(encoding).compress_all(body)
+        times.append(time.thread_time() - started)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response compression benchmark")
+    parser.add_argument("--files", type=int, default=50000)
+    parser.add_argument("--folders", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--link-mbit", type=float, default=10.0, help="link speed for the delivery estimate")
+    parser.add_argument("--output", default="compression.json")
+    args = parser.parse_args()
+
+    init_db()
+    user_id = seed(args.files, args.folders)
+    auth = {"Authorization": f"Bearer {create_access_token({'sub': str(user_id)})}"}
+    link_bytes_s = args.link_mbit * 1_000_000 / 8
+
+    results = {}
+    mismatches = []
+    with TestClient(app) as client:
+        for url in ("/storage/files", "/storage/folders"):
+            plain = None
+            for encoding in ("identity", *supported_encodings()):
+                headers = {**auth, "Accept-Encoding": encoding}
+                fetch(client, url, headers)
+                latencies, cpu = [], []
+                for _ in range(args.repeat):
+                    seconds, cpu_seconds, served_as, raw = fetch(client, url, headers)
+                    latencies.append(seconds)
+                    cpu.append(cpu_seconds)
+
+                body = decode(served_as, raw)
+                if plain is None:
+                    plain = body
+                elif body != plain:
+                    mismatches.append(f"{url} {encoding}")
+
+                result = {
+                    "bytes": len(raw),
+                    "ratio": round(len(plain) / len(raw), 2),
+                    **latency_summary(latencies),
+                    "cpu_ms": round(statistics.median(cpu) * 1000, 3),
+                    "compress_cpu_ms": (
+                        round(compress_cpu(encoding, plain, args.repeat) * 1000, 3) if served_as else 0.0
+                    ),
+                }
+                result["delivery_ms"] = round((len(raw) / link_bytes_s + statistics.median(latencies)) * 1000, 1)
+                results[f"{url}/{encoding}"] = result
+                print(f"{url:18s} {encoding:8s} {len(raw) / MIB:7.2f} MiB  x{result['ratio']:5.2f}  "
+                      f"p50 {result['p50_ms']:8.1f} ms  cpu {result['cpu_ms']:8.1f} ms  "
+                      f"compress {result['compress_cpu_ms']:7.1f} ms  "
+                      f"@{args.link_mbit:g} Mbit/s {result['delivery_ms']:8.1f} ms")
+
+    params = {k: v for k, v in vars(args).items() if k != "output"}
+    write_results(args.output, "compression", params, results)
+
+    if mismatches:
+        print("Compressed bodies differ from the uncompressed ones: " + ", ".join(mismatches))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
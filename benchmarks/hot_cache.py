@@ -0,0 +1,123 @@
+"""Shared downloads of small files with and without the hot-file cache.
+
+Seeds one user with small shared files, then downloads them through their
+share links in a Zipf-skewed order, as popular links are, first with the
+cache off and then with it on. Every tenth request asks for a byte range:
+
+    python benchmarks/hot_cache.py --files 500 --requests 5000 --cache-mib 8 --output hot_cache.json
+
+Reports throughput and latency for both runs, and the cache's hit rate,
+admissions, evictions and memory held. Exits with status 1 if a download
+differs from the uploaded file.
+"""
+import argparse
+import random
+import sys
+import time
+
+from common import latency_summary, use_temp_environment, write_results
+
+use_temp_environment()
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.common.hot_cache import hot_cache
+from app.config.settings import settings
+
+KIB = 1024
+MIB = 1024 * KIB
+
+
+def seed(client: TestClient, files: int, max_kib: int, rng: random.Random) -> list[tuple[str, bytes]]:
+    response = client.post(
+        "/auth/register",
+        json={"email": "hot@example.com", "username": "hot", "password": "bench-password"}
+    )
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    shares = []
+    for n in range(files):
+        data = rng.randbytes(rng.randint(1, max_kib * KIB))
+        upload = client.post("/storage/upload", files={"file": (f"hot{n}.bin", data)}, headers=headers)
+        upload.raise_for_status()
+        share = client.post("/shares/", json={"file_id": upload.json()["id"]}, headers=headers)
+        share.raise_for_status()
+        shares.append((share.json()["share_token"], data))
+    return shares
+
+
+def run(client: TestClient, plan: list[tuple[int, tuple[int, int] | None]], shares: list) -> tuple[dict, int]:
+    latencies = []
+    mismatches = 0
+    served = 0
+    started = time.perf_counter()
+    for index, byte_range in plan:
+        token, data = shares[index]
+        headers = {"Range": f"bytes={byte_range[0]}-{byte_range[1] - 1}"} if byte_range else {}
+        request_started = time.perf_counter()
+        response = client.get(f"/shares/{token}/download", headers=headers)
+        latencies.append(time.perf_counter() - request_started)
+        expected = data[byte_range[0]:byte_range[1]] if byte_range else data
+        if response.status_code not in (200, 206) or response.content != expected:
+            mismatches += 1
+        served += len(response.content)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests_per_s": round(len(plan) / elapsed, 1),
+        "mib_per_s": round(served / MIB / elapsed, 2),
+        **latency_summary(latencies),
+    }, mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot-file cache benchmark")
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--max-file-kib", type=int, default=256)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--zipf", type=float, default=1.1, help="popularity skew of the share links")
+    parser.add_argument("--cache-mib", type=float, default=8.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="hot_cache.json")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    weights = [1 / (rank + 1) ** args.zipf for rank in range(args.files)]
+
+    settings.HOT_CACHE_MAX_FILE_BYTES = args.max_file_kib * KIB
+    results = {}
+    mismatches = 0
+    with TestClient(app) as client:
+        shares = seed(client, args.files, args.max_file_kib, rng)
+        plan = []
+        for n, index in enumerate(rng.choices(range(args.files), weights=weights, k=args.requests)):
+            size = len(shares[index][1])
+            if n % 10 or size < 2:
+                plan.append((index, None))
+            else:
+                start = rng.randrange(size - 1)
+                plan.append((index, (start, rng.randint(start + 1, size))))
+
+        for name, max_bytes in (("off", 0), ("on", int(args.cache_mib * MIB))):
+            settings.HOT_CACHE_MAX_BYTES = max_bytes
+            result, failed = run(client, plan, shares)
+            mismatches += failed
+            results[name] = result
+            print(f"cache {name:3s}  {result['requests_per_s']:8.1f} req/s  {result['mib_per_s']:7.2f} MiB/s  "
+                  f"p50 {result['p50_ms']:7.3f} ms  p99 {result['p99_ms']:7.3f} ms")
+
+        results["cache"] = hot_cache.snapshot()
+        print(f"hit rate {results['cache']['hit_rate']}  entries {results['cache']['entries']}  "
+              f"{results['cache']['bytes'] / MIB:.2f} MiB held  evictions {results['cache']['evictions']}")
+
+    params = {k: v for k, v in vars(args).items() if k != "output"}
+    write_results(args.output, "hot_cache", params, results)
+
+    if mismatches:
+        print(f"{mismatches} downloads differ from the uploaded files")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
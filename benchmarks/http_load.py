@@ -0,0 +1,284 @@
+"""End-to-end HTTP load test for the HolaBox API.
+
+Starts ``app.main:app`` under uvicorn against a temporary SQLite database and
+storage directory, then drives each scenario with a pool of concurrent async
+clients and reports throughput, latency percentiles and the server's peak RSS:
+
+    python benchmarks/http_load.py --concurrency 16 --requests 500 \\
+        --output results.json
+    python benchmarks/http_load.py --compare results.json --max-regression 10
+
+With ``--compare`` the run exits with status 1 if any scenario's p95 latency
+or throughput regressed by more than ``--max-regression`` percent.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+import time
+
+import httpx
+
+from common import (
+    ServerProcess, compare_results, latency_summary, temp_environment, write_results
+)
+
+KIB = 1024
+UPLOAD_SIZES = {"small": 4 * KIB, "medium": 256 * KIB, "large": 4 * KIB * KIB}
+
+
+class VirtualUser:
+    def __init__(self, email: str, token: str):
+        self.email = email
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.file_ids = []
+        self.share_tokens = []
+        self.disposable_file_ids = []
+
+
+_serial = itertools.count()
+
+
+async def register(client: httpx.AsyncClient) -> VirtualUser:
+    n = next(_serial)
+    email = f"bench{n}@example.com"
+    response = await client.post(
+        "/auth/register",
+        json={"email": email, "username": f"bench{n}", "password": "bench-password"}
+    )
+    response.raise_for_status()
+    return VirtualUser(email, response.json()["access_token"])
+
+
+async def upload(client: httpx.AsyncClient, user: VirtualUser, payload: bytes, name: str = "bench.bin") -> int:
+    response = await client.post(
+        "/storage/upload",
+        files={"file": (name, payload, "application/octet-stream")},
+        headers=user.headers
+    )
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+async def op_register_login(client, user, rng, payloads):
+    new_user = await register(client)
+    response = await client.post("/auth/login", json={"email": new_user.email, "password": "bench-password"})
+    response.raise_for_status()
+    return 0
+
+
+def op_upload(size: str):
+    async def op(client, user, rng, payloads):
+        await upload(client, user, payloads[size])
+        return len(payloads[size])
+    return op
+
+
+async def op_list_files(client, user, rng, payloads):
+    response = await client.get("/storage/files", headers=user.headers)
+    response.raise_for_status()
+    return len(response.content)
+
+
+async def op_list_folders(client, user, rng, payloads):
+    response = await client.get("/storage/folders", headers=user.headers)
+    response.raise_for_status()
+    return len(response.content)
+
+
+async def op_download(client, user, rng, payloads):
+    file_id = rng.choice(user.file_ids)
+    response = await client.get(f"/storage/files/{file_id}/download", headers=user.headers)
+    response.raise_for_status()
+    return len(response.content)
+
+
+async def op_share_create(client, user, rng, payloads):
+    response = await client.post("/shares/", json={"file_id": rng.choice(user.file_ids)}, headers=user.headers)
+    response.raise_for_status()
+    user.share_tokens.append(response.json()["share_token"])
+    return 0
+
+
+async def op_share_access(client, user, rng, payloads):
+    response = await client.request("GET", f"/shares/{rng.choice(user.share_tokens)}/access", json={})
+    response.raise_for_status()
+    return 0
+
+
+async def op_share_download(client, user, rng, payloads):
+    response = await client.get(f"/shares/{rng.choice(user.share_tokens)}/download")
+    response.raise_for_status()
+    return len(response.content)
+
+
+async def op_delete(client, user, rng, payloads):
+    if not user.disposable_file_ids:
+        return 0
+    response = await client.delete(f"/storage/files/{user.disposable_file_ids.pop()}", headers=user.headers)
+    response.raise_for_status()
+    return 0
+
+
+MIXED_WEIGHTS = [
+    (op_list_files, 35),
+    (op_list_folders, 10),
+    (op_download, 25),
+    (op_upload("small"), 15),
+    (op_share_create, 5),
+    (op_share_access, 10),
+]
+
+
+async def op_mixed(client, user, rng, payloads):
+    op = rng.choices([op for op, _ in MIXED_WEIGHTS], weights=[w for _, w in MIXED_WEIGHTS])[0]
+    return await op(client, user, rng, payloads)
+
+
+SCENARIOS = {
+    "register_login": op_register_login,
+    "upload_small": op_upload("small"),
+    "upload_medium": op_upload("medium"),
+    "upload_large": op_upload("large"),
+    "list_files": op_list_files,
+    "list_folders": op_list_folders,
+    "download": op_download,
+    "share_create": op_share_create,
+    "share_access": op_share_access,
+    "share_download": op_share_download,
+    "delete": op_delete,
+    "mixed": op_mixed,
+}
+
+
+async def prepare(client: httpx.AsyncClient, args, payloads: dict) -> list[VirtualUser]:
+    users = await asyncio.gather(*(register(client) for _ in range(args.users)))
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def seed(user: VirtualUser, i: int):
+        async with semaphore:
+            user.file_ids.append(await upload(client, user, payloads["small"], f"seed-{i}.bin"))
+
+    await asyncio.gather(*(
+        seed(user, i) for user in users for i in range(args.listing_files)
+    ))
+    for user in users:
+        response = await client.post("/storage/folders", json={"name": "bench"}, headers=user.headers)
+        response.raise_for_status()
+        response = await client.post("/shares/", json={"file_id": user.file_ids[0]}, headers=user.headers)
+        response.raise_for_status()
+        user.share_tokens.append(response.json()["share_token"])
+
+    if "delete" in args.scenarios:
+        per_user = args.requests // len(users) + 1
+        await asyncio.gather(*(
+            _seed_disposable(client, user, payloads, semaphore) for user in users for _ in range(per_user)
+        ))
+    return users
+
+
+async def _seed_disposable(client, user, payloads, semaphore):
+    async with semaphore:
+        user.disposable_file_ids.append(await upload(client, user, payloads["small"], "disposable.bin"))
+
+
+async def run_scenario(name, client, server, users, args, payloads) -> dict:
+    op = SCENARIOS[name]
+    rng = random.Random(args.seed)
+    counter = itertools.count()
+    latencies = []
+    errors = 0
+    transferred = 0
+    peak_rss = server.rss()
+    running = True
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while running:
+            peak_rss = max(peak_rss, server.rss())
+            await asyncio.sleep(0.05)
+
+    async def worker(worker_id: int):
+        nonlocal errors, transferred
+        user = users[worker_id % len(users)]
+        while next(counter) < args.requests:
+            started = time.perf_counter()
+            try:
+                transferred += await op(client, user, rng, payloads)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    sampler = asyncio.create_task(sample_rss())
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    running = False
+    await sampler
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "throughput_mib_s": round(transferred / elapsed / KIB / KIB, 2),
+        **latency_summary(latencies),
+        "peak_rss_mib": round(peak_rss / KIB / KIB, 1),
+    }
+
+
+async def run(args) -> dict:
+    env = temp_environment()
+    payloads = {size: os.urandom(n) for size, n in UPLOAD_SIZES.items()}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    with ServerProcess(env, workers=args.workers) as server:
+        print(f"Server ready in {server.ready_seconds:.2f}s at {server.base_url} (data in {env['work_dir']})")
+        async with httpx.AsyncClient(base_url=server.base_url, limits=limits, timeout=args.timeout) as client:
+            users = await prepare(client, args, payloads)
+
+            results = {}
+            for name in args.scenarios:
+                results[name] = await run_scenario(name, client, server, users, args, payloads)
+                r = results[name]
+                print(
+                    f"{name:16s} {r['throughput_rps']:9.1f} req/s  p50 {r['p50_ms']:8.2f} ms  "
+                    f"p95 {r['p95_ms']:8.2f} ms  p99 {r['p99_ms']:8.2f} ms  "
+                    f"rss {r['peak_rss_mib']:7.1f} MiB  errors {r['errors']}"
+                )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HolaBox end-to-end HTTP load test")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=300, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=4, help="virtual users sharing the load")
+    parser.add_argument("--listing-files", type=int, default=100, help="files seeded per user before the run")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="http_load.json")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=10.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    params = {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+    write_results(args.output, "http_load", params, results)
+
+    if args.compare:
+        regressions = compare_results(
+            args.compare, results, {"p95_ms": "lower", "throughput_rps": "higher"}, args.max_regression
+        )
+        if regressions:
+            print("Regressions: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Compare the listing fast path with FastAPI's default response path.
+
+Seeds one user with a large folder, then times, for the same rows:
+
+- ``orm``: ORM objects validated through the response model and encoded by
+  ``JSONResponse``, which is what ``/storage/files`` used to do
+- ``fast``: column projection into plain rows encoded by ``app.common.fast_json``
+
+Both outputs, and the live ``/storage/files`` and ``/storage/folders``
+responses, must be byte-identical or the run fails:
+
+    python benchmarks/listing_serialization.py --files 50000 --output listing.json
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from common import compare_results, latency_summary, use_temp_environment, write_results
+
+use_temp_environment()
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.testclient import TestClient
+from fastapi.utils import create_model_field
+from app.main import app
+from app.auth.jwt_handler import create_access_token
+from app.config.database import SessionLocal, engine, init_db
+from app.common.fast_json import dumps
+from app.common.models import File, Folder
+from app.users.models import User
+from app.schemas.file_schema import FileResponse, FolderResponse
+from app.storage.service import get_user_file_rows, get_user_files, get_user_folder_rows, get_user_folders
+
+NAMES = ["report", "Résumé", "фото", "写真", "emoji-🙂", 'quote"s', "back\\slash", "tab\tname"]
+
+
+def seed(files: int, folders: int) -> int:
+    rng = random.Random(7)
+    base = datetime(2025, 1, 1)
+
+    def timestamp():
+        # Whole seconds are serialized without a fraction, so cover both cases.
+        moment = base + timedelta(seconds=rng.randint(0, 10 ** 7))
+        return moment if rng.random() < 0.2 else moment.replace(microsecond=rng.randint(0, 999999))
+
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [{
+            "id": 1, "email": "listing@example.com", "username": "listing", "hashed_password": "x",
+            "is_active": True, "is_admin": False, "plan_type": "free", "storage_used": 0, "total_uploads": 0,
+        }])
+        connection.execute(Folder.__table__.insert(), [
+            {"name": f"{rng.choice(NAMES)}-{i}", "path": f"/f{i}", "user_id": 1, "is_deleted": False,
+             "created_at": timestamp(), "updated_at": timestamp()}
+            for i in range(folders)
+        ])
+        connection.execute(File.__table__.insert(), [
+            {
+                "filename": f"{i:012x}.bin", "original_filename": f"{rng.choice(NAMES)}-{i}.bin",
+                "file_path": f"/data/1/{i:012x}.bin", "file_size": rng.randint(0, 2 ** 40),
+                "mime_type": rng.choice([None, "application/octet-stream", "image/jpeg"]),
+                "user_id": 1, "is_deleted": False, "view_count": rng.randint(0, 1000),
+                "download_count": rng.randint(0, 1000), "created_at": timestamp(), "updated_at": timestamp(),
+            }
+            for i in range(files)
+        ])
+    return 1
+
+
+def orm_path(fetch, schema):
+    field = create_model_field(name="response", type_=list[schema], mode="serialization")
+
+    def run():
+        db = SessionLocal()
+        try:
+            content = asyncio.run(serialize_response(field=field, response_content=fetch(db)))
+            return JSONResponse(content).body
+        finally:
+            db.close()
+    return run
+
+
+def fast_path(fetch):
+    def run():
+        db = SessionLocal()
+        try:
+            return dumps(fetch(db))
+        finally:
+            db.close()
+    return run
+
+
+def measure(fn, repeat: int) -> tuple[dict, bytes]:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn()
+        latencies.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        **latency_summary(latencies),
+        "peak_alloc_mib": round(peak / 1024 / 1024, 2),
+        "response_bytes": len(body),
+    }, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Listing serialization benchmark")
+    parser.add_argument("--files", type=int, default=50000)
+    parser.add_argument("--folders", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", default="listing_serialization.json")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=15.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    init_db()
+    user_id = seed(args.files, args.folders)
+    listings = {
+        "files": (
+            lambda db: get_user_files(user_id, None, False, db),
+            lambda db: get_user_file_rows(user_id, None, False, db),
+            FileResponse, "/storage/files",
+        ),
+        "folders": (
+            lambda db: get_user_folders(user_id, None, False, db),
+            lambda db: get_user_folder_rows(user_id, None, False, db),
+            FolderResponse, "/storage/folders",
+        ),
+    }
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': str(user_id)})}"}
+
+    results = {}
+    mismatches = []
+    with TestClient(app) as client:
+        for name, (fetch_orm, fetch_rows, schema, url) in listings.items():
+            results[f"{name}/orm"], expected = measure(orm_path(fetch_orm, schema), args.repeat)
+            results[f"{name}/fast"], body = measure(fast_path(fetch_rows), args.repeat)
+            if body != expected:
+                mismatches.append(f"{name} fast path")
+            if client.get(url, headers=headers).content != expected:
+                mismatches.append(f"{name} endpoint")
+
+            orm, fast = results[f"{name}/orm"], results[f"{name}/fast"]
+            print(f"{name:8s} {len(expected) / 1024 / 1024:6.1f} MiB  "
+                  f"orm {orm['mean_ms']:8.1f} ms {orm['peak_alloc_mib']:7.1f} MiB  "
+                  f"fast {fast['mean_ms']:8.1f} ms {fast['peak_alloc_mib']:7.1f} MiB  "
+                  f"speedup {orm['mean_ms'] / fast['mean_ms']:4.1f}x")
+
+    write_results(args.output, "listing_serialization", {k: v for k, v in vars(args).items() if k not in ("output", "compare")}, results)
+
+    if mismatches:
+        print("Output differs from the default response path: " + ", ".join(mismatches))
+        sys.exit(1)
+    if args.compare:
+        regressions = compare_results(args.compare, results, {"mean_ms": "lower"}, args.max_regression)
+        if regressions:
+            print("Regressions: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
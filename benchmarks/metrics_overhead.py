@@ -0,0 +1,128 @@
+"""Measure what request and database metrics cost on the listing routes.
+
+Starts two servers on the same temporary database, one with
+``METRICS_ENABLED=false`` (no ``MetricsMiddleware`` and no cursor or pool
+hooks) and one as deployed. The same users are driven through the listing
+scenarios on both in many short rounds, switching servers after every
+block so that drift in machine load falls on both alike:
+
+    python benchmarks/metrics_overhead.py --concurrency 16 --requests 500 --rounds 20 --output metrics.json
+
+Each block also records the server's CPU time per request. A round's
+overhead is the "on" block against the "off" block run next to it, and
+the median over the rounds is reported. Exits with status 1 if that
+median, in CPU time per request or without /proc in throughput, exceeds
+--max-overhead percent for any scenario. On a machine with fewer cores
+than the client and server need, single rounds scatter by far more than
+2%; add rounds until the median settles.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+
+import httpx
+
+from common import ServerProcess, temp_environment, write_results
+from http_load import UPLOAD_SIZES, prepare, run_scenario
+
+DEFAULT_SCENARIOS = ["list_files", "list_folders"]
+VARIANTS = {"off": {"METRICS_ENABLED": "false"}, "on": {}}
+
+
+async def run_rounds(servers: dict, args, payloads: dict) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    clients = {
+        name: httpx.AsyncClient(base_url=server.base_url, limits=limits, timeout=args.timeout)
+        for name, server in servers.items()
+    }
+    try:
+        users = await prepare(clients["on"], args, payloads)
+        rounds = {name: {scenario: [] for scenario in args.scenarios} for name in servers}
+        for round_number in range(args.rounds):
+            # Swap the order every round so neither server always goes first.
+            order = list(servers) if round_number % 2 == 0 else list(reversed(servers))
+            for scenario in args.scenarios:
+                for name in order:
+                    cpu_before = servers[name].cpu_seconds()
+                    result = await run_scenario(scenario, clients[name], servers[name], users, args, payloads)
+                    if cpu_before is not None and result["requests"]:
+                        cpu = servers[name].cpu_seconds() - cpu_before
+                        result["cpu_ms_per_request"] = round(cpu / result["requests"] * 1000, 4)
+                    rounds[name][scenario].append(result)
+        return rounds
+    finally:
+        for client in clients.values():
+            await client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metrics instrumentation overhead benchmark")
+    parser.add_argument("--scenarios", nargs="+", default=DEFAULT_SCENARIOS)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario, server and round")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--listing-files", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--max-overhead", type=float, default=2.0, help="allowed cost in percent")
+    parser.add_argument("--output", default="metrics_overhead.json")
+    args = parser.parse_args()
+
+    env = temp_environment()
+    payloads = {size: os.urandom(n) for size, n in UPLOAD_SIZES.items()}
+
+    with ServerProcess(env, extra_env=VARIANTS["off"]) as off, ServerProcess(env, extra_env=VARIANTS["on"]) as on:
+        print(f"Servers ready in {off.ready_seconds:.2f}s and {on.ready_seconds:.2f}s (data in {env['work_dir']})")
+        rounds = asyncio.run(run_rounds({"off": off, "on": on}, args, payloads))
+
+    def median(scenario: str, metric: str) -> dict:
+        values = {name: [r.get(metric) for r in rounds[name][scenario]] for name in VARIANTS}
+        if any(None in v for v in values.values()):
+            return {}
+        return {name: statistics.median(v) for name, v in values.items()}
+
+    def paired_pct(scenario: str, metric: str, higher_is_worse: bool) -> float | None:
+        # Each round's on/off pair ran back to back, so machine drift mostly cancels.
+        pairs = list(zip(rounds["off"][scenario], rounds["on"][scenario]))
+        if any(off.get(metric) is None or on.get(metric) is None for off, on in pairs):
+            return None
+        changes = [(on[metric] - off[metric]) / off[metric] * 100 for off, on in pairs]
+        return round(statistics.median(changes) * (1 if higher_is_worse else -1), 2)
+
+    results = {"rounds": rounds, "median": {}, "overhead_pct": {}}
+    for scenario in args.scenarios:
+        throughput = median(scenario, "throughput_rps")
+        p95 = median(scenario, "p95_ms")
+        cpu = median(scenario, "cpu_ms_per_request")
+        overhead = {"throughput": paired_pct(scenario, "throughput_rps", higher_is_worse=False)}
+        if cpu:
+            overhead["cpu_per_request"] = paired_pct(scenario, "cpu_ms_per_request", higher_is_worse=True)
+        results["median"][scenario] = {"throughput_rps": throughput, "p95_ms": p95, "cpu_ms_per_request": cpu}
+        results["overhead_pct"][scenario] = overhead
+
+        line = (f"{scenario:14s} off {throughput['off']:7.1f} req/s p95 {p95['off']:7.2f} ms  |  "
+                f"on {throughput['on']:7.1f} req/s p95 {p95['on']:7.2f} ms  |  "
+                f"throughput {overhead['throughput']:+.2f}%")
+        if cpu:
+            line += (f"  |  cpu/request {cpu['off']:.3f} -> {cpu['on']:.3f} ms "
+                     f"({overhead['cpu_per_request']:+.2f}%)")
+        print(line)
+
+    params = {k: v for k, v in vars(args).items() if k != "output"}
+    write_results(args.output, "metrics_overhead", params, results)
+
+    problems = []
+    for scenario, overhead in results["overhead_pct"].items():
+        measure = "cpu_per_request" if "cpu_per_request" in overhead else "throughput"
+        if overhead[measure] > args.max_overhead:
+            problems.append(f"{scenario}: metrics cost {overhead[measure]:.2f}% in {measure.replace('_', ' ')}")
+    if problems:
+        print("\n".join(problems))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
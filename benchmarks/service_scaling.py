@@ -0,0 +1,129 @@
+"""Time the storage and sharing service functions as the dataset grows.
+
+For each size a fresh SQLite database is filled by
+``scripts/generate_dataset.py`` and every function of
+``app/storage/service.py`` and ``app/sharing/service.py`` is timed for the
+heaviest user and for a median user:
+
+    python benchmarks/service_scaling.py --sizes 10k 1M 10M --output scaling.json
+
+Loading 10M rows takes several minutes and a few GB of disk.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from common import PROJECT_ROOT, compare_results, latency_summary, temp_environment, use_temp_environment, write_results
+
+use_temp_environment()
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "scripts"))
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+from generate_dataset import generate
+from app.config.database import Base
+from app.common.models import File
+from app.users.models import User
+from app.sharing.models import Share
+from app.storage.service import create_folder, get_user_files, get_user_folders, soft_delete_file, restore_file
+from app.sharing.service import create_share_link, verify_share_access
+
+
+def parse_size(value: str) -> int:
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    suffix = value[-1].lower()
+    return int(float(value[:-1]) * multipliers[suffix]) if suffix in multipliers else int(value)
+
+
+def timed(fn, repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def pick_users(db) -> dict:
+    counts = db.query(File.user_id, func.count(File.id).label("n")).group_by(File.user_id).order_by(func.count(File.id)).all()
+    return {"heavy": counts[-1].user_id, "median": counts[len(counts) // 2].user_id}
+
+
+def bench_user(db, user_id: int, repeat: int) -> dict:
+    user = db.query(User).filter(User.id == user_id).first()
+    busiest = db.query(File.folder_id).filter(
+        File.user_id == user_id, File.folder_id.isnot(None)
+    ).group_by(File.folder_id).order_by(func.count(File.id).desc()).first()
+    folder_id = busiest.folder_id if busiest else None
+    file_id = db.query(File.id).filter(File.user_id == user_id, File.is_deleted == False).first().id
+    share = db.query(Share).filter(Share.user_id == user_id).first() or create_share_link(file_id, user_id, None, None, db)
+    counter = iter(range(10 ** 9))
+
+    def delete_and_restore():
+        soft_delete_file(file_id, user, db)
+        restore_file(file_id, user, db)
+
+    cases = {
+        "get_user_files(root)": lambda: get_user_files(user_id, None, False, db),
+        "get_user_files(folder)": lambda: get_user_files(user_id, folder_id, False, db),
+        "get_user_folders(root)": lambda: get_user_folders(user_id, None, False, db),
+        "get_user_folders(folder)": lambda: get_user_folders(user_id, folder_id, False, db),
+        "create_folder": lambda: create_folder(f"bench-{next(counter)}", folder_id, user, db),
+        "soft_delete+restore_file": delete_and_restore,
+        "create_share_link": lambda: create_share_link(file_id, user_id, None, None, db),
+        "verify_share_access": lambda: verify_share_access(share.share_token, None, db),
+    }
+
+    results = {}
+    for name, fn in cases.items():
+        samples = timed(fn, repeat)
+        db.expunge_all()
+        user = db.query(User).filter(User.id == user_id).first()
+        results[name] = {"mean_ms": round(statistics.mean(samples) * 1000, 3), **latency_summary(samples)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Service function scaling benchmark")
+    parser.add_argument("--sizes", nargs="+", default=["10k", "1M", "10M"], help="file rows per dataset")
+    parser.add_argument("--files-per-user", type=int, default=1000, help="average, the distribution is skewed")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", default="service_scaling.json")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    results = {}
+    for size_arg in args.sizes:
+        size = parse_size(size_arg)
+        env = temp_environment()
+        engine = create_engine(env["DATABASE_URL"], connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+
+        print(f"== {size_arg}: generating {size:,} files in {env['work_dir']}")
+        summary = generate(engine, max(10, size // args.files_per_user), size, storage_path=env["STORAGE_PATH"])
+        print(f"   loaded in {summary['seconds']}s")
+
+        db = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)()
+        try:
+            for kind, user_id in pick_users(db).items():
+                for name, r in bench_user(db, user_id, args.repeat).items():
+                    results[f"{size_arg}/{kind}/{name}"] = r
+                    print(f"   {kind:6s} {name:26s} mean {r['mean_ms']:9.3f} ms  p95 {r['p95_ms']:9.3f} ms")
+        finally:
+            db.close()
+            engine.dispose()
+
+    write_results(args.output, "service_scaling", vars(args), results)
+
+    if args.compare:
+        regressions = compare_results(args.compare, results, {"mean_ms": "lower"}, args.max_regression)
+        if regressions:
+            print("Regressions: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
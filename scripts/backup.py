@@ -0,0 +1,633 @@
+"""Consistent, incremental backups of the database and the blobs.
+
+    python scripts/backup.py snapshot
+    python scripts/backup.py verify --checksums
+    python scripts/backup.py restore --snapshot 20261019T020000Z --database-url sqlite:///./restored.db --storage-path ./restored
+    python scripts/backup.py list
+
+Everything lives under --backup-path (``BACKUP_PATH``):
+
+    blobs/<user_id>/<filename>       blob store shared by all snapshots
+    snapshots/<name>/snapshot.json   watermarks, counts and the source STORAGE_PATH
+    snapshots/<name>/database.*      the database as of the snapshot
+    snapshots/<name>/manifest.ndjson.gz
+                                     one line per file row in that database
+
+With ``SHARD_DATABASE_URLS`` set, ``snapshot`` takes one of every shard
+under the same name, shard N's in ``snapshots-shardN/``; each manifest
+lists the blobs of the users on its shard. ``verify`` and ``restore``
+take --shard, shard 0 by default, and ``list`` shows every shard.
+
+``snapshot`` copies the database while the server keeps running: SQLite with
+its online backup API, PostgreSQL with ``pg_dump`` on an exported snapshot.
+The manifest is read from that same copy (or snapshot), so it lists exactly
+the blobs the database refers to. Blobs are never rewritten once stored, so
+only rows past the previous snapshot's watermarks, a higher ``File.id`` or a
+``created_at`` within ``BACKUP_OVERLAP_MINUTES`` of the last one, are
+copied. The overlap catches rows whose transaction committed after a lower id
+had already been backed up. Copies run on --workers threads that together
+read at most --rate-mb-s, and are checked against ``File.checksum`` as they
+are written. A snapshot is built under ``<name>.partial`` and renamed when it
+is complete; rerunning after an interruption reuses the blobs it stored.
+
+``verify`` checks a snapshot's database and that every blob in its
+manifest is in the store with the recorded size, and with --checksums also
+the recorded SHA-256. ``restore`` writes the database to --database-url and
+the blobs to --storage-path, and points the restored rows at that path.
+
+Blobs of rows purged after a snapshot stay in the store; nothing is pruned.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.engine import make_url
+from app.config.database import head_revision, shard_engines
+from app.config.settings import settings
+from app.common.models import File
+from app.common.storage_engine import COPY_CHUNK_SIZE, storage_engine
+from app.common.throttle import TokenBucket
+# Relationships between the models resolve only once every model is imported.
+from app.users.models import User
+from app.sharing.models import Share
+from app.premium.models import Subscription
+from app.jobs.models import Job
+
+MB = 1024 * 1024
+MANIFEST = "manifest.ndjson.gz"
+SQLITE_FILE = "database.sqlite3"
+PG_DUMP_FILE = "database.pgdump"
+# Pages copied per step of the SQLite backup; the database is unlocked in between.
+SQLITE_STEP_PAGES = 4096
+# A write during the backup restarts it. After this many restarts the rest
+# is copied in one step, holding the read lock until it is done.
+SQLITE_MAX_RESTARTS = 3
+PROBLEM_LIMIT = 20
+
+SHARD_URLS = [settings.DATABASE_URL, *settings.SHARD_DATABASE_URLS]
+
+_manifest_columns = select(
+    File.id, File.user_id, File.file_path, File.file_size, File.checksum, File.created_at
+).order_by(File.id)
+
+
+class BackupError(Exception):
+    pass
+
+
+class SqliteRestarted(Exception):
+    pass
+
+
+def database_kind(url: str) -> str:
+    backend = make_url(url).get_backend_name()
+    if backend not in ("sqlite", "postgresql"):
+        raise BackupError(f"Backups of {backend} databases are not supported")
+    return backend
+
+
+def libpq_url(url: str) -> str:
+    # pg_dump and pg_restore do not understand SQLAlchemy driver names.
+    return make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+def relative_blob(path: str, storage_prefix: str) -> str | None:
+    return path[len(storage_prefix):] if path.startswith(storage_prefix) else None
+
+
+def snapshots_dir(backup_path: str, shard: int = 0) -> str:
+    return os.path.join(backup_path, f"snapshots-shard{shard}" if shard else "snapshots")
+
+
+def complete_snapshots(backup_path: str, shard: int = 0) -> list[str]:
+    directory = snapshots_dir(backup_path, shard)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        name for name in os.listdir(directory)
+        if not name.endswith(".partial") and os.path.exists(os.path.join(directory, name, "snapshot.json"))
+    )
+
+
+def load_snapshot(backup_path: str, name: str | None, shard: int = 0) -> tuple[str, dict]:
+    names = complete_snapshots(backup_path, shard)
+    where = f"{backup_path} for shard {shard}" if shard else backup_path
+    if not names:
+        raise BackupError(f"No snapshots in {where}")
+    name = name or names[-1]
+    if name not in names:
+        raise BackupError(f"No snapshot {name} in {where}")
+    directory = os.path.join(snapshots_dir(backup_path, shard), name)
+    with open(os.path.join(directory, "snapshot.json")) as f:
+        return directory, json.load(f)
+
+
+def read_manifest(directory: str):
+    with gzip.open(os.path.join(directory, MANIFEST), "rt") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def copy_blob(source: str, dest: str, size: int, checksum: str | None, throttle: TokenBucket,
+              reuse: bool = True) -> tuple[str, int]:
+    """Copy one blob, paying ``throttle`` for every chunk; returns the outcome and bytes read."""
+    if reuse:
+        try:
+            if os.path.getsize(dest) == size:
+                return "reused", 0
+        except FileNotFoundError:
+            pass
+
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = f"{dest}.tmp-{os.getpid()}"
+    hasher = hashlib.sha256()
+    copied = 0
+    try:
+        with open(source, "rb") as src, open(tmp, "wb") as dst:
+            while chunk := src.read(COPY_CHUNK_SIZE):
+                throttle.consume(len(chunk))
+                hasher.update(chunk)
+                dst.write(chunk)
+                copied += len(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+    except FileNotFoundError as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        if e.filename == source:
+            return "missing", 0
+        raise
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, dest)
+    if copied != size or (checksum and hasher.hexdigest() != checksum):
+        # Kept anyway: the damaged blob is still the best copy there is.
+        return "mismatch", copied
+    return "copied", copied
+
+
+def check_blob(path: str, size: int, checksum: str | None, throttle: TokenBucket | None) -> tuple[str, int]:
+    try:
+        if throttle is None or not checksum:
+            return ("ok" if os.path.getsize(path) == size else "wrong_size"), 0
+        actual_size, actual = storage_engine.hash_file(path, throttle)
+    except FileNotFoundError:
+        return "missing", 0
+    if actual_size != size:
+        return "wrong_size", actual_size
+    return ("ok" if actual == checksum else "wrong_checksum"), actual_size
+
+
+def run_parallel(pool: ThreadPoolExecutor, workers: int, tasks, on_result):
+    """Run ``(item, fn, args)`` tasks with a bounded number in flight, in order."""
+    in_flight = deque()
+    for item, fn, args in tasks:
+        in_flight.append((item, pool.submit(fn, *args)))
+        if len(in_flight) >= workers * 4:
+            done_item, future = in_flight.popleft()
+            on_result(done_item, future.result())
+    while in_flight:
+        done_item, future = in_flight.popleft()
+        on_result(done_item, future.result())
+
+
+class Progress:
+    def __init__(self, label: str):
+        self.label = label
+        self.started = time.perf_counter()
+        self.last_report = self.started
+        self.rows = 0
+        self.bytes = 0
+
+    def add(self, size: int):
+        self.rows += 1
+        self.bytes += size
+        now = time.perf_counter()
+        if now - self.last_report >= 5:
+            self.last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        print(
+            f"  {self.label}: {self.rows:,} rows, {self.bytes / MB:,.1f} MiB read "
+            f"({self.rows / elapsed:,.0f} rows/s, {self.bytes / MB / elapsed:,.1f} MiB/s)",
+            file=sys.stderr
+        )
+
+
+# Snapshot
+
+def backup_sqlite(url: str, dest: str):
+    source = sqlite3.connect(make_url(url).database)
+    target = sqlite3.connect(dest)
+    restarts = 0
+    remaining_before = None
+
+    def progress(status, remaining, total):
+        nonlocal remaining_before, restarts
+        if remaining_before is not None and remaining > remaining_before:
+            restarts += 1
+            if restarts > SQLITE_MAX_RESTARTS:
+                raise SqliteRestarted()
+        remaining_before = remaining
+
+    try:
+        try:
+            source.backup(target, pages=SQLITE_STEP_PAGES, progress=progress)
+        except SqliteRestarted:
+            print("  database kept changing; copying it in one step", file=sys.stderr)
+            source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def manifest_rows(connection):
+    yield from connection.execution_options(stream_results=True).execute(_manifest_columns)
+
+
+def write_snapshot(args, directory: str, previous: dict | None, shard: int = 0) -> dict:
+    url = SHARD_URLS[shard]
+    kind = database_kind(url)
+    storage_prefix = os.path.join(settings.STORAGE_PATH, "")
+    store = os.path.join(args.backup_path, "blobs")
+    throttle = TokenBucket(args.rate_mb_s * MB)
+    overlap = timedelta(minutes=args.overlap_minutes)
+    watermark_id = previous["watermark"]["file_id"] if previous else None
+    watermark_at = (
+        datetime.fromisoformat(previous["watermark"]["created_at"]) - overlap
+        if previous and previous["watermark"]["created_at"] else None
+    )
+    counts = Counter()
+    summary = {"files": 0, "bytes": 0, "copied_bytes": 0}
+    high_id = watermark_id
+    high_at = datetime.fromisoformat(previous["watermark"]["created_at"]) if watermark_at else None
+    problems = []
+    progress = Progress("blobs")
+
+    def is_new(row) -> bool:
+        return (
+            watermark_id is None
+            or row.id > watermark_id
+            or (watermark_at is not None and row.created_at is not None and row.created_at >= watermark_at)
+        )
+
+    def on_copied(row, result):
+        outcome, copied = result
+        counts[outcome] += 1
+        summary["copied_bytes"] += copied
+        progress.add(copied)
+        if outcome in ("missing", "mismatch") and len(problems) < PROBLEM_LIMIT:
+            problems.append({"file_id": row.id, "path": row.file_path, "problem": outcome})
+
+    def snapshot_from(connection):
+        revision = connection.exec_driver_sql("SELECT version_num FROM alembic_version").scalar()
+        manifest = gzip.open(os.path.join(directory, MANIFEST), "wt", compresslevel=6)
+
+        def tasks():
+            nonlocal high_id, high_at
+            for row in manifest_rows(connection):
+                relative = relative_blob(row.file_path, storage_prefix)
+                if relative is None:
+                    counts["outside_storage"] += 1
+                    continue
+                manifest.write(json.dumps({
+                    "id": row.id, "user_id": row.user_id, "path": relative,
+                    "size": row.file_size, "checksum": row.checksum,
+                }) + "\n")
+                summary["files"] += 1
+                summary["bytes"] += row.file_size
+                high_id = max(high_id or 0, row.id)
+                if row.created_at is not None:
+                    high_at = max(high_at or row.created_at, row.created_at)
+                if is_new(row):
+                    yield row, copy_blob, (
+                        row.file_path, os.path.join(store, relative), row.file_size, row.checksum, throttle
+                    )
+
+        try:
+            with ThreadPoolExecutor(max_workers=args.workers) as pool:
+                run_parallel(pool, args.workers, tasks(), on_copied)
+        finally:
+            manifest.close()
+        return revision
+
+    started = time.perf_counter()
+    if kind == "sqlite":
+        database_file = SQLITE_FILE
+        backup_sqlite(url, os.path.join(directory, database_file))
+        print(f"  database copied in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        copy_engine = create_engine(f"sqlite:///{os.path.join(directory, database_file)}")
+        try:
+            with copy_engine.connect() as connection:
+                revision = snapshot_from(connection)
+        finally:
+            copy_engine.dispose()
+    else:
+        database_file = PG_DUMP_FILE
+        with shard_engines[shard].connect() as connection:
+            connection = connection.execution_options(isolation_level="REPEATABLE READ")
+            with connection.begin():
+                # pg_dump reads the same snapshot as the manifest query.
+                exported = connection.exec_driver_sql("SELECT pg_export_snapshot()").scalar()
+                dump = subprocess.Popen([
+                    "pg_dump", "--format=custom", f"--snapshot={exported}",
+                    "--file", os.path.join(directory, database_file), "--dbname", libpq_url(url),
+                ])
+                try:
+                    revision = snapshot_from(connection)
+                finally:
+                    if dump.wait() != 0:
+                        raise BackupError(f"pg_dump exited with status {dump.returncode}")
+    progress.report()
+
+    if counts["outside_storage"]:
+        print(f"  {counts['outside_storage']:,} file rows are not under {settings.STORAGE_PATH}; "
+              f"their blobs are not backed up", file=sys.stderr)
+    for problem in problems:
+        print(f"  {problem['problem']}: file {problem['file_id']} at {problem['path']}", file=sys.stderr)
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "shard": shard,
+        "database": kind,
+        "database_file": database_file,
+        "alembic_revision": revision,
+        "storage_path": settings.STORAGE_PATH,
+        "previous": previous["name"] if previous else None,
+        "watermark": {"file_id": high_id, "created_at": high_at.isoformat() if high_at else None},
+        **summary,
+        "blobs": dict(counts),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def snapshot_shard(args, name: str, shard: int) -> int:
+    previous = None
+    names = complete_snapshots(args.backup_path, shard)
+    if names and not args.full:
+        previous = load_snapshot(args.backup_path, names[-1], shard)[1]
+
+    label = f"Snapshot {name} of shard {shard}" if len(SHARD_URLS) > 1 else f"Snapshot {name}"
+    final = os.path.join(snapshots_dir(args.backup_path, shard), name)
+    directory = final + ".partial"
+    if os.path.exists(final) or os.path.exists(directory):
+        raise BackupError(f"{label} already exists")
+    os.makedirs(directory)
+    print(label + (f", incremental after {previous['name']}" if previous else ", full"), file=sys.stderr)
+
+    info = {"name": name, **write_snapshot(args, directory, previous, shard)}
+    with open(os.path.join(directory, "snapshot.json"), "w") as f:
+        json.dump(info, f, indent=2)
+    os.rename(directory, final)
+
+    blobs = info["blobs"]
+    print(
+        f"{label}: {info['files']:,} files ({info['bytes'] / MB:,.1f} MiB); "
+        f"copied {blobs.get('copied', 0) + blobs.get('mismatch', 0):,} blobs "
+        f"({info['copied_bytes'] / MB:,.1f} MiB), reused {blobs.get('reused', 0):,}, "
+        f"missing {blobs.get('missing', 0):,}, checksum mismatches {blobs.get('mismatch', 0):,} "
+        f"in {info['seconds']:.1f}s",
+        file=sys.stderr
+    )
+    return 1 if blobs.get("missing") or blobs.get("mismatch") else 0
+
+
+def snapshot(args):
+    # Every shard's snapshot has the same name; the blobs of a user moved
+    # between them are stored once.
+    name = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return max(snapshot_shard(args, name, shard) for shard in range(len(SHARD_URLS)))
+
+
+# Verify
+
+def verify_database(directory: str, info: dict) -> list[str]:
+    path = os.path.join(directory, info["database_file"])
+    if not os.path.exists(path):
+        return [f"{info['database_file']} is missing"]
+    if info["database"] == "postgresql":
+        listed = subprocess.run(["pg_restore", "--list", path], capture_output=True, text=True)
+        return [] if listed.returncode == 0 else [f"pg_restore cannot read the dump: {listed.stderr.strip()}"]
+
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = connection.execute("PRAGMA integrity_check").fetchall()
+        problems = [] if result == [("ok",)] else [f"integrity_check: {row[0]}" for row in result[:PROBLEM_LIMIT]]
+        count = connection.execute("SELECT count(*) FROM files").fetchone()[0]
+    finally:
+        connection.close()
+    expected = info["files"] + info["blobs"].get("outside_storage", 0)
+    if count != expected:
+        problems.append(f"the database has {count:,} file rows, the manifest accounts for {expected:,}")
+    return problems
+
+
+def verify(args):
+    directory, info = load_snapshot(args.backup_path, args.snapshot, args.shard)
+    store = os.path.join(args.backup_path, "blobs")
+    throttle = TokenBucket(args.rate_mb_s * MB) if args.checksums else None
+    problems = verify_database(directory, info)
+    for problem in problems:
+        print(problem)
+
+    counts = Counter()
+    progress = Progress("verify")
+
+    def on_checked(row, result):
+        outcome, size = result
+        counts[outcome] += 1
+        progress.add(size)
+        if outcome != "ok":
+            print(json.dumps({"file_id": row["id"], "path": row["path"], "problem": outcome}))
+
+    tasks = (
+        (row, check_blob, (os.path.join(store, row["path"]), row["size"], row["checksum"], throttle))
+        for row in read_manifest(directory)
+    )
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        run_parallel(pool, args.workers, tasks, on_checked)
+
+    bad = sum(n for outcome, n in counts.items() if outcome != "ok")
+    print(
+        f"Snapshot {info['name']}: {counts['ok']:,} of {info['files']:,} blobs ok, {bad:,} bad, "
+        f"{len(problems)} database problems" + (" (checksums verified)" if args.checksums else ""),
+        file=sys.stderr
+    )
+    return 1 if bad or problems else 0
+
+
+# Restore
+
+def restore_database(directory: str, info: dict, url: str, force: bool):
+    kind = database_kind(url)
+    if kind != info["database"]:
+        raise BackupError(f"Snapshot {info['name']} holds a {info['database']} database, not {kind}")
+    source = os.path.join(directory, info["database_file"])
+
+    if kind == "sqlite":
+        path = make_url(url).database
+        if os.path.exists(path):
+            if not force:
+                raise BackupError(f"{path} exists; pass --force to overwrite it")
+            os.remove(path)
+        shutil.copyfile(source, path)
+        return
+
+    target = create_engine(url)
+    try:
+        with target.connect() as connection:
+            populated = target.dialect.has_table(connection, "alembic_version")
+    finally:
+        target.dispose()
+    if populated and not force:
+        raise BackupError("The target database has a schema; pass --force to replace it")
+    subprocess.run([
+        "pg_restore", "--clean", "--if-exists", "--no-owner", "--exit-on-error",
+        "--dbname", libpq_url(url), source,
+    ], check=True)
+
+
+def repoint_files(url: str, old_prefix: str, new_prefix: str):
+    if old_prefix == new_prefix:
+        return 0
+    target = create_engine(url)
+    try:
+        with target.begin() as connection:
+            return connection.execute(
+                File.__table__.update().where(
+                    File.__table__.c.file_path.startswith(old_prefix, autoescape=True)
+                ).values(file_path=new_prefix + func.substr(File.__table__.c.file_path, len(old_prefix) + 1))
+            ).rowcount
+    finally:
+        target.dispose()
+
+
+def restore(args):
+    directory, info = load_snapshot(args.backup_path, args.snapshot, args.shard)
+    args.database_url = args.database_url or SHARD_URLS[args.shard]
+    store = os.path.join(args.backup_path, "blobs")
+    storage_path = args.storage_path
+    if os.path.isdir(storage_path) and os.listdir(storage_path) and not args.force:
+        raise BackupError(f"{storage_path} is not empty; pass --force to restore into it")
+
+    print(f"Restoring snapshot {info['name']} to {args.database_url} and {storage_path}", file=sys.stderr)
+    restore_database(directory, info, args.database_url, args.force)
+    repointed = repoint_files(args.database_url, os.path.join(info["storage_path"], ""), os.path.join(storage_path, ""))
+    if repointed:
+        print(f"  {repointed:,} file rows now point into {storage_path}", file=sys.stderr)
+
+    throttle = TokenBucket(args.rate_mb_s * MB)
+    counts = Counter()
+    progress = Progress("restore")
+
+    def on_copied(row, result):
+        outcome, copied = result
+        counts[outcome] += 1
+        progress.add(copied)
+        if outcome != "copied":
+            print(json.dumps({"file_id": row["id"], "path": row["path"], "problem": outcome}))
+
+    tasks = (
+        (row, copy_blob, (
+            os.path.join(store, row["path"]), os.path.join(storage_path, row["path"]),
+            row["size"], row["checksum"], throttle, False
+        ))
+        for row in read_manifest(directory)
+    )
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        run_parallel(pool, args.workers, tasks, on_copied)
+    progress.report()
+
+    if info["alembic_revision"] != head_revision():
+        print(f"  the snapshot is at schema revision {info['alembic_revision']}; "
+              f"run `alembic -x shard={args.shard} upgrade head`", file=sys.stderr)
+    bad = sum(n for outcome, n in counts.items() if outcome != "copied")
+    print(f"Restored {counts['copied']:,} of {info['files']:,} blobs, {bad:,} missing or damaged", file=sys.stderr)
+    return 1 if bad else 0
+
+
+def list_snapshots(args):
+    shards = range(len(SHARD_URLS)) if args.shard is None else [args.shard]
+    for shard in shards:
+        for name in complete_snapshots(args.backup_path, shard):
+            info = load_snapshot(args.backup_path, name, shard)[1]
+            print(
+                (f"shard {shard}  " if len(SHARD_URLS) > 1 else "") + f"{name}  {info['database']:10s} {info['files']:>10,} files {info['bytes'] / MB:>12,.1f} MiB  "
+                f"copied {info['copied_bytes'] / MB:>10,.1f} MiB  "
+                + (f"after {info['previous']}" if info["previous"] else "full")
+            )
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up and restore the HolaBox database and blobs")
+    parser.add_argument("--backup-path", default=settings.BACKUP_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def shard_option(command, default=0):
+        command.add_argument("--shard", type=int, default=default, choices=range(len(SHARD_URLS)),
+                             metavar="N", help="shard whose snapshots to use")
+
+    def transfer_options(command):
+        command.add_argument("--workers", type=int, default=settings.BACKUP_WORKERS, help="parallel copies")
+        command.add_argument("--rate-mb-s", type=float, default=settings.BACKUP_RATE_MB_S,
+                             help="total read rate, 0 for unlimited")
+
+    command = commands.add_parser("snapshot", help="take a snapshot, copying blobs added since the last one")
+    transfer_options(command)
+    command.add_argument("--full", action="store_true", help="check every blob instead of only the new rows")
+    command.add_argument("--overlap-minutes", type=float, default=settings.BACKUP_OVERLAP_MINUTES)
+    command.set_defaults(handler=snapshot)
+
+    command = commands.add_parser("verify", help="check a snapshot against the blob store")
+    transfer_options(command)
+    command.add_argument("--snapshot", help="snapshot name; the latest by default")
+    command.add_argument("--checksums", action="store_true", help="also read every blob and compare its SHA-256")
+    shard_option(command)
+    command.set_defaults(handler=verify)
+
+    command = commands.add_parser("restore", help="restore a snapshot's database and blobs")
+    transfer_options(command)
+    command.add_argument("--snapshot", help="snapshot name; the latest by default")
+    command.add_argument("--database-url", help="the shard's database by default")
+    command.add_argument("--storage-path", default=settings.STORAGE_PATH)
+    command.add_argument("--force", action="store_true", help="overwrite an existing database or storage directory")
+    shard_option(command)
+    command.set_defaults(handler=restore)
+
+    command = commands.add_parser("list", help="list the complete snapshots")
+    shard_option(command, default=None)
+    command.set_defaults(handler=list_snapshots)
+
+    args = parser.parse_args()
+    try:
+        status = args.handler(args)
+    except BackupError as e:
+        sys.exit(str(e))
+    except KeyboardInterrupt:
+        print("\nInterrupted", file=sys.stderr)
+        sys.exit(130)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
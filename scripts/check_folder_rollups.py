@@ -0,0 +1,297 @@
+"""Check that folder rollups stay consistent under concurrent mutations.
+
+A temporary database is seeded with a folder tree, then several threads
+upload (singly and in batches), copy, trash, restore, move and purge files
+and folders of the same user through the API at the same time. Afterwards every folder's stored
+``total_bytes`` and ``item_count`` are compared with a recount. Then some
+rollups are corrupted on purpose and the ``folder_rollups_repair`` job must
+put them right. Finally a file is added below a folder whose parent is
+being moved, with the move committing while the addition waits for its
+locks. The script exits with status 1 on any mismatch:
+
+    python scripts/check_folder_rollups.py --threads 8 --operations 2000
+
+SQLite runs one writer at a time, so races between writers only show on
+PostgreSQL. ``--database-url`` points the check at an empty database there:
+
+    python scripts/check_folder_rollups.py --database-url postgresql://localhost/holabox_check
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# Read before the app is imported, which takes DATABASE_URL from the environment.
+DATABASE_URL_ARGUMENT = argparse.ArgumentParser(add_help=False)
+DATABASE_URL_ARGUMENT.add_argument("--database-url", help="empty database to run against; default a temporary SQLite file")
+
+WORK_DIR = tempfile.mkdtemp(prefix="holabox-rollups-")
+os.environ["DATABASE_URL"] = (
+    DATABASE_URL_ARGUMENT.parse_known_args()[0].database_url or f"sqlite:///{os.path.join(WORK_DIR, 'holabox.db')}"
+)
+os.environ["STORAGE_PATH"] = os.path.join(WORK_DIR, "storage")
+os.environ.setdefault("JOB_POLL_INTERVAL_SECONDS", "0.2")
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.config.database import SessionLocal, engine
+from app.common.models import File, Folder
+from app.storage.rollups import compute_user_rollups, folder_contribution, propagate_rollups
+from app.users.models import User
+
+
+def register(client: TestClient, name: str) -> dict:
+    response = client.post(
+        "/auth/register",
+        json={"email": f"{name}@example.com", "username": name, "password": "rollup-pass"}
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def pick(model, user_id: int, deleted: bool):
+    db = SessionLocal()
+    try:
+        ids = [row.id for row in db.query(model.id).filter(model.user_id == user_id, model.is_deleted == deleted)]
+    finally:
+        db.close()
+    return ids
+
+
+def mutate(client: TestClient, headers: dict, user_id: int, rng: random.Random) -> int:
+    live_folders = pick(Folder, user_id, False)
+    folder = rng.choice(live_folders + [None])
+    op = rng.choice([
+        "upload", "upload", "upload", "upload_batch", "folder", "delete_file", "restore_file", "move_file", "purge_file",
+        "copy_file", "move_folder", "delete_folder", "restore_folder", "purge_folder", "copy_folder",
+    ])
+
+    if op == "upload":
+        url = "/storage/upload" + (f"?folder_id={folder}" if folder else "")
+        payload = os.urandom(rng.randint(1, 2048))
+        return client.post(url, files={"file": ("f.bin", payload)}, headers=headers).status_code
+    if op == "upload_batch":
+        payloads = [os.urandom(rng.randint(0, 2048)) for _ in range(rng.randint(1, 5))]
+        url = f"/storage/upload/batch?total_size={sum(map(len, payloads))}" + (f"&folder_id={folder}" if folder else "")
+        files = [("files", (f"b{i}.bin", payload)) for i, payload in enumerate(payloads)]
+        return client.post(url, files=files, headers=headers).status_code
+    if op == "folder":
+        body = {"name": f"f{rng.randint(0, 10 ** 6)}", "parent_id": folder}
+        return client.post("/storage/folders", json=body, headers=headers).status_code
+
+    if op in ("delete_file", "move_file", "copy_file"):
+        files = pick(File, user_id, False)
+        if not files:
+            return 0
+        if op == "delete_file":
+            return client.delete(f"/storage/files/{rng.choice(files)}", headers=headers).status_code
+        if op == "copy_file":
+            body = {"target_folder_id": folder}
+            return client.post(f"/storage/files/{rng.choice(files)}/copy", json=body, headers=headers).status_code
+        body = {"file_id": rng.choice(files), "target_folder_id": folder}
+        return client.post("/storage/files/move", json=body, headers=headers).status_code
+    if op in ("restore_file", "purge_file"):
+        files = pick(File, user_id, True)
+        if not files:
+            return 0
+        if op == "restore_file":
+            return client.post(f"/storage/files/{rng.choice(files)}/restore", headers=headers).status_code
+        return client.delete(f"/storage/files/{rng.choice(files)}/purge", headers=headers).status_code
+
+    if op in ("move_folder", "delete_folder", "copy_folder"):
+        if not live_folders:
+            return 0
+        source = rng.choice(live_folders)
+        if op == "delete_folder":
+            return client.delete(f"/storage/folders/{source}", headers=headers).status_code
+        if op == "copy_folder":
+            body = {"target_parent_id": folder}
+            return client.post(f"/storage/folders/{source}/copy", json=body, headers=headers).status_code
+        body = {"target_parent_id": folder}
+        return client.put(f"/storage/folders/{source}/move", json=body, headers=headers).status_code
+
+    trashed = pick(Folder, user_id, True)
+    if not trashed:
+        return 0
+    if op == "restore_folder":
+        return client.post(f"/storage/folders/{rng.choice(trashed)}/restore", headers=headers).status_code
+    return client.delete(f"/storage/folders/{rng.choice(trashed)}/purge", headers=headers).status_code
+
+
+def mismatches(user_ids: list[int]) -> list[str]:
+    db = SessionLocal()
+    try:
+        found = []
+        for user_id in user_ids:
+            stored = {
+                row.id: (row.total_bytes, row.item_count)
+                for row in db.query(Folder.id, Folder.total_bytes, Folder.item_count).filter(Folder.user_id == user_id)
+            }
+            for folder_id, expected in compute_user_rollups(db, user_id).items():
+                if stored[folder_id] != expected:
+                    found.append(f"folder {folder_id}: stored {stored[folder_id]}, expected {expected}")
+        return found
+    finally:
+        db.close()
+
+
+def add_during_move(user_id: int) -> list[str]:
+    """Add a file two levels below a folder while that folder is moved.
+
+    The move takes its locks first and commits only once the addition is
+    waiting for them, so the addition's ancestor chain changes under it.
+    """
+    db = SessionLocal()
+    try:
+        old_parent = Folder(name="old", path="/old", user_id=user_id)
+        new_parent = Folder(name="new", path="/new", user_id=user_id)
+        db.add_all([old_parent, new_parent])
+        db.flush()
+        moved = Folder(name="moved", path="/old/moved", parent_id=old_parent.id, user_id=user_id)
+        db.add(moved)
+        db.flush()
+        inner = Folder(name="inner", path="/old/moved/inner", parent_id=moved.id, user_id=user_id)
+        db.add(inner)
+        db.flush()
+        propagate_rollups(db, moved.id, 0, 1)
+        propagate_rollups(db, old_parent.id, 0, 1)
+        db.commit()
+        ids = (old_parent.id, new_parent.id, moved.id, inner.id)
+    finally:
+        db.close()
+    old_parent_id, new_parent_id, moved_id, inner_id = ids
+
+    def add_file():
+        db = SessionLocal()
+        try:
+            db.add(File(filename="race.bin", original_filename="race.bin", file_path="/nonexistent/race.bin",
+                        file_size=100, folder_id=inner_id, user_id=user_id))
+            db.flush()
+            propagate_rollups(db, inner_id, 100, 1)
+            db.commit()
+        finally:
+            db.close()
+
+    mover = SessionLocal()
+    try:
+        # What move_folder does, held open until the addition is blocked.
+        mover.query(Folder).filter(Folder.id == moved_id).update(
+            {Folder.parent_id: new_parent_id, Folder.path: "/new/moved"}, synchronize_session=False
+        )
+        propagate_rollups(mover, old_parent_id, *folder_contribution(moved_id, -1))
+        propagate_rollups(mover, new_parent_id, *folder_contribution(moved_id))
+        adder = threading.Thread(target=add_file)
+        adder.start()
+        time.sleep(1)
+        mover.commit()
+    finally:
+        mover.close()
+    adder.join()
+    return mismatches([user_id])
+
+
+def run_repair(client: TestClient, headers: dict) -> dict:
+    response = client.post("/admin/jobs/folder-rollups", json={}, headers=headers)
+    response.raise_for_status()
+    job_id = response.json()["id"]
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        job = client.get(f"/admin/jobs/{job_id}", headers=headers).json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.1)
+    raise RuntimeError("Repair job did not finish in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0], parents=[DATABASE_URL_ARGUMENT])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=1000, help="mutations across all threads")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    failures = []
+
+    with TestClient(app, raise_server_exceptions=False) as client:
+        if engine.dialect.name == "sqlite":
+            # With the default rollback journal, concurrent SQLite writers fail
+            # with "database is locked" instead of waiting for each other.
+            with engine.connect() as connection:
+                connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+        headers = register(client, "rollups")
+        admin_headers = register(client, "admin")
+        register(client, "race")
+        db = SessionLocal()
+        try:
+            user_id = db.query(User.id).filter(User.username == "rollups").scalar()
+            race_user_id = db.query(User.id).filter(User.username == "race").scalar()
+            db.query(User).filter(User.username == "admin").update({User.is_admin: True})
+            db.commit()
+        finally:
+            db.close()
+
+        seed_rng = random.Random(args.seed)
+        parents = [None]
+        for i in range(30):
+            body = {"name": f"seed{i}", "parent_id": seed_rng.choice(parents)}
+            parents.append(client.post("/storage/folders", json=body, headers=headers).json()["id"])
+
+        statuses = Counter()
+
+        def worker(n: int):
+            rng = random.Random(args.seed * 1000 + n)
+            for _ in range(args.operations // args.threads):
+                statuses[mutate(client, headers, user_id, rng)] += 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            list(pool.map(worker, range(args.threads)))
+        elapsed = time.perf_counter() - started
+
+        print(f"{sum(statuses.values())} mutations in {elapsed:.1f}s, status codes: {dict(sorted(statuses.items()))}")
+        if statuses.get(500):
+            failures.append(f"{statuses[500]} mutations failed with 500")
+
+        found = mismatches([user_id])
+        print(f"After concurrent mutations: {len(found)} inconsistent folders")
+        failures.extend(found)
+
+        db = SessionLocal()
+        try:
+            corrupted = [row.id for row in db.query(Folder.id).filter(Folder.user_id == user_id).limit(10)]
+            db.query(Folder).filter(Folder.id.in_(corrupted)).update(
+                {Folder.total_bytes: Folder.total_bytes + 12345, Folder.item_count: 0}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+        job = run_repair(client, admin_headers)
+        print(f"Repair job {job['status']}: {job['result']}")
+        if job["status"] != "succeeded":
+            failures.append(f"repair job {job['status']}: {job['error']}")
+        found = mismatches([user_id])
+        print(f"After repairing {len(corrupted)} corrupted folders: {len(found)} inconsistent folders")
+        failures.extend(found)
+
+        found = add_during_move(race_user_id)
+        print(f"After adding below a folder being moved: {len(found)} inconsistent folders")
+        failures.extend(found)
+
+    if failures:
+        print("\n".join(failures[:50]))
+        sys.exit(1)
+    print("Folder rollups are consistent.")
+
+
+if __name__ == "__main__":
+    main()
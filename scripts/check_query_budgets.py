@@ -0,0 +1,344 @@
+"""Check the number of SQL statements each API route issues against its budget.
+
+Every route of the auth, users, storage, sharing, premium and admin routers
+is called once against a freshly seeded SQLite database in a temporary
+directory. The script exits with status 1 if a route exceeds its budget or if
+a route has no budget declared, so it can gate CI:
+
+    python scripts/check_query_budgets.py [-v]
+
+Budgets include the authenticated user lookup done by ``get_current_user``.
+When a change legitimately needs more statements, raise the budget here in the
+same commit and say why in the review.
+"""
+import argparse
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+WORK_DIR = tempfile.mkdtemp(prefix="holabox-budgets-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORK_DIR, 'holabox.db')}"
+os.environ["STORAGE_PATH"] = os.path.join(WORK_DIR, "storage")
+os.environ.setdefault("SKIP_DB", "1")
+
+from sqlalchemy import event
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from app.main import app
+from app.config.database import SessionLocal, engine, init_db
+from app.auth.hashing import hash_password
+from app.auth.jwt_handler import create_access_token, create_refresh_token
+from app.common.models import File, Folder
+from app.common.storage_engine import storage_engine
+from app.jobs.models import Job
+from app.monitoring.profiling import PROFILE_HEADER, create_profile_token
+from app.premium.models import Subscription
+from app.sharing.models import Share
+from app.storage.models import SyncState
+from app.users.models import User
+
+ROUTER_PREFIXES = ("/auth", "/users", "/storage", "/shares", "/premium", "/admin")
+
+# (method, route template, budget)
+BUDGETS = {
+    ("POST", "/auth/register"): 3,
+    ("POST", "/auth/login"): 2,
+    ("POST", "/auth/refresh"): 1,
+    ("POST", "/auth/change-password"): 2,
+    ("POST", "/auth/logout"): 1,
+
+    ("GET", "/users/me"): 1,
+    ("PUT", "/users/me"): 3,
+    ("GET", "/users/storage"): 1,
+
+    ("POST", "/storage/folders"): 6,
+    ("GET", "/storage/folders"): 3,
+    ("GET", "/storage/browse/{folder_id}"): 5,
+    ("POST", "/storage/upload"): 7,
+    ("POST", "/storage/upload/batch"): 9,
+    ("GET", "/storage/files"): 3,
+    ("GET", "/storage/export"): 3,
+    ("GET", "/storage/files/{file_id}/download"): 3,
+    ("DELETE", "/storage/files/{file_id}"): 6,
+    ("POST", "/storage/files/{file_id}/restore"): 6,
+    ("PUT", "/storage/files/{file_id}/rename"): 5,
+    ("POST", "/storage/files/move"): 7,
+    ("POST", "/storage/files/{file_id}/copy"): 9,
+    ("DELETE", "/storage/files/{file_id}/purge"): 6,
+    ("PUT", "/storage/folders/{folder_id}/rename"): 6,
+    ("PUT", "/storage/folders/{folder_id}/move"): 11,
+    ("POST", "/storage/folders/{folder_id}/copy"): 12,
+    ("GET", "/storage/jobs/{job_id}"): 2,
+    ("DELETE", "/storage/folders/{folder_id}"): 9,
+    ("POST", "/storage/folders/{folder_id}/restore"): 10,
+    ("DELETE", "/storage/folders/{folder_id}/purge"): 10,
+    ("GET", "/storage/changes"): 3,
+
+    ("POST", "/shares/"): 3,
+    ("GET", "/shares/my-shares"): 2,
+    ("GET", "/shares/{share_token}/access"): 2,
+    ("GET", "/shares/{share_token}/download"): 2,
+    ("DELETE", "/shares/{share_id}"): 3,
+
+    ("GET", "/premium/plans"): 0,
+    ("POST", "/premium/upgrade"): 4,
+    ("GET", "/premium/subscription"): 2,
+
+    ("GET", "/admin/users"): 2,
+    ("POST", "/admin/users/{user_id}/suspend"): 3,
+    ("POST", "/admin/users/{user_id}/activate"): 3,
+    ("POST", "/admin/users/{user_id}/reset-storage"): 3,
+    ("GET", "/admin/stats"): 2,
+    ("GET", "/admin/export"): 4,
+    ("POST", "/admin/jobs/storage-reconcile"): 2,
+    ("POST", "/admin/jobs/changes-compact"): 2,
+    ("POST", "/admin/jobs/folder-rollups"): 2,
+    ("POST", "/admin/jobs/file-scrub"): 2,
+    ("POST", "/admin/jobs/storage-orphans"): 2,
+    ("GET", "/admin/jobs"): 2,
+    ("GET", "/admin/jobs/{job_id}"): 2,
+    ("POST", "/admin/jobs/{job_id}/cancel"): 5,
+    ("GET", "/admin/jobs/{job_id}/drift"): 3,
+    ("GET", "/admin/jobs/{job_id}/findings"): 3,
+    ("GET", "/admin/jobs/{job_id}/orphans"): 3,
+    ("GET", "/admin/integrity"): 3,
+    ("GET", "/admin/admission"): 1,
+    ("GET", "/admin/hot-cache"): 1,
+    ("POST", "/admin/profiling/token"): 1,
+    ("GET", "/admin/profiles"): 1,
+    ("GET", "/admin/profiles/{profile_id}"): 1,
+}
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def seed() -> dict:
+    init_db()
+    db = SessionLocal()
+    try:
+        admin = User(email="admin@example.com", username="admin", hashed_password=hash_password("admin-pass"), is_admin=True)
+        user = User(email="user@example.com", username="user", hashed_password=hash_password("user-pass"))
+        other = User(email="other@example.com", username="other", hashed_password=hash_password("other-pass"))
+        for account in (admin, user, other):
+            account.subscription = Subscription(plan_type="free")
+        db.add_all([admin, user, other])
+        db.flush()
+
+        # Users get their sync state row with their first change; seed it so
+        # the budgets measure the steady state.
+        db.add_all([SyncState(user_id=account.id, last_seq=0, min_seq=1) for account in (admin, user, other)])
+
+        folder = Folder(name="docs", path="/docs", user_id=user.id)
+        archive = Folder(name="archive", path="/archive", user_id=user.id)
+        trashed_folder = Folder(name="old", path="/old", user_id=user.id, is_deleted=True)
+        db.add_all([folder, archive, trashed_folder])
+        db.flush()
+
+        path = os.path.join(storage_engine.get_user_storage_path(user.id), "seed.txt")
+        with open(path, "wb") as f:
+            f.write(b"seed file contents")
+
+        files = [
+            File(filename="seed.txt", original_filename=f"seed-{i}.txt", file_path=path, file_size=18,
+                 mime_type="text/plain", folder_id=folder.id if i % 2 else None, user_id=user.id)
+            for i in range(10)
+        ]
+        # Purged by a later case, so it gets a blob of its own.
+        trashed_path = os.path.join(os.path.dirname(path), "trashed.txt")
+        with open(trashed_path, "wb") as f:
+            f.write(b"seed file contents")
+        trashed = File(filename="trashed.txt", original_filename="trashed.txt", file_path=trashed_path, file_size=18,
+                       mime_type="text/plain", user_id=user.id, is_deleted=True)
+        db.add_all(files + [trashed])
+        user.storage_used = 18 * len(files)
+        db.flush()
+
+        share = Share(share_token="public-token", file_id=files[0].id, user_id=user.id)
+        db.add(share)
+        copy_job = Job(kind="folder_copy", status="succeeded", created_by=user.id)
+        db.add(copy_job)
+        db.flush()
+        job = Job(kind="storage_reconcile", status="succeeded", created_by=admin.id)
+        db.add(job)
+        db.commit()
+
+        return {
+            "admin_token": create_access_token({"sub": str(admin.id)}),
+            "user_token": create_access_token({"sub": str(user.id)}),
+            "user_refresh": create_refresh_token({"sub": str(user.id)}),
+            "other_id": other.id,
+            "file_id": files[0].id,
+            "trashed_id": trashed.id,
+            "folder_id": folder.id,
+            "archive_id": archive.id,
+            "trashed_folder_id": trashed_folder.id,
+            "share_id": share.id,
+            "job_id": job.id,
+            "copy_job_id": copy_job.id,
+            "profile_token": create_profile_token(300)[0],
+        }
+    finally:
+        db.close()
+
+
+def build_cases(s: dict) -> list[tuple]:
+    user = {"Authorization": f"Bearer {s['user_token']}"}
+    admin = {"Authorization": f"Bearer {s['admin_token']}"}
+
+    # (method, route template, url, request kwargs); order matters for
+    # routes that change state used by later cases.
+    return [
+        ("POST", "/auth/register", "/auth/register",
+         {"json": {"email": "new@example.com", "username": "new", "password": "new-pass"}}),
+        ("POST", "/auth/login", "/auth/login", {"json": {"email": "user@example.com", "password": "user-pass"}}),
+        ("POST", "/auth/refresh", "/auth/refresh", {"json": {"refresh_token": s["user_refresh"]}}),
+        ("POST", "/auth/change-password", "/auth/change-password",
+         {"json": {"old_password": "user-pass", "new_password": "user-pass"}, "headers": user}),
+        ("POST", "/auth/logout", "/auth/logout", {"headers": user}),
+
+        ("GET", "/users/me", "/users/me", {"headers": user}),
+        ("PUT", "/users/me", "/users/me", {"json": {"full_name": "User", "email": "user@example.com"}, "headers": user}),
+        ("GET", "/users/storage", "/users/storage", {"headers": user}),
+
+        ("POST", "/storage/folders", "/storage/folders",
+         {"json": {"name": "child", "parent_id": s["folder_id"]}, "headers": user}),
+        ("GET", "/storage/folders", "/storage/folders", {"headers": user}),
+        ("POST", "/storage/upload", f"/storage/upload?folder_id={s['folder_id']}",
+         {"files": {"file": ("upload.txt", b"uploaded", "text/plain")}, "headers": user}),
+        ("POST", "/storage/upload/batch", f"/storage/upload/batch?folder_id={s['folder_id']}&total_size=24",
+         {"files": [("files", (f"batch{i}.txt", b"uploaded", "text/plain")) for i in range(3)], "headers": user}),
+        ("GET", "/storage/files", f"/storage/files?folder_id={s['folder_id']}", {"headers": user}),
+        ("GET", "/storage/browse/{folder_id}", f"/storage/browse/{s['folder_id']}", {"headers": user}),
+        ("GET", "/storage/export", "/storage/export?format=csv&gzip=true", {"headers": user}),
+        ("GET", "/storage/files/{file_id}/download", f"/storage/files/{s['file_id']}/download", {"headers": user}),
+        ("PUT", "/storage/files/{file_id}/rename", f"/storage/files/{s['file_id']}/rename",
+         {"json": {"new_name": "renamed.txt"}, "headers": user}),
+        ("POST", "/storage/files/{file_id}/restore", f"/storage/files/{s['trashed_id']}/restore", {"headers": user}),
+        ("DELETE", "/storage/files/{file_id}", f"/storage/files/{s['trashed_id']}", {"headers": user}),
+        ("DELETE", "/storage/files/{file_id}/purge", f"/storage/files/{s['trashed_id']}/purge", {"headers": user}),
+        ("POST", "/storage/files/move", "/storage/files/move",
+         {"json": {"file_id": s["file_id"], "target_folder_id": s["archive_id"]}, "headers": user}),
+        ("POST", "/storage/files/{file_id}/copy", f"/storage/files/{s['file_id']}/copy",
+         {"json": {"target_folder_id": s["folder_id"]}, "headers": user}),
+        ("PUT", "/storage/folders/{folder_id}/rename", f"/storage/folders/{s['folder_id']}/rename",
+         {"json": {"new_name": "documents"}, "headers": user}),
+        ("PUT", "/storage/folders/{folder_id}/move", f"/storage/folders/{s['folder_id']}/move",
+         {"json": {"target_parent_id": s["archive_id"]}, "headers": user}),
+        ("POST", "/storage/folders/{folder_id}/copy", f"/storage/folders/{s['folder_id']}/copy",
+         {"json": {"new_name": "docs copy"}, "headers": user}),
+        ("GET", "/storage/jobs/{job_id}", f"/storage/jobs/{s['copy_job_id']}", {"headers": user}),
+        ("DELETE", "/storage/folders/{folder_id}", f"/storage/folders/{s['archive_id']}", {"headers": user}),
+        ("POST", "/storage/folders/{folder_id}/restore", f"/storage/folders/{s['archive_id']}/restore",
+         {"headers": user}),
+        ("DELETE", "/storage/folders/{folder_id}/purge", f"/storage/folders/{s['trashed_folder_id']}/purge",
+         {"headers": user}),
+        ("GET", "/storage/changes", "/storage/changes?since=0", {"headers": user}),
+
+        ("POST", "/shares/", "/shares/", {"json": {"file_id": s["file_id"]}, "headers": user}),
+        ("GET", "/shares/my-shares", "/shares/my-shares", {"headers": user}),
+        ("GET", "/shares/{share_token}/access", "/shares/public-token/access", {"json": {}}),
+        ("GET", "/shares/{share_token}/download", "/shares/public-token/download", {}),
+        ("DELETE", "/shares/{share_id}", f"/shares/{s['share_id']}", {"headers": user}),
+
+        ("GET", "/premium/plans", "/premium/plans", {}),
+        ("POST", "/premium/upgrade", "/premium/upgrade",
+         {"json": {"plan_type": "premium", "payment_method": "card"}, "headers": user}),
+        ("GET", "/premium/subscription", "/premium/subscription", {"headers": user}),
+
+        ("GET", "/admin/users", "/admin/users", {"headers": admin}),
+        ("POST", "/admin/users/{user_id}/suspend", f"/admin/users/{s['other_id']}/suspend", {"headers": admin}),
+        ("POST", "/admin/users/{user_id}/activate", f"/admin/users/{s['other_id']}/activate", {"headers": admin}),
+        ("POST", "/admin/users/{user_id}/reset-storage", f"/admin/users/{s['other_id']}/reset-storage",
+         {"headers": admin}),
+        ("GET", "/admin/stats", "/admin/stats", {"headers": admin}),
+        ("GET", "/admin/export", f"/admin/export?user_id={s['other_id']}", {"headers": admin}),
+        ("POST", "/admin/jobs/storage-reconcile", "/admin/jobs/storage-reconcile",
+         {"json": {"user_ids": [s["other_id"]]}, "headers": admin}),
+        ("POST", "/admin/jobs/changes-compact", "/admin/jobs/changes-compact", {"json": {}, "headers": admin}),
+        ("POST", "/admin/jobs/folder-rollups", "/admin/jobs/folder-rollups", {"json": {}, "headers": admin}),
+        ("POST", "/admin/jobs/file-scrub", "/admin/jobs/file-scrub", {"json": {"max_files": 10}, "headers": admin}),
+        ("POST", "/admin/jobs/storage-orphans", "/admin/jobs/storage-orphans", {"json": {}, "headers": admin}),
+        ("GET", "/admin/jobs", "/admin/jobs", {"headers": admin}),
+        ("GET", "/admin/jobs/{job_id}", f"/admin/jobs/{s['job_id']}", {"headers": admin}),
+        ("POST", "/admin/jobs/{job_id}/cancel", f"/admin/jobs/{s['job_id'] + 1}/cancel", {"headers": admin}),
+        ("GET", "/admin/jobs/{job_id}/drift", f"/admin/jobs/{s['job_id']}/drift", {"headers": admin}),
+        ("GET", "/admin/jobs/{job_id}/findings", f"/admin/jobs/{s['job_id']}/findings", {"headers": admin}),
+        ("GET", "/admin/jobs/{job_id}/orphans", f"/admin/jobs/{s['job_id']}/orphans", {"headers": admin}),
+        ("GET", "/admin/integrity", "/admin/integrity", {"headers": admin}),
+        ("GET", "/admin/admission", "/admin/admission", {"headers": admin}),
+        ("GET", "/admin/hot-cache", "/admin/hot-cache", {"headers": admin}),
+        # Profiled, so that the profile detail case below has a profile to read.
+        ("POST", "/admin/profiling/token", "/admin/profiling/token",
+         {"headers": {**admin, PROFILE_HEADER: s["profile_token"]}}),
+        ("GET", "/admin/profiles", "/admin/profiles", {"headers": admin}),
+        ("GET", "/admin/profiles/{profile_id}", "/admin/profiles/1", {"headers": admin}),
+    ]
+
+
+def declared_routes() -> set[tuple[str, str]]:
+    routes = set()
+    for route in app.routes:
+        if isinstance(route, APIRoute) and route.path_format.startswith(ROUTER_PREFIXES):
+            for method in route.methods:
+                routes.add((method, route.path_format))
+    return routes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the statements of failing routes")
+    args = parser.parse_args()
+
+    state = seed()
+    failures = []
+
+    missing = declared_routes() - set(BUDGETS)
+    for method, path in sorted(missing):
+        failures.append(f"{method} {path}: no query budget declared")
+
+    with TestClient(app, raise_server_exceptions=False) as client:
+        for method, route, url, kwargs in build_cases(state):
+            budget = BUDGETS[(method, route)]
+            with count_queries() as statements:
+                response = client.request(method, url, **kwargs)
+
+            used = len(statements)
+            flag = "OK  " if used <= budget else "FAIL"
+            print(f"{flag} {used:3d}/{budget:<3d} {response.status_code} {method} {route}")
+
+            if response.status_code >= 400:
+                failures.append(f"{method} {route}: unexpected status {response.status_code}: {response.text}")
+            if used > budget:
+                failures.append(f"{method} {route}: {used} statements, budget {budget}")
+                if args.verbose:
+                    for statement in statements:
+                        print(f"        {' '.join(statement.split())}")
+
+    if failures:
+        print()
+        for failure in failures:
+            print(failure)
+        sys.exit(1)
+
+    print(f"\nAll {len(BUDGETS)} routes within budget.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Export the folder and file inventory as NDJSON or CSV.
+
+Reads the configured database directly, with the same streaming export as
+``GET /storage/export``:
+
+    python scripts/export_inventory.py --user-id 42 --output inventory.ndjson
+    python scripts/export_inventory.py --format csv --gzip --output all.csv.gz
+
+Without --user-id every user's rows of --shard are exported. An interrupted run prints
+the cursor of the last row it wrote; pass it to --cursor to continue. For an
+uncompressed NDJSON file, --resume finds the cursor in the file itself and
+appends to it.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from app.storage.export import encode_csv, encode_ndjson, gzip_frames, iter_inventory
+# Relationships between the models resolve only once every model is imported.
+from app.users.models import User
+from app.sharing.models import Share
+from app.premium.models import Subscription
+from app.jobs.models import Job
+
+
+def resume_cursor(path: str) -> str | None:
+    """Return the cursor of the last complete line, dropping a partial one."""
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        position = end
+        tail = b""
+        while position > 0 and tail.count(b"\n") < 2:
+            step = min(65536, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+
+        lines = tail.split(b"\n")
+        if lines[-1]:
+            # The last line was cut off mid-write.
+            f.truncate(end - len(lines[-1]))
+        complete = [line for line in lines[:-1] if line]
+        if not complete:
+            return None
+        row = json.loads(complete[-1])
+        return f"{row['type']}:{row['id']}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the HolaBox drive inventory")
+    parser.add_argument("--user-id", type=int, help="export one user; default is every user")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--output", required=True, help="file to write, or - for stdout")
+    parser.add_argument("--cursor", help="continue after this <type>:<id> cursor")
+    parser.add_argument("--resume", action="store_true", help="append to an uncompressed NDJSON --output")
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--shard", type=int, default=0, help="database shard to read")
+    args = parser.parse_args()
+
+    mode = "wb"
+    if args.resume:
+        if args.format != "ndjson" or args.gzip or args.output == "-":
+            parser.error("--resume needs an uncompressed NDJSON --output file; use --cursor otherwise")
+        if os.path.exists(args.output):
+            args.cursor = resume_cursor(args.output)
+            mode = "ab"
+            print(f"Resuming after {args.cursor}", file=sys.stderr)
+
+    state = {"rows": 0, "pending": args.cursor, "written": args.cursor}
+
+    def tracked(batches):
+        for kind, rows in batches:
+            state["rows"] += len(rows)
+            state["pending"] = f"{kind}:{rows[-1]['id']}"
+            yield kind, rows
+
+    encode = encode_csv if args.format == "csv" else encode_ndjson
+    chunks = encode(tracked(iter_inventory(args.user_id, args.cursor, args.batch_size, args.shard)))
+    if args.gzip:
+        chunks = gzip_frames(chunks)
+
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, mode)
+    started = time.perf_counter()
+    last_report = started
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+            # Encoders emit one chunk per batch, so the batch is now on disk.
+            state["written"] = state["pending"]
+            now = time.perf_counter()
+            if now - last_report >= 5:
+                last_report = now
+                print(f"  {state['rows']:,} rows ({state['rows'] / (now - started):,.0f} rows/s)", file=sys.stderr)
+    except KeyboardInterrupt:
+        out.flush()
+        print(f"\nInterrupted; continue with --cursor {state['written']}", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Exported {state['rows']:,} rows in {elapsed:.1f}s; last cursor {state['written']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Find blobs without a file row and file rows whose blob is gone.
+
+Scans the configured database and storage directory with the same
+merge-join as the ``storage_orphans`` job (see app/jobs/orphans.py) and
+writes one NDJSON line per mismatch:
+
+    python scripts/find_orphans.py --output orphans.ndjson
+    python scripts/find_orphans.py --quarantine --min-age-hours 48 --output orphans.ndjson
+
+With --quarantine orphaned blobs are moved under ``STORAGE_PATH/.quarantine``.
+An interrupted run prints the last path it finished; pass it to --after to
+continue. The peak RSS is printed at the end. With several shards, run it
+once per shard with --shard; each reports only the blobs of its own users.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from app.config.database import shard_sessions
+from app.common.storage_engine import storage_engine
+from app.jobs.orphans import find_mismatches, quarantine_blob, rows_outside_storage
+# Relationships between the models resolve only once every model is imported.
+from app.users.models import User
+from app.sharing.models import Share
+from app.premium.models import Subscription
+from app.jobs.models import Job
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find orphaned blobs and dangling file rows")
+    parser.add_argument("--output", default="-", help="file to write, or - for stdout")
+    parser.add_argument("--quarantine", action="store_true", help="move orphaned blobs to the quarantine directory")
+    parser.add_argument("--min-age-hours", type=float, help="ignore blobs modified more recently than this")
+    parser.add_argument("--after", help="continue after this path")
+    parser.add_argument("--shard", type=int, default=0, help="database shard to scan")
+    args = parser.parse_args()
+
+    base_path = storage_engine.base_path
+    batch = time.strftime("scan-%Y%m%d-%H%M%S")
+    counts = {"paths": 0, "orphan_blob": 0, "dangling_row": 0, "quarantined": 0}
+    last_path = args.after
+
+    db = shard_sessions[args.shard]()
+    out = sys.stdout if args.output == "-" else open(args.output, "a" if args.after else "w")
+    started = time.perf_counter()
+    last_report = started
+    try:
+        outside = rows_outside_storage(db, base_path)
+        if outside:
+            print(f"{outside:,} file rows are not under {base_path}", file=sys.stderr)
+            if args.quarantine:
+                sys.exit("Refusing to quarantine; check STORAGE_PATH")
+
+        for path, findings in find_mismatches(db, base_path, args.after, args.min_age_hours, args.shard):
+            for finding in findings:
+                counts[finding["kind"]] += 1
+                if args.quarantine and finding["kind"] == "orphan_blob":
+                    finding["quarantined_to"] = quarantine_blob(path, base_path, batch)
+                    counts["quarantined"] += 1
+                out.write(json.dumps(finding) + "\n")
+
+            last_path = path
+            counts["paths"] += 1
+            now = time.perf_counter()
+            if now - last_report >= 5:
+                last_report = now
+                print(f"  {counts['paths']:,} paths ({counts['paths'] / (now - started):,.0f}/s)", file=sys.stderr)
+    except KeyboardInterrupt:
+        out.flush()
+        print(f"\nInterrupted; continue with --after {last_path!r}", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        db.close()
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - started
+    # ru_maxrss is in KiB on Linux.
+    peak_mib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(
+        f"Scanned {counts['paths']:,} paths in {elapsed:.1f}s: {counts['orphan_blob']:,} orphaned blobs "
+        f"({counts['quarantined']:,} quarantined), {counts['dangling_row']:,} dangling rows; "
+        f"peak RSS {peak_mib:.0f} MiB",
+        file=sys.stderr
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""Bulk-load a synthetic, production-shaped dataset.
+
+Rows are inserted through the tables of the real models (User, Folder, File,
+Share, Subscription) with explicit ids and large executemany batches, so
+millions of files load in minutes rather than hours. The shape is meant to
+reproduce what makes production slow:
+
+- files per user follow a Zipf distribution, so a few users own most rows
+- each user gets a folder tree built by random descent, up to --max-depth
+- file sizes are log-normal, about 2% of files are in the trash and about
+  1% are shared
+
+By default ``file_path`` points at files that do not exist. With
+--placeholders a sparse file of the recorded size is created for each row,
+which costs inodes but no disk blocks.
+
+    DATABASE_URL=sqlite:///./bench.db python scripts/generate_dataset.py --users 1000 --files 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.engine import Engine
+from app.config.database import engine as default_engine, init_db
+from app.config.settings import settings
+from app.auth.hashing import hash_password
+from app.common.models import File, Folder
+from app.premium.models import Subscription
+from app.sharing.models import Share
+from app.users.models import User
+
+EXTENSIONS = [
+    ("jpg", "image/jpeg", 30), ("png", "image/png", 10), ("mp4", "video/mp4", 8),
+    ("pdf", "application/pdf", 15), ("docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", 8),
+    ("txt", "text/plain", 6), ("zip", "application/zip", 5), ("mp3", "audio/mpeg", 8),
+    ("apk", "application/vnd.android.package-archive", 2), ("bin", "application/octet-stream", 8),
+]
+PLANS = [("free", 90), ("premium", 8), ("ultra", 2)]
+
+
+def zipf_counts(total: int, buckets: int, alpha: float) -> list[int]:
+    weights = [1 / (rank ** alpha) for rank in range(1, buckets + 1)]
+    scale = total / sum(weights)
+    counts = [int(w * scale) for w in weights]
+    for i in range(total - sum(counts)):
+        counts[i % buckets] += 1
+    return counts
+
+
+def next_id(connection, model) -> int:
+    return (connection.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+class BatchWriter:
+    """Buffers rows for one table; flushing writes the tables it references first."""
+
+    def __init__(self, connection, table, batch_size: int, depends_on: tuple = ()):
+        self.connection = connection
+        self.table = table
+        self.batch_size = batch_size
+        self.depends_on = depends_on
+        self.rows = []
+        self.written = 0
+
+    def add(self, row: dict):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for writer in self.depends_on:
+            writer.flush()
+        if self.rows:
+            self.connection.execute(self.table.insert(), self.rows)
+            self.written += len(self.rows)
+            self.rows = []
+
+
+def build_tree(rng: random.Random, user_id: int, count: int, max_depth: int, first_id: int) -> list[dict]:
+    folders = []
+    roots = []
+    for i in range(count):
+        parent = None
+        # Descend from the root, stopping at each level with some probability,
+        # which yields a few deep chains and many shallow siblings.
+        candidates = roots
+        while candidates and rng.random() < 0.7:
+            choice = rng.choice(candidates)
+            if choice["depth"] >= max_depth:
+                break
+            parent = choice
+            candidates = parent["children"]
+
+        name = f"folder-{i}"
+        folder = {
+            "id": first_id + i,
+            "name": name,
+            "path": f"{parent['path']}/{name}" if parent else f"/{name}",
+            "parent_id": parent["id"] if parent else None,
+            "user_id": user_id,
+            "depth": parent["depth"] + 1 if parent else 1,
+            "children": [],
+        }
+        (parent["children"] if parent else roots).append(folder)
+        folders.append(folder)
+    return folders
+
+
+def generate(
+    engine: Engine,
+    users: int,
+    files: int,
+    alpha: float = 1.1,
+    files_per_folder: int = 40,
+    max_depth: int = 12,
+    placeholders: bool = False,
+    storage_path: str | None = None,
+    batch_size: int = 20000,
+    seed: int = 42,
+) -> dict:
+    rng = random.Random(seed)
+    storage_path = storage_path or settings.STORAGE_PATH
+    password_hash = hash_password("password")
+    now = datetime.utcnow()
+    extensions = [e[:2] for e in EXTENSIONS]
+    extension_weights = [e[2] for e in EXTENSIONS]
+    started = time.perf_counter()
+
+    with engine.begin() as connection:
+        if connection.dialect.name == "sqlite":
+            connection.exec_driver_sql("PRAGMA synchronous=OFF")
+
+        user_id = next_id(connection, User)
+        folder_id = next_id(connection, Folder)
+        file_id = next_id(connection, File)
+        share_id = next_id(connection, Share)
+
+        user_writer = BatchWriter(connection, User.__table__, batch_size)
+        subscription_writer = BatchWriter(connection, Subscription.__table__, batch_size, (user_writer,))
+        folder_writer = BatchWriter(connection, Folder.__table__, batch_size, (user_writer,))
+        file_writer = BatchWriter(connection, File.__table__, batch_size, (folder_writer,))
+        share_writer = BatchWriter(connection, Share.__table__, batch_size, (file_writer,))
+        storage_used = {}
+        rollups = []
+
+        per_user = zipf_counts(files, users, alpha)
+        rng.shuffle(per_user)
+
+        for n, file_count in enumerate(per_user):
+            plan = rng.choices([p for p, _ in PLANS], weights=[w for _, w in PLANS])[0]
+            created = now - timedelta(days=rng.uniform(0, 730))
+            uid = user_id
+            user_id += 1
+
+            user_writer.add({
+                "id": uid, "email": f"user{uid}@example.com", "username": f"user{uid}",
+                "hashed_password": password_hash, "is_active": True, "is_admin": False,
+                "is_verified": True, "plan_type": plan, "storage_used": 0,
+                "total_uploads": file_count, "last_login": now, "created_at": created, "updated_at": created,
+            })
+            subscription_writer.add({
+                "user_id": uid, "plan_type": plan, "is_active": True,
+                "start_date": created, "created_at": created, "updated_at": created,
+            })
+
+            folders = build_tree(rng, uid, file_count // files_per_folder + 1, max_depth, folder_id)
+            folder_id += len(folders)
+            for folder in folders:
+                folder_writer.add({
+                    "id": folder["id"], "name": folder["name"], "path": folder["path"],
+                    "parent_id": folder["parent_id"], "user_id": uid, "is_deleted": False,
+                    "created_at": created, "updated_at": created,
+                })
+
+            user_dir = os.path.join(storage_path, str(uid))
+            if placeholders and file_count:
+                os.makedirs(user_dir, exist_ok=True)
+
+            used = 0
+            totals = {folder["id"]: [0, 0] for folder in folders}
+            for _ in range(file_count):
+                ext, mime = rng.choices(extensions, weights=extension_weights)[0]
+                size = max(1, int(rng.lognormvariate(12, 2)))
+                filename = f"{file_id:012x}.{ext}"
+                path = os.path.join(user_dir, filename)
+                deleted = rng.random() < 0.02
+                uploaded = created + timedelta(days=rng.uniform(0, (now - created).days or 1))
+                # Roughly one file in ten stays at the root.
+                file_folder_id = rng.choice(folders)["id"] if rng.random() > 0.1 else None
+                if not deleted:
+                    used += size
+                    if file_folder_id:
+                        totals[file_folder_id][0] += size
+                        totals[file_folder_id][1] += 1
+
+                file_writer.add({
+                    "id": file_id, "filename": filename, "original_filename": f"file-{file_id}.{ext}",
+                    "file_path": path, "file_size": size, "mime_type": mime,
+                    "folder_id": file_folder_id,
+                    "user_id": uid, "is_deleted": deleted, "deleted_at": now if deleted else None,
+                    "view_count": 0, "download_count": int(rng.paretovariate(1.5)) - 1,
+                    "created_at": uploaded, "updated_at": uploaded,
+                })
+
+                if not deleted and rng.random() < 0.01:
+                    share_writer.add({
+                        "id": share_id, "share_token": f"gen-{share_id:012x}", "file_id": file_id,
+                        "user_id": uid, "view_count": 0, "download_count": 0, "is_active": True,
+                        "created_at": uploaded,
+                    })
+                    share_id += 1
+
+                if placeholders:
+                    with open(path, "wb") as f:
+                        f.truncate(size)
+                file_id += 1
+
+            storage_used[uid] = used
+            # Parents precede their children in ``folders``, so walking it
+            # backwards rolls every subtree up before its parent.
+            for folder in reversed(folders):
+                if folder["parent_id"]:
+                    parent = totals[folder["parent_id"]]
+                    parent[0] += totals[folder["id"]][0]
+                    parent[1] += totals[folder["id"]][1] + 1
+            rollups.extend(
+                {"fid": fid, "total_bytes": total_bytes, "item_count": item_count}
+                for fid, (total_bytes, item_count) in totals.items() if item_count
+            )
+
+            if (n + 1) % 100 == 0:
+                elapsed = time.perf_counter() - started
+                print(f"  {n + 1}/{users} users, {file_writer.written + len(file_writer.rows)} files "
+                      f"({(file_writer.written + len(file_writer.rows)) / elapsed:,.0f} files/s)", flush=True)
+
+        for writer in (subscription_writer, share_writer):
+            writer.flush()
+
+        connection.execute(
+            User.__table__.update().where(User.id == bindparam("uid")).values(storage_used=bindparam("used")),
+            [{"uid": uid, "used": used} for uid, used in storage_used.items() if used]
+        )
+        if rollups:
+            connection.execute(
+                Folder.__table__.update().where(Folder.id == bindparam("fid")).values(
+                    total_bytes=bindparam("total_bytes"), item_count=bindparam("item_count")
+                ),
+                rollups
+            )
+
+    elapsed = time.perf_counter() - started
+    return {
+        "users": user_writer.written,
+        "folders": folder_writer.written,
+        "files": file_writer.written,
+        "shares": share_writer.written,
+        "seconds": round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load a synthetic HolaBox dataset")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--files", type=int, default=100000)
+    parser.add_argument("--alpha", type=float, default=1.1, help="Zipf exponent of files per user")
+    parser.add_argument("--files-per-folder", type=int, default=40)
+    parser.add_argument("--max-depth", type=int, default=12)
+    parser.add_argument("--placeholders", action="store_true", help="create sparse files on disk")
+    parser.add_argument("--batch-size", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    init_db()
+    print(f"Generating {args.files:,} files for {args.users:,} users into {default_engine.url}")
+    summary = generate(
+        default_engine, args.users, args.files, args.alpha, args.files_per_folder,
+        args.max_depth, args.placeholders, batch_size=args.batch_size, seed=args.seed
+    )
+    print(f"Inserted {summary['users']:,} users, {summary['folders']:,} folders, "
+          f"{summary['files']:,} files and {summary['shares']:,} shares in {summary['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,538 @@
+"""Import a local directory tree into a user's drive.
+
+Directories become folders under --folder-id (the root by default) and
+regular files become files in them; symlinks and special files are left
+out. A folder that already exists at the same path is reused, so a tree can
+be imported again into the same place.
+
+Files are hashed by --workers processes and put into the user's storage
+directory with ``StorageEngine.place_file``: ``--mode link`` hard-links and
+``--mode move`` renames when the tree is on the same filesystem as
+STORAGE_PATH, and both copy otherwise; ``--mode copy`` always copies.
+Hard-linked and moved files count as verified, since the file that was
+hashed is the one placed; copies are left for the integrity scrub to read
+back first, like server-side copies. Rows are inserted --batch-size files
+at a time. Each batch is one transaction that also charges the quota,
+journals the new items, bumps the listing versions and updates the folder
+rollups, as uploads do.
+
+    python scripts/import_tree.py /mnt/old-drive --user alice@example.com --mode link --workers 8
+
+Progress is saved to --checkpoint after every batch. After an interruption,
+run the same command with --resume: a batch that was being placed is either
+found committed or undone, and the import continues after the last
+committed file. Throughput is printed every few seconds and at the end.
+
+A hard-linked blob shares its data with the source file, so later changes
+to the source show up as corruption in the integrity scrub. Use
+--mode move or --mode copy for trees that are still in use.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from sqlalchemy import bindparam, func
+from app.config.database import SessionLocal, insert_returning_ids, is_sharded
+from app.common.helpers import generate_unique_filename
+from app.common.models import File, Folder
+from app.common.storage_engine import storage_engine
+from app.jobs.orphans import iter_disk_paths
+from app.storage.changes import record_changes
+from app.storage.rollups import propagate_rollups
+from app.storage.utils import get_mime_type
+from app.users.service import reserve_storage
+from app.shards.service import locate_email, locate_user, open_user_session
+# Relationships between the models resolve only once every model is imported.
+from app.users.models import User
+from app.sharing.models import Share
+from app.premium.models import Subscription
+from app.jobs.models import Job
+
+# Files per task sent to a hashing process.
+HASH_CHUNK = 32
+# Rows per INSERT, which keeps its parameters within SQLite's and PostgreSQL's limits.
+INSERT_CHUNK = 1000
+# Placements that put the hashed file itself into storage.
+IN_PLACE_METHODS = ("hardlink", "rename")
+MIB = 1024 * 1024
+
+_add_rollups = Folder.__table__.update().where(Folder.__table__.c.id == bindparam("folder_id")).values(
+    total_bytes=Folder.__table__.c.total_bytes + bindparam("delta_bytes"),
+    item_count=Folder.__table__.c.item_count + bindparam("delta_items")
+)
+
+
+class ImportAborted(Exception):
+    pass
+
+
+def display_name(name: str) -> str:
+    # Names that are not valid UTF-8 come back from the OS with surrogates,
+    # which the database cannot store.
+    return name.encode("utf-8", "surrogateescape").decode("utf-8", "replace")
+
+
+def hash_sources(paths: list[str]) -> list[tuple]:
+    """Runs in a worker process; returns (size, sha256, error) per path."""
+    results = []
+    for path in paths:
+        try:
+            size, digest = storage_engine.hash_file(path)
+            results.append((size, digest, None))
+        except OSError as e:
+            results.append((None, None, e.strerror or str(e)))
+    return results
+
+
+def tree_chain(rel_dir: str):
+    """``rel_dir`` and its parents inside the imported tree, deepest first."""
+    while rel_dir:
+        yield rel_dir
+        rel_dir = os.path.dirname(rel_dir)
+
+
+def chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class Importer:
+    def __init__(self, db, user: User, target_id: int | None, source: str, args, state: dict):
+        self.db = db
+        self.user = user
+        self.target_id = target_id
+        self.target_path = db.query(Folder.path).filter(Folder.id == target_id).scalar() if target_id else ""
+        self.source = source
+        self.mode = args.mode
+        self.batch_size = args.batch_size
+        self.skip_quota = args.skip_quota
+        self.checkpoint_path = args.checkpoint
+        self.state = state
+        self.folder_ids = {"": target_id}
+        self.skipped = Counter(state.get("skipped", {}))
+        self.methods = Counter(state.get("methods", {}))
+        self.timings = Counter()
+        self.started = time.perf_counter()
+        self.session_files = 0
+        self.session_bytes = 0
+        self.last_report = self.started
+        # The storage directory is never imported into itself.
+        storage = os.path.realpath(storage_engine.base_path)
+        self.skip = storage if storage.startswith(os.path.join(source, "")) else None
+
+    def save(self):
+        self.state["skipped"] = dict(self.skipped)
+        self.state["methods"] = dict(self.methods)
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp, self.checkpoint_path)
+
+    def rel_dir(self, directory: str) -> str:
+        return "" if directory == self.source else os.path.relpath(directory, self.source)
+
+    def folder_path(self, rel_dir: str) -> str:
+        return f"{self.target_path}/{display_name(rel_dir).replace(os.sep, '/')}"
+
+    def insert(self, model, rows: list[dict]) -> list[int]:
+        """Insert rows of ``model`` and return their ids, in row order."""
+        return [
+            row_id
+            for chunk in chunks(rows, INSERT_CHUNK)
+            for row_id in insert_returning_ids(self.db, model.__table__, chunk)
+        ]
+
+    def claim_live_folders(self, folder_ids) -> bool:
+        """Claim every folder items are about to be added to, like ``add_to_live_folder``."""
+        ids = {folder_id for folder_id in folder_ids if folder_id is not None}
+        if not ids:
+            return True
+        claimed = self.db.query(Folder).filter(
+            Folder.id.in_(ids),
+            Folder.user_id == self.user.id,
+            Folder.is_deleted == False
+        ).update({Folder.version: Folder.version + 1}, synchronize_session=False)
+        if claimed == len(ids):
+            return True
+        self.db.rollback()
+        return False
+
+    def add_rollups(self, contributions: list[tuple[str, int, int]]):
+        """Add (rel_dir, bytes, items) to the folders of the tree and to the target's chain."""
+        deltas = defaultdict(lambda: [0, 0])
+        total_bytes = total_items = 0
+        for rel_dir, size, items in contributions:
+            for rel in tree_chain(rel_dir):
+                deltas[self.folder_ids[rel]][0] += size
+                deltas[self.folder_ids[rel]][1] += items
+            total_bytes += size
+            total_items += items
+        if deltas:
+            self.db.execute(_add_rollups, [
+                {"folder_id": folder_id, "delta_bytes": size, "delta_items": items}
+                for folder_id, (size, items) in deltas.items()
+            ])
+        propagate_rollups(self.db, self.target_id, total_bytes, total_items)
+
+    # Folders
+
+    def ensure_folders(self, rel_dirs) -> int:
+        """Create the folders for ``rel_dirs`` and their parents that don't exist yet."""
+        wanted = {rel for rel_dir in rel_dirs for rel in tree_chain(rel_dir)} - self.folder_ids.keys()
+        levels = defaultdict(list)
+        for rel in wanted:
+            levels[rel.count(os.sep)].append(rel)
+
+        created = 0
+        for depth in sorted(levels):
+            for batch in chunks(sorted(levels[depth]), self.batch_size):
+                created += self._create_folder_batch(batch)
+        return created
+
+    def _create_folder_batch(self, batch: list[str]) -> int:
+        paths = {rel: self.folder_path(rel) for rel in batch}
+        # Oldest first, so duplicates resolve to the folder that was there first.
+        existing = {}
+        for path, folder_id in self.db.query(Folder.path, Folder.id).filter(
+            Folder.user_id == self.user.id,
+            Folder.is_deleted == False,
+            Folder.path.in_(paths.values())
+        ).order_by(Folder.id.desc()):
+            existing[path] = folder_id
+        for rel in batch:
+            if paths[rel] in existing:
+                self.folder_ids[rel] = existing[paths[rel]]
+
+        new = [rel for rel in batch if paths[rel] not in existing]
+        if not new:
+            self.db.commit()
+            return 0
+
+        parents = {rel: self.folder_ids[os.path.dirname(rel)] for rel in new}
+        if not self.claim_live_folders(parents.values()):
+            raise ImportAborted("A folder was deleted during the import")
+
+        now = datetime.utcnow()
+        ids = self.insert(Folder, [
+            {
+                "name": display_name(os.path.basename(rel)), "path": paths[rel], "parent_id": parents[rel],
+                "user_id": self.user.id, "version": 0, "total_bytes": 0, "item_count": 0,
+                "is_deleted": False, "created_at": now, "updated_at": now,
+            }
+            for rel in new
+        ])
+
+        by_parent = defaultdict(list)
+        for rel, folder_id in zip(new, ids):
+            self.folder_ids[rel] = folder_id
+            by_parent[parents[rel]].append((folder_id, display_name(os.path.basename(rel))))
+        # The new folders are empty; each counts as one item of its parents.
+        self.add_rollups([(os.path.dirname(rel), 0, 1) for rel in new])
+        for parent_id, items in by_parent.items():
+            record_changes(self.db, self.user.id, "folder", "create", items, parent_id)
+        self.db.commit()
+        return len(new)
+
+    def import_folders(self):
+        rel_dirs = []
+        for dirpath, dirnames, _ in os.walk(self.source, onerror=self._walk_error):
+            dirnames[:] = sorted(
+                name for name in dirnames
+                if not os.path.islink(os.path.join(dirpath, name)) and os.path.join(dirpath, name) != self.skip
+            )
+            if dirpath != self.source:
+                rel_dirs.append(self.rel_dir(dirpath))
+        created = self.ensure_folders(rel_dirs)
+        self.state["folders"] = self.state.get("folders", 0) + created
+        print(f"{len(rel_dirs):,} directories, {created:,} folders created", file=sys.stderr)
+
+    def _walk_error(self, error: OSError):
+        self.skipped[f"unreadable directory: {error.strerror}"] += 1
+        print(f"  skipping {error.filename}: {error.strerror}", file=sys.stderr)
+
+    # Files
+
+    def recover(self):
+        """Settle the batch that was being placed when a previous run stopped."""
+        pending = self.state.get("pending")
+        if not pending:
+            return
+        dests = [dest for _, dest in pending["files"]]
+        committed = self.db.query(func.count(File.id), func.coalesce(func.sum(File.file_size), 0)).filter(
+            File.file_path.in_(dests)
+        ).one() if dests else (0, 0)
+        self.db.commit()
+
+        if committed[0]:
+            self.state["after"] = pending["after"]
+            self.state["files"] += committed[0]
+            self.state["bytes"] += committed[1]
+            print(f"Last batch was committed ({committed[0]:,} files)", file=sys.stderr)
+        else:
+            self.undo([tuple(pair) for pair in pending["files"]])
+            print(f"Last batch was not committed; undid {len(dests):,} placements", file=sys.stderr)
+        self.state["pending"] = None
+        self.save()
+
+    def undo(self, placed: list[tuple[str, str]]):
+        for source, dest in placed:
+            if self.mode == "move":
+                if os.path.exists(dest) and not os.path.exists(source):
+                    storage_engine.move_file(dest, source)
+            else:
+                storage_engine.delete_file(dest)
+
+    def hashed_batches(self, pool):
+        """Yield each batch of paths with its hashes, hashing the next batch meanwhile."""
+        paths = iter_disk_paths(self.source, self.state.get("after"), self.skip, self._walk_error)
+        pending = None
+        while True:
+            batch = [path for _, path in zip(range(self.batch_size), paths)]
+            futures = [pool.submit(hash_sources, chunk) for chunk in chunks(batch, HASH_CHUNK)]
+            if pending is not None:
+                started = time.perf_counter()
+                hashes = [result for future in pending[1] for result in future.result()]
+                self.timings["hash_wait"] += time.perf_counter() - started
+                yield pending[0], hashes
+            if not batch:
+                return
+            pending = (batch, futures)
+
+    def import_batch(self, batch: list[str], hashes: list[tuple]):
+        user_path = storage_engine.get_user_storage_path(self.user.id)
+        entries = []
+        for path, (size, digest, error) in zip(batch, hashes):
+            if error:
+                self.skipped[error] += 1
+                continue
+            name = display_name(os.path.basename(path))
+            filename = generate_unique_filename(name)
+            entries.append({
+                "source": path, "rel_dir": self.rel_dir(os.path.dirname(path)), "name": name, "filename": filename, "dest": os.path.join(user_path, filename),
+                "size": size, "digest": digest,
+            })
+
+        # Directories that appeared after the folder pass.
+        missing = {entry["rel_dir"] for entry in entries} - self.folder_ids.keys()
+        if missing:
+            self.ensure_folders(missing)
+
+        self.state["pending"] = {"after": batch[-1], "files": [[e["source"], e["dest"]] for e in entries]}
+        self.save()
+
+        started = time.perf_counter()
+        placed = []
+        try:
+            for entry in entries:
+                try:
+                    entry["method"] = storage_engine.place_file(entry["source"], entry["dest"], self.mode)
+                except FileNotFoundError:
+                    self.skipped["vanished"] += 1
+                    continue
+                placed.append((entry["source"], entry["dest"]))
+                if os.stat(entry["dest"]).st_size != entry["size"]:
+                    self.undo([placed.pop()])
+                    self.skipped["changed while importing"] += 1
+                    continue
+                entry["placed"] = True
+            self.timings["place"] += time.perf_counter() - started
+
+            rows = [entry for entry in entries if entry.get("placed")]
+            started = time.perf_counter()
+            if rows:
+                self.commit_rows(rows)
+            self.timings["database"] += time.perf_counter() - started
+        except BaseException:
+            self.db.rollback()
+            self.undo(placed)
+            self.state["pending"] = None
+            self.save()
+            raise
+
+        size = sum(entry["size"] for entry in rows)
+        self.methods.update(entry["method"] for entry in rows)
+        self.state.update(after=batch[-1], pending=None)
+        self.state["files"] += len(rows)
+        self.state["bytes"] += size
+        self.session_files += len(rows)
+        self.session_bytes += size
+        self.save()
+
+    def commit_rows(self, rows: list[dict]):
+        total_bytes = sum(row["size"] for row in rows)
+        if self.skip_quota:
+            self.db.query(User).filter(User.id == self.user.id).update(
+                {User.storage_used: User.storage_used + total_bytes}, synchronize_session=False
+            )
+        elif not reserve_storage(self.user, total_bytes, self.db):
+            raise ImportAborted(f"Storage limit exceeded after {self.state['files']:,} files")
+
+        if not self.claim_live_folders(self.folder_ids[row["rel_dir"]] for row in rows):
+            raise ImportAborted("A folder was deleted during the import")
+
+        # A hard link or a rename places the very file that was hashed, so it
+        # counts as verified now. The digest of a copy (including the copy a
+        # link or move falls back to) was taken from the source, not from the
+        # placed bytes, so copies are left for the scrubber to read back.
+        now = datetime.utcnow()
+        ids = self.insert(File, [
+            {
+                "filename": row["filename"], "original_filename": row["name"], "file_path": row["dest"],
+                "file_size": row["size"], "mime_type": get_mime_type(row["name"]), "checksum": row["digest"],
+                "verified_at": now if row["method"] in IN_PLACE_METHODS else None,
+                "folder_id": self.folder_ids[row["rel_dir"]], "user_id": self.user.id,
+                "is_deleted": False, "view_count": 0, "download_count": 0, "created_at": now, "updated_at": now,
+            }
+            for row in rows
+        ])
+
+        by_folder = defaultdict(list)
+        for row, file_id in zip(rows, ids):
+            by_folder[self.folder_ids[row["rel_dir"]]].append((file_id, row["name"]))
+        self.add_rollups([(row["rel_dir"], row["size"], 1) for row in rows])
+        for folder_id, items in by_folder.items():
+            record_changes(self.db, self.user.id, "file", "create", items, folder_id)
+
+        self.db.query(User).filter(User.id == self.user.id).update(
+            {User.total_uploads: User.total_uploads + len(rows)}, synchronize_session=False
+        )
+        self.db.commit()
+
+    def import_files(self, workers: int):
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for batch, hashes in self.hashed_batches(pool):
+                self.import_batch(batch, hashes)
+                self.report()
+
+    def report(self, final: bool = False):
+        now = time.perf_counter()
+        if not final and now - self.last_report < 5:
+            return
+        self.last_report = now
+        elapsed = now - self.started
+        print(
+            f"  {self.state['files']:,} files, {self.state['bytes'] / MIB / 1024:,.2f} GiB; "
+            f"{self.session_files / elapsed:,.0f} files/s, {self.session_bytes / MIB / elapsed:,.1f} MiB/s",
+            file=sys.stderr
+        )
+
+
+def open_owner_session(value: str):
+    """A session on the shard holding the user given by email or id."""
+    if not is_sharded():
+        return SessionLocal()
+    entry = locate_user(int(value)) if value.isdigit() else locate_email(value)
+    if entry is not None and entry.moving:
+        sys.exit(f"User {entry.user_id} is being moved to another shard; try again once it is done")
+    return open_user_session(entry.user_id) if entry else SessionLocal()
+
+
+def resolve_user(db, value: str) -> User | None:
+    if value.isdigit():
+        return db.query(User).filter(User.id == int(value)).first()
+    return db.query(User).filter(User.email == value).first()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a local directory tree into a user's drive")
+    parser.add_argument("source", help="directory to import")
+    parser.add_argument("--user", required=True, help="email or id of the owner")
+    parser.add_argument("--folder-id", type=int, help="folder to import into; the root by default")
+    parser.add_argument("--mode", choices=["copy", "link", "move"], default="copy",
+                        help="how files are put into storage; link and move copy across filesystems")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="hashing processes")
+    parser.add_argument("--batch-size", type=int, default=1000, help="files per transaction")
+    parser.add_argument("--checkpoint", default="import_tree.checkpoint.json")
+    parser.add_argument("--resume", action="store_true", help="continue from --checkpoint")
+    parser.add_argument("--skip-quota", action="store_true", help="charge storage without enforcing the plan limit")
+    parser.add_argument("--report", help="also write the final throughput report as JSON to this file")
+    args = parser.parse_args()
+
+    source = os.path.realpath(args.source)
+    if not os.path.isdir(source):
+        sys.exit(f"{args.source} is not a directory")
+
+    db = open_owner_session(args.user)
+    try:
+        user = resolve_user(db, args.user)
+        if user is None:
+            sys.exit(f"No user {args.user}")
+        if args.folder_id and not db.query(Folder.id).filter(
+            Folder.id == args.folder_id,
+            Folder.user_id == user.id,
+            Folder.is_deleted == False
+        ).first():
+            sys.exit(f"User {user.id} has no folder {args.folder_id}")
+
+        identity = {"source": source, "user_id": user.id, "folder_id": args.folder_id, "mode": args.mode}
+        if args.resume:
+            with open(args.checkpoint) as f:
+                state = json.load(f)
+            if {key: state.get(key) for key in identity} != identity:
+                sys.exit(f"{args.checkpoint} is for a different import: {json.dumps({k: state.get(k) for k in identity})}")
+        elif os.path.exists(args.checkpoint):
+            sys.exit(f"{args.checkpoint} exists; pass --resume to continue that import or remove it")
+        else:
+            state = {**identity, "after": None, "files": 0, "bytes": 0, "folders": 0, "pending": None}
+
+        importer = Importer(db, user, args.folder_id, source, args, state)
+        importer.save()
+        try:
+            importer.recover()
+            importer.import_folders()
+            importer.import_files(args.workers)
+        except ImportAborted as e:
+            importer.report(final=True)
+            sys.exit(f"{e}; continue with --resume once resolved")
+        except KeyboardInterrupt:
+            importer.report(final=True)
+            print("\nInterrupted; continue with --resume", file=sys.stderr)
+            sys.exit(130)
+        state["finished"] = True
+        importer.save()
+    finally:
+        db.close()
+
+    elapsed = time.perf_counter() - importer.started
+    report = {
+        "files": importer.session_files,
+        "bytes": importer.session_bytes,
+        "folders_total": state["folders"],
+        "files_total": state["files"],
+        "bytes_total": state["bytes"],
+        "seconds": round(elapsed, 3),
+        "files_per_second": round(importer.session_files / elapsed, 1),
+        "mib_per_second": round(importer.session_bytes / MIB / elapsed, 2),
+        "seconds_waiting_for_hashes": round(importer.timings["hash_wait"], 3),
+        "seconds_placing": round(importer.timings["place"], 3),
+        "seconds_in_database": round(importer.timings["database"], 3),
+        "methods": dict(importer.methods),
+        "skipped": dict(importer.skipped),
+    }
+    print(
+        f"Imported {report['files']:,} files ({report['bytes'] / MIB:,.1f} MiB) in {elapsed:.1f}s: "
+        f"{report['files_per_second']:,.0f} files/s, {report['mib_per_second']:,.1f} MiB/s; "
+        f"hash wait {report['seconds_waiting_for_hashes']:.1f}s, placing {report['seconds_placing']:.1f}s, "
+        f"database {report['seconds_in_database']:.1f}s",
+        file=sys.stderr
+    )
+    if report["methods"]:
+        print("Placed by " + ", ".join(f"{m}: {n:,}" for m, n in report["methods"].items()), file=sys.stderr)
+    if report["skipped"]:
+        print("Skipped " + ", ".join(f"{r}: {n:,}" for r, n in report["skipped"].items()), file=sys.stderr)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+"""Set up shards, fill the shard directory and move users between shards.
+
+Shard 0 is DATABASE_URL and holds the directory; SHARD_DATABASE_URLS adds
+the others (see app/shards):
+
+    python scripts/shards.py init
+    python scripts/shards.py backfill
+    python scripts/shards.py status
+    python scripts/shards.py move --user 42 --to 2
+
+``init`` creates the schema on new shards and starts each one's folder,
+file and share ids at its own range. ``backfill`` adds the users, shares
+and jobs already in the shards to the directory; run it once when turning
+sharding on, before the API is started with more than one shard.
+
+``move`` marks the user as moving, which makes the API refuse their writes
+with 503, and waits SHARD_MOVE_DRAIN_SECONDS for requests already running
+to finish. It then copies the user's rows to the new shard, keeping the ids
+clients know, and reads the old ones back: if anything changed meanwhile,
+say a maintenance job, the copy is redone. Once both sides match, the
+directory points at the new shard, and after another drain the rows are
+deleted from the old one. Blobs stay where they are, since the storage
+directory is shared by every shard. If a move is interrupted after the
+switch, ``purge`` deletes what was left behind.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from sqlalchemy import bindparam, func, select, text
+from sqlalchemy.exc import IntegrityError
+from app.config.database import (
+    create_schema, current_revision, is_sharded, keep_id_range, next_ids, reserve_id_range, shard_engines,
+    shard_sessions
+)
+from app.config.settings import settings
+from app.common.models import File, Folder
+from app.jobs.models import IntegrityFinding, Job, StorageDrift
+from app.jobs.runner import FINISHED_STATUSES
+from app.shards.models import ShardJob, ShardShare, ShardUser
+from app.storage.models import Change, SyncState
+# Relationships between the models resolve only once every model is imported.
+from app.users.models import User
+from app.sharing.models import Share
+from app.premium.models import Subscription
+
+PAGE_SIZE = 1000
+MOVE_ATTEMPTS = 3
+
+users, folders, jobs = User.__table__, Folder.__table__, Job.__table__
+
+# A user's rows, in the order they are inserted: (table, owner column, renumbered).
+# Renumbered tables get new ids on the new shard; clients never see them.
+USER_TABLES = [
+    (users, users.c.id, False),
+    (Subscription.__table__, Subscription.__table__.c.user_id, True),
+    (SyncState.__table__, SyncState.__table__.c.user_id, False),
+    (folders, folders.c.user_id, False),
+    (File.__table__, File.__table__.c.user_id, False),
+    (Share.__table__, Share.__table__.c.user_id, False),
+    (Change.__table__, Change.__table__.c.user_id, True),
+    # Copy jobs report on the user's own folders; maintenance jobs stay with their shard.
+    (jobs, jobs.c.created_by, False),
+]
+
+# updated_at is set too, or its onupdate default would change the copy.
+_set_parent = folders.update().where(folders.c.id == bindparam("folder_id")).values(
+    parent_id=bindparam("parent"), updated_at=bindparam("updated")
+)
+
+
+class MoveError(Exception):
+    pass
+
+
+def log(message: str):
+    print(message, file=sys.stderr, flush=True)
+
+
+def owned_by(table, column, user_id: int):
+    condition = column == user_id
+    if table is jobs:
+        condition = condition & (jobs.c.kind == "folder_copy")
+    return condition
+
+
+def iter_pages(bind, table, column, user_id: int, columns=None):
+    """Yield a user's rows of ``table`` a page at a time, in primary key order.
+
+    Each page is its own short read, so a large user does not hold a read
+    lock on SQLite for the whole copy.
+    """
+    key = list(table.primary_key.columns)[0]
+    last = None
+    while True:
+        query = select(*(columns or [table])).where(owned_by(table, column, user_id))
+        if last is not None:
+            query = query.where(key > last)
+        with bind.connect() as connection:
+            rows = [dict(row._mapping) for row in connection.execute(query.order_by(key).limit(PAGE_SIZE))]
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][key.key]
+
+
+def digest_rows(hasher, rows: list[dict], renumbered: bool):
+    for row in rows:
+        hasher.update(repr([str(value) for name, value in row.items() if not (renumbered and name == "id")]).encode())
+
+
+def fingerprint(bind, user_id: int) -> str:
+    hasher = hashlib.sha256()
+    for table, column, renumbered in USER_TABLES:
+        hasher.update(table.name.encode())
+        for rows in iter_pages(bind, table, column, user_id):
+            digest_rows(hasher, rows, renumbered)
+    return hasher.hexdigest()
+
+
+def delete_user_rows(connection, user_id: int, reports: bool = False):
+    """Delete everything in USER_TABLES that belongs to the user.
+
+    With ``reports`` the maintenance reports naming the user go too, and
+    jobs they started stop pointing at them, so the user row can be dropped.
+    """
+    connection.execute(folders.update().where(folders.c.user_id == user_id).values(parent_id=None))
+    for table, column, _ in reversed(USER_TABLES):
+        if table is users:
+            if reports:
+                connection.execute(StorageDrift.__table__.delete().where(StorageDrift.__table__.c.user_id == user_id))
+                connection.execute(
+                    IntegrityFinding.__table__.delete().where(IntegrityFinding.__table__.c.user_id == user_id)
+                )
+                connection.execute(jobs.update().where(jobs.c.created_by == user_id).values(created_by=None))
+        connection.execute(table.delete().where(owned_by(table, column, user_id)))
+
+
+def copy_user(source, target_shard: int, user_id: int) -> tuple[str, list[int]]:
+    """Replace the user's rows on ``target_shard`` with those on ``source``.
+
+    Returns the fingerprint of the rows copied and the ids of the jobs.
+    """
+    hasher = hashlib.sha256()
+    job_ids = []
+    with shard_engines[target_shard].begin() as connection, keep_id_range(connection, target_shard):
+        delete_user_rows(connection, user_id)
+        for table, column, renumbered in USER_TABLES:
+            hasher.update(table.name.encode())
+            parents = []
+            copied = 0
+            for rows in iter_pages(source, table, column, user_id):
+                digest_rows(hasher, rows, renumbered)
+                if renumbered:
+                    rows = [{name: value for name, value in row.items() if name != "id"} for row in rows]
+                if table is folders:
+                    # Parents may have larger ids than their children; link them once all exist.
+                    parents.extend(
+                        {"folder_id": row["id"], "parent": row["parent_id"], "updated": row["updated_at"]}
+                        for row in rows if row["parent_id"]
+                    )
+                    rows = [{**row, "parent_id": None} for row in rows]
+                if table is jobs:
+                    job_ids.extend(row["id"] for row in rows)
+                connection.execute(table.insert(), rows)
+                copied += len(rows)
+            if parents:
+                connection.execute(_set_parent, parents)
+            if copied:
+                log(f"  {table.name}: {copied:,} rows")
+    return hasher.hexdigest(), job_ids
+
+
+def check_id_range(shard: int):
+    """Refuse to go on if the shard would hand out ids outside its own range."""
+    start = shard * settings.SHARD_ID_STRIDE
+    with shard_engines[shard].connect() as connection:
+        last_ids = next_ids(connection)
+    for table, last in last_ids.items():
+        if not start - 1 <= last < start + settings.SHARD_ID_STRIDE:
+            raise MoveError(
+                f"Shard {shard} hands out {table} ids after {last}, outside its range from {start}; "
+                f"see SHARD_ID_STRIDE"
+            )
+
+
+def check_movable(source, target_shard: int, user_id: int):
+    with source.connect() as connection:
+        running = connection.execute(
+            select(func.count()).select_from(jobs).where(
+                owned_by(jobs, jobs.c.created_by, user_id), jobs.c.status.notin_(FINISHED_STATUSES)
+            )
+        ).scalar()
+    if running:
+        raise MoveError(f"User {user_id} has {running} unfinished folder copies; wait for them to finish")
+
+    check_id_range(target_shard)
+    target = shard_engines[target_shard]
+    for table in (folders, File.__table__, Share.__table__):
+        for rows in iter_pages(source, table, table.c.user_id, user_id, [table.c.id]):
+            with target.connect() as connection:
+                taken = connection.execute(
+                    select(table.c.id).where(table.c.id.in_([row["id"] for row in rows]), table.c.user_id != user_id)
+                    .limit(1)
+                ).scalar()
+            if taken is not None:
+                raise MoveError(f"{table.name} id {taken} is already used on the target shard; see SHARD_ID_STRIDE")
+
+
+def move_user(user_id: int, target_shard: int, drain_seconds: float):
+    directory = shard_sessions[0]()
+    try:
+        entry = directory.get(ShardUser, user_id)
+        if entry is None:
+            raise MoveError(f"User {user_id} is not in the shard directory; run backfill first")
+        source_shard = entry.shard
+        if source_shard == target_shard:
+            raise MoveError(f"User {user_id} is already on shard {target_shard}")
+        source, target = shard_engines[source_shard], shard_engines[target_shard]
+        check_movable(source, target_shard, user_id)
+
+        if entry.moving:
+            log(f"User {user_id} was left moving by an earlier run; starting over")
+        entry.moving = True
+        directory.commit()
+
+        try:
+            log(f"Moving user {user_id} from shard {source_shard} to {target_shard}; "
+                f"waiting {drain_seconds:g}s for requests to drain")
+            time.sleep(drain_seconds)
+            for attempt in range(1, MOVE_ATTEMPTS + 1):
+                copied, job_ids = copy_user(source, target_shard, user_id)
+                if fingerprint(source, user_id) == copied and fingerprint(target, user_id) == copied:
+                    break
+                log(f"  rows changed during copy {attempt}; copying again")
+            else:
+                raise MoveError(f"User {user_id} kept changing during {MOVE_ATTEMPTS} copies; try again later")
+            check_id_range(target_shard)
+        except BaseException:
+            with target.begin() as connection:
+                delete_user_rows(connection, user_id)
+            entry.moving = False
+            directory.commit()
+            raise
+
+        entry.shard = target_shard
+        entry.moving = False
+        if job_ids:
+            directory.query(ShardJob).filter(ShardJob.job_id.in_(job_ids)).update(
+                {ShardJob.shard: target_shard}, synchronize_session=False
+            )
+        directory.commit()
+        log(f"User {user_id} now served from shard {target_shard}; waiting {drain_seconds:g}s before cleaning up")
+    finally:
+        directory.close()
+
+    try:
+        time.sleep(drain_seconds)
+        purge_user(user_id, source_shard)
+    except KeyboardInterrupt:
+        log(f"\nInterrupted; finish with: python scripts/shards.py purge --user {user_id} --shard {source_shard}")
+        sys.exit(130)
+
+
+def purge_user(user_id: int, shard: int):
+    directory = shard_sessions[0]()
+    try:
+        entry = directory.get(ShardUser, user_id)
+    finally:
+        directory.close()
+    if entry is None or entry.shard == shard:
+        raise MoveError(f"Shard {shard} is where user {user_id} lives; refusing to purge it")
+
+    with shard_engines[shard].begin() as connection:
+        delete_user_rows(connection, user_id, reports=True)
+    log(f"Deleted user {user_id}'s rows from shard {shard}")
+
+
+def init_shards():
+    for shard, bind in enumerate(shard_engines):
+        if current_revision(bind) is None:
+            create_schema(bind, shard)
+            log(f"Shard {shard}: created the schema")
+        elif shard:
+            with bind.begin() as connection:
+                reserve_id_range(connection, shard)
+            log(f"Shard {shard}: id ranges reserved where the tables were empty")
+
+
+def _insert_new(directory, model, rows: list[dict]) -> int:
+    """Insert directory rows; on a conflict, one at a time to name the culprits."""
+    try:
+        directory.execute(model.__table__.insert(), rows)
+        directory.commit()
+        return len(rows)
+    except IntegrityError:
+        directory.rollback()
+
+    inserted = 0
+    for row in rows:
+        try:
+            directory.execute(model.__table__.insert(), [row])
+            directory.commit()
+            inserted += 1
+        except IntegrityError:
+            directory.rollback()
+            log(f"  skipped {model.__tablename__} {row}: it conflicts with an existing entry")
+    return inserted
+
+
+def backfill():
+    directory = shard_sessions[0]()
+    try:
+        known_users = {row[0] for row in directory.query(ShardUser.user_id)}
+        known_shares = {row[0] for row in directory.query(ShardShare.share_token)}
+        known_jobs = {row[0] for row in directory.query(ShardJob.job_id)}
+        directory.rollback()
+
+        for shard, session_factory in enumerate(shard_sessions):
+            db = session_factory()
+            try:
+                user_rows = [
+                    {"user_id": u.id, "shard": shard, "email": u.email, "username": u.username,
+                     "moving": False, "created_at": u.created_at}
+                    for u in db.query(User.id, User.email, User.username, User.created_at)
+                    if u.id not in known_users
+                ]
+                share_rows = [
+                    {"share_token": s.share_token, "user_id": s.user_id}
+                    for s in db.query(Share.share_token, Share.user_id) if s.share_token not in known_shares
+                ]
+                job_rows = [{"job_id": j.id, "shard": shard} for j in db.query(Job.id) if j.id not in known_jobs]
+            finally:
+                db.close()
+
+            added = [0, 0, 0]
+            for index, (model, rows) in enumerate(((ShardUser, user_rows), (ShardShare, share_rows), (ShardJob, job_rows))):
+                for start in range(0, len(rows), PAGE_SIZE):
+                    added[index] += _insert_new(directory, model, rows[start:start + PAGE_SIZE])
+            known_users.update(row["user_id"] for row in user_rows)
+            known_shares.update(row["share_token"] for row in share_rows)
+            known_jobs.update(row["job_id"] for row in job_rows)
+            log(f"Shard {shard}: added {added[0]:,} users, {added[1]:,} shares and {added[2]:,} jobs")
+
+        if directory.get_bind().dialect.name == "postgresql":
+            # Ids were inserted explicitly; new ones must start past them.
+            for table, column in (("shard_users", "user_id"), ("shard_jobs", "job_id")):
+                directory.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                    f"GREATEST((SELECT MAX({column}) FROM {table}), 1))"
+                ))
+            directory.commit()
+    finally:
+        directory.close()
+
+
+def status():
+    directory = shard_sessions[0]()
+    try:
+        listed = dict(directory.query(ShardUser.shard, func.count()).group_by(ShardUser.shard).all())
+        moving = [row[0] for row in directory.query(ShardUser.user_id).filter(ShardUser.moving == True)]
+    finally:
+        directory.close()
+
+    for shard, session_factory in enumerate(shard_sessions):
+        db = session_factory()
+        try:
+            user_count, stored = db.query(func.count(User.id), func.coalesce(func.sum(User.storage_used), 0)).one()
+            file_count = db.query(func.count(File.id)).scalar()
+        finally:
+            db.close()
+        print(f"shard {shard}: {user_count:,} users ({listed.get(shard, 0):,} in the directory), "
+              f"{file_count:,} files, {stored / 1024 ** 3:,.2f} GiB")
+    if moving:
+        print(f"moving: {', '.join(map(str, moving))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage database shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init", help="create new shards and reserve their id ranges")
+    commands.add_parser("backfill", help="add existing users, shares and jobs to the directory")
+    commands.add_parser("status", help="users, files and bytes per shard")
+    move = commands.add_parser("move", help="move a user to another shard")
+    move.add_argument("--user", type=int, required=True)
+    move.add_argument("--to", type=int, required=True, help="target shard")
+    move.add_argument("--drain-seconds", type=float, default=settings.SHARD_MOVE_DRAIN_SECONDS)
+    purge = commands.add_parser("purge", help="delete a moved user's leftover rows from a shard")
+    purge.add_argument("--user", type=int, required=True)
+    purge.add_argument("--shard", type=int, required=True)
+    args = parser.parse_args()
+
+    if args.command in ("move", "purge") and not is_sharded():
+        sys.exit("Only one shard is configured; set SHARD_DATABASE_URLS")
+    for shard in (getattr(args, "to", None), getattr(args, "shard", None)):
+        if shard is not None and not 0 <= shard < len(shard_engines):
+            sys.exit(f"No shard {shard}; there are {len(shard_engines)}")
+
+    started = time.perf_counter()
+    try:
+        if args.command == "init":
+            init_shards()
+        elif args.command == "backfill":
+            backfill()
+        elif args.command == "status":
+            status()
+        elif args.command == "move":
+            move_user(args.user, args.to, args.drain_seconds)
+        else:
+            purge_user(args.user, args.shard)
+    except MoveError as e:
+        sys.exit(str(e))
+    except KeyboardInterrupt:
+        # A move puts the user back on their shard unless it got as far as switching.
+        log("\nInterrupted; run the same command again")
+        sys.exit(130)
+
+    if args.command == "move":
+        log(f"Moved user {args.user} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()